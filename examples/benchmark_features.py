@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+"""
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+ Copyright (C) 2015 National Institutes of Health
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+Benchmark of the feature computation engine: times every FeatureAlgorithm and
+ImageTransform registered in ComputationTaskInstances, and the four standard
+feature computation plans in StdFeatureComputationPlans, on synthetic images and
+on the images bundled with the tests, at several image sizes and bit depths.
+
+Everything runs offline. Each measurement is the best of --repeat runs, and results
+are written to a JSON file. Given a --baseline JSON file from an earlier run,
+measurements that got slower by more than --tolerance are flagged as regressions,
+and the exit status is 1 if there were any. Two existing result files can be compared
+without running anything with --compare BASELINE CURRENT.
+
+Algorithms are run through a single feature group computation plan, e.g.,
+"Haralick Textures ()", so they're timed the way feature vectors are computed.
+Transforms are timed with their execute() method. Tasks and plans that need color
+images are only run on color images passed in with --image."""
+
+import argparse
+import json
+import os
+import sys
+from timeit import default_timer as timer
+from math import ceil
+import numpy as np
+
+test_dir = os.path.join( os.path.dirname( os.path.dirname( os.path.realpath( __file__ ) ) ), 'tests' )
+bundled_images = [ os.path.join( test_dir, 'wndchrm_tests', '010067_301x300.tif' ),
+        os.path.join( test_dir, 'wndchrm_tests', 't1_s01_c05_ij.tif' ),
+        os.path.join( test_dir, 'pywndcharm_tests', 'lymphoma_eosin_channel_MCL_test_img_sj-05-3362-R2_001_E.tif' ) ]
+
+# ImageTransforms and FeatureAlgorithms that operate on the color plane
+color_tasks = set( [ 'Color', 'Hue', 'Color Histogram' ] )
+
+# ( name, StdFeatureComputationPlans method, requires color )
+std_plans = [ ( 'short', 'getFeatureSet', False ), ( 'long', 'getFeatureSetLong', False ),
+        ( 'short_color', 'getFeatureSetColor', True ),
+        ( 'long_color', 'getFeatureSetLongColor', True ) ]
+
+results_format_version = 1
+
+#================================================================
+def SyntheticPixels( size, bits, random_state=42 ):
+    """Returns size * size array of a field of blurry cells on a dim background with
+    shot noise, in integer intensities from 0 to 2**bits - 1."""
+
+    rs = np.random.RandomState( random_state )
+    max_val = 2 ** bits - 1
+    coords = np.arange( size, dtype='double' )
+    pixels = np.zeros( ( size, size ) )
+    num_cells = max( 4, int( ( size / 32.0 ) ** 2 ) )
+    # Gaussians are separable, so each cell is an outer product
+    for i in xrange( num_cells ):
+        x, y = rs.uniform( 0, size, 2 )
+        sigma = rs.uniform( 2, 6 ) * size / 256.0 + 1
+        brightness = rs.uniform( 0.3, 1.0 )
+        pixels += brightness * np.outer( np.exp( -0.5 * ( ( coords - y ) / sigma ) ** 2 ),
+                np.exp( -0.5 * ( ( coords - x ) / sigma ) ** 2 ) )
+    pixels = 0.05 + 0.9 * pixels / pixels.max()
+    pixels = rs.poisson( pixels * 200 ) / 200.0 * max_val
+    return np.clip( np.round( pixels ), 0, max_val )
+
+#================================================================
+def BenchmarkImages( sizes, bit_depths, image_paths ):
+    """Yields tuples ( image name, size, bits, PyImageMatrix ) of the synthetic images at each
+    size and bit depth, and the given images cropped to each size. Grayscale images
+    smaller than a size are tiled to fill it, color ones are skipped."""
+
+    import wndcharm
+    from wndcharm.PyImageMatrix import PyImageMatrix
+
+    sources = [ ( 'synthetic', bits, None ) for bits in bit_depths ]
+    for path in image_paths:
+        original = PyImageMatrix()
+        if 1 != original.OpenImage( path, 0, None, 0, 0 ):
+            raise ValueError( 'Could not build an ImageMatrix from {0}, check the path.'.format( path ) )
+        sources.append( ( os.path.basename( path ), original.bits, original ) )
+
+    for size in sizes:
+        for name, bits, original in sources:
+            im = PyImageMatrix()
+            if original is not None and original.width >= size and original.height >= size:
+                # N.B. submatrix() bounds are inclusive
+                im.submatrix( original, 0, 0, size - 1, size - 1 )
+                yield name, size, bits, im
+                continue
+            if original is None:
+                pixels = SyntheticPixels( size, bits )
+            elif original.ColorMode != wndcharm.cmGRAY:
+                print "Skipping {0} at size {1}: can't tile color images".format( name, size )
+                continue
+            else:
+                pixels = original.as_ndarray()
+                pixels = np.tile( pixels, ( int( ceil( float( size ) / pixels.shape[0] ) ),
+                        int( ceil( float( size ) / pixels.shape[1] ) ) ) )[ : size, : size ]
+            im.allocate( size, size )
+            im.as_ndarray()[:] = pixels
+            im.bits = bits
+            im.finish()
+            yield name, size, bits, im
+
+#================================================================
+def BestTime( func, repeat, budget ):
+    """Returns tuple ( best time of up to repeat calls of func, number of calls ).
+    Stops repeating once the calls took budget seconds in total."""
+
+    times = []
+    while len( times ) < repeat and sum( times ) < budget:
+        start = timer()
+        func()
+        times.append( timer() - start )
+    return min( times ), len( times )
+
+#================================================================
+def RunBenchmarks( args ):
+    """Returns list of measurement dicts"""
+
+    import wndcharm
+    from wndcharm.PyImageMatrix import PyImageMatrix
+    import re
+
+    name_filter = re.compile( args.only ) if args.only else None
+
+    # Registered tasks, and an instance of each transform's class to call execute() on
+    algorithms = []
+    transforms = []
+    for task in wndcharm.ComputationTaskInstances.getInstances():
+        if task.type == task.ImageTransformTask:
+            transforms.append( task.name )
+        elif task.type == task.FeatureAlgorithmTask:
+            algorithms.append( task.name )
+    transform_instances = {}
+    for cls in vars( wndcharm ).values():
+        if isinstance( cls, type ) and issubclass( cls, wndcharm.ImageTransform ):
+            try:
+                instance = cls()
+            except Exception:
+                # abstract
+                continue
+            transform_instances[ instance.name ] = instance
+
+    # ( kind, name, plan, requires color )
+    plans = []
+    for name in algorithms:
+        plan = wndcharm.FeatureComputationPlan( name )
+        plan.add( name + ' ()' )
+        plans.append( ( 'algorithm', name, plan, name in color_tasks ) )
+    if not args.no_plans:
+        for name, method, requires_color in std_plans:
+            plans.append( ( 'plan', name, getattr( wndcharm.StdFeatureComputationPlans, method )(),
+                requires_color ) )
+
+    image_paths = list( args.image )
+    if not args.no_bundled:
+        image_paths.extend( bundled_images )
+
+    results = []
+    def Record( kind, name, image_name, size, bits, func, **extra ):
+        seconds, runs = BestTime( func, args.repeat, args.budget )
+        result = { 'kind': kind, 'name': name, 'image': image_name, 'size': size,
+                'bits': bits, 'seconds': seconds, 'runs': runs }
+        result.update( extra )
+        results.append( result )
+        print "{0}\t{1}\t{2}\t{3}\t{4}\t{5:.6f}".format( kind, name, image_name, size, bits, seconds )
+        sys.stdout.flush()
+
+    print "kind\tname\timage\tsize\tbits\tseconds"
+    for image_name, size, bits, im in BenchmarkImages( args.sizes, args.bits, image_paths ):
+        is_color = im.ColorMode != wndcharm.cmGRAY
+
+        for name in transforms:
+            if name_filter and not name_filter.search( name ):
+                continue
+            if name in color_tasks and not is_color:
+                continue
+            if name not in transform_instances:
+                print "Skipping transform {0}: no class with that name".format( name )
+                continue
+            out = PyImageMatrix()
+            Record( 'transform', name, image_name, size, bits,
+                    lambda: transform_instances[ name ].execute( im, out ) )
+
+        for kind, name, plan, requires_color in plans:
+            if name_filter and not name_filter.search( name ):
+                continue
+            if requires_color and not is_color:
+                continue
+            feature_vec = wndcharm.DoubleVector( plan.n_features )
+            plan_exec = wndcharm.FeatureComputationPlanExecutor( plan )
+            Record( kind, name, image_name, size, bits,
+                    lambda: plan_exec.run( im, feature_vec, 0 ), n_features=plan.n_features )
+    return results
+
+#================================================================
+def MeasurementKey( result ):
+    return '{kind}/{name}/{image}/{size}/{bits}'.format( **result )
+
+#================================================================
+def CompareResults( baseline, current, tolerance, min_seconds ):
+    """Compares the measurements of two result dicts. Returns tuple ( list of tuples
+    ( key, baseline seconds, current seconds, ratio, flag ) for measurements in both,
+    number of regressions ). Measurements more than tolerance (a fraction) and
+    min_seconds slower than the baseline are flagged as regressions."""
+
+    baseline_seconds = dict( [ ( MeasurementKey( r ), r[ 'seconds' ] ) for r in baseline[ 'results' ] ] )
+    comparisons = []
+    num_regressions = 0
+    for result in current[ 'results' ]:
+        key = MeasurementKey( result )
+        if key not in baseline_seconds:
+            continue
+        old = baseline_seconds[ key ]
+        new = result[ 'seconds' ]
+        ratio = new / old if old > 0 else float( 'inf' )
+        flag = ''
+        if new > old * ( 1 + tolerance ) and new - old > min_seconds:
+            flag = 'REGRESSION'
+            num_regressions += 1
+        elif old > new * ( 1 + tolerance ) and old - new > min_seconds:
+            flag = 'faster'
+        comparisons.append( ( key, old, new, ratio, flag ) )
+    return comparisons, num_regressions
+
+#================================================================
+def PrintComparison( baseline, current, tolerance, min_seconds ):
+    """Prints the comparison table, and returns the number of regressions."""
+
+    comparisons, num_regressions = CompareResults( baseline, current, tolerance, min_seconds )
+    print "measurement\tbaseline (s)\tcurrent (s)\tratio\t"
+    for key, old, new, ratio, flag in comparisons:
+        print "{0}\t{1:.6f}\t{2:.6f}\t{3:.2f}\t{4}".format( key, old, new, ratio, flag )
+    current_keys = set( [ MeasurementKey( r ) for r in current[ 'results' ] ] )
+    missing = [ MeasurementKey( r ) for r in baseline[ 'results' ] \
+            if MeasurementKey( r ) not in current_keys ]
+    if missing:
+        print "{0} baseline measurements were not run, e.g., {1}".format( len( missing ), missing[0] )
+    print "{0} of {1} measurements regressed by more than {2:.0%}".format(
+            num_regressions, len( comparisons ), tolerance )
+    return num_regressions
+
+#================================================================
+def main():
+    parser = argparse.ArgumentParser( description="Time feature algorithms, image transforms and standard feature computation plans." )
+    parser.add_argument( '-s', '--sizes', help='image widths/heights in pixels',
+            type=int, nargs='+', metavar='<integer>', default=[ 64, 256, 1024, 4096 ] )
+    parser.add_argument( '-b', '--bits', help='bit depths of the synthetic images',
+            type=int, nargs='+', metavar='<integer>', default=[ 8, 16 ] )
+    parser.add_argument( '-i', '--image', help='additional image to tile/crop to each size',
+            action='append', metavar='<path>', default=[] )
+    parser.add_argument( '--no-bundled', help="don't use the test suite images",
+            action='store_true' )
+    parser.add_argument( '--no-plans', help="don't time the standard feature computation plans",
+            action='store_true' )
+    parser.add_argument( '--only', help='only time tasks/plans whose name matches this regex',
+            metavar='<regex>' )
+    parser.add_argument( '-r', '--repeat', help='report best time of up to this many runs',
+            type=int, metavar='<integer>', default=3 )
+    parser.add_argument( '--budget', help='stop repeating a measurement after this many seconds',
+            type=float, metavar='<seconds>', default=10.0 )
+    parser.add_argument( '-o', '--output', help='write results to this JSON file',
+            metavar='<path>' )
+    parser.add_argument( '--baseline', help='compare results to this JSON file from an earlier run',
+            metavar='<path>' )
+    parser.add_argument( '--compare', help="compare two existing JSON files, don't run anything",
+            nargs=2, metavar=( '<baseline>', '<current>' ) )
+    parser.add_argument( '-t', '--tolerance', help='fraction slower than baseline that counts as a regression',
+            type=float, metavar='<float>', default=0.2 )
+    parser.add_argument( '--min-seconds', help='ignore differences smaller than this',
+            type=float, metavar='<seconds>', default=0.001 )
+    args = parser.parse_args()
+
+    if args.compare:
+        with open( args.compare[0] ) as infile:
+            baseline = json.load( infile )
+        with open( args.compare[1] ) as infile:
+            current = json.load( infile )
+        return 1 if PrintComparison( baseline, current, args.tolerance, args.min_seconds ) else 0
+
+    import platform
+    import time
+    from multiprocessing import cpu_count
+    import wndcharm
+
+    current = { 'format_version': results_format_version,
+            'created': time.strftime( '%Y-%m-%dT%H:%M:%S' ),
+            'host': { 'platform': platform.platform(), 'machine': platform.machine(),
+                'python': platform.python_version(), 'numpy': np.__version__,
+                'cpu_count': cpu_count(), 'wndcharm': wndcharm.__version__ },
+            'settings': { 'sizes': args.sizes, 'bits': args.bits, 'repeat': args.repeat,
+                'budget': args.budget },
+            'results': RunBenchmarks( args ) }
+
+    if args.output:
+        with open( args.output, 'w' ) as outfile:
+            json.dump( current, outfile, indent=1, sort_keys=True )
+
+    if args.baseline:
+        with open( args.baseline ) as infile:
+            baseline = json.load( infile )
+        return 1 if PrintComparison( baseline, current, args.tolerance, args.min_seconds ) else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit( main() )
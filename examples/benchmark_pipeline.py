@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+ Copyright (C) 2015 National Institutes of Health
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+Benchmark of the Python classification/regression pipeline on artificial feature
+spaces, swept over numbers of samples, features, classes and tiles per sample group.
+
+For every combination, the inputs of each operation are prepared up front, then each
+operation runs in a forked child process, which reports the best wall time of
+--repeat runs and the peak resident set size (RSS) the first run added on top of
+what the child started with. The peak RSS comes from /proc/self/status, so it's
+only recorded on Linux.
+
+The scaling report fits, for each operation and each swept dimension, the exponent
+k of time ~ n^k (and of peak RSS), holding the other dimensions fixed, and prints
+the median over the combinations of the other dimensions."""
+
+import argparse
+import json
+import os
+import sys
+import pickle
+import re
+from timeit import default_timer as timer
+from tempfile import mkdtemp
+from shutil import rmtree
+from itertools import product
+import numpy as np
+
+from wndcharm.ArtificialFeatureSpace import CreateArtificialFeatureSpace_Discrete, \
+        CreateArtificialFeatureSpace_Continuous
+from wndcharm.FeatureSpace import FeatureSpace
+from wndcharm.FeatureWeights import FisherFeatureWeights, PearsonFeatureWeights
+from wndcharm.FeatureSpacePrediction import FeatureSpaceClassification, FeatureSpaceRegression
+from wndcharm.FeatureSpacePredictionExperiment import FeatureSpaceClassificationExperiment
+
+# Number of well behaved artificial signal types, the number of features is a multiple of it
+num_signal_types = 20
+dimensions = ( 'samples', 'features', 'classes', 'tiles' )
+
+#================================================================
+def Fixtures( n_samples, n_features, n_classes, n_tiles, tempdir ):
+    """Returns dict of the inputs of the benchmarked operations for one
+    combination of the swept dimensions."""
+
+    per_signal = max( 1, n_features // num_signal_types )
+    fs = CreateArtificialFeatureSpace_Discrete( n_samples=n_samples, n_classes=n_classes,
+            num_features_per_signal_type=per_signal, n_samples_per_group=n_tiles,
+            random_state=42 )
+    continuous_fs = CreateArtificialFeatureSpace_Continuous( n_samples=n_samples,
+            num_features_per_signal_type=per_signal, n_samples_per_group=n_tiles,
+            random_state=42 )
+    fixtures = { 'fs': fs, 'continuous_fs': continuous_fs }
+
+    fixtures[ 'fit_path' ] = os.path.join( tempdir, 'benchmark.fit' )
+    fs.ToFitFile( fixtures[ 'fit_path' ] )
+    num_features = int( round( 0.15 * fs.num_features ) )
+    fixtures[ 'num_features' ] = num_features
+    fixtures[ 'normalized_fs' ] = fs.Normalize( inplace=False, quiet=True )
+    fixtures[ 'fisher_weights' ] = FisherFeatureWeights.NewFromFeatureSpace(
+            fixtures[ 'normalized_fs' ] ).Threshold( num_features )
+    group_ids = sorted( set( fs._contiguous_sample_group_ids ) )
+    fixtures[ 'half_group_ids' ] = group_ids[ : : 2 ]
+
+    # Normalized, feature reduced training and test sets, as in NewShuffleSplit
+    for prefix, feature_space, weights_class in ( ( '', fs, FisherFeatureWeights ),
+            ( 'continuous_', continuous_fs, PearsonFeatureWeights ) ):
+        train_set, test_set = feature_space.Split( random_state=42, quiet=True )
+        train_set.Normalize( quiet=True )
+        weights = weights_class.NewFromFeatureSpace( train_set ).Threshold( num_features )
+        fixtures[ prefix + 'train_set' ] = train_set
+        fixtures[ prefix + 'weights' ] = weights
+        fixtures[ prefix + 'reduced_train_set' ] = train_set.FeatureReduce( weights, quiet=True )
+        fixtures[ prefix + 'reduced_test_set' ] = test_set.FeatureReduce(
+                weights, quiet=True ).Normalize( fixtures[ prefix + 'reduced_train_set' ], quiet=True )
+    return fixtures
+
+#================================================================
+# name -> function of the fixtures and the command line args
+operations = [
+    ( 'ToFitFile', lambda f, args: f['fs'].ToFitFile( f['fit_path'] + '.out.fit' ) ),
+    ( 'NewFromFitFile', lambda f, args: FeatureSpace.NewFromFitFile( f['fit_path'],
+        tile_num_rows=f['fs'].num_samples_per_group, tile_num_cols=1, quiet=True ) ),
+    ( 'Normalize', lambda f, args: f['fs'].Normalize( inplace=False, quiet=True ) ),
+    ( 'FeatureReduce', lambda f, args: f['normalized_fs'].FeatureReduce(
+        f['fisher_weights'], quiet=True ) ),
+    ( 'SampleReduce', lambda f, args: f['fs'].SampleReduce(
+        leave_in_sample_group_ids=f['half_group_ids'], quiet=True ) ),
+    ( 'Split', lambda f, args: f['fs'].Split( random_state=42, quiet=True ) ),
+    ( 'FisherFeatureWeights', lambda f, args: FisherFeatureWeights.NewFromFeatureSpace(
+        f['train_set'] ) ),
+    ( 'PearsonFeatureWeights', lambda f, args: PearsonFeatureWeights.NewFromFeatureSpace(
+        f['continuous_train_set'] ) ),
+    ( 'NewWND5', lambda f, args: FeatureSpaceClassification.NewWND5( f['reduced_train_set'],
+        f['reduced_test_set'], f['weights'], quiet=True ) ),
+    ( 'NewLeastSquares', lambda f, args: FeatureSpaceRegression.NewLeastSquares(
+        f['continuous_reduced_train_set'], f['continuous_reduced_test_set'],
+        f['continuous_weights'], quiet=True ) ),
+    ( 'NewShuffleSplit', lambda f, args: FeatureSpaceClassificationExperiment.NewShuffleSplit(
+        f['fs'], n_iter=args.n_iter, random_state=42, quiet=True ) ),
+]
+
+#================================================================
+def ReadProcStatus( field ):
+    """Returns the value in bytes of a memory field of /proc/self/status, e.g., VmRSS
+    (current resident set size) or VmHWM (peak), or None if unavailable."""
+
+    try:
+        with open( '/proc/self/status' ) as status:
+            for line in status:
+                if line.startswith( field + ':' ):
+                    return int( line.split()[1] ) * 1024
+    except IOError:
+        pass
+    return None
+
+#================================================================
+def MeasureInChild( func, repeat ):
+    """Runs func repeat times in a forked child process. Returns tuple ( best wall time,
+    peak RSS in bytes added by the first run, or None ).
+
+    The kernel resets the peak RSS of a forked process to its RSS at the time of the
+    fork, so the peak isn't inflated by whatever the parent had allocated and freed."""
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # child
+        os.close( read_fd )
+        try:
+            start_rss = ReadProcStatus( 'VmRSS' )
+            times = []
+            peak_rss = None
+            for i in xrange( repeat ):
+                start = timer()
+                func()
+                times.append( timer() - start )
+                if i == 0 and start_rss is not None:
+                    peak_rss = ReadProcStatus( 'VmHWM' ) - start_rss
+            result = ( min( times ), peak_rss )
+        except Exception as e:
+            result = e
+        with os.fdopen( write_fd, 'wb' ) as outfile:
+            pickle.dump( result, outfile, pickle.HIGHEST_PROTOCOL )
+        os._exit( 0 )
+
+    os.close( write_fd )
+    with os.fdopen( read_fd, 'rb' ) as infile:
+        result = pickle.load( infile )
+    os.waitpid( pid, 0 )
+    if isinstance( result, Exception ):
+        raise result
+    return result
+
+#================================================================
+def ScalingExponents( results, op_name, dimension, quantity ):
+    """Returns the median over all the combinations of the other dimensions of the
+    least squares slope of log( quantity ) versus log( dimension ) for operation op_name,
+    or None if no combination varies the dimension."""
+
+    others = [ d for d in dimensions if d != dimension ]
+    groups = {}
+    for r in results:
+        if r[ 'operation' ] != op_name or not r.get( quantity ) or r[ quantity ] <= 0:
+            continue
+        key = tuple( r[ d ] for d in others )
+        groups.setdefault( key, [] ).append( ( r[ dimension ], r[ quantity ] ) )
+    slopes = []
+    for points in groups.values():
+        x = np.log( [ p[0] for p in points ] )
+        if len( set( x ) ) < 2:
+            continue
+        y = np.log( [ p[1] for p in points ] )
+        slopes.append( np.polyfit( x, y, 1 )[0] )
+    if not slopes:
+        return None
+    return float( np.median( slopes ) )
+
+#================================================================
+def main():
+    parser = argparse.ArgumentParser( description="Time and memory profile the Python pipeline on artificial feature spaces." )
+    parser.add_argument( '-s', '--samples', help='numbers of samples',
+            type=int, nargs='+', metavar='<integer>', default=[ 500, 2000, 8000 ] )
+    parser.add_argument( '-f', '--features', help='numbers of features, rounded down to a multiple of {0}'.format( num_signal_types ),
+            type=int, nargs='+', metavar='<integer>', default=[ 200, 1000 ] )
+    parser.add_argument( '-c', '--classes', help='numbers of classes',
+            type=int, nargs='+', metavar='<integer>', default=[ 2, 10 ] )
+    parser.add_argument( '-t', '--tiles', help='numbers of tiles per sample group',
+            type=int, nargs='+', metavar='<integer>', default=[ 1, 4 ] )
+    parser.add_argument( '--only', help='only run operations whose name matches this regex',
+            metavar='<regex>' )
+    parser.add_argument( '-n', '--n-iter', help='NewShuffleSplit iterations',
+            type=int, metavar='<integer>', default=5 )
+    parser.add_argument( '-r', '--repeat', help='report best time of this many runs',
+            type=int, metavar='<integer>', default=3 )
+    parser.add_argument( '-o', '--output', help='write results and scaling report to this JSON file',
+            metavar='<path>' )
+    args = parser.parse_args()
+
+    ops = [ ( name, func ) for name, func in operations \
+            if not args.only or re.search( args.only, name ) ]
+
+    results = []
+    tempdir = mkdtemp()
+    try:
+        print "operation\tsamples\tfeatures\tclasses\ttiles\tseconds\tpeak RSS (MB)"
+        for n_samples, n_features, n_classes, n_tiles in \
+                product( args.samples, args.features, args.classes, args.tiles ):
+            fixtures = Fixtures( n_samples, n_features, n_classes, n_tiles, tempdir )
+            for name, func in ops:
+                seconds, peak_rss = MeasureInChild( lambda: func( fixtures, args ), args.repeat )
+                result = { 'operation': name, 'samples': n_samples, 'features': n_features,
+                    'classes': n_classes, 'tiles': n_tiles, 'seconds': seconds,
+                    'peak_rss': peak_rss, 'num_samples': fixtures[ 'fs' ].num_samples,
+                    'num_features': fixtures[ 'fs' ].num_features }
+                results.append( result )
+                print "{0}\t{1}\t{2}\t{3}\t{4}\t{5:.4f}\t{6}".format( name, n_samples,
+                    n_features, n_classes, n_tiles, seconds,
+                    'n/a' if peak_rss is None else '{0:.1f}'.format( peak_rss / 2.0 ** 20 ) )
+                sys.stdout.flush()
+    finally:
+        rmtree( tempdir )
+
+    # Scaling report
+    report = {}
+    print
+    print "Scaling exponents k, time ~ n^k (peak RSS ~ n^k), median over the other dimensions"
+    print "operation\t" + "\t".join( dimensions )
+    for name, func in ops:
+        report[ name ] = {}
+        line = name
+        for dimension in dimensions:
+            time_exp = ScalingExponents( results, name, dimension, 'seconds' )
+            rss_exp = ScalingExponents( results, name, dimension, 'peak_rss' )
+            report[ name ][ dimension ] = { 'seconds': time_exp, 'peak_rss': rss_exp }
+            line += "\t{0} ({1})".format(
+                '-' if time_exp is None else '{0:.2f}'.format( time_exp ),
+                '-' if rss_exp is None else '{0:.2f}'.format( rss_exp ) )
+        print line
+
+    if args.output:
+        with open( args.output, 'w' ) as outfile:
+            json.dump( { 'settings': vars( args ), 'results': results, 'scaling': report },
+                    outfile, indent=1, sort_keys=True )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+ Copyright (C) 2015 National Institutes of Health
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+Microbenchmark of FeatureSpace.SortSamplesByGroundTruth() and the class metadata
+calculation in FeatureSpace._RebuildViews(), against the zip-and-sort and
+list.count() implementations they replaced."""
+
+import argparse
+from time import time
+import numpy as np
+
+from wndcharm.FeatureSpace import FeatureSpace
+
+parser = argparse.ArgumentParser( description="Time sorting a shuffled FeatureSpace by ground truth." )
+parser.add_argument( '-s', '--samples', help='number of samples (rows)',
+                     type=int, metavar='<integer>', default=100000 )
+parser.add_argument( '-f', '--features', help='number of features (columns)',
+                     type=int, metavar='<integer>', default=50 )
+parser.add_argument( '-c', '--classes', help='number of classes',
+                     type=int, metavar='<integer>', default=20 )
+parser.add_argument( '-r', '--repeat', help='report best time of this many runs',
+                     type=int, metavar='<integer>', default=3 )
+args = parser.parse_args()
+
+def LegacySortSamplesByGroundTruth( fs ):
+    """The zip-and-sort row shuffle, for discrete FeatureSpaces"""
+    from operator import itemgetter
+    sample_data = zip( fs._contiguous_ground_truth_labels,
+        fs._contiguous_ground_truth_values, fs.data_matrix,
+        fs._contiguous_sample_names, fs._contiguous_sample_sequence_ids )
+    a, b, c, d, e = zip( *sorted( sample_data, key=itemgetter(0) ) )
+    return fs.Derive( _contiguous_ground_truth_labels=list(a),
+        _contiguous_ground_truth_values=list(b), data_matrix=np.array(c),
+        _contiguous_sample_names=list(d), _contiguous_sample_sequence_ids=list(e),
+        samples_sorted_by_ground_truth=True )
+
+def LegacyClassMetadata( labels ):
+    """class_names/class_sizes with list.count() per class"""
+    seen = set()
+    seen_add = seen.add
+    class_names = [ x for x in labels if not (x in seen or seen_add(x) ) ]
+    class_sizes = [ labels.count( label ) for label in class_names ]
+    return class_names, class_sizes
+
+def BestTime( func ):
+    times = []
+    for i in range( args.repeat ):
+        start = time()
+        func()
+        times.append( time() - start )
+    return min( times )
+
+# Build a discrete FeatureSpace with rows in random order
+rs = np.random.RandomState( 42 )
+labels = [ 'Class{0:03d}'.format( i ) for i in rs.randint( args.classes, size=args.samples ) ]
+fs = FeatureSpace( name='benchmark', num_samples=args.samples, num_features=args.features,
+        discrete=True )
+fs.data_matrix[:] = rs.rand( args.samples, args.features )
+fs._contiguous_ground_truth_labels = labels
+fs._contiguous_ground_truth_values = [ float( label[5:] ) for label in labels ]
+fs._contiguous_sample_names = [ 'sample{0:06d}'.format( i ) for i in range( args.samples ) ]
+fs._contiguous_sample_group_ids = range( args.samples )
+fs._contiguous_sample_sequence_ids = [ 0 ] * args.samples
+
+sorted_fs = fs.SortSamplesByGroundTruth()
+
+print "{0} samples x {1} features, {2} classes, best of {3}".format(
+        args.samples, args.features, args.classes, args.repeat )
+print "operation\tlegacy (s)\tcurrent (s)\tspeedup"
+results = [
+    ( 'sort rows', BestTime( lambda: LegacySortSamplesByGroundTruth( fs ) ),
+        BestTime( lambda: fs.SortSamplesByGroundTruth( rebuild_views=False ) ) ),
+    # N.B. _RebuildViews() also slices out the per-class views
+    ( 'class metadata', BestTime( lambda: LegacyClassMetadata( sorted_fs._contiguous_ground_truth_labels ) ),
+        BestTime( lambda: sorted_fs._RebuildViews() ) ) ]
+for name, legacy, current in results:
+    print "{0}\t{1:.4f}\t{2:.4f}\t{3:.1f}x".format( name, legacy, current, legacy / current )
@@ -37,6 +37,7 @@
 #include <cmath>
 #include <ctime>
 #include <sstream>
+#include <thread>
 
 #include <assert.h>
 // defines OUR_UNORDERED_MAP based on what's available
@@ -134,40 +135,27 @@ int IsSupportedFormat(char *filename) {
 //---------------------------------------------------------------------------
 
 /* constructor of a TrainingSet object
-   samples_num -long- a maximal number of samples in the training set
+   samples_num -long- the expected number of samples in the training set (unused - samples are added as needed)
+   class_num -long- the expected number of classes (used to reserve space - classes are added as needed)
 */
 TrainingSet::TrainingSet(long samples_num, long class_num)
-{  int signature_index,sample_index;
-//   samples=new sample[samples_num];
-   samples=new signatures*[samples_num];
-   for (sample_index=0;sample_index<samples_num;sample_index++)
-     samples[sample_index]=NULL;
+{
    /* initialize */
-   for (signature_index=0;signature_index<MAX_SIGNATURE_NUM;signature_index++)
-   {  SignatureNames[signature_index][0]='\0';
-      SignatureWeights[signature_index]=0.0;
-      SignatureMins[signature_index]=INF;
-      SignatureMaxes[signature_index]=-INF;
-   }
    this->class_num=0;
    color_features=0;     /* by default - no color features are used */
    signature_count=0;
    is_continuous=0;
    is_numeric=0;
    is_pure_numeric=0;
-   class_labels=new char*[class_num+1];
-   class_nsamples = new long[class_num+1];
-   for (sample_index=0;sample_index<=class_num;sample_index++)
-   {  class_labels[sample_index]=new char[MAX_CLASS_NAME_LENGTH];
-      strcpy(class_labels[sample_index],"");
-      class_nsamples[sample_index] = 0;
-   }
+   /* only the class arrays are reserved: samples_num is often a generous upper bound */
+   class_labels.reserve(class_num+1);
+   class_nsamples.reserve(class_num+1);
+   ResizeClasses(0);
    
    train_class = NULL;
    
-//   for (sample_index=0;sample_index<MAX_CLASS_NUM;sample_index++)
-//     strcpy(class_labels[sample_index],"");
    count=0;
+   compacted=false;
 
 	 // Memory allocated for the aggregated_feature_stats
 	 // if this* is the top Level TrainingSet from which all
@@ -181,16 +169,104 @@ TrainingSet::TrainingSet(long samples_num, long class_num)
 /* destructor of a training set object
 */
 TrainingSet::~TrainingSet()
-{  int sample_index;
-   for (sample_index=0;sample_index<count;sample_index++)
+{  size_t sample_index;
+   for (sample_index=0;sample_index<samples.size();sample_index++)
      if (samples[sample_index]) delete samples[sample_index];
-   for (sample_index=0;sample_index<=class_num;sample_index++) {
+   for (sample_index=0;sample_index<class_labels.size();sample_index++) {
      delete [] class_labels[sample_index];
    }
-   delete [] class_labels;
-   delete [] samples;
-   delete [] class_nsamples;
-   if (train_class) delete train_class;
+   if (train_class) delete [] train_class;
+}
+
+/* ResizeClasses
+   make room in class_labels and class_nsamples for class indexes up to new_class_num.
+   New classes get an empty label and no samples. Never shrinks the arrays.
+*/
+void TrainingSet::ResizeClasses(long new_class_num)
+{
+   while ((long)class_labels.size() <= new_class_num) {
+      char *label = new char[MAX_CLASS_NAME_LENGTH];
+      label[0] = '\0';
+      class_labels.push_back(label);
+      class_nsamples.push_back(0);
+   }
+}
+
+/* SetSignatureCount
+   set the number of features in each sample, growing the per-feature arrays as needed,
+   and re-laying out sample_matrix so that each row has new_signature_count values.
+   Values of existing samples are kept for the features both counts have, the rest are 0.
+*/
+void TrainingSet::SetSignatureCount(long new_signature_count)
+{  long sample_index, copy_count;
+   compacted = false;
+   if ((long)SignatureNames.size() < new_signature_count) {
+      SignatureNames.resize(new_signature_count);
+      SignatureWeights.resize(new_signature_count, 0.0);
+      SignatureMins.resize(new_signature_count, INF);
+      SignatureMaxes.resize(new_signature_count, -INF);
+   }
+   if (new_signature_count == signature_count) return;
+
+   std::vector<double> new_matrix(count * new_signature_count, 0.0);
+   copy_count = std::min (signature_count, new_signature_count);
+   for (sample_index=0;sample_index<count;sample_index++)
+      std::copy (sample_matrix.begin() + sample_index * signature_count,
+         sample_matrix.begin() + sample_index * signature_count + copy_count,
+         new_matrix.begin() + sample_index * new_signature_count);
+   sample_matrix.swap (new_matrix);
+   signature_count = new_signature_count;
+}
+
+/* SetSignatureName
+   name the feature at sig_index, unless it already has a name.
+   Called by signatures objects that have this set as their NamesTrainingSet.
+*/
+void TrainingSet::SetSignatureName(long sig_index, const char *name)
+{
+   if ((long)SignatureNames.size() <= sig_index) {
+      SignatureNames.resize(sig_index+1);
+      SignatureWeights.resize(sig_index+1, 0.0);
+      SignatureMins.resize(sig_index+1, INF);
+      SignatureMaxes.resize(sig_index+1, -INF);
+   }
+   if (SignatureNames[sig_index].empty()) SignatureNames[sig_index] = name;
+}
+
+/* StoreSampleData
+   copy the feature values of sample into row sample_index of sample_matrix, and release the sample's own copy.
+   The first sample with values sets signature_count.
+   returned value -int- 1 if the values were stored, 0 if the sample doesn't have any values yet (e.g. they are being
+                        computed by another process; AddAllSignatures stores them later), < 0 if the number of values is wrong.
+*/
+int TrainingSet::StoreSampleData(long sample_index, signatures *sample)
+{  char buffer[IMAGE_PATH_LENGTH+SAMPLE_NAME_LENGTH+1];
+
+   if (sample->count < 1) return (0);
+   compacted = false;
+   if (signature_count == 0) SetSignatureCount (sample->count);
+   else if (sample->count != signature_count) {
+      catError ("ERROR: Adding sample '%s' with %ld features to training set with %ld features.\n",
+         sample->GetFileName(buffer), sample->count, signature_count);
+      return (INCONSISTENT_FEATURE_COUNT);
+   }
+   std::copy (sample->data.begin(), sample->data.begin() + signature_count, SampleData (sample_index));
+   std::vector<double>().swap (sample->data);
+   sample->allocated = 0;
+   return (1);
+}
+
+/* SampleSignatures
+   make a new signatures object with the class, value, path and feature values of a sample.
+   The caller owns the returned object.
+*/
+signatures *TrainingSet::SampleSignatures(long sample_index)
+{  signatures *new_samp = samples[sample_index]->duplicate();
+   double *row = SampleData (sample_index);
+   new_samp->count = signature_count;
+   new_samp->Resize (signature_count);
+   if (row) std::copy (row, row + signature_count, new_samp->data.begin());
+   return (new_samp);
 }
 
 
@@ -218,8 +294,9 @@ int TrainingSet::AddContinuousClass(char *label) {
 	is_continuous = 1;
 	is_numeric = 1;
 	class_num = 1;
+	ResizeClasses (CONTINUOUS_CLASS_INDEX);
 	if (label) snprintf(class_labels[CONTINUOUS_CLASS_INDEX],MAX_CLASS_NAME_LENGTH,"%s",label);
-	else class_labels[CONTINUOUS_CLASS_INDEX] = '\0';
+	else class_labels[CONTINUOUS_CLASS_INDEX][0] = '\0';
 	class_nsamples[CONTINUOUS_CLASS_INDEX] = 0;
 	
 	return (1);
@@ -257,11 +334,7 @@ int numeric;
 
 // If it belongs at the end of the ordered class list, add it.
 	} else if (cmp_label > 0) {
-		// Check if we have too many classes
-		if (class_num >= MAX_CLASS_NUM-1) {
-			catError ("Maximum number of classes (%d) exceeded.\n",MAX_CLASS_NUM-1);
-			return (TOO_MANY_CLASSES);
-		}
+		ResizeClasses (class_num+1);
 		class_num++;
 		snprintf(class_labels[class_num],MAX_CLASS_NAME_LENGTH,"%s",label);
 		class_nsamples[class_num] = 0;
@@ -292,11 +365,13 @@ int numeric;
    path -char *- full path to the image file (NULL if n/a)
 
    returned value -int- 1 if suceeded 0 if failed.
-                        can fail due to bad sample class
+                        can fail due to bad sample class, or a feature count different from the other samples
+   The feature values are moved into sample_matrix; the training set keeps new_sample for its class, value and path.
 */
 int TrainingSet::AddSample(signatures *new_sample)
 {
 	char buffer[IMAGE_PATH_LENGTH+SAMPLE_NAME_LENGTH+1];
+	int res;
 
    /* check if the sample can be added */
 	if (new_sample->sample_class > class_num) {
@@ -319,14 +394,18 @@ int TrainingSet::AddSample(signatures *new_sample)
 		feature_vec_version = new_sample->version;
 		feature_vec_type = new_sample->feature_vec_type;
 	}
-	if (signature_count > 0)
-		signature_count = new_sample->count;
 
-	samples[count]=new_sample;
-	signature_count=new_sample->count;
+	samples.push_back (new_sample);
+	count++;
+	sample_matrix.resize (count * signature_count, 0.0);
+	if ( (res = StoreSampleData (count-1, new_sample)) < 0) {
+		samples.pop_back ();
+		count--;
+		sample_matrix.resize (count * signature_count);
+		return (res);
+	}
 	class_nsamples[new_sample->sample_class]++;
 //printf ("Adding Sample to class: %d, total:%ld, signature_count:%ld\n",new_sample->sample_class,class_nsamples[new_sample->sample_class],signature_count);
-	count++;
 	return(1);
 }
 
@@ -348,18 +427,18 @@ int TrainingSet::SaveToFile(char *filename)
    fprintf(file,"%ld\n",count);
    /* write the signature names */
    for (sig_index=0;sig_index<signature_count;sig_index++)
-     fprintf(file,"%s\n",SignatureNames[sig_index]);
+     fprintf(file,"%s\n",SignatureNames[sig_index].c_str());
    /* write the class labels */
    for (class_index=0;class_index<=class_num;class_index++)
      fprintf(file,"%s\n",class_labels[class_index]);
    /* write the samples */
    for (sample_index=0;sample_index<count;sample_index++)
-   {
+   {  double *row = SampleData(sample_index);
       for (sig_index=0;sig_index<signature_count;sig_index++)
-        if (samples[sample_index]->data[sig_index] == (int)(samples[sample_index]->data[sig_index]))
-      fprintf(file,"%ld ",(long)(samples[sample_index]->data[sig_index]));      /* make the file smaller */
-//        else fprintf(file,"%.6f ",samples[sample_index]->data[sig_index]);
-      else fprintf(file,"%.5e ",samples[sample_index]->data[sig_index]);
+        if (row[sig_index] == (int)(row[sig_index]))
+      fprintf(file,"%ld ",(long)(row[sig_index]));      /* make the file smaller */
+//        else fprintf(file,"%.6f ",row[sig_index]);
+      else fprintf(file,"%.5e ",row[sig_index]);
       if (is_continuous) fprintf(file,"%f\n",samples[sample_index]->sample_value);  /* if the class is 0, save the continouos value of the sample */
 	  else fprintf(file,"%d\n",samples[sample_index]->sample_class);   /* save the class of the sample */
       fprintf(file,"%s\n",samples[sample_index]->full_path);
@@ -396,6 +475,22 @@ bool TrainingSet::IsFitFile(char *filename) {
 }
 
 
+/* read_line
+   read one line of any length from file into line, growing it as needed
+   returned value -char *- the line, including the '\n'. Empty at the end of the file.
+*/
+static char *read_line(FILE *file, std::vector<char> &line)
+{  size_t len = 0;
+   if (line.size() < 512) line.resize(512);
+   line[0] = '\0';
+   while (fgets(&line[len],line.size()-len,file)) {
+      len += strlen(&line[len]);
+      if (line[len-1] == '\n' || len < line.size()-1) break;
+      line.resize(2*line.size());
+   }
+   return(&line[0]);
+}
+
 /* ReadFromFile
    filename -char *- the name of the file to open
    returned value -int- 1 is successful, 0 if failed.
@@ -406,7 +501,9 @@ int TrainingSet::ReadFromFile(char *filename)
 {  int sample_index, class_index, sample_count,sig_index;
    int res, file_class_num;
 	int version_maj = 0, version_min = 0;
-   char buffer[50000];
+   compacted = false;
+   std::vector<char> line;
+   char *buffer;
    FILE *file;
    if (!(file=fopen(filename,"r"))) {
     catError ("Can't read .fit file '%s'\n",filename);
@@ -414,8 +511,10 @@ int TrainingSet::ReadFromFile(char *filename)
    }
    for (sample_index=0;sample_index<count;sample_index++)
      if (samples[sample_index]) delete samples[sample_index];
-   delete [] samples;
-   fgets(buffer,sizeof(buffer),file);
+   samples.clear();
+   sample_matrix.clear();
+   count=0;
+   buffer=read_line(file,line);
 	sscanf (buffer, "%d%*[\t ]%d.%d", &file_class_num, &version_maj, &version_min);
 	// If we did not read a version, then it is 1.0
 	if (version_maj == 0) {
@@ -426,27 +525,24 @@ int TrainingSet::ReadFromFile(char *filename)
 		feature_vec_type = version_min;
 	}
 
-   fgets(buffer,sizeof(buffer),file);
-   signature_count=atoi(buffer);
-   fgets(buffer,sizeof(buffer),file);
-   sample_count=atoi(buffer);
-   samples=new signatures*[sample_count];
-   count=0;         /* initialize the count before adding the samples to the training set */
+   signature_count=0;
+   SetSignatureCount (atoi(read_line(file,line)));
+   sample_count=atoi(read_line(file,line));
+   samples.reserve(sample_count);
+   sample_matrix.reserve((size_t)sample_count*signature_count);
    color_features=0;
    /* read the signature names */
    for (sig_index=0;sig_index<signature_count;sig_index++)
-   {  fgets(buffer,sizeof(buffer),file);
+   {  buffer=read_line(file,line);
       chomp (buffer);
-      strcpy(SignatureNames[sig_index],buffer);
-      if (strstr(SignatureNames[sig_index],"color") || strstr(SignatureNames[sig_index],"Color")) color_features=1;   /* check if color signatures are used */
+      SignatureNames[sig_index]=buffer;
+      if (strstr(buffer,"color") || strstr(buffer,"Color")) color_features=1;   /* check if color signatures are used */
    }
    /* read the class labels */
    for (class_index=0;class_index<=file_class_num;class_index++)
-   {  fgets(buffer,sizeof(buffer),file);
+   {  buffer=read_line(file,line);
       chomp (buffer);
-      if ( (res = AddClass(buffer) < 0) ) {
-      	delete [] samples;
-      	samples = NULL;
+      if ( (res = AddClass(buffer)) < 0 ) {
       	fclose(file);
       	return (res);
       }
@@ -456,25 +552,23 @@ int TrainingSet::ReadFromFile(char *filename)
 	   	char *p_buffer;
 		signatures *one_sample;
 		one_sample=new signatures();
-		one_sample->Resize (count);
+		one_sample->Resize (signature_count);
 
-		fgets(buffer,sizeof(buffer),file);
-		p_buffer=strtok(buffer," \n");
+		p_buffer=strtok(read_line(file,line)," \n");
 		for (sig_index=0;sig_index<signature_count;sig_index++) {
-			one_sample->Add(SignatureNames[sig_index],atof(p_buffer));
+			one_sample->data[sig_index]=atof(p_buffer);
 			p_buffer=strtok(NULL," \n");
 		}
+		one_sample->count=signature_count;
 		one_sample->sample_class=atoi(p_buffer);                   // read the class of the sample
 		if (is_continuous) one_sample->sample_value=atof(p_buffer);// use the same value as an continouos value
 		else one_sample->sample_value=atof(class_labels[one_sample->sample_class]); // use the class label as a value
-		fgets(buffer,sizeof(buffer),file);                        // read the image path (can also be en ampty line)
+		buffer=read_line(file,line);                              // read the image path (can also be en ampty line)
 		chomp (buffer);
-		strcpy(one_sample->full_path,buffer);                     // copy the full path to the signatures object
+		snprintf(one_sample->full_path,IMAGE_PATH_LENGTH,"%s",buffer); // copy the full path to the signatures object
 		one_sample->version = feature_vec_version;                // Since we are reading sigs from a fit file, the sig version is the same as fit version.
 		if ( (res=AddSample(one_sample)) < 0) {
-			for (sig_index=0;sig_index<sample_index;sig_index++) delete samples[sig_index];
-			delete [] samples;
-			samples = NULL;
+			delete one_sample;
 			fclose(file);
 			return (res);
 		}
@@ -492,9 +586,10 @@ int TrainingSet::ReadFromFile(char *filename)
 void TrainingSet::MakeContinuous(char *label) {
 long index;
 
+	ResizeClasses (CONTINUOUS_CLASS_INDEX);
 	for (index=0;index < class_num;index++) strcpy(class_labels[index],"");
 	if (label) snprintf(class_labels[CONTINUOUS_CLASS_INDEX],MAX_CLASS_NAME_LENGTH,"%s",label);
-	else class_labels[CONTINUOUS_CLASS_INDEX] = '\0';
+	else class_labels[CONTINUOUS_CLASS_INDEX][0] = '\0';
 
 
 	/* make the samples referring to class_index refer to class 0 */
@@ -545,6 +640,7 @@ void TrainingSet::RemoveClass(long class_index)
 {  long index,deleted_count=0;
 
 	if (class_index >= class_num || class_index < 0) return;
+	compacted = false;
 // remove the class label , and shift labels down only for index > 0
 	if (class_index > 0) {
 		for (index=class_index;index<class_num;index++) {
@@ -555,16 +651,22 @@ void TrainingSet::RemoveClass(long class_index)
 		class_nsamples[0] = 0;
 	}
 	
-// remove the samples of that class
+// remove the samples of that class, moving the rows of the remaining samples up in sample_matrix
 	for (index=0;index<count;index++)  {
 		if (samples[index]->sample_class==class_index) {
 			delete samples[index];
 			deleted_count++;
-		} else samples[index-deleted_count]=samples[index];
+		} else if (deleted_count > 0) {
+			samples[index-deleted_count]=samples[index];
+			if (signature_count > 0)
+				std::copy (SampleData(index), SampleData(index)+signature_count, SampleData(index-deleted_count));
+		}
 	}
 
 // set the new number of samples
 	count=count-deleted_count;
+	samples.resize(count);
+	sample_matrix.resize(count*signature_count);
 // change the indices of the samples, only if class_index > 0
 	if (class_index > 0) {
 		for (index=0;index<count;index++)
@@ -590,7 +692,7 @@ int TrainingSet::SaveWeightVector(char *filename)
    }
    if (verbosity>=2) printf("Saving weight vector to file '%s'...\n",filename);   
    for (sig_index=0;sig_index<signature_count;sig_index++)
-     fprintf(sig_file,"%f %s\n",SignatureWeights[sig_index],SignatureNames[sig_index]);
+     fprintf(sig_file,"%f %s\n",SignatureWeights[sig_index],SignatureNames[sig_index].c_str());
    fclose(sig_file);
    return(1);
 }
@@ -606,6 +708,7 @@ double TrainingSet::LoadWeightVector(char *filename, double factor)
    int sig_index=0;
    char line[128],*p_line;
    double feature_weight_distance=0.0;
+   compacted = false;
    if (!(sig_file=fopen(filename,"r"))) {
     catError ("Can't read weight vector from '%s'.\n",filename);
    	return(0);
@@ -613,7 +716,8 @@ double TrainingSet::LoadWeightVector(char *filename, double factor)
    if (verbosity>=2) printf("Loading weight vector from file '%s'...\n",filename);
    p_line=fgets(line,sizeof(line),sig_file);
    while (p_line)
-   {  if (strlen(p_line)>0)
+   {  if (strlen(p_line)>0 && sig_index>=signature_count) sig_index++;   /* too many weights - only counted for the error below */
+      else if (strlen(p_line)>0)
       {  if (strchr(p_line,' ')) (*strchr(p_line,' '))='\0';
          feature_weight_distance+=pow(SignatureWeights[sig_index]-atof(p_line),2);
          if (factor==0) SignatureWeights[sig_index++]=atof(p_line);
@@ -635,15 +739,16 @@ double TrainingSet::LoadWeightVector(char *filename, double factor)
 */
 void TrainingSet::SetAttrib(TrainingSet *set)
 {  int class_index,sig_index;
-   set->signature_count=signature_count;
+   set->SetSignatureCount(signature_count);
    set->color_features=color_features;
 	 // set->count = count; don't set this, count get incremented as you load sigs into it
    /* copy the class labels to the train and test */
+   set->ResizeClasses(class_num);
    for (class_index=0;class_index<=class_num;class_index++)
      strcpy(set->class_labels[class_index],class_labels[class_index]);
    /* copy the signature names to the training and test set */
    for (sig_index=0;sig_index<signature_count;sig_index++)
-     strcpy(set->SignatureNames[sig_index],SignatureNames[sig_index]);
+     set->SignatureNames[sig_index]=SignatureNames[sig_index];
    set->is_numeric = is_numeric;
    set->is_pure_numeric = is_pure_numeric;
    set->is_continuous = is_continuous;
@@ -673,7 +778,7 @@ int TrainingSet::split(int randomize, double ratio,TrainingSet *TrainSet,Trainin
 	int res;
 	int class_index,tile_index;
 	int number_of_test_samples, number_of_train_samples;
-	long class_counts[MAX_CLASS_NUM];
+	std::vector<long> class_counts(class_num+1, 0);
 	class_samples = new long[count];
 	bool make_test_set = true;
 	long rand_index;
@@ -687,6 +792,8 @@ int TrainingSet::split(int randomize, double ratio,TrainingSet *TrainSet,Trainin
 	 // make sure the number of tiles is valid
 	if( tiles < 1 )	tiles = 1;
 
+	TrainSet->ResizeClasses(class_num);
+	TestSet->ResizeClasses(class_num);
 	TrainSet->class_num = TestSet->class_num = class_num;
 
 	 // if test already has samples from a file
@@ -731,7 +838,7 @@ int TrainingSet::split(int randomize, double ratio,TrainingSet *TrainSet,Trainin
 			else rand_index=0;
 
 			for( tile_index=0; tile_index < tiles; tile_index++ )    // add all the tiles of that image 
-				if( ( res = TrainSet->AddSample( samples[ class_samples[ rand_index * tiles + tile_index ] ]->duplicate() ) ) < 0) return (res);   // add the random sample		   
+				if( ( res = TrainSet->AddSample( SampleSignatures( class_samples[ rand_index * tiles + tile_index ] ) ) ) < 0) return (res);   // add the random sample		   
 			// remove the index
 			memmove( &( class_samples[ rand_index * tiles ] ), &( class_samples[ rand_index * tiles + tiles ] ), sizeof( long )*( tiles*( class_samples_count - rand_index ) ) );
 			class_samples_count--;
@@ -754,7 +861,7 @@ int TrainingSet::split(int randomize, double ratio,TrainingSet *TrainSet,Trainin
 			//printf ("getting %d testing samples from class %s\n", sample_count, class_labels[class_index]);
 			for( sample_index = 0; sample_count > 0; sample_index++ )
 			{
-				if( ( res = TestSet->AddSample( samples[ class_samples[ sample_index ] ]->duplicate() ) ) < 0 ) return (res);
+				if( ( res = TestSet->AddSample( SampleSignatures( class_samples[ sample_index ] ) ) ) < 0 ) return (res);
 				sample_count--;
 			}
 		}
@@ -767,7 +874,7 @@ int TrainingSet::split(int randomize, double ratio,TrainingSet *TrainSet,Trainin
 				else rand_index=0;
 
 				for( tile_index=0; tile_index < tiles; tile_index++ )    // add all the tiles of that image 
-					if( ( res = TestSet->AddSample( samples[ class_samples[ rand_index * tiles + tile_index ] ]->duplicate() ) ) < 0) return (res);   // add the random sample		   
+					if( ( res = TestSet->AddSample( SampleSignatures( class_samples[ rand_index * tiles + tile_index ] ) ) ) < 0) return (res);   // add the random sample		   
 				// remove the index
 				memmove( &( class_samples[ rand_index * tiles ] ), &( class_samples[ rand_index * tiles + tiles ] ), sizeof( long )*( tiles*( class_samples_count - rand_index ) ) );
 				class_samples_count--;
@@ -793,7 +900,7 @@ int TrainingSet::SplitAreas(long tiles_num, TrainingSet **TrainingSets)
    }
    tile_index=0;
    for (samp_index=0;samp_index<count;samp_index++)
-   {  if ( (res=TrainingSets[tile_index]->AddSample(samples[samp_index]->duplicate())) < 0) return (res);
+   {  if ( (res=TrainingSets[tile_index]->AddSample(SampleSignatures(samp_index))) < 0) return (res);
       tile_index++;
       if (tile_index>=tiles_num) tile_index=0;
    }
@@ -849,8 +956,8 @@ int TrainingSet::AddAllSignatures() {
 			if (sample->count != signature_count && signature_count > 0) {
 				bad_sizes << "\t" << sample->GetFileName(buffer) << "\t" << sample->count << "\n";
 				read_error = INCONSISTENT_FEATURE_COUNT;
-			} else if (signature_count == 0) {
-				signature_count = sample->count;
+			} else {
+				StoreSampleData (samp_index, sample);
 			}
 			
 		} else { // report error
@@ -913,8 +1020,9 @@ int TrainingSet::LoadFromPath(char *path, int save_sigs, featureset_t *featurese
 	int path_len = strlen(path);
 	DIR *root_dir,*class_dir;
 	struct dirent *ent;
-	char buffer[512], filename[512], label[512], class_label[MAX_CLASS_NAME_LENGTH], *label_p;
-	char classes_found[MAX_CLASS_NUM][MAX_CLASS_NAME_LENGTH];
+	char buffer[512], filename[512], label[512], class_label[MAX_CLASS_NAME_LENGTH];
+	std::vector<std::string> classes_found; // kept sorted
+	std::vector<std::string>::iterator label_it;
 	int res,n_classes_found=0, do_subdirs=0, class_found_index, class_index, file_class_num,pure_numeric=1;
 	double samp_val;
 	FILE *input_file=NULL;
@@ -941,6 +1049,7 @@ int TrainingSet::LoadFromPath(char *path, int save_sigs, featureset_t *featurese
 			// This also tells us we don't have any defined classes
 				do_subdirs = 0;
 				n_classes_found = 0;
+				classes_found.clear();
 				break; // Don't read any more entries.
 
 			} else if ( (class_dir=opendir(buffer)) ) {
@@ -955,14 +1064,9 @@ int TrainingSet::LoadFromPath(char *path, int save_sigs, featureset_t *featurese
 				errno = 0;
 				if (ent) {
 					do_subdirs = 1;
-					if (n_classes_found < MAX_CLASS_NUM-1) {
-						snprintf(classes_found[n_classes_found],MAX_CLASS_NAME_LENGTH,"%s",class_label);
-						if ( !check_numeric (classes_found[n_classes_found],NULL) ) pure_numeric = 0; // across all class labels!
-						n_classes_found++;
-					} else {
-						catError ("Classes in subdirectories of '%s' exceeds the maximum number of classes allowed (%d).\n",path,MAX_CLASS_NUM-1);
-						return (TOO_MANY_CLASSES);
-					}
+					classes_found.push_back (class_label);
+					if ( !check_numeric (class_label,NULL) ) pure_numeric = 0; // across all class labels!
+					n_classes_found++;
 				}
 			}
 		} // each dir entry.
@@ -973,7 +1077,7 @@ int TrainingSet::LoadFromPath(char *path, int save_sigs, featureset_t *featurese
 		errno = 0;
 
 	// Sort any classes we found
-		qsort(classes_found,n_classes_found,sizeof(classes_found[0]),comp_strings);
+		std::sort (classes_found.begin(), classes_found.end());
 
 	} else {
 	// Its a file (image, .fit or file-of-files)
@@ -1020,25 +1124,14 @@ int TrainingSet::LoadFromPath(char *path, int save_sigs, featureset_t *featurese
 					snprintf (class_label,MAX_CLASS_NAME_LENGTH,"%s",label); // conform to size restriction
 
 				// Search for the label in pre-existing labels
-					label_p = (char *)bsearch(class_label, classes_found, n_classes_found, sizeof(classes_found[0]), comp_strings);
+					label_it = std::lower_bound (classes_found.begin(), classes_found.end(), std::string (class_label));
 
-					if (label_p) {
-					// Class was previously found in the file - convert bsearch pointer to index
-						file_class_num = (int) ( (label_p - classes_found[0]) / sizeof(classes_found[0]) ) + 1;
-
-					} else {
+					if (label_it == classes_found.end() || *label_it != class_label) {
 					// New label - NO pre-existing class found
-						if (n_classes_found < MAX_CLASS_NUM-1) {
-							snprintf(classes_found[n_classes_found],MAX_CLASS_NAME_LENGTH,"%s",class_label);	/* the label of the class is the directory name */
-							if ( !check_numeric (classes_found[n_classes_found],NULL) ) pure_numeric = 0; // across all class labels!
-							n_classes_found++;
-						} else {
-							catError ("Classes in file '%s' exceeds the maximum number of classes allowed (%d).\n",path,MAX_CLASS_NUM-1);
-							return (TOO_MANY_CLASSES);
-						}
-					// Sort any classes we found
-					// Note that we have to re-sort the list for every class we find in order for bsearch above to work.
-						qsort(classes_found,n_classes_found,sizeof(classes_found[0]),comp_strings);
+					// Insert it in sort order so that the search above keeps working.
+						classes_found.insert (label_it, class_label);
+						if ( !check_numeric (class_label,NULL) ) pure_numeric = 0; // across all class labels!
+						n_classes_found++;
 					} // new label
 				} // got a label from file
 			} // while reading file of filenames
@@ -1066,18 +1159,19 @@ int TrainingSet::LoadFromPath(char *path, int save_sigs, featureset_t *featurese
 	// Process the classes we found, and the subdirectories if we found them
 		for (class_found_index=0;class_found_index<n_classes_found;class_found_index++) {
 		// Create class.
+			snprintf(class_label,MAX_CLASS_NAME_LENGTH,"%s",classes_found[class_found_index].c_str());
 			if (is_continuous) class_index = CONTINUOUS_CLASS_INDEX;
 			else {
-				class_index = AddClass (classes_found[class_found_index]);
+				class_index = AddClass (class_label);
 				// This may barf for various reasons.
 				if (class_index < 0) return (class_index);
 			}
 	
-			check_numeric (classes_found[class_found_index],&samp_val);
+			check_numeric (class_label,&samp_val);
 	
 		// LoadFromFilesDir sorts the samples (files)
 			if (do_subdirs) {
-				sprintf(buffer,"%s/%s",path,classes_found[class_found_index]);
+				sprintf(buffer,"%s/%s",path,class_label);
 			// reset the system error
 				errno = 0;
 				res=LoadFromFilesDir (buffer, class_index, samp_val, save_sigs, featureset);
@@ -1115,8 +1209,8 @@ int TrainingSet::LoadFromPath(char *path, int save_sigs, featureset_t *featurese
 	
 				// Search for the label in pre-existing labels
 					if (!is_continuous) {
-						label_p = (char *)bsearch(class_label, classes_found, n_classes_found, sizeof(classes_found[0]), comp_strings);
-						if (label_p) file_class_num = (int) ( (label_p - classes_found[0]) / sizeof(classes_found[0]) ) + 1;
+						label_it = std::lower_bound (classes_found.begin(), classes_found.end(), std::string (class_label));
+						if (label_it != classes_found.end() && *label_it == class_label) file_class_num = (int) (label_it - classes_found.begin()) + 1;
 						else file_class_num = UNKNOWN_CLASS_INDEX; // This should never happen.
 					} else {
 						file_class_num = CONTINUOUS_CLASS_INDEX;
@@ -1581,24 +1675,52 @@ int TrainingSet::CheckImageSigs (char *filename, featureset_t *featureset ) {
 	return (1);
 }
 
+/* output_printf
+   printf to stdout, or append to output->console if output is not NULL
+*/
+static void output_printf (classify_output_t *output, const char *format, ...) {
+	va_list args, args2;
+	va_start (args, format);
+	if (!output) {
+		vprintf (format, args);
+	} else {
+		char buffer[512];
+		va_copy (args2, args);
+		int length = vsnprintf (buffer, sizeof (buffer), format, args);
+		if (length >= (int)sizeof (buffer)) {
+			std::vector<char> long_buffer (length + 1);
+			vsnprintf (&long_buffer[0], long_buffer.size(), format, args2);
+			output->console += &long_buffer[0];
+		} else if (length > 0) {
+			output->console += buffer;
+		}
+		va_end (args2);
+	}
+	va_end (args);
+}
+
 /* Classify 
    Classify a test sample.
    TestSet -TrainingSet *- one or more tiles of one or more test image
    test_sample_index -int- the index of the image in TestSet that should be tested. if tiles, then the first tile.
    max_tile -int- just use the most similar tile instead of averaging all times
+   output -classify_output_t *- if not NULL, the report lines are appended to it instead of being printed, and the
+     report's table row to output->individual_images instead of split->individual_images
    returned value can be either a class index, or if is_continuous a contiouos value
 */
 
-double TrainingSet::ClassifyImage(TrainingSet *TestSet, int test_sample_index,int method, int tiles, int tile_areas, TrainingSet *TilesTrainingSets[], int max_tile, int rank, data_split *split, double *similarities)
+double TrainingSet::ClassifyImage(TrainingSet *TestSet, int test_sample_index,int method, int tiles, int tile_areas, TrainingSet *TilesTrainingSets[], int max_tile, int rank, data_split *split, double *similarities, classify_output_t *output)
 {  int predicted_class=0,tile_index,class_index,cand,sample_class,test_tile_index,interpolate=1;
-   double probabilities[MAX_CLASS_NUM],probabilities_sum[MAX_CLASS_NUM],normalization_factor,normalization_factor_avg=0;
+   std::vector<double> probabilities(class_num+1, 0.0),probabilities_sum(class_num+1, 0.0);
+   double normalization_factor,normalization_factor_avg=0;
    signatures *closest_sample=NULL, *tile_closest_sample=NULL,*test_signature;
    char interpolated_value[128],last_path[IMAGE_PATH_LENGTH];
    TrainingSet *ts_selector;
    int most_similar_tile=1,most_similar_predicted_class=0;
    double val=0.0,sum_prob=0.0,dist,value=0.0,most_similar_value=0.0,closest_value_dist=INF,max_tile_similarity=0.0;
    int do_html=0;
-   char buffer[512],closest_image[512],color[128],one_image_string[MAX_CLASS_NUM*15];
+   char buffer[512],closest_image[512],color[128];
+   std::string one_image_string;
 
    // interpolate only if all class labels are values
 	interpolate=is_numeric;
@@ -1617,8 +1739,8 @@ double TrainingSet::ClassifyImage(TrainingSet *TestSet, int test_sample_index,in
 
 	for (tile_index=test_sample_index;tile_index<test_sample_index+tiles;tile_index++) {
 		if (verbosity>=2 && tiles>1)
-			printf("%s (%d/%d)\t",TestSet->samples[tile_index]->full_path,1+tile_index-test_sample_index,tiles);
-		test_signature = TestSet->samples[ tile_index ]->duplicate();
+			output_printf (output, "%s (%d/%d)\t",TestSet->samples[tile_index]->full_path,1+tile_index-test_sample_index,tiles);
+		test_signature = TestSet->SampleSignatures( tile_index );
 		if (tile_areas==0 || tiles==1)
 			ts_selector=this;
 		else 
@@ -1642,17 +1764,17 @@ double TrainingSet::ClassifyImage(TrainingSet *TestSet, int test_sample_index,in
 			value = value + val / ( double ) tiles;
 			if( verbosity>=2 && tiles > 1 ) {
 				if( sample_class )
-					printf( "%.3g\t%.3g\n", TestSet->samples[ test_sample_index ]->sample_value, val );
+					output_printf (output, "%.3g\t%.3g\n", TestSet->samples[ test_sample_index ]->sample_value, val );
 				else
-					printf( "N/A\t%.3g\n", val );
+					output_printf (output, "N/A\t%.3g\n", val );
 			}
 		}
 		else
 		{
 			if( method == WNN )
-				predicted_class = ts_selector->WNNclassify( test_signature, probabilities, &normalization_factor, &closest_sample );
+				predicted_class = ts_selector->WNNclassify( test_signature, &probabilities[0], &normalization_factor, &closest_sample );
 			if( method == WND )
-				predicted_class = ts_selector->classify2( TestSet->samples[ test_sample_index ]->full_path, test_sample_index, test_signature, probabilities, &normalization_factor );
+				predicted_class = ts_selector->classify2( TestSet->samples[ test_sample_index ]->full_path, test_sample_index, test_signature, &probabilities[0], &normalization_factor );
 			//if (method==WND) predicted_class=this->classify3(test_signature, probabilities, &normalization_factor);
 			if (predicted_class < 1) {
 				// This should not really happen...
@@ -1660,22 +1782,22 @@ double TrainingSet::ClassifyImage(TrainingSet *TestSet, int test_sample_index,in
 			}
 
 			if( verbosity>=2 && tiles>1) {
-				printf( "%.3g\t", normalization_factor );
+				output_printf (output, "%.3g\t", normalization_factor );
 				for( class_index = 1; class_index <= class_num; class_index++)
-					printf( "%.3f\t", probabilities[ class_index ] );
+					output_printf (output, "%.3f\t", probabilities[ class_index ] );
 				if( sample_class )
-					printf( "%s\t%s", class_labels[ sample_class ], class_labels[ predicted_class ] );
+					output_printf (output, "%s\t%s", class_labels[ sample_class ], class_labels[ predicted_class ] );
 				else
-					printf( "%s*\t%s", TestSet->class_labels[TestSet->samples[ test_sample_index ]->sample_class], class_labels[ predicted_class ] );
+					output_printf (output, "%s*\t%s", TestSet->class_labels[TestSet->samples[ test_sample_index ]->sample_class], class_labels[ predicted_class ] );
 
 				if (interpolate) {
 					TestSet->samples[ test_sample_index ]->interpolated_value = 0;
 					for( class_index = 1; class_index <= class_num; class_index++ )
 						TestSet->samples[ test_sample_index ]->interpolated_value += 
 							probabilities[ class_index ] * atof (TestSet->class_labels [class_index]) ;
-					printf ("\t%.3f",TestSet->samples[ test_sample_index ]->interpolated_value);
+					output_printf (output, "\t%.3f",TestSet->samples[ test_sample_index ]->interpolated_value);
 				}
-				printf( "\n" );
+				output_printf (output, "\n" );
 			}
 		}
 
@@ -1714,19 +1836,19 @@ double TrainingSet::ClassifyImage(TrainingSet *TestSet, int test_sample_index,in
 				signatures *compare_to;
 				if( max_tile )
 					// so that only the most similar tile is used 
-					compare_to = TestSet->samples[ most_similar_tile ]->duplicate();
+					compare_to = TestSet->SampleSignatures( most_similar_tile );
 				else
-					compare_to = TestSet->samples[ test_tile_index ]->duplicate();          
+					compare_to = TestSet->SampleSignatures( test_tile_index );
 				// compare two normalized vectors
 				compare_to->normalize(this);
 				int indx = ( 1 + test_sample_index / tiles ) * ( TestSet->count / tiles + 1 ) + test_tile_index / tiles + 1;
-				split->image_similarities[ indx ] += distance( test_signature, compare_to, 2.0 ) / tiles;
+				split->image_similarities[ indx ] += distance( &test_signature->data[0], &compare_to->data[0], 2.0 ) / tiles;
 				delete compare_to;
 			}
 		}
 		  
 		if( ( strcmp( last_path, test_signature->full_path ) != 0 ) )
-			printf( "inconsistent tile %d of image '%s' \n", tile_index-test_sample_index, test_signature->full_path );
+			output_printf (output, "inconsistent tile %d of image '%s' \n", tile_index-test_sample_index, test_signature->full_path );
 
 		for( class_index = 1; class_index <= class_num; class_index++ )
 		{
@@ -1804,23 +1926,24 @@ double TrainingSet::ClassifyImage(TrainingSet *TestSet, int test_sample_index,in
 
 	// Image index
 	if( do_html ) {
-		sprintf( one_image_string, "<tr><td>%d</td>", ( test_sample_index / tiles ) + 1 );
+		sprintf( buffer, "<tr><td>%d</td>", ( test_sample_index / tiles ) + 1 );
+		one_image_string = buffer;
 	}
 
 	// Name
 	if (verbosity>=1) {
-		printf("%s",TestSet->samples[test_sample_index]->full_path);
-		if (tiles > 1) printf(" (AVG)");
-		printf ("\t");
+		output_printf (output, "%s",TestSet->samples[test_sample_index]->full_path);
+		if (tiles > 1) output_printf (output, " (AVG)");
+		output_printf (output, "\t");
 	}
 
 	// Normalization Factor
 	if (!is_continuous && (do_html || verbosity>=1)) {
 		if (do_html) {
 			sprintf( buffer,"<td>%.3g</td>", normalization_factor_avg );
-			strcat(one_image_string, buffer);
+			one_image_string += buffer;
 		}
-		if (verbosity>=1) printf ("%.3g\t",normalization_factor_avg);
+		if (verbosity>=1) output_printf (output, "%.3g\t",normalization_factor_avg);
 	}
 
 	// Marginal Probabilities
@@ -1835,10 +1958,10 @@ double TrainingSet::ClassifyImage(TrainingSet *TestSet, int test_sample_index,in
 					sprintf(buffer,"<td><b>%.3f</b></td>",probabilities_sum[class_index]);
 				else
 					sprintf(buffer,"<td>%.3f</td>",probabilities_sum[class_index]);
-				strcat(one_image_string,buffer);
+				one_image_string += buffer;
 			}
 			if( verbosity >= 1 )
-				printf ("%.3f\t",probabilities_sum[class_index]);
+				output_printf (output, "%.3f\t",probabilities_sum[class_index]);
 		}
 		if( do_html )
 		{
@@ -1888,7 +2011,7 @@ double TrainingSet::ClassifyImage(TrainingSet *TestSet, int test_sample_index,in
 			if (do_html) sprintf(buffer,"<td></td><td>%.3g</td><td>%.3f</td>",TestSet->samples[test_sample_index]->sample_value,TestSet->samples[test_sample_index]->interpolated_value);
 			// if a known class, print actual value,predicted value, percent error(abs((actual-predicted)/actual)).
 			if (verbosity>=1)
-				printf("%f\t%f\t%f\n",TestSet->samples[test_sample_index]->sample_value,
+				output_printf (output, "%f\t%f\t%f\n",TestSet->samples[test_sample_index]->sample_value,
 					TestSet->samples[test_sample_index]->interpolated_value,
 					fabs((TestSet->samples[test_sample_index]->sample_value-TestSet->samples[test_sample_index]->interpolated_value)/TestSet->samples[test_sample_index]->sample_value));
 		}
@@ -1897,7 +2020,7 @@ double TrainingSet::ClassifyImage(TrainingSet *TestSet, int test_sample_index,in
 			if (do_html) sprintf(buffer,"<td></td><td>UNKNOWN</td><td>%.3g</td>",TestSet->samples[test_sample_index]->interpolated_value);
 			// if a known class, print actual value,predicted value, percent error(abs((actual-predicted)/actual)).  Otherwise just predicted value.
 			if (verbosity>=1)
-				printf("N/A\t%f\n",TestSet->samples[test_sample_index]->interpolated_value);
+				output_printf (output, "N/A\t%f\n",TestSet->samples[test_sample_index]->interpolated_value);
 		}
 	}
 	else
@@ -1905,26 +2028,27 @@ double TrainingSet::ClassifyImage(TrainingSet *TestSet, int test_sample_index,in
 	// if a known class, print actual class,predicted class.  Otherwise just predicted value.
 		if (sample_class) { // known class
 			if (verbosity>=1) {
-				printf("%s\t%s",class_labels[sample_class],class_labels[predicted_class]);
-				if (interpolate) printf ("\t%.3f",TestSet->samples[ test_sample_index ]->interpolated_value);
-				printf("\n");
+				output_printf (output, "%s\t%s",class_labels[sample_class],class_labels[predicted_class]);
+				if (interpolate) output_printf (output, "\t%.3f",TestSet->samples[ test_sample_index ]->interpolated_value);
+				output_printf (output, "\n");
 			}
 			if (do_html) sprintf(buffer,"<td></td><td>%s</td><td>%s</td><td>%s</td>%s",class_labels[sample_class],class_labels[predicted_class],color,interpolated_value);
 		} else {
 			if (verbosity>=1) {
-				printf( "%s*\t%s", TestSet->class_labels[TestSet->samples[ test_sample_index ]->sample_class], class_labels[ predicted_class ] );
-				if (interpolate) printf ("\t%.3f",TestSet->samples[ test_sample_index ]->interpolated_value);
-				printf("\n");
+				output_printf (output, "%s*\t%s", TestSet->class_labels[TestSet->samples[ test_sample_index ]->sample_class], class_labels[ predicted_class ] );
+				if (interpolate) output_printf (output, "\t%.3f",TestSet->samples[ test_sample_index ]->interpolated_value);
+				output_printf (output, "\n");
 			}
 			if (do_html) sprintf(buffer,"<td></td><td>%s*</td><td>%s</td><td>%s</td>%s",TestSet->class_labels[TestSet->samples[ test_sample_index ]->sample_class],class_labels[predicted_class],color,interpolated_value);
 		}
 	}
 
 	if (do_html) {
-		strcat(one_image_string,buffer);
+		one_image_string += buffer;
 		sprintf(buffer,"<td><A HREF=\"%s\"><IMG WIDTH=40 HEIGHT=40 SRC=\"%s__1\"></A></td>%s</tr>\n",TestSet->samples[test_sample_index]->full_path,TestSet->samples[test_sample_index]->full_path,closest_image); /* add the links to the image */
-		strcat(one_image_string,buffer);
-		strcat(split->individual_images,one_image_string);   /* add the image to the string */
+		one_image_string += buffer;
+		if (output) output->individual_images += one_image_string;
+		else strcat(split->individual_images,one_image_string.c_str());   /* add the image to the string */
 	}
 
    /* end of reporting */
@@ -1934,6 +2058,31 @@ double TrainingSet::ClassifyImage(TrainingSet *TestSet, int test_sample_index,in
    else return(predicted_class);
 }
 
+/* test_images
+   classify the test images that start at samples first_sample up to last_sample of TestSet (see Test)
+   known_images, accurate_prediction -long *- incremented for each image with a known class, and each one correctly predicted
+*/
+static void test_images(TrainingSet *train, TrainingSet *TestSet, int first_sample, int last_sample, int method, int tiles, int tile_areas, TrainingSet *TilesTrainingSets[], int max_tile, long rank, data_split *split, classify_output_t *output, long *known_images, long *accurate_prediction)
+{	int test_sample_index, predicted_class;
+
+	for( test_sample_index = first_sample; test_sample_index < last_sample; test_sample_index += tiles )
+	{
+		if( train->is_continuous )
+			train->ClassifyImage( TestSet, test_sample_index, method, tiles, tile_areas, TilesTrainingSets, max_tile, rank, split, NULL, output );
+		  //FIXME: do what with the value returned by ClassifyImage?
+		else
+		{
+			predicted_class = int( train->ClassifyImage( TestSet, test_sample_index, method, tiles, tile_areas, TilesTrainingSets, max_tile, rank, split, NULL, output ) );
+			if( TestSet->samples[ test_sample_index ]->sample_class )
+			{
+				(*known_images)++;
+				if( predicted_class == TestSet->samples[ test_sample_index ]->sample_class )
+					(*accurate_prediction)++;
+			}
+		}
+	}
+}
+
 /* Test
    Test the classification accuracy using two sets of signatures
    method -int- 0 - WNN,   1 - WND-5
@@ -1941,12 +2090,14 @@ double TrainingSet::ClassifyImage(TrainingSet *TestSet, int test_sample_index,in
    tiles -int- number of tiles of each image.
    rank -long- the number of first closest classes among which a presence of the right class is considered a match
    max_tile -int- use only the most similar tile
+   n_threads -int- the number of threads classifying the test images. Each thread gets a contiguous range of images,
+     and its own confusion and similarity matrices, which are added up in order when all the threads are done.
+   console -std::string *- if not NULL, the per-image report lines are appended to it instead of being printed.
 */
-double TrainingSet::Test(TrainingSet *TestSet, int method, int tiles, int tile_areas, TrainingSet *TilesTrainingSets[], int max_tile,long rank, data_split *split)
+double TrainingSet::Test(TrainingSet *TestSet, int method, int tiles, int tile_areas, TrainingSet *TilesTrainingSets[], int max_tile,long rank, data_split *split, int n_threads, std::string *console)
 {  int test_sample_index,class_index,b;//tile_index;
    long accurate_prediction=0, known_images=0;//,interpolate=1;
-	double value;
-	int predicted_class;
+	long n_images;
 
    if (tiles<1) tiles=1;       /* make sure the number of tiles is at least 1 */
    if (rank<=0) rank=1;  /* set a valid value to rank                */
@@ -1987,20 +2138,98 @@ double TrainingSet::Test(TrainingSet *TestSet, int method, int tiles, int tile_a
 	 }
 #endif
 
-	 for( test_sample_index = 0; test_sample_index < TestSet->count; test_sample_index += tiles )
-	 {
-		 if( is_continuous )
-			 value = ClassifyImage(TestSet,test_sample_index,method,tiles,tile_areas,TilesTrainingSets,max_tile,rank,split,NULL);
-		   //FIXME: do what with the value in "value"?
-		 else 
-		 {
-			 predicted_class = int( ClassifyImage( TestSet, test_sample_index, method, tiles, tile_areas, TilesTrainingSets, max_tile, rank, split, NULL ) );
-			 if( TestSet->samples[ test_sample_index ]->sample_class )
-			 {
-				 known_images++;
-				 if( predicted_class == TestSet->samples[ test_sample_index ]->sample_class )
-					 accurate_prediction++;
+	 // classify2() only goes through the features with non-zero weights.
+	 // Compact them here, before any classifying thread starts - classify2() never does.
+	 if( method == WND ) {
+		 if( !compacted ) CompactFeatures();
+		 if( tile_areas && tiles > 1 )
+			 for( b = 0; b < tiles; b++ )
+				 if( !TilesTrainingSets[ b ]->compacted ) TilesTrainingSets[ b ]->CompactFeatures();
+	 }
+
+	 n_images = ( TestSet->count + tiles - 1 ) / tiles;
+	 if( n_threads > n_images ) n_threads = n_images;
+#if DEBUG_CREATE_INDIV_DISTANCE_FILES
+	 n_threads = 1; // classify2() appends to the files
+#endif
+
+	 if( n_threads <= 1 ) {
+		 classify_output_t output;
+		 test_images( this, TestSet, 0, TestSet->count, method, tiles, tile_areas, TilesTrainingSets, max_tile, rank, split,
+			 ( console ? &output : NULL ), &known_images, &accurate_prediction );
+		 if( console ) {
+			 *console += output.console;
+			 if( split && split->individual_images ) strcat( split->individual_images, output.individual_images.c_str() );
+		 }
+	 } else {
+		 // Each thread accumulates into its own data_split. Its image_similarities rows are those of its own images,
+		 // so it can share them. individual_images is only checked for NULL - the rows go to the thread's output.
+		 typedef struct {
+			 data_split split;
+			 std::vector<unsigned short> confusion_matrix;
+			 std::vector<double> similarity_matrix;
+			 std::vector<double> tile_area_accuracy;
+			 classify_output_t output;
+			 long known_images, accurate_prediction;
+			 int first_sample, last_sample;
+		 } test_thread_t;
+		 std::vector<test_thread_t> thread_data( n_threads );
+		 std::vector<std::thread> threads;
+		 long first_image = 0, thread_images;
+		 int thread_index;
+
+		 for( thread_index = 0; thread_index < n_threads; thread_index++ ) {
+			 test_thread_t &td = thread_data[ thread_index ];
+			 thread_images = n_images / n_threads + ( thread_index < n_images % n_threads );
+			 td.first_sample = first_image * tiles;
+			 td.last_sample = std::min( ( first_image + thread_images ) * tiles, (long)TestSet->count );
+			 first_image += thread_images;
+			 td.known_images = td.accurate_prediction = 0;
+			 if( !split ) continue;
+			 td.split = data_split();
+			 td.split.image_similarities = split->image_similarities;
+			 td.split.individual_images = split->individual_images;
+			 if( split->confusion_matrix ) {
+				 td.confusion_matrix.resize( (class_num + 1) * (class_num + 1), 0 );
+				 td.split.confusion_matrix = &td.confusion_matrix[0];
+			 }
+			 if( split->similarity_matrix ) {
+				 td.similarity_matrix.resize( (class_num + 1) * (class_num + 1), 0.0 );
+				 td.split.similarity_matrix = &td.similarity_matrix[0];
+			 }
+			 if( split->tile_area_accuracy ) {
+				 td.tile_area_accuracy.resize( tiles, 0.0 );
+				 td.split.tile_area_accuracy = &td.tile_area_accuracy[0];
+			 }
+			 td.split.marginal_probabilities.resize( (class_num + 1) * (class_num + 1) );
+		 }
+
+		 for( thread_index = 0; thread_index < n_threads; thread_index++ ) {
+			 test_thread_t *td = &thread_data[ thread_index ];
+			 threads.push_back( std::thread( [=]() {
+				 test_images( this, TestSet, td->first_sample, td->last_sample, method, tiles, tile_areas, TilesTrainingSets, max_tile, rank,
+					 ( split ? &td->split : NULL ), &td->output, &td->known_images, &td->accurate_prediction );
+			 } ) );
+		 }
+
+		 // add up the threads' results in the order of the test images
+		 for( thread_index = 0; thread_index < n_threads; thread_index++ ) {
+			 test_thread_t &td = thread_data[ thread_index ];
+			 threads[ thread_index ].join();
+			 known_images += td.known_images;
+			 accurate_prediction += td.accurate_prediction;
+			 if( console ) *console += td.output.console;
+			 else fputs( td.output.console.c_str(), stdout );
+			 if( !split ) continue;
+			 for( class_index = 0; class_index < (class_num + 1) * (class_num + 1); class_index++ ) {
+				 if( split->confusion_matrix ) split->confusion_matrix[ class_index ] += td.confusion_matrix[ class_index ];
+				 if( split->similarity_matrix ) split->similarity_matrix[ class_index ] += td.similarity_matrix[ class_index ];
+				 split->marginal_probabilities[ class_index ].splice( split->marginal_probabilities[ class_index ].end(),
+					 td.split.marginal_probabilities[ class_index ] );
 			 }
+			 if( split->tile_area_accuracy )
+				 for( b = 0; b < tiles; b++ ) split->tile_area_accuracy[ b ] += td.tile_area_accuracy[ b ];
+			 if( split->individual_images ) strcat( split->individual_images, td.output.individual_images.c_str() );
 		 }
 	 }
 /*
@@ -2078,40 +2307,211 @@ double TrainingSet::Test(TrainingSet *TestSet, int method, int tiles, int tile_a
 
 void TrainingSet::normalize() {  
 	int sig_index, samp_index;
+	double *row;
+	compacted = false;
 
 	double sig_val, sig_min, sig_max;
 
+	// Both passes go through sample_matrix a row at a time, in memory order.
+	/* these values of min and max can be used for normalizing a test vector */
 	for( sig_index = 0; sig_index < signature_count; sig_index++ ) {  
-    // Get the values for this particular feature across entire training set
-    	sig_min = MAX_SIG_VAL;
-    	sig_max = MIN_SIG_VAL;
-		for( samp_index = 0; samp_index < count; samp_index++ ) {
-			sig_val = samples[ samp_index ]->data[ sig_index ];
+		SignatureMaxes[ sig_index ] = MIN_SIG_VAL;
+		SignatureMins[ sig_index ] = MAX_SIG_VAL;
+	}
+	// Get the range of each feature across entire training set
+	for( samp_index = 0; samp_index < count; samp_index++ ) {
+		row = SampleData( samp_index );
+		for( sig_index = 0; sig_index < signature_count; sig_index++ ) {  
+			sig_val = row[ sig_index ];
 			// ignore out of bounds sig values for determining minimum and maximum: They will be clipped later
 			if (std::isnan (sig_val) || sig_val > MAX_SIG_VAL || sig_val < MIN_SIG_VAL) continue;
 
-			if (sig_val > sig_max) sig_max = sig_val;
-			if (sig_val < sig_min) sig_min = sig_val;
+			if (sig_val > SignatureMaxes[ sig_index ]) SignatureMaxes[ sig_index ] = sig_val;
+			if (sig_val < SignatureMins[ sig_index ]) SignatureMins[ sig_index ] = sig_val;
 		}
+	}
 
-		/* these values of min and max can be used for normalizing a test vector */
-		SignatureMaxes[ sig_index ] = sig_max;
-		SignatureMins[ sig_index ] = sig_min;
-
-		for( samp_index = 0; samp_index < count; samp_index++ ) {
-			sig_val = samples[ samp_index ]->data[ sig_index ];
+	for( samp_index = 0; samp_index < count; samp_index++ ) {
+		row = SampleData( samp_index );
+		for( sig_index = 0; sig_index < signature_count; sig_index++ ) {  
+			sig_val = row[ sig_index ];
+			sig_min = SignatureMins[ sig_index ];
+			sig_max = SignatureMaxes[ sig_index ];
 
 			if (std::isnan (sig_val) || sig_val < sig_min || (sig_max - sig_min) < DBL_EPSILON) sig_val = 0; 
 			else if( sig_val > sig_max )
 				sig_val = 100;
 			else
 				sig_val = 100 * ( (sig_val - sig_min) / (sig_max - sig_min) );
-			samples[ samp_index ]->data[ sig_index ] = sig_val;
+			row[ sig_index ] = sig_val;
 		}
 	}
 }
 
 
+/* CompactFeatures
+   Copy the columns of sample_matrix of the features with non-zero weights to compact_matrix, and their squared weights
+   to compact_weights2, so that classify2 goes through only the features it uses, in memory order.
+   Sets compacted. Anything that changes the weights or the feature values clears it, and Test() compacts again
+   before it starts classifying. Not thread-safe: it must not be called while classify2 may be running.
+*/
+
+void TrainingSet::CompactFeatures() {
+	long samp_index, compact_index, n_compact;
+	double *row, *compact_row;
+
+	CompactWeights( compact_features, compact_weights2 );
+	n_compact = compact_features.size();
+	compact_matrix.assign( count * n_compact, 0.0 );
+	for( samp_index = 0; samp_index < count && n_compact > 0; samp_index++ ) {
+		row = SampleData( samp_index );
+		compact_row = &compact_matrix[ samp_index * n_compact ];
+		for( compact_index = 0; compact_index < n_compact; compact_index++ )
+			compact_row[ compact_index ] = row[ compact_features[ compact_index ] ];
+	}
+	compacted = true;
+}
+
+/* CompactWeights
+   fill features with the indexes of the features with non-zero weights, and weights2 with their squared weights.
+*/
+void TrainingSet::CompactWeights(std::vector<long> &features, std::vector<double> &weights2) const {
+	long sig_index;
+
+	features.clear();
+	weights2.clear();
+	for( sig_index = 0; sig_index < signature_count; sig_index++ ) {
+		if (SignatureWeights[ sig_index ] < DBL_EPSILON) continue;
+		features.push_back( sig_index );
+		weights2.push_back( SignatureWeights[ sig_index ] * SignatureWeights[ sig_index ] );
+	}
+}
+
+
+#define MRMR_STATES 3   /* number of states the features are discretized into for mRMR */
+
+/* mrmr_entropy
+   entropy in bits of a distribution given as n counts that add up to total
+*/
+static double mrmr_entropy(const long *counts, int n, long total) {
+	double entropy = 0.0, p;
+	for (int index = 0; index < n; index++) {
+		if (counts[index] < 1) continue;
+		p = (double)counts[index] / (double)total;
+		entropy -= p * log2 (p);
+	}
+	return (entropy);
+}
+
+/* mrmr_add_redundancy
+   add the mutual information of candidate features first to last-1 with the selected candidate to their redundancy_sums
+   states -unsigned char *- the discretized values of each candidate, n_samples per candidate
+*/
+static void mrmr_add_redundancy(const unsigned char *states, long n_samples, long selected, long first, long last,
+	const double *entropies, double *redundancy_sums) {
+	const unsigned char *selected_states = states + selected * n_samples;
+	long counts[MRMR_STATES * MRMR_STATES];
+
+	for (long candidate = first; candidate < last; candidate++) {
+		const unsigned char *candidate_states = states + candidate * n_samples;
+		memset (counts, 0, sizeof (counts));
+		for (long sample_index = 0; sample_index < n_samples; sample_index++)
+			counts[ candidate_states[sample_index] * MRMR_STATES + selected_states[sample_index] ]++;
+		redundancy_sums[candidate] += entropies[candidate] + entropies[selected] - mrmr_entropy (counts, MRMR_STATES * MRMR_STATES, n_samples);
+	}
+}
+
+/* SetmRMRScores
+   Select features by Minimum Redundancy Maximum Relevance (Peng, Long & Ding 2005) among the features with non-zero weights,
+   and set their weights to their mRMR (MID) scores. The weights of all the other features are set to 0.
+   used_signatures -double- the fraction of the signatures that SetFisherScores kept
+   used_mrmr -double- the fraction of those that mRMR selects
+   The features are discretized into three states at their mean +/- one standard deviation. The first feature selected is the one with
+   the highest mutual information with the class (relevance), then each time the one with the highest relevance minus its mean mutual
+   information with the selected features (redundancy). Redundancies are updated with one selected feature at a time, in several threads.
+*/
+void TrainingSet::SetmRMRScores(double used_signatures, double used_mrmr)
+{	std::vector<long> candidates;
+	long sig_index, sample_index, candidate, n_candidates, n_select, n_selected;
+	int n_threads, thread_index;
+	double *row, mean, stddev, val;
+	compacted = false;
+
+	for (sig_index = 0; sig_index < signature_count; sig_index++)
+		if (SignatureWeights[sig_index] > 0) candidates.push_back (sig_index);
+	n_candidates = candidates.size();
+	n_select = (long)(used_mrmr*used_signatures*signature_count);
+	if (n_select > n_candidates) n_select = n_candidates;
+	if (n_select < 1 || count < 1) return;
+
+	// discretize the candidates, and get their entropies and mutual information with the class
+	std::vector<unsigned char> states (n_candidates * count);
+	std::vector<double> entropies (n_candidates), relevances (n_candidates), redundancy_sums (n_candidates, 0.0);
+	std::vector<long> counts (MRMR_STATES * (class_num + 1)), class_counts (class_num + 1, 0);
+	for (sample_index = 0; sample_index < count; sample_index++)
+		class_counts[ samples[sample_index]->sample_class ]++;
+	double class_entropy = mrmr_entropy (&class_counts[0], class_num + 1, count);
+
+	for (candidate = 0; candidate < n_candidates; candidate++) {
+		sig_index = candidates[candidate];
+		Moments2 feature_stats;
+		for (sample_index = 0; sample_index < count; sample_index++)
+			feature_stats.add (SampleData (sample_index)[sig_index]);
+		mean = feature_stats.mean();
+		stddev = feature_stats.std();
+
+		std::fill (counts.begin(), counts.end(), 0);
+		for (sample_index = 0; sample_index < count; sample_index++) {
+			row = SampleData (sample_index);
+			val = row[sig_index];
+			unsigned char state = (val < mean - stddev ? 0 : (val > mean + stddev ? 2 : 1));
+			states[candidate * count + sample_index] = state;
+			counts[ samples[sample_index]->sample_class * MRMR_STATES + state ]++;
+		}
+		long state_counts[MRMR_STATES] = {0};
+		for (sample_index = 0; sample_index < (long)counts.size(); sample_index++)
+			state_counts[sample_index % MRMR_STATES] += counts[sample_index];
+		entropies[candidate] = mrmr_entropy (state_counts, MRMR_STATES, count);
+		relevances[candidate] = entropies[candidate] + class_entropy - mrmr_entropy (&counts[0], counts.size(), count);
+	}
+
+	n_threads = std::thread::hardware_concurrency();
+	if (n_threads < 1) n_threads = 1;
+	if (n_threads > n_candidates / 64) n_threads = std::max (1L, n_candidates / 64);
+
+	for (sig_index = 0; sig_index < signature_count; sig_index++)
+		SignatureWeights[sig_index] = 0.0;
+	std::vector<bool> available (n_candidates, true);
+	for (n_selected = 0; n_selected < n_select; n_selected++) {
+		long best = -1;
+		double score, best_score = 0.0;
+		for (candidate = 0; candidate < n_candidates; candidate++) {
+			if (!available[candidate]) continue;
+			score = relevances[candidate];
+			if (n_selected > 0) score -= redundancy_sums[candidate] / n_selected;
+			if (best < 0 || score > best_score) {
+				best = candidate;
+				best_score = score;
+			}
+		}
+		available[best] = false;
+		if (best_score > 0) SignatureWeights[ candidates[best] ] = best_score;   /* make sure the values are not negative */
+		if (verbosity>=2) printf ("mRMR feature %ld: %s, score %g\n", n_selected + 1, SignatureNames[ candidates[best] ].c_str(), best_score);
+		if (n_selected + 1 == n_select) break;
+
+		if (n_threads == 1) {
+			mrmr_add_redundancy (&states[0], count, best, 0, n_candidates, &entropies[0], &redundancy_sums[0]);
+		} else {
+			std::vector<std::thread> threads;
+			for (thread_index = 0; thread_index < n_threads; thread_index++)
+				threads.push_back (std::thread (mrmr_add_redundancy, &states[0], (long)count, best,
+					n_candidates * thread_index / n_threads, n_candidates * (thread_index + 1) / n_threads, &entropies[0], &redundancy_sums[0]));
+			for (thread_index = 0; thread_index < n_threads; thread_index++)
+				threads[thread_index].join();
+		}
+	}
+}
+
 /* SetFisherScores
    Compute the fisher score of each signature
    used_signatures -double- what fraction of the signatures should be used (a value between 0 and 1).
@@ -2119,60 +2519,11 @@ void TrainingSet::normalize() {
    int method - 0 for Fisher Scores. 1 for Pearson Correlation scores (with the ground truth).
 */
 
-void TrainingSet::SetmRMRScores(double used_signatures, double used_mrmr)
-{  FILE *mrmr_file;
-   char buffer[512],*p_buffer; 
-   int sig_index,sample_index;
-
-   /* use mRMR (if an executable file "mrmr" exists) */
-   if ( (mrmr_file=fopen("mrmr","r")) ) fclose(mrmr_file);
-   if (mrmr_file)  /* use mrmr */
-   {  /* first create a csv file for mrmr */
-      mrmr_file=fopen("mrmr_sigs.csv","w");
-      fprintf(mrmr_file,"class");
-	  for (sig_index=0;sig_index<signature_count;sig_index++)
-         if (SignatureWeights[sig_index]>0) fprintf(mrmr_file,",%d",sig_index);
-      fprintf(mrmr_file,"\n");
-      for (sample_index=0;sample_index<count;sample_index++)
-      {  fprintf(mrmr_file,"%d",samples[sample_index]->sample_class);
-	     for (sig_index=0;sig_index<signature_count;sig_index++)
-           if (SignatureWeights[sig_index]>0) fprintf(mrmr_file,",%.0f",samples[sample_index]->data[sig_index]);
-         fprintf(mrmr_file,"\n");
-      }
-	  fclose(mrmr_file);
-      sprintf(buffer,"./mrmr -i mrmr_sigs.csv -n %ld -s %ld -v %ld > mrmr_output",(long)(used_mrmr*used_signatures*signature_count),count,signature_count);
-      printf("%s\n",buffer);
-	  system(buffer);	  
-      remove("mrmr_sigs.csv");
-      /* now read the mRMR output file */
-	  for (sig_index=0;sig_index<signature_count;sig_index++)  /* first set all scores to zero */
-         SignatureWeights[sig_index]=0.0;	  
-      if (!(mrmr_file=fopen("mrmr_output","r"))) printf("Cannot open file 'mrmr_sigs.csv'\n");
-	  p_buffer=fgets(buffer,sizeof(buffer),mrmr_file); /* skip the first lines */
-      while (p_buffer && strstr(p_buffer,"mRMR")==NULL) p_buffer=fgets(buffer,sizeof(buffer),mrmr_file);
-      if (!p_buffer) printf("Cannot parse file 'mrmr_output'\n");	  
-	  p_buffer=fgets(buffer,sizeof(buffer),mrmr_file); /* skip the first line */	  
-	  p_buffer=fgets(buffer,sizeof(buffer),mrmr_file); /* skip the first line */	  	  
-      while(p_buffer && strlen(p_buffer)>8)
-	  {  long sig_num;
-         double weight;
-	     strtok(p_buffer," \t\n");
-         strtok(NULL," \t\n");		 
-         sig_num=atoi(strtok(NULL," \t\n"));
-        weight=atof(strtok(NULL," \t\n"));
-        if (weight<0) weight=0.0;   /* make sure the values are not negative */
-		if (weight>0) SignatureWeights[sig_num]=pow(weight,1);
-         p_buffer=fgets(buffer,sizeof(buffer),mrmr_file);	  
-	  }
-	  fclose(mrmr_file);
-      remove("mrmr_output");	 
-   }   
-}
-
 void TrainingSet::SetFisherScores(double used_signatures, double used_mrmr, data_split *split)
 {  int sample_index,sig_index,class_index;
    double class_dev_from_mean,mean_inner_class_var;
    double threshold;   
+   compacted = false;
 
    Moments2 *class_stats = new Moments2 [class_num+1];
    
@@ -2202,7 +2553,7 @@ void TrainingSet::SetFisherScores(double used_signatures, double used_mrmr, data
 			for (sample_index = 0; sample_index < count; sample_index++) {
 				class_index = samples[sample_index]->sample_class;
 				if (class_index) {
-					val = samples[sample_index]->data[sig_index];
+					val = SampleData(sample_index)[sig_index];
 					feature_stats.add (val);
 					class_stats[class_index].add (val);
 				}
@@ -2236,12 +2587,12 @@ void TrainingSet::SetFisherScores(double used_signatures, double used_mrmr, data
            stddev_ground+=pow(samples[sample_index]->sample_value-mean_ground,2);	  
          stddev_ground=sqrt(stddev_ground/count);
          for (sample_index=0;sample_index<count;sample_index++)
-           mean+=(samples[sample_index]->data[sig_index]/((double)count));
+           mean+=(SampleData(sample_index)[sig_index]/((double)count));
          for (sample_index=0;sample_index<count;sample_index++)  /* compute the stddev of the continouos values */
-           stddev+=pow(samples[sample_index]->data[sig_index]-mean,2);	  
+           stddev+=pow(SampleData(sample_index)[sig_index]-mean,2);	  
          stddev=sqrt(stddev/count);	
          for (sample_index=0;sample_index<count;sample_index++)
-           if (stddev>0 && stddev_ground>0) z_score_sum+=((samples[sample_index]->sample_value-mean_ground)/stddev_ground)*((samples[sample_index]->data[sig_index]-mean)/stddev);
+           if (stddev>0 && stddev_ground>0) z_score_sum+=((samples[sample_index]->sample_value-mean_ground)/stddev_ground)*((SampleData(sample_index)[sig_index]-mean)/stddev);
          SignatureWeights[sig_index]=pow(fabs(z_score_sum/count),1);
 //printf("%d Fisher Score: %f\n",class_num,SignatureWeights[sig_index]);		 
 	  } /* end of method 1 (Pearson Correlation) */
@@ -2322,17 +2673,18 @@ int TrainingSet::IgnoreFeatureGroup(long index,char *group_name)
 {  int group=0,sig_index=0;
 	size_t char_index;
    char current_name[256]={'\0'},last_name[256]={'\0'};
+   compacted = false;
    
    while(group<=index)
    {  if (sig_index>=signature_count) return(0);   /* no more image features */
       while (SignatureNames[sig_index][0]<'A' || SignatureNames[sig_index][0]>'Z') sig_index++;
-      strcpy(current_name,SignatureNames[sig_index]);
+      snprintf(current_name,sizeof(current_name),"%s",SignatureNames[sig_index].c_str());
       if (strchr(current_name,' ')) *(strchr(current_name,' '))='\0';
       if (strcmp(current_name,last_name)!=0) group++;
 	  strcpy(last_name,current_name);
 	  if (group==index) 
 	  {  SignatureWeights[sig_index]=0;
-         if (group_name) strcpy(group_name,SignatureNames[sig_index]);   /* return the name of the group */	  
+         if (group_name) strcpy(group_name,SignatureNames[sig_index].c_str());   /* return the name of the group */	  
          for (char_index=0;char_index<strlen(group_name);char_index++) if (isdigit(group_name[char_index])) group_name[char_index]=' ';          
       }
 	  sig_index++;
@@ -2341,13 +2693,14 @@ int TrainingSet::IgnoreFeatureGroup(long index,char *group_name)
 }
 
 /* distance 
-   Find the weighted Euclidean distance between two samples
+   Find the weighted Euclidean distance between two feature vectors of signature_count values each,
+   e.g. a test sample's data and a row of sample_matrix
 */
-double TrainingSet::distance(signatures *sample1, signatures *sample2, double power)
+double TrainingSet::distance(const double *sample1, const double *sample2, double power)
 {   double dist=0;
     int sig_index;	
       for (sig_index=0;sig_index<signature_count;sig_index++)
-        dist=dist+pow(SignatureWeights[sig_index],1)*pow(sample1->data[sig_index]-sample2->data[sig_index],power);
+        dist=dist+pow(SignatureWeights[sig_index],1)*pow(sample1[sig_index]-sample2[sig_index],power);
     return(pow(dist,1/power));
 }
 
@@ -2374,7 +2727,7 @@ long TrainingSet::WNNclassify(signatures *test_sample, double *probabilities, do
    /* normalize the test sample */
    test_sample->normalize(this);
    for (sample_index=0;sample_index<count;sample_index++)
-   {  double dist=distance(test_sample,samples[sample_index],2.0);
+   {  double dist=distance(&test_sample->data[0],SampleData(sample_index),2.0);
       if ((dist<1/INF) || (strcmp(samples[sample_index]->full_path,test_sample->full_path)==0)) dist=INF;    /* ignore images that are 100% identical */
 //if (strstr(samples[sample_index]->full_path,"1948")==NULL) dist=INF;	  
       if (dist<closest_dist)
@@ -2435,33 +2788,40 @@ long TrainingSet::classify2( char* name, int test_sample_index, signatures *test
 	double dist_sum;
 	double similarity;
 
+	// Only the features with non-zero weights are compared. Test() compacts them before it starts classifying,
+	// possibly in several threads, so this may run concurrently and must not touch the compact_* members.
+	// Without a compaction, the weights are gathered locally and the values read from sample_matrix.
+	vector<long> local_features;
+	vector<double> local_weights2;
+	if( !compacted ) CompactWeights( local_features, local_weights2 );
+	const vector<long> &features = compacted ? compact_features : local_features;
+	const vector<double> &weights2 = compacted ? compact_weights2 : local_weights2;
+	const long n_compact = features.size();
+	vector<double> test_compact( n_compact );
+	for( sig_index = 0; sig_index < n_compact; sig_index++ )
+		test_compact[ sig_index ] = test_sample->data[ features[ sig_index ] ];
+	const double *row;
+
 	// iterate over all images in training set
 	for( sample_index = 0; sample_index < count; sample_index++ )
 	{
 		dist_sum = 0.0;
-		// iterate over all features
-		for( sig_index = 0; sig_index < signature_count; sig_index++ )
-		{
-			// if the feature weight for this feature == 0, skip to next feature
-			if (SignatureWeights[ sig_index ] < DBL_EPSILON) continue;
-			dist = fabs( test_sample->data[ sig_index ] - samples[ sample_index ]->data[ sig_index ] );
-			if( dist < DBL_EPSILON )
-			//if( FLOAT_EQ( test_sample->data[ sig_index ], samples[ sample_index ]->data[ sig_index ], 100000000 ) )
+		// iterate over the features with non-zero weights
+		if( compacted ) {
+			row = &compact_matrix[ sample_index * n_compact ];
+			for( sig_index = 0; sig_index < n_compact; sig_index++ )
 			{
-				
-			  //if( !( FLOAT_EQ( test_sample->data[ sig_index ], 0.0, 1) && FLOAT_EQ( samples[ sample_index ]->data[ sig_index ], 0, 1) ) )
-				/*	cout << "--- Test img " << test_sample_index << ": Train img " << sample_index << " sig_index " 
-						   << sig_index << " dist " << dist << "\t test sig val " <<  test_sample->data[ sig_index ]
-							 << "\t train sig val " << samples[ sample_index ]->data[ sig_index ] << endl;
-				*/
-				continue;
+				dist = fabs( test_compact[ sig_index ] - row[ sig_index ] );
+				if( dist < DBL_EPSILON ) continue;
+				dist_sum += weights2[ sig_index ] * ( dist * dist );
 			}
-			else
+		} else {
+			row = SampleData( sample_index );
+			for( sig_index = 0; sig_index < n_compact; sig_index++ )
 			{
-				/*	cout << "### Test img " << test_sample_index << ": Train img " << sample_index << " sig_index " 
-						   << sig_index << " dist " << dist << "\t test sig val " <<  test_sample->data[ sig_index ]
-							 << "\t train sig val " << samples[ sample_index ]->data[ sig_index ] << endl; */
-				dist_sum += pow( SignatureWeights[ sig_index ], 2 ) * pow( dist, 2 );
+				dist = fabs( test_compact[ sig_index ] - row[ features[ sig_index ] ] );
+				if( dist < DBL_EPSILON ) continue;
+				dist_sum += weights2[ sig_index ] * ( dist * dist );
 			}
 		}
 
@@ -2597,7 +2957,7 @@ double TrainingSet::InterpolateValue(signatures *test_sample, int method, int N,
 
       /* find the closest samples */
       for (sample_index=0;sample_index<count;sample_index++)
-      {  double dist=distance(test_sample,samples[sample_index],2.0);
+      {  double dist=distance(&test_sample->data[0],SampleData(sample_index),2.0);
 //printf("dist: %f   %f\n",dist,samples[sample_index]->sample_value);	  
          if (closest_sample && dist<min_dists[0]) *closest_sample=samples[sample_index];  /* for returning the closest sample */	  
          if (closest_dist && dist<min_dists[0]) *closest_dist=dist;                       /* for returning the distanmce to the closest sample */	  		 
@@ -2658,7 +3018,7 @@ long TrainingSet::classify3(signatures *test_sample, double *probabilities,doubl
    double *min_dists;
    long *min_dists_classes;
    int most_probable_class=0;
-   long double probs[MAX_CLASS_NUM];
+   std::vector<long double> probs(class_num+1);
    double dist;
    long size_of_class;
 
@@ -2684,7 +3044,7 @@ long TrainingSet::classify3(signatures *test_sample, double *probabilities,doubl
         min_dists[dist_index]=INF;
       for (sample_index=0;sample_index<count;sample_index++)
       {
-         dist=fabs(test_sample->data[sig_index]-samples[sample_index]->data[sig_index]);
+         dist=fabs(test_sample->data[sig_index]-SampleData(sample_index)[sig_index]);
          /* check if this dist should be in the close list */
          for (close_index=0;close_index<count;close_index++)
          if (dist<min_dists[close_index])
@@ -3580,9 +3940,9 @@ long TrainingSet::report( FILE*                     output_file,
 	/* *** generate a dendrogram *** */
 	if (phylib_path && class_num>0 ) {  /* generate a dendrogram only if phlyb path was specified */
 		if (distance_method == 5)
-			dendrogram(output_file,this->name, phylib_path, class_num,avg_class_prob_matrix, class_labels,distance_method,phylip_algorithm);
+			dendrogram(output_file,this->name, phylib_path, class_num,avg_class_prob_matrix, &class_labels[0],distance_method,phylip_algorithm);
 		else
-			dendrogram(output_file,this->name, phylib_path, class_num,avg_similarity_matrix, class_labels,distance_method,phylip_algorithm);
+			dendrogram(output_file,this->name, phylib_path, class_num,avg_similarity_matrix, &class_labels[0],distance_method,phylip_algorithm);
 		if (export_tsv) {  /* write the phylip file to the tsv directory */
 			sprintf(buffer,"cp %s/dend_file tsv/dend_file.txt",phylib_path);
 			system(buffer);
@@ -39,6 +39,7 @@
 #include "signatures.h"
 #include "config.h" // for version info
 
+// Not a limit: the class arrays grow as classes are added. Used as a capacity hint.
 #define MAX_CLASS_NUM 1024
 #define MAX_CLASS_NAME_LENGTH 50
 #define MAX_SAMPLES_PER_IMAGE 4096
@@ -178,6 +179,12 @@ typedef struct {
 	std::vector< std::list< float > > marginal_probabilities; //keep track of marginal probs
 } data_split;
 
+// Text from classifying test images, collected instead of printed so that images classified concurrently are reported in order
+typedef struct {
+	std::string console;                  /* what would have been printed to stdout                           */
+	std::string individual_images;        /* rows for the report's table of individual images                 */
+} classify_output_t;
+
 class TrainingSet
 {
 public:
@@ -185,21 +192,26 @@ public:
 	char name[256];                       /* Name of dataset - source_path from last '/' to last '.'    */
 	char source_path[256];                       /* Path we read this set from     */
 	int feature_vec_version, feature_vec_type; // from the signatures class
-   signatures **samples;                                           /* samples data                              */
-   char SignatureNames[MAX_SIGNATURE_NUM][SIGNATURE_NAME_LENGTH];  /* names of the signatures (e.g. "MultiScale Histogram bin 3) */
-   double SignatureWeights[MAX_SIGNATURE_NUM];                     /* weights of the samples                    */
-   double SignatureMins[MAX_SIGNATURE_NUM];                        /* minimum value of each signature           */
-   double SignatureMaxes[MAX_SIGNATURE_NUM];                       /* maximum value of each signature           */
+   std::vector<signatures *> samples;                              /* sample class, value, path, etc. The feature values are in sample_matrix */
+   std::vector<double> sample_matrix;                              /* feature values of all samples: count rows of signature_count values, contiguous */
+   std::vector<std::string> SignatureNames;                        /* names of the signatures (e.g. "MultiScale Histogram bin 3) */
+   std::vector<double> SignatureWeights;                           /* weights of the samples                    */
+   std::vector<double> SignatureMins;                              /* minimum value of each signature           */
+   std::vector<double> SignatureMaxes;                             /* maximum value of each signature           */
+   std::vector<long> compact_features;                             /* indexes of the features with non-zero weights, set by CompactFeatures() */
+   std::vector<double> compact_weights2;                           /* the squared weights of compact_features   */
+   std::vector<double> compact_matrix;                             /* sample_matrix with only the compact_features columns */
+   bool compacted;                                                 /* the compact_* arrays match the current weights and samples */
 	  featuregroups_t *aggregated_feature_stats;                    // only the top level TrainingSet has this allocated by wndcharm.cpp::split_and_test
    long class_num;                                                 /* number of known/defined classes (may be 0 if all samples are unknown, may be 1 when is_continuous, or for 1 known discrete class */
-   char **class_labels;                                            /* labels of the classes                     */
-   long *class_nsamples;                                           /* sample counts in each class               */
+   std::vector<char *> class_labels;                               /* labels of the classes (class_num+1 of them) */
+   std::vector<long> class_nsamples;                               /* sample counts in each class               */
    int *train_class;                                               /* class indexes into training set           */
    int  is_continuous;                                             /* A numeric/continuous dataset.  sample_class = 0 or 1 for all samples. class_nsamples is valid, but class_labels is not. */
    int  is_numeric;                                                /* All class labels can be interpreted as numeric values (is_continuous can be false when is_numeric is true) */
    int  is_pure_numeric;                                           /* All class labels are numerical (no characters other than those than can be part of a valid double - INF, NAN, etc are technically valid, but not in our case)  */
    long count;                                                     /* the number of samples in the training set */
-   long signature_count;                                           /* the number of signatures (< MAX_SIGNATURE_NUM) */
+   long signature_count;                                           /* the number of signatures (row length of sample_matrix) */
    long color_features;                                            /* color signatures are used                 */
 /* methods */
    TrainingSet(long samples_num, long class_num);                  /* constructor                               */
@@ -210,8 +222,8 @@ public:
 	int LoadFromFilesDir(char *path, unsigned short sample_class, double sample_value, int save_sigs, featureset_t *featureset);
 	int LoadFromPath(char *path, int save_sigs, featureset_t *featureset, int make_continuous);
 	int CheckImageSigs (char *filename, featureset_t *featureset ); /* perform a check only for a complete set of image features */
-   double ClassifyImage(TrainingSet *TestSet, int test_sample_index,int method, int tiles, int tile_areas, TrainingSet *TilesTrainingSets[], int max_tile,int rank, data_split *split, double *similarities);  /* classify one or more images */
-   double Test(TrainingSet *TestSet, int method, int tiles, int tile_areas, TrainingSet *TilesTrainingSets[], int max_tile,long rank, data_split *split);     /* test      */
+   double ClassifyImage(TrainingSet *TestSet, int test_sample_index,int method, int tiles, int tile_areas, TrainingSet *TilesTrainingSets[], int max_tile,int rank, data_split *split, double *similarities, classify_output_t *output = NULL);  /* classify one or more images */
+   double Test(TrainingSet *TestSet, int method, int tiles, int tile_areas, TrainingSet *TilesTrainingSets[], int max_tile,long rank, data_split *split, int n_threads = 1, std::string *console = NULL);     /* test      */
    int SaveToFile(char *filename);                                 /* save the training set values to a file    */
 	bool IsFitFile(char *filename);                                /* checks if its a proper fit file by making sure the first three lines are pure numeric */
    int ReadFromFile(char *filename);                               /* read the training set values from a file  */
@@ -226,11 +238,21 @@ public:
    int AddClass(char *label);                                      /* add a discrete class    */
    int AddContinuousClass (char *label);                           /* add a continuous class - not that only one can be added */
    int AddSample(signatures *new_sample);                          /* add signatures computed from one image    */
+   double *SampleData(long sample_index) {                         /* the feature values of one sample          */
+      return (sample_matrix.empty() ? NULL : &sample_matrix[0] + sample_index * signature_count);
+   }
+   signatures *SampleSignatures(long sample_index);                /* a new copy of a sample, with its feature values */
+   int StoreSampleData(long sample_index, signatures *sample);     /* move a sample's feature values into its row of sample_matrix */
+   void SetSignatureCount(long new_signature_count);               /* resize the per-feature arrays and the rows of sample_matrix */
+   void SetSignatureName(long sig_index, const char *name);        /* name a feature, unless it already has a name */
+   void ResizeClasses(long new_class_num);                         /* make room for class indexes up to new_class_num */
    void normalize();                                               /* normalize the values of the signatures to [0,100] */
+   void CompactFeatures();                                         /* copy the columns of the features with non-zero weights, for classify2 */
+   void CompactWeights(std::vector<long> &features, std::vector<double> &weights2) const; /* the features with non-zero weights and their squared weights */
    void SetmRMRScores(double used_signatures,double used_mrmr);                     /* set mRMR scores to the features           */
    void SetFisherScores(double used_signatures, double used_mrmr, data_split *split);/* compute the fisher scores for the signatures  */
    int IgnoreFeatureGroup(long index,char *group_name);            /* set the Fisher Score of a group of image features to zero */
-   double distance(signatures *sample1, signatures *sample2,double power);  /* Find the weighted Euclidean distance between two samples  */
+   double distance(const double *sample1, const double *sample2,double power);  /* Find the weighted Euclidean distance between two feature vectors */
    long WNNclassify(signatures *test_sample, double *probabilities, double *normalization_factor, signatures **closest_sample);/* classify a sample using weighted nearest neighbor */
    long classify2(char* name, int test_sample_index, signatures *test_sample, double *probabilities,double *normalization_factor); /* classify using -5                         */
    double InterpolateValue(signatures *test_sample, int method, int N, signatures **closest_sample, double *closest_dist);  /* interpolate a value */
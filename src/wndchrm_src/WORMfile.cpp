@@ -119,8 +119,6 @@ FILE *WORMfile::fp () {
 
 void WORMfile::finish (bool reopen) {
 
-	if (_fp < 0) return;
-
 	if (status == WORM_WR) {
 		// Change to read-only permissions
 		// r--r--r--: mode_t mask = S_IRUSR | S_IRGRP | S_IROTH;
@@ -112,10 +112,8 @@ void signatures::Resize(size_t nsigs) {
    value -double- the value to add
 */
 void signatures::Add(const char *name,double value) {
-	if (name && *name && NamesTrainingSet) {
-		char *char_p = ((TrainingSet *)(NamesTrainingSet))->SignatureNames[count];
-		if (! *char_p) strcpy(char_p,name);
-	}
+	if (name && *name && NamesTrainingSet)
+		((TrainingSet *)(NamesTrainingSet))->SetSignatureName (count, name);
 	
 	if (count == 0 && allocated == 0) Resize (max_sigs);
 	else if (count >= allocated) Resize (count + 1024);
@@ -180,10 +178,7 @@ void signatures::compute_plan (const ImageMatrix &matrix, const FeatureComputati
 	// If we have an attached NamesTrainingSet, copy the feature names over, but only the first time.
 	if (NamesTrainingSet) {
 		for (int i = 0; i < count; i++) {
-			char *char_p = ((TrainingSet *)(NamesTrainingSet))->SignatureNames[i];
-			if (! *char_p) {
-				strcpy(char_p,plan->getFeatureNameByIndex(i).c_str());
-			}
+			((TrainingSet *)(NamesTrainingSet))->SetSignatureName (i, plan->getFeatureNameByIndex(i).c_str());
 		}
 	}
 }
@@ -253,7 +248,7 @@ int signatures::SaveToFile (int save_feature_names) {
 	fprintf(wf_fp,"%s\n",full_path);
 	for (sig_index=0; sig_index < count; sig_index++) {
 		if (save_feature_names && NamesTrainingSet)
-			fprintf(wf_fp,"%f\t%s\n",data[sig_index],((TrainingSet *)NamesTrainingSet)->SignatureNames[sig_index]);
+			fprintf(wf_fp,"%f\t%s\n",data[sig_index],((TrainingSet *)NamesTrainingSet)->SignatureNames[sig_index].c_str());
 		else
 			fprintf(wf_fp,"%f\n",data[sig_index]);
 	}
@@ -40,6 +40,7 @@
 // isdigit
 #include <ctype.h>
 #include <algorithm>
+#include <thread>
 
 #include "TrainingSet.h"
 #include "wndchrm_error.h"
@@ -228,11 +229,55 @@ int check_split_params (int *n_train_p, int *n_test_p, double *split_ratio, Trai
 }
 
 
+// A split that has been prepared for testing by split_and_test
+typedef struct {
+	long split_index;
+	TrainingSet *train, *test, **TilesTrainingSets;
+	double feature_weight_distance;
+	double accuracy;
+	std::string console;    /* the output of Test(), when the split is tested concurrently with others */
+} split_job_t;
+
+void print_split_header(TrainingSet *ts) {
+	int class_index;
+
+	// The following is the separator between split results
+	printf( "\n----------\n" );
+
+	// Label the columns
+	if (verbosity>=1) {
+		printf("image\t");
+		if (ts->is_continuous) {
+			printf("act. val.\tpred. val.\n");
+		} else {
+			printf ("norm. fact.\t");
+			for (class_index=1;class_index<=ts->class_num;class_index++) {
+				printf("p(%s)\t",ts->class_labels[class_index]);
+			}
+			printf("act. class\tpred. class");
+			if (ts->is_numeric) printf ("\tpred. val.");
+			printf ("\n");
+		}
+	}
+}
+
+void test_split(split_job_t *job, data_split *split, int method, int samples_per_image, int tile_areas, int max_tile, long first_n, int n_threads, std::string *console) {
+	job->accuracy=job->train->Test(job->test,method,samples_per_image,tile_areas,job->TilesTrainingSets,max_tile,first_n,split,n_threads,console);
+	split->feature_weight_distance=job->feature_weight_distance;
+	split->method=method;
+	split->pearson_coefficient=job->test->pearson(samples_per_image,&(split->avg_abs_dif),&(split->pearson_p_value));
+}
+
 int split_and_test(TrainingSet *ts, char *report_file_name, int argc, char **argv, int class_num, int method, featureset_t *featureset, double split_ratio, int balanced_splits, double max_features, double used_mrmr, long split_num,
 	int report,int max_training_images, int exact_training_images, int max_test_images, char *phylib_path,int distance_method, int phylip_algorithm,int export_tsv,
-	long first_n, char *weight_file_buffer, char weight_vector_action, int N, TrainingSet *testset, int ignore_group, int tile_areas, int max_tile, int image_similarities, int random_splits) {
+	long first_n, char *weight_file_buffer, char weight_vector_action, int N, TrainingSet *testset, int ignore_group, int tile_areas, int max_tile, int image_similarities, int random_splits,
+	int n_threads) {
 	TrainingSet *train,*test,**TilesTrainingSets=NULL;
 	std::vector<data_split> splits;
+	std::vector<split_job_t> jobs;
+	long concurrent_splits;
+	int test_threads;
+	size_t job_index;
 	char group_name[64];
 	FILE *output_file;
 	int split_index,tile_index;
@@ -324,10 +369,16 @@ int split_and_test(TrainingSet *ts, char *report_file_name, int argc, char **arg
 		if (split_ratio > 0) printf ("samples per image=%d, UNBALANCED training fraction=%g\n",samples_per_image,split_ratio);
 		else printf ("samples per image=%d, training images: %d, testing images %d\n",samples_per_image,n_train,n_test);
 	}
+	// Splits are prepared one at a time, in order, because ts->split() uses rand() and the feature weights are computed
+	// with shared state. Then up to n_threads of them are tested at once, and reported in order.
+	// A testset given on the command line is shared by all the splits, so they're tested one at a time.
+	if (n_threads < 1) n_threads = 1;
+	concurrent_splits = testset ? 1 : std::min ((long)n_threads, split_num);
+	test_threads = std::max (1, n_threads / (int)concurrent_splits);
+
 	splits.resize(split_num);
 	for (split_index=0;split_index<split_num;split_index++)
 	{
-		double accuracy;
 		double feature_weight_distance=-1.0;
 
 		train=new TrainingSet(ts->count,ts->class_num);
@@ -423,49 +474,61 @@ int split_and_test(TrainingSet *ts, char *report_file_name, int argc, char **arg
 				return(0);
 			}
 		}
-		
-		// The following is the separator between split results
-		printf( "\n----------\n" );
 
-		// Label the columns
-		if (verbosity>=1) {
-			printf("image\t");
-			if (ts->is_continuous) {
-				printf("act. val.\tpred. val.\n");
-			} else {
-				printf ("norm. fact.\t");
-				for (class_index=1;class_index<=ts->class_num;class_index++) {
-					printf("p(%s)\t",ts->class_labels[class_index]);
-				}
-				printf("act. class\tpred. class");
-				if (ts->is_numeric) printf ("\tpred. val.");
-				printf ("\n");
+		split_job_t job;
+		job.split_index = split_index;
+		job.train = train;
+		job.test = test;
+		job.TilesTrainingSets = TilesTrainingSets;
+		job.feature_weight_distance = feature_weight_distance;
+		job.accuracy = 0.0;
+		jobs.push_back (job);
+		TilesTrainingSets = NULL;
+		// Test once there are concurrent_splits prepared, or there are no more to prepare
+		if ((long)jobs.size() < concurrent_splits && split_index < split_num-1) continue;
+
+		if (jobs.size() == 1) {
+			// print as it goes
+			print_split_header (ts);
+			test_split (&jobs[0],&(splits[jobs[0].split_index]),method,samples_per_image,tile_areas,max_tile,first_n,test_threads,NULL);
+		} else {
+			std::vector<std::thread> threads;
+			for (job_index = 0; job_index < jobs.size(); job_index++) {
+				split_job_t *job_p = &jobs[job_index];
+				data_split *split = &(splits[job_p->split_index]);
+				threads.push_back (std::thread ([=] () {
+					test_split (job_p,split,method,samples_per_image,tile_areas,max_tile,first_n,test_threads,&(job_p->console));
+				}));
 			}
+			for (job_index = 0; job_index < threads.size(); job_index++) threads[job_index].join();
 		}
 
-		accuracy=train->Test(test,method,samples_per_image,tile_areas,TilesTrainingSets,max_tile,first_n,&(splits[split_index]));
-
-		splits[split_index].feature_weight_distance=feature_weight_distance;
-		splits[split_index].method=method;
-		splits[split_index].pearson_coefficient=test->pearson(samples_per_image,&(splits[split_index].avg_abs_dif),&(splits[split_index].pearson_p_value));
+		for (job_index = 0; job_index < jobs.size(); job_index++) {
+			split_job_t &job = jobs[job_index];
+			if (jobs.size() > 1) {
+				print_split_header (ts);
+				fputs (job.console.c_str(), stdout);
+			}
 
-		if (!report && !ignore_group && verbosity > 2 )   // print the accuracy and confusion and similarity matrices
-		{ 
-			printf( "\n" );
-			ts->PrintConfusion(stdout,splits[split_index].confusion_matrix,NULL);//,0,0);
-			ts->PrintConfusion(stdout,NULL,splits[split_index].similarity_matrix);//,0,0);
-			if (ts->is_continuous) printf("Pearson Correlation: %f \n\n",splits[split_index].pearson_coefficient);
-			else printf("\nAccuracy: %f \n",accuracy);
-		}
+			if (!report && !ignore_group && verbosity > 2 )   // print the accuracy and confusion and similarity matrices
+			{ 
+				printf( "\n" );
+				ts->PrintConfusion(stdout,splits[job.split_index].confusion_matrix,NULL);//,0,0);
+				ts->PrintConfusion(stdout,NULL,splits[job.split_index].similarity_matrix);//,0,0);
+				if (ts->is_continuous) printf("Pearson Correlation: %f \n\n",splits[job.split_index].pearson_coefficient);
+				else printf("\nAccuracy: %f \n",job.accuracy);
+			}
 
-		if (TilesTrainingSets)    // delete the training sets allocated for the different areas
-		{
-			for (tile_index=0;tile_index<samples_per_image;tile_index++)
-			delete TilesTrainingSets[tile_index];
-			delete TilesTrainingSets;
+			if (job.TilesTrainingSets)    // delete the training sets allocated for the different areas
+			{
+				for (tile_index=0;tile_index<samples_per_image;tile_index++)
+				delete job.TilesTrainingSets[tile_index];
+				delete job.TilesTrainingSets;
+			}
+			delete job.train;
+			if (!testset) delete job.test;
 		}
-		delete train;
-		if (!testset) delete test;
+		jobs.clear();
 	} // End for (split_index=0;split_index<split_num;split_index++)
 
 	if( ts->aggregated_feature_stats ) {
@@ -630,6 +693,7 @@ void ShowHelp()
 	
 	printf("\nFeature reduction options:\n==========================\n");
 	printf("fN[:M] - maximum number of features out of the dataset (0,1) . The default is 0.15. \n");
+	printf("         If M is specified, select a fraction M (0,1) of these features by mRMR (minimum redundancy maximum relevance).\n");
 	printf("v[r|w|+|-][path] - read/write/add/subtract the feature weights from a file.\n");   
 	printf("A - assess the contribution of each group of image features independently.\n");
 	
@@ -642,6 +706,8 @@ void ShowHelp()
 	printf("        the class is ignored if it doesn't have at least N samples.\n");
 	printf("jN - Set a maximal number of test images (for each class). \n");
 	printf("nN - Number of repeated random splits. The default is 1.\n");
+	printf("uN - Number of threads for testing. Up to N splits are tested at once, each in N/(number of splits)\n");
+	printf("     threads. The default is the number of processors.\n");
 	printf("Nx - set the maximum number of classes (use only the first x classes).\n");
 	//printf("C - *highly experimental* perform interpolation on a continuous scale rather than discrete classes\n");
 	//printf("    All class labels must be interpretable as numbers.\n");
@@ -734,6 +800,7 @@ int main(int argc, char *argv[])
     int assess_features=0;           /* assess the contribution of each feature to the performance */
     int image_similarities=0;        /* generate a dendrogram showing the similarity of the images */
     int max_tile=0;                  /* use only the closest tile                                  */
+    int n_threads=0;                 /* threads for testing splits, 0 for one per processor        */
 	int overwrite=0;                 /* force overwriting of pre-computed .sig files               */
 	char *dataset_save_fit=NULL;     /* path to save the dataset/train set                         */
 	char *testset_save_fit=NULL;     /* path to save the test set                                  */
@@ -928,6 +995,7 @@ int main(int argc, char *argv[])
            max_training_images=atoi(char_p+1);
         }
         if (strchr(argv[arg_index],'j')) max_test_images=atoi(&(strchr(argv[arg_index],'j')[1]));
+        if (strchr(argv[arg_index],'u')) n_threads=atoi(&(strchr(argv[arg_index],'u')[1]));
         if (strchr(argv[arg_index],'w')) method=0;
         if (strchr(argv[arg_index],'h'))
         {  ShowHelp();
@@ -1058,10 +1126,12 @@ int main(int argc, char *argv[])
 // 				}
 			}
 
+			if (n_threads < 1) n_threads = std::thread::hardware_concurrency();
+			if (n_threads < 1) n_threads = 1;
 			for (ignore_group=0;ignore_group<=assess_features;ignore_group++) {
 				split_and_test(dataset, report_file, argc, argv, MAX_CLASS_NUM, method, &featureset, split_ratio, balanced_splits, max_features, used_mrmr,splits_num,report,max_training_images,
 					exact_training_images,max_test_images,phylib_path,distance_method,phylip_algorithm,export_tsv,first_n,weight_file_buffer,weight_vector_action,N,
-					testset,ignore_group,tile_areas,max_tile,image_similarities, random_splits);
+					testset,ignore_group,tile_areas,max_tile,image_similarities, random_splits, n_threads);
 			}
 	
 			// report any warnings
@@ -0,0 +1,133 @@
+"""
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Copyright (C) 2015 National Institutes of Health
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+    See the GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+ Written by:    Christopher Coletta (github.com/colettace)
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~"""
+
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import os
+import numpy as np
+from struct import unpack
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from wndcharm.ArtificialImages import CreateArtificialImage, WriteTIFF, \
+        CreateArtificialImageDirectory
+
+class TestCreateArtificialImage( unittest.TestCase ):
+    """
+    Test CreateArtificialImage and friends
+    """
+
+    def test_Deterministic( self ):
+        """Same seed, same pixels; requested dtype, shape and range"""
+
+        for bits, dtype in ( ( 8, np.uint8 ), ( 16, np.uint16 ) ):
+            for color, shape in ( ( False, ( 30, 40 ) ), ( True, ( 30, 40, 3 ) ) ):
+                a = CreateArtificialImage( 1, 3, width=40, height=30, bits=bits, color=color,
+                        random_state=7 )
+                b = CreateArtificialImage( 1, 3, width=40, height=30, bits=bits, color=color,
+                        random_state=7 )
+                self.assertEqual( a.dtype, dtype )
+                self.assertEqual( a.shape, shape )
+                self.assertTrue( ( a == b ).all() )
+                self.assertGreater( a.max(), a.min() )
+        c = CreateArtificialImage( 1, 3, width=40, height=30, random_state=8 )
+        self.assertFalse( ( c == CreateArtificialImage( 1, 3, width=40, height=30,
+                random_state=7 ) ).all() )
+        self.assertRaises( ValueError, CreateArtificialImage, 3, 3 )
+        self.assertRaises( ValueError, CreateArtificialImage, bits=12 )
+        self.assertRaises( ValueError, CreateArtificialImage, content=( 'stripes', ) )
+
+    def test_ClassesDiffer( self ):
+        """Grating orientation and blob size depend on the class"""
+
+        n_classes = 4
+        angles = []
+        coverages = []
+        for class_index in xrange( n_classes ):
+            grating = CreateArtificialImage( class_index, n_classes, content=( 'grating', ),
+                    random_state=5 ).astype( float )
+            spectrum = np.abs( np.fft.fft2( grating - grating.mean() ) )
+            iy, ix = np.unravel_index( spectrum.argmax(), spectrum.shape )
+            angles.append( np.degrees( np.arctan2( np.fft.fftfreq( 128 )[ iy ],
+                np.fft.fftfreq( 128 )[ ix ] ) ) % 180 )
+            blobs = CreateArtificialImage( class_index, n_classes, content=( 'blobs', ),
+                    random_state=5 )
+            coverages.append( ( blobs > 128 ).mean() )
+        for class_index, angle in enumerate( angles ):
+            self.assertLess( abs( angle - 180.0 * class_index / n_classes ), 10 )
+        self.assertEqual( len( set( coverages ) ), n_classes )
+
+    def test_WriteTIFF( self ):
+        """Uncompressed single strip TIFF with the pixels at the strip offset"""
+
+        tempdir = mkdtemp()
+        try:
+            for color in ( False, True ):
+                pixels = CreateArtificialImage( 0, 2, width=7, height=5, bits=16, color=color )
+                path = WriteTIFF( pixels, os.path.join( tempdir, 'test.tif' ) )
+                with open( path, 'rb' ) as infile:
+                    data = infile.read()
+                byte_order, magic, ifd_offset = unpack( '<2sHI', data[:8] )
+                self.assertEqual( ( byte_order, magic ), ( 'II', 42 ) )
+                num_entries = unpack( '<H', data[ ifd_offset : ifd_offset + 2 ] )[0]
+                tags = {}
+                for i in xrange( num_entries ):
+                    start = ifd_offset + 2 + 12 * i
+                    tag, tag_type, count = unpack( '<HHI', data[ start : start + 8 ] )
+                    fmt = '<H' if tag_type == 3 and count == 1 else '<I'
+                    tags[ tag ] = unpack( fmt, data[ start + 8 : start + 8 + ( 2 if fmt == '<H' else 4 ) ] )[0]
+                self.assertEqual( ( tags[ 256 ], tags[ 257 ] ), ( 7, 5 ) )
+                self.assertEqual( tags[ 277 ], 3 if color else 1 )
+                strip = data[ tags[ 273 ] : tags[ 273 ] + tags[ 279 ] ]
+                read_back = np.fromstring( strip, dtype='<u2' ).reshape( pixels.shape )
+                self.assertTrue( ( read_back == pixels ).all() )
+        finally:
+            rmtree( tempdir )
+
+    def test_ShuffleSplitFromDirectory( self ):
+        """Features calculated from a directory of artificial images separate the classes"""
+
+        from wndcharm.FeatureSpace import FeatureSpace
+        from wndcharm.FeatureSpacePredictionExperiment import FeatureSpaceClassificationExperiment
+
+        tempdir = mkdtemp()
+        try:
+            CreateArtificialImageDirectory( tempdir, n_classes=3, n_samples_per_class=12,
+                    width=64, height=64, random_state=42 )
+            fs = FeatureSpace.NewFromDirectory( tempdir, quiet=True )
+            self.assertEqual( fs.num_samples, 36 )
+            exp = FeatureSpaceClassificationExperiment.NewShuffleSplit( fs, n_iter=3,
+                    random_state=42, quiet=True )
+            exp.GenerateStats()
+            self.assertGreater( exp.classification_accuracy, 0.8 )
+        finally:
+            rmtree( tempdir )
+
+if __name__ == '__main__':
+    unittest.main()
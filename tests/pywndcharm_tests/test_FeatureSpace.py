@@ -599,6 +599,220 @@ class TestFeatureSet( unittest.TestCase ):
         #    from numpy.testing import assert_allclose
         #    assert_allclose( result_fs.data_matrix, target_fs.data_matrix )
 
+    # --------------------------------------------------------------------------
+    def test_Views( self ):
+        """SampleReduce/FeatureReduce/Split views only hold indices into the parent's
+        feature matrix, and materialize to the same thing as the copying versions."""
+
+        from wndcharm.ArtificialFeatureSpace import CreateArtificialFeatureSpace_Discrete
+        from numpy.testing import assert_array_equal
+
+        fs = CreateArtificialFeatureSpace_Discrete( n_samples=200, n_classes=4,
+                num_features_per_signal_type=5, n_samples_per_group=4, random_state=42 )
+        features = fs.feature_names[ 30 : 5 : -3 ]
+        groups = [ 3, 17, 4, 40, 2 ]
+
+        expected = fs.FeatureReduce( features, quiet=True ).SampleReduce( groups, quiet=True )
+        view = fs.FeatureReduce( features, view=True, quiet=True ).SampleReduce( groups,
+                view=True, quiet=True )
+        self.assertTrue( view.is_view )
+        self.assertIs( view._view_source, fs.data_matrix )
+        self.assertEqual( view.shape, expected.shape )
+        self.assertEqual( view._contiguous_sample_names, expected._contiguous_sample_names )
+        self.assertEqual( view.feature_names, expected.feature_names )
+        assert_array_equal( view.GetFeatureMatrix( rows=slice( 4, 12 ), columns=[ 2, 0 ] ),
+                expected.data_matrix[ 4 : 12 ][ :, [ 2, 0 ] ] )
+
+        # Normalizing gathers straight from the parent
+        normalized = view.Derive().Normalize( quiet=True )
+        self.assertFalse( normalized.is_view )
+        assert_array_equal( normalized.data_matrix,
+                expected.Derive().Normalize( quiet=True ).data_matrix )
+
+        # Accessing the data materializes
+        for class_view, class_expected in zip( view.data_list, expected.data_list ):
+            assert_array_equal( class_view, class_expected )
+        self.assertFalse( view.is_view )
+        assert_array_equal( view.data_matrix, expected.data_matrix )
+
+        # Many simultaneous splits don't copy the parent's features
+        splits = [ fs.Split( random_state=i, view=True, quiet=True ) for i in range( 50 ) ]
+        for train_set, test_set in splits:
+            for split_set in train_set, test_set:
+                self.assertIsNone( split_set._data_matrix )
+                self.assertIs( split_set._view_source, fs.data_matrix )
+        train_set, test_set = fs.Split( random_state=7, quiet=True )
+        assert_array_equal( splits[7][0].data_matrix, train_set.data_matrix )
+        assert_array_equal( splits[7][1].data_matrix, test_set.data_matrix )
+
+    # --------------------------------------------------------------------------
+    def test_SortSamplesByGroundTruth( self ):
+        """Stable sort of rows by label (discrete) or value (continuous)"""
+
+        from wndcharm.ArtificialFeatureSpace import CreateArtificialFeatureSpace_Discrete, \
+                CreateArtificialFeatureSpace_Continuous
+        from numpy.testing import assert_array_equal
+
+        for fs in ( CreateArtificialFeatureSpace_Discrete( n_samples=300, n_classes=5,
+                        num_features_per_signal_type=2, random_state=42 ),
+                    CreateArtificialFeatureSpace_Continuous( n_samples=300,
+                        num_features_per_signal_type=2, random_state=42 ) ):
+            shuffled_rows = np.random.RandomState( 42 ).permutation( fs.num_samples )
+            # Unsorted copy of fs
+            unsorted = fs.Derive( data_matrix=fs.data_matrix[ shuffled_rows ],
+                **dict( ( member, [ getattr( fs, member )[i] for i in shuffled_rows ] )
+                    for member in ( '_contiguous_sample_names', '_contiguous_ground_truth_labels',
+                        '_contiguous_ground_truth_values', '_contiguous_sample_sequence_ids' ) ) )
+            sort_keys = unsorted._contiguous_ground_truth_labels if fs.discrete \
+                    else unsorted._contiguous_ground_truth_values
+            expected_rows = sorted( range( fs.num_samples ), key=sort_keys.__getitem__ )
+
+            result = unsorted.SortSamplesByGroundTruth()
+            self.assertEqual( result._contiguous_sample_names,
+                    [ unsorted._contiguous_sample_names[i] for i in expected_rows ] )
+            assert_array_equal( result.data_matrix, unsorted.data_matrix[ expected_rows ] )
+            if fs.discrete:
+                # Artificial feature spaces' classes are in value order, not alphanumeric
+                self.assertEqual( result.class_names, sorted( fs.class_names ) )
+                self.assertEqual( dict( zip( result.class_names, result.class_sizes ) ),
+                        dict( zip( fs.class_names, fs.class_sizes ) ) )
+                for class_index, class_name in enumerate( result.class_names ):
+                    self.assertEqual( set( result.ground_truth_labels[ class_index ] ),
+                            set( [ class_name ] ) )
+                    self.assertEqual( len( result.data_list[ class_index ] ),
+                            result.class_sizes[ class_index ] )
+
+    # --------------------------------------------------------------------------
+    def test_Normalizer( self ):
+        """Chunked Normalizer matches the masked array normalization it replaced,
+        and FeatureSpace.Normalize( inplace=True ) doesn't copy unless there are views."""
+
+        from wndcharm.utils import Normalizer
+        from wndcharm.ArtificialFeatureSpace import CreateArtificialFeatureSpace_Discrete
+        from numpy.testing import assert_array_equal, assert_allclose
+        import pickle
+
+        def MaskedArrayNormalize( full_stack, mins=None, maxs=None ):
+            oldsettings = np.seterr(all='ignore')
+            if mins is None:
+                full_stack_m = np.ma.masked_invalid( full_stack, copy=False )
+                maxs = full_stack_m.max( axis=0 )
+                mins = full_stack_m.min( axis=0 )
+            full_stack.clip( mins, maxs, full_stack )
+            full_stack_m = np.ma.masked_invalid( full_stack, copy=False )
+            full_stack_m -= mins
+            full_stack_m /= ( maxs - mins )
+            full_stack[:] = full_stack_m.filled( 0 ) * 100.0
+            np.seterr(**oldsettings)
+            return mins, maxs
+
+        rs = np.random.RandomState( 42 )
+        train = rs.randn( 101, 12 ) * 50
+        train[ rs.rand( *train.shape ) < 0.05 ] = np.nan
+        train[ 3, 1 ] = np.inf
+        train[ 7, 2 ] = -np.inf
+        train[ :, 4 ] = 7.0 # zero range
+        train[ :, 5 ] = np.nan # no finite values
+        test = rs.randn( 40, 12 ) * 80
+        test[ 0, : ] = np.inf
+
+        expected_train = train.copy()
+        mins, maxs = MaskedArrayNormalize( expected_train )
+        expected_test = test.copy()
+        MaskedArrayNormalize( expected_test, mins, maxs )
+
+        # Small chunks, so fit and apply go through several
+        normalizer = Normalizer()
+        normalizer.chunk_bytes = 8 * 12 * 10
+        for start in range( 0, len( train ), 17 ):
+            normalizer.Fit( train[ start : start + 17 ] )
+        self.assertTrue( np.isnan( normalizer.feature_minima[5] ) )
+        assert_array_equal( normalizer.feature_minima[ :5 ], mins[ :5 ] )
+        assert_array_equal( normalizer.feature_maxima[ :5 ], maxs[ :5 ] )
+
+        out = normalizer.Apply( train )
+        self.assertIsNot( out, train )
+        assert_allclose( out, expected_train, rtol=1e-12 )
+        normalizer = pickle.loads( pickle.dumps( normalizer, pickle.HIGHEST_PROTOCOL ) )
+        in_place = test.copy()
+        self.assertIs( normalizer.Apply( in_place, out=in_place ), in_place )
+        assert_allclose( in_place, expected_test, rtol=1e-12 )
+        # A single sample
+        assert_allclose( normalizer.Apply( test[ 3 ] ), expected_test[ 3 ], rtol=1e-12 )
+
+        fs = CreateArtificialFeatureSpace_Discrete( n_samples=60, n_classes=3,
+                num_features_per_signal_type=5, random_state=42 )
+        original_features = fs.data_matrix.copy()
+        expected = fs.Normalize( inplace=False, quiet=True )
+        assert_array_equal( fs.data_matrix, original_features )
+        view = fs.SampleReduce( range( 10, 30 ), view=True, quiet=True )
+        # The parent's features are shared with a view now, so they're copied
+        matrix = fs.data_matrix
+        fs.Normalize( quiet=True )
+        self.assertIsNot( fs.data_matrix, matrix )
+        assert_array_equal( fs.data_matrix, expected.data_matrix )
+        assert_array_equal( matrix, original_features )
+        # and the caller can still write to them
+        self.assertTrue( matrix.flags.writeable )
+        self.assertTrue( view.is_view )
+
+        # Once the views are gone, there's no copy
+        fs = CreateArtificialFeatureSpace_Discrete( n_samples=60, n_classes=3,
+                num_features_per_signal_type=5, random_state=42 )
+        view = fs.SampleReduce( range( 10, 30 ), view=True, quiet=True )
+        view.Materialize()
+        train_set, test_set = fs.Split( random_state=42, view=True, quiet=True )
+        del train_set, test_set
+        matrix = fs.data_matrix
+        fs.Normalize( quiet=True )
+        self.assertIs( fs.data_matrix, matrix )
+
+        fs = CreateArtificialFeatureSpace_Discrete( n_samples=60, n_classes=3,
+                num_features_per_signal_type=5, random_state=42 )
+        matrix = fs.data_matrix
+        fs.Normalize( quiet=True )
+        self.assertIs( fs.data_matrix, matrix )
+        assert_array_equal( fs.data_matrix, expected.data_matrix )
+        reduced = fs.GetNormalizer().FeatureReduce( fs.feature_names[ 10 : 3 : -2 ] )
+        assert_array_equal( reduced.feature_minima, fs.feature_minima[ 10 : 3 : -2 ] )
+
+    # --------------------------------------------------------------------------
+    def test_ScrambleGroundTruths( self ):
+        """Ground truths are permuted among sample groups, keeping tiles together"""
+
+        from wndcharm.ArtificialFeatureSpace import CreateArtificialFeatureSpace_Discrete
+        from numpy.testing import assert_array_equal
+
+        for n_samples_per_group in ( 1, 4 ):
+            fs = CreateArtificialFeatureSpace_Discrete( n_samples=80, n_classes=4,
+                    num_features_per_signal_type=2, n_samples_per_group=n_samples_per_group,
+                    random_state=42 )
+            rows = dict( [ ( name, i ) for i, name in enumerate( fs._contiguous_sample_names ) ] )
+            scrambled = fs.ScrambleGroundTruths( random_state=42, quiet=True )
+            # Artificial feature spaces' classes are in value order, not alphanumeric
+            self.assertEqual( dict( zip( scrambled.class_names, scrambled.class_sizes ) ),
+                    dict( zip( fs.class_names, fs.class_sizes ) ) )
+            self.assertEqual( scrambled._contiguous_ground_truth_labels,
+                    sorted( scrambled._contiguous_ground_truth_labels ) )
+            self.assertNotEqual( scrambled._contiguous_ground_truth_labels,
+                    [ fs._contiguous_ground_truth_labels[ rows[ name ] ] \
+                        for name in scrambled._contiguous_sample_names ] )
+
+            # Each of the original sample groups got one new label and value
+            new_ground_truths = {}
+            for i, name in enumerate( scrambled._contiguous_sample_names ):
+                new_ground_truths.setdefault( fs._contiguous_sample_group_ids[ rows[ name ] ],
+                        set() ).add( ( scrambled._contiguous_ground_truth_labels[i],
+                            scrambled._contiguous_ground_truth_values[i] ) )
+            self.assertEqual( len( new_ground_truths ), fs.num_samples / n_samples_per_group )
+            self.assertTrue( all( len( gt ) == 1 for gt in new_ground_truths.values() ) )
+
+            # Features stay with their samples
+            assert_array_equal( scrambled.data_matrix, fs.data_matrix[ [ rows[ name ] \
+                    for name in scrambled._contiguous_sample_names ] ] )
+            self.assertEqual( scrambled._contiguous_sample_names,
+                fs.ScrambleGroundTruths( random_state=42, quiet=True )._contiguous_sample_names )
+
     # --------------------------------------------------------------------------
     @unittest.skip('')
     def test_ClassSortingFunctionality( self ):
@@ -174,6 +174,436 @@ class TestFeatureSpaceClassification( unittest.TestCase ):
                     class_name, result.similarity_matrix[ class_name ][ class_name ] )
                 raise
 
+    def test_ResultsTable( self ):
+        """Columnar results give the same statistics as lists of result objects"""
+
+        import pickle
+        from wndcharm.ArtificialFeatureSpace import CreateArtificialFeatureSpace_Discrete
+        from wndcharm.FeatureSpacePrediction import ClassificationResultsTable
+
+        fs = CreateArtificialFeatureSpace_Discrete( n_samples=120, n_classes=3,
+                num_features_per_signal_type=10, noise_gradient=50, initial_noise_sigma=75,
+                n_samples_per_group=4, random_state=42, interpolatable=True )
+        train, test = fs.Split( random_state=42, quiet=True )
+        train.Normalize( inplace=True, quiet=True )
+        fw = FisherFeatureWeights.NewFromFeatureSpace( train ).Threshold( 10 )
+        train.FeatureReduce( fw, inplace=True, quiet=True )
+        test.FeatureReduce( fw, inplace=True, quiet=True ).Normalize( train, inplace=True, quiet=True )
+
+        result = FeatureSpaceClassification.NewWND5( train, test, fw, quiet=True ).GenerateStats()
+        table = result.GetResultsTable( tiled=False )
+        self.assertEqual( len( table ), test.num_samples )
+        self.assertEqual( len( result.individual_results ), test.num_samples )
+        self.assertEqual( len( result.tiled_results ), test.num_samples // 4 )
+        # Objects are created on demand, and are the same object every time
+        self.assertIs( result.individual_results[-1], table.Row( len( table ) - 1 ) )
+        self.assertEqual( result.tiled_results[0].tile_index, 'AVG' )
+        self.assertEqual( [ r.source_filepath for r in result.tiled_results[0].tiled_results ],
+                test._contiguous_sample_names[:4] )
+        np.testing.assert_allclose( result.tiled_results[1].marginal_probabilities, np.mean(
+            [ r.marginal_probabilities for r in result.individual_results[4:8] ], axis=0 ), rtol=1e-12 )
+
+        # The same results as plain lists of objects
+        from_objects = FeatureSpaceClassification( train, test, fw )
+        from_objects.individual_results = list( result.individual_results )
+        from_objects.tiled_results = list( result.tiled_results )
+        from_objects.tiled_predicted_values = result.tiled_predicted_values
+        from_objects.tiled_ground_truth_values = result.tiled_ground_truth_values
+        from_objects.GenerateStats()
+        self.assertEqual( from_objects.classification_accuracy, result.classification_accuracy )
+        self.assertEqual( from_objects.confusion_matrix, result.confusion_matrix )
+        for gt_class in test.class_names:
+            for pred_class in train.class_names:
+                self.assertAlmostEqual( result.average_class_probability_matrix[ gt_class ][ pred_class ],
+                    from_objects.average_class_probability_matrix[ gt_class ][ pred_class ] )
+
+        # A sample that collided with every training sample
+        marginal_probabilities = np.array( [ [ 0.7, 0.2, 0.1 ], [ np.nan ] * 3, [ 0.1, 0.1, 0.8 ] ] )
+        collided = ClassificationResultsTable( train.class_names, train.class_names[ ::-1 ],
+                [ 2, 1, 0 ], marginal_probabilities, [ 1e-20, np.nan, 2e-20 ] )
+        self.assertEqual( collided.Row( 1 ).predicted_class_name, collided.collision_class_name )
+        self.assertIsNone( collided.Row( 1 ).marginal_probabilities )
+        self.assertEqual( collided.CorrectPredictions().tolist(), [ True, False, True ] )
+        both = ClassificationResultsTable.Concatenate( [ table, collided ] )
+        self.assertEqual( both.batch_indices.tolist(), [0] * len( table ) + [1] * 3 )
+        self.assertEqual( both.ConfusionCounts().sum(), len( table ) + 3 )
+        self.assertEqual( [ both.ground_truth_class_names[i] for i in both.ground_truth_codes[ -3: ] ],
+                [ collided.ground_truth_class_names[i] for i in collided.ground_truth_codes ] )
+
+        unpickled = pickle.loads( pickle.dumps( result, pickle.HIGHEST_PROTOCOL ) )
+        self.assertEqual( [ r.predicted_class_name for r in unpickled.individual_results ],
+                [ r.predicted_class_name for r in result.individual_results ] )
+
+    def test_ResultRecords( self ):
+        """Per-sample results are printed from record events, to the calling thread's output only"""
+
+        import threading
+        from StringIO import StringIO
+        from wndcharm import instrumentation
+        from wndcharm.ArtificialFeatureSpace import CreateArtificialFeatureSpace_Discrete
+
+        fs = CreateArtificialFeatureSpace_Discrete( n_samples=60, n_classes=3,
+                num_features_per_signal_type=5, n_samples_per_group=2, random_state=42 )
+        train, test = fs.Split( random_state=42, quiet=True )
+        train.Normalize( inplace=True, quiet=True )
+        fw = FisherFeatureWeights.NewFromFeatureSpace( train ).Threshold( 10 )
+        train.FeatureReduce( fw, inplace=True, quiet=True )
+        test.FeatureReduce( fw, inplace=True, quiet=True ).Normalize( train, inplace=True, quiet=True )
+
+        # Two threads classify at once, each printing to its own stream
+        outputs = { 'train': StringIO(), 'test': StringIO() }
+        results = {}
+        def classify( key, test_set ):
+            results[ key ] = FeatureSpaceClassification.NewWND5( train, test_set, fw,
+                    quiet=False, output_stream=outputs[ key ] )
+        stdout = sys.stdout
+        sys.stdout = leaked = StringIO()
+        try:
+            threads = [ threading.Thread( target=classify, args=( 'train', train ) ),
+                    threading.Thread( target=classify, args=( 'test', test ) ) ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            self.assertIs( sys.stdout, leaked )
+            sys.stdout = stdout
+        self.assertFalse( instrumentation.Enabled() )
+        self.assertEqual( [ line for line in leaked.getvalue().splitlines() \
+                if not line.startswith( 'Saving output of function "NewWND5()"' ) ], [] )
+        for key, other in ( ( 'train', 'test' ), ( 'test', 'train' ) ):
+            lines = outputs[ key ].getvalue().splitlines()
+            line_items = [ r.LineItem() for r in results[ key ].individual_results ]
+            self.assertEqual( len( line_items ), len( results[ key ].individual_results ) )
+            for line_item in line_items:
+                self.assertIn( line_item, lines )
+            other_items = set( r.LineItem() for r in results[ other ].individual_results )
+            self.assertFalse( other_items.intersection( lines ) )
+
+        # Structured sinks get the fields of each result, even when quiet
+        events = []
+        with instrumentation.Attached( instrumentation.CallbackSink( events.append ) ):
+            result = FeatureSpaceClassification.NewWND5( train, test, fw, quiet=True )
+        records = [ e for e in events if e.kind == 'record' ]
+        self.assertEqual( len( records ), len( result.individual_results ) + \
+                len( result.tiled_results ) )
+        self.assertEqual( records[0].name, 'FeatureSpaceClassification.NewWND5.result' )
+        self.assertEqual( records[0].attributes[ 'source_filepath' ],
+                result.individual_results[0].source_filepath )
+        self.assertEqual( str( records[0] ), result.individual_results[0].LineItem() )
+
+    def test_TileAggregation( self ):
+        """Vectorized tile aggregators match per-sample loops, skipping collided tiles"""
+
+        from wndcharm.FeatureSpacePrediction import ClassificationResultsTable
+
+        rs = np.random.RandomState( 42 )
+        num_groups, tiles_per_group, num_classes = 7, 5, 3
+        num_tiles = num_groups * tiles_per_group
+        probabilities = rs.rand( num_tiles, num_classes )
+        probabilities /= probabilities.sum( axis=1 )[ :, np.newaxis ]
+        norm_factors = rs.rand( num_tiles ) * 1e-18
+        for collided_tile in ( 3, 11, 12, 14 ) + tuple( range( 20, 25 ) ):
+            probabilities[ collided_tile ] = np.nan
+            norm_factors[ collided_tile ] = np.nan
+        class_names = [ 'A', 'B', 'C' ]
+        tiles = ClassificationResultsTable( class_names, class_names,
+                np.repeat( np.arange( num_groups ) % num_classes, tiles_per_group ),
+                probabilities, norm_factors, interpolation_coefficients=[ 1.0, 2.0, 3.0 ] )
+        tiles.num_samples_in_group = tiles_per_group
+
+        def Expected( method, mps, nfs ):
+            if method == 'mean':
+                return np.mean( mps, axis=0 ), np.mean( nfs )
+            if method == 'median':
+                mp = np.median( mps, axis=0 )
+                return mp / mp.sum(), np.median( nfs )
+            if method == 'max_confidence':
+                best = np.argmax( mps.max( axis=1 ) )
+                return mps[ best ], nfs[ best ]
+            return np.dot( nfs, mps ) / nfs.sum(), np.mean( nfs )
+
+        for method in ClassificationResultsTable.tile_aggregation_methods:
+            # Every other sample, to exercise gathering the tile rows
+            for groups in ( range( num_groups ), range( 0, num_groups, 2 ) ):
+                tile_rows = np.array( [ np.arange( g * tiles_per_group, ( g + 1 ) * tiles_per_group )
+                        for g in groups ] )
+                aggregated = tiles.AggregateTiles( tile_rows, method )
+                for i, rows in enumerate( tile_rows ):
+                    called = rows[ ~np.isnan( norm_factors[ rows ] ) ]
+                    result = aggregated.Row( i )
+                    if not len( called ):
+                        self.assertIsNone( result.marginal_probabilities )
+                        self.assertEqual( result.predicted_class_name,
+                                ClassificationResultsTable.tiled_collision_class_name )
+                        continue
+                    mp, nf = Expected( method, probabilities[ called ], norm_factors[ called ] )
+                    np.testing.assert_allclose( result.marginal_probabilities, mp, rtol=1e-12 )
+                    self.assertAlmostEqual( result.normalization_factor / nf, 1.0 )
+                    self.assertEqual( result.predicted_class_name, class_names[ np.argmax( mp ) ] )
+                    self.assertAlmostEqual( result.predicted_value, np.dot( mp, [ 1.0, 2.0, 3.0 ] ) )
+                    self.assertEqual( [ r.normalization_factor for r in result.tiled_results ],
+                            [ tiles.Row( row ).normalization_factor for row in rows ] )
+
+        self.assertRaises( ValueError, tiles.AggregateTiles, np.arange( num_tiles ), 'mode' )
+
+    def test_TileAggregationThreshold( self ):
+        """Tiles dropped by the normalization factor threshold leave the other samples' tiles alone"""
+
+        from wndcharm.ArtificialFeatureSpace import CreateArtificialFeatureSpace_Discrete
+
+        fs = CreateArtificialFeatureSpace_Discrete( n_samples=120, n_classes=3,
+                num_features_per_signal_type=10, noise_gradient=50, initial_noise_sigma=75,
+                n_samples_per_group=4, random_state=42 )
+        train, test = fs.Split( random_state=42, quiet=True )
+        train.Normalize( inplace=True, quiet=True )
+        fw = FisherFeatureWeights.NewFromFeatureSpace( train ).Threshold( 10 )
+        train.FeatureReduce( fw, inplace=True, quiet=True )
+        test.FeatureReduce( fw, inplace=True, quiet=True ).Normalize( train, inplace=True, quiet=True )
+
+        # Move the second tile of the middle sample next to a training sample, so its
+        # normalization factor is the only one over the threshold
+        middle_group = test.num_samples // 4 // 2
+        dropped = middle_group * 4 + 1
+        test.data_matrix[ dropped ] = 0.9 * train.data_matrix[0] + 0.1 * test.data_matrix[ dropped ]
+        unthresholded = FeatureSpaceClassification.NewWND5( train, test, fw, quiet=True )
+        norm_factors = [ r.normalization_factor for r in unthresholded.individual_results ]
+        self.assertEqual( np.argmax( norm_factors ), dropped )
+        threshold = np.sqrt( sorted( norm_factors )[-1] * sorted( norm_factors )[-2] )
+
+        result = FeatureSpaceClassification.NewWND5( train, test, fw, quiet=True,
+                norm_factor_threshold=threshold )
+        self.assertEqual( len( result.individual_results ), test.num_samples - 1 )
+        self.assertEqual( len( result.tiled_results ), test.num_samples // 4 )
+        for group_index, tiled_result in enumerate( result.tiled_results ):
+            tile_names = test._contiguous_sample_names[ group_index * 4 : ( group_index + 1 ) * 4 ]
+            if group_index == middle_group:
+                del tile_names[1]
+            self.assertEqual( [ r.source_filepath for r in tiled_result.tiled_results ], tile_names )
+            unthresholded_tiles = [ unthresholded.individual_results[ group_index * 4 + i ] \
+                    for i in range( 4 ) if group_index * 4 + i != dropped ]
+            np.testing.assert_allclose( tiled_result.marginal_probabilities, np.mean(
+                [ r.marginal_probabilities for r in unthresholded_tiles ], axis=0 ), rtol=1e-12 )
+        self.assertEqual( [ r.tile_index for r in result.tiled_results[ middle_group ].tiled_results ],
+                [ 0, 2, 3 ] )
+
+    def test_WNN( self ):
+        """Vectorized WNN matches a per-sample loop over the training samples"""
+
+        from wndcharm.ArtificialFeatureSpace import CreateArtificialFeatureSpace_Discrete
+
+        fs = CreateArtificialFeatureSpace_Discrete( n_samples=80, n_classes=4,
+                num_features_per_signal_type=10, random_state=42 )
+        train, test = fs.Split( random_state=42, quiet=True )
+        train.Normalize( quiet=True )
+        weights = FisherFeatureWeights.NewFromFeatureSpace( train ).Threshold( 20 )
+        train = train.FeatureReduce( weights, quiet=True )
+        test = test.FeatureReduce( weights, quiet=True )
+        test.Normalize( train, quiet=True )
+        # a test sample identical to a training sample ignores that sample
+        test.data_matrix[0] = train.data_matrix[3]
+
+        result = FeatureSpaceClassification.NewWNN( train, test, weights, quiet=True )
+
+        train_classes = np.repeat( np.arange( train.num_classes ), train.class_sizes )
+        for test_row, row in zip( test.data_matrix, result.individual_results ):
+            closest = [ np.inf ] * train.num_classes
+            for train_row, train_class in zip( train.data_matrix, train_classes ):
+                dist = np.sqrt( np.sum( weights.values * ( test_row - train_row ) ** 2 ) )
+                if dist > 0 and dist < closest[ train_class ]:
+                    closest[ train_class ] = dist
+            inverses = 1.0 / np.array( closest )
+            np.testing.assert_allclose( row.marginal_probabilities, inverses / inverses.sum(), rtol=1e-9 )
+            self.assertAlmostEqual( row.normalization_factor / inverses.sum(), 1.0 )
+            self.assertEqual( row.predicted_class_name, train.class_names[ np.argmin( closest ) ] )
+
+        # a test sample that only has identical training samples is a non-call
+        probabilities, norm_factors = FeatureSpaceClassification._WNNBlock(
+                train, train.data_matrix[ :2 ], np.zeros( train.num_features ) )
+        self.assertTrue( np.isnan( probabilities ).all() and np.isnan( norm_factors ).all() )
+
+        experiment = FeatureSpaceClassificationExperiment.NewShuffleSplit( fs, n_iter=2,
+                features_size=20, random_state=42, classifier='wnn', quiet=True )
+        self.assertEqual( len( experiment.individual_results ), 2 )
+
+    def test_ApproximateWND5( self ):
+        """WND5 from the nearest neighbors is within its error bounds of exact WND5"""
+
+        from wndcharm.ArtificialFeatureSpace import CreateArtificialFeatureSpace_Discrete
+        from wndcharm.FeatureSpacePrediction import WND5NeighborIndex
+
+        fs = CreateArtificialFeatureSpace_Discrete( n_samples=120, n_classes=3,
+                num_features_per_signal_type=10, random_state=42 )
+        train, test = fs.Split( random_state=42, quiet=True )
+        train.Normalize( quiet=True )
+        weights = FisherFeatureWeights.NewFromFeatureSpace( train ).Threshold( 20 )
+        train = train.FeatureReduce( weights, quiet=True )
+        test = test.FeatureReduce( weights, quiet=True )
+        test.Normalize( train, quiet=True )
+        # a test sample identical to a training sample ignores that sample
+        test.data_matrix[0] = train.data_matrix[3]
+
+        exact = FeatureSpaceClassification.NewWND5( train, test, weights, quiet=True )
+        index = WND5NeighborIndex.NewFromFeatureSpace( train, weights )
+
+        # with every training sample as a neighbor, it's exact
+        approx = FeatureSpaceClassification.NewWND5( train, test, weights, quiet=True,
+                num_neighbors=max( train.class_sizes ), neighbor_index=index )
+        for exact_row, approx_row in zip( exact.individual_results, approx.individual_results ):
+            np.testing.assert_allclose( approx_row.marginal_probabilities,
+                    exact_row.marginal_probabilities, rtol=1e-9 )
+            self.assertAlmostEqual( approx_row.error_bound, 0 )
+
+        approx = FeatureSpaceClassification.NewWND5( train, test, weights, quiet=True,
+                num_neighbors=3, neighbor_index=index )
+        for exact_row, approx_row in zip( exact.individual_results, approx.individual_results ):
+            error = np.abs( np.array( approx_row.marginal_probabilities ) -
+                    exact_row.marginal_probabilities ).max()
+            self.assertLessEqual( error, approx_row.error_bound + 1e-12 )
+            self.assertLess( approx_row.error_bound, 1 )
+
+        # a test sample that collides with a whole class is a non-call
+        train.data_list[0][:] = train.data_list[0][0]
+        index = WND5NeighborIndex.NewFromFeatureSpace( train, weights )
+        probabilities, norm_factors, error_bounds = index.ClassifyBlock( train.data_list[0][:1], 3 )
+        self.assertTrue( np.isnan( probabilities ).all() and np.isnan( norm_factors ).all() )
+
+        self.assertRaises( ValueError, FeatureSpaceClassification.NewWND5, train, test,
+                weights, quiet=True, num_neighbors=0 )
+        self.assertRaises( ValueError, FeatureSpaceClassification.NewWND5, train, test,
+                weights, quiet=True, neighbor_index=index )
+
+    def test_Float32( self ):
+        """float32 feature spaces agree with double ones to within float32 tolerances"""
+
+        from wndcharm.ArtificialFeatureSpace import CreateArtificialFeatureSpace_Discrete
+
+        fs = CreateArtificialFeatureSpace_Discrete( n_samples=200, n_classes=4,
+                num_features_per_signal_type=10, random_state=42 )
+        fs32 = fs.AsType( 'float32' )
+        self.assertEqual( fs.dtype, np.double )
+        self.assertEqual( fs32.dtype, np.float32 )
+        self.assertEqual( fs32.data_matrix.nbytes * 2, fs.data_matrix.nbytes )
+
+        splits = []
+        for feature_space in fs, fs32:
+            train, test = feature_space.Split( random_state=42, quiet=True )
+            train.Normalize( quiet=True )
+            test.Normalize( train, quiet=True )
+            splits.append( ( train, test ) )
+        ( train, test ), ( train32, test32 ) = splits
+        self.assertEqual( train32.dtype, np.float32 )
+        self.assertEqual( test32.dtype, np.float32 )
+        # features are normalized on [0,100]
+        np.testing.assert_allclose( train32.data_matrix, train.data_matrix, atol=1e-4 )
+        np.testing.assert_allclose( test32.data_matrix, test.data_matrix, atol=1e-4 )
+
+        weights = FisherFeatureWeights.NewFromFeatureSpace( train )
+        weights32 = FisherFeatureWeights.NewFromFeatureSpace( train32 )
+        np.testing.assert_allclose( weights32.values, weights.values, rtol=1e-4 )
+
+        weights = weights.Threshold( 30 )
+        train, test = train.FeatureReduce( weights, quiet=True ), test.FeatureReduce( weights, quiet=True )
+        train32, test32 = train32.FeatureReduce( weights, quiet=True ), test32.FeatureReduce( weights, quiet=True )
+        for classify in FeatureSpaceClassification.NewWND5, FeatureSpaceClassification.NewWNN:
+            result = classify( train, test, weights, quiet=True )
+            result32 = classify( train32, test32, weights, quiet=True )
+            for row, row32 in zip( result.individual_results, result32.individual_results ):
+                np.testing.assert_allclose( row32.marginal_probabilities,
+                        row.marginal_probabilities, atol=1e-5 )
+                self.assertAlmostEqual( row32.normalization_factor / row.normalization_factor, 1, places=3 )
+                self.assertEqual( row32.predicted_class_name, row.predicted_class_name )
+
+        self.assertRaises( ValueError, fs.AsType, 'int32' )
+
+
+class TestFeatureSpaceRegression( unittest.TestCase ):
+    """
+    Test the regression functionality
+    """
+
+    def _BruteForceLeaveOneOut( self, fs, fw ):
+        """Reference implementation: re-solve lstsq once per left out sample group."""
+
+        A = np.hstack( [ fs.data_matrix * np.array( fw.values ), np.ones( ( fs.num_samples, 1 ) ) ] )
+        y = np.array( fs._contiguous_ground_truth_values )
+        group_ids = np.array( fs._contiguous_sample_group_ids )
+        predicted_values = np.empty( fs.num_samples )
+        for group_id in set( fs._contiguous_sample_group_ids ):
+            left_out = group_ids == group_id
+            coeffs = np.linalg.lstsq( A[ ~left_out ], y[ ~left_out ] )[0]
+            predicted_values[ left_out ] = np.dot( A[ left_out ], coeffs )
+        return predicted_values
+
+    def test_LeastSquaresLeaveOneOut( self ):
+        """Closed-form leave-one-out matches explicitly re-solving for each sample"""
+
+        from wndcharm.ArtificialFeatureSpace import CreateArtificialFeatureSpace_Continuous
+
+        for n_samples_per_group in ( 1, 4 ):
+            fs = CreateArtificialFeatureSpace_Continuous( n_samples=100,
+                    num_features_per_signal_type=5, noise_gradient=5, initial_noise_sigma=10,
+                    n_samples_per_group=n_samples_per_group, random_state=42 )
+            fs.Normalize( quiet=True )
+            fw = PearsonFeatureWeights.NewFromFeatureSpace( fs ).Threshold()
+            fs.FeatureReduce( fw, inplace=True, quiet=True )
+
+            orig_matrix = np.copy( fs.data_matrix )
+            result = FeatureSpaceRegression.NewLeastSquares( fs, None, fw, quiet=True )
+
+            # input feature space must be left untouched
+            np.testing.assert_array_equal( fs.data_matrix, orig_matrix )
+            np.testing.assert_allclose( result.predicted_values,
+                    self._BruteForceLeaveOneOut( fs, fw ), rtol=1e-7, atol=1e-9 )
+
+
+    def test_LeastSquaresRegressionModel( self ):
+        """Fitted model predicts the same as the per-sample solver and survives pickling"""
+
+        import cPickle as pickle
+        from wndcharm.ArtificialFeatureSpace import CreateArtificialFeatureSpace_Continuous
+        from wndcharm.FeatureSpacePrediction import LeastSquaresRegressionModel
+        from wndcharm.SingleSamplePrediction import SingleSampleRegression
+
+        fs = CreateArtificialFeatureSpace_Continuous( n_samples=100,
+                num_features_per_signal_type=5, noise_gradient=5, initial_noise_sigma=10,
+                random_state=42 )
+        train_set, test_set = fs.Split( random_state=42, quiet=True )
+        train_set.Normalize( quiet=True )
+        test_set.Normalize( train_set, quiet=True )
+        fw = PearsonFeatureWeights.NewFromFeatureSpace( train_set ).Threshold()
+        train_set.FeatureReduce( fw, inplace=True, quiet=True )
+        test_set.FeatureReduce( fw, inplace=True, quiet=True )
+
+        result = FeatureSpaceRegression.NewLeastSquares( train_set, test_set, fw, quiet=True )
+        model = result.model
+        self.assertIsInstance( model, LeastSquaresRegressionModel )
+
+        weights = np.array( fw.values )
+        A = np.hstack( [ train_set.data_matrix * weights, np.ones( ( train_set.num_samples, 1 ) ) ] )
+        B = np.hstack( [ test_set.data_matrix * weights, np.ones( ( test_set.num_samples, 1 ) ) ] )
+        expected = [ SingleSampleRegression._LeastSquares( row, A,
+            train_set._contiguous_ground_truth_values ).predicted_value for row in B ]
+        np.testing.assert_allclose( result.predicted_values, expected, rtol=1e-7, atol=1e-9 )
+
+        # Reusing a model skips the fit and gives the same answer
+        reused = FeatureSpaceRegression.NewLeastSquares( train_set, test_set, fw,
+                quiet=True, model=model )
+        self.assertIs( reused.model, model )
+        np.testing.assert_array_equal( reused.predicted_values, result.predicted_values )
+
+        # A model fit for other features can't be reused
+        fewer = fw.Threshold( len( fw.feature_names ) - 1 )
+        other_model = LeastSquaresRegressionModel.NewFromFeatureSpace(
+                train_set.FeatureReduce( fewer, quiet=True ), fewer )
+        self.assertRaises( ValueError, FeatureSpaceRegression.NewLeastSquares, train_set,
+                test_set, fw, quiet=True, model=other_model )
+
+        unpickled = pickle.loads( pickle.dumps( model, pickle.HIGHEST_PROTOCOL ) )
+        np.testing.assert_array_equal( unpickled.Predict( test_set ), model.Predict( test_set ) )
+        np.testing.assert_array_equal( unpickled.Predict( test_set.data_matrix ),
+                result.predicted_values )
+
             
 if __name__ == '__main__':
     unittest.main()
@@ -277,5 +277,286 @@ class TESTINGFeatureSpaceClassificationExperiment( unittest.TestCase ):
         exp.PerSampleStatistics( )#output_stream=devnull )
         self.assertTrue(True)
 
+    # -------------------------------------------------------------------
+    def test_NewShuffleSplitParallel(self):
+        """DISCRETE ShuffleSplit in worker processes gives same results as serial"""
+
+        fs = CreateArtificialFeatureSpace_Discrete( n_samples=40, n_classes=2,
+                num_features_per_signal_type=10, noise_gradient=50, initial_noise_sigma=75,
+                random_state=42, interpolatable=True )
+
+        ss_kwargs = {}
+        ss_kwargs['quiet'] = True
+        ss_kwargs['n_iter'] = 4
+        ss_kwargs['train_size'] = 8 # per-class
+        ss_kwargs['test_size' ] = 2 # per-class
+        ss_kwargs['random_state'] = 42
+        serial = FeatureSpaceClassificationExperiment.NewShuffleSplit( fs, **ss_kwargs )
+        parallel = FeatureSpaceClassificationExperiment.NewShuffleSplit( fs, n_jobs=2, **ss_kwargs )
+
+        self.assertEqual( len( serial.individual_results ), len( parallel.individual_results ) )
+        for s_batch, p_batch in zip( serial.individual_results, parallel.individual_results ):
+            self.assertEqual( s_batch.batch_number, p_batch.batch_number )
+            self.assertEqual( s_batch.feature_weights.feature_names,
+                    p_batch.feature_weights.feature_names )
+            self.assertEqual( [ r.source_filepath for r in s_batch.individual_results ],
+                    [ r.source_filepath for r in p_batch.individual_results ] )
+            self.assertEqual( [ r.marginal_probabilities for r in s_batch.individual_results ],
+                    [ r.marginal_probabilities for r in p_batch.individual_results ] )
+            self.assertEqual( s_batch.predicted_values, p_batch.predicted_values )
+            # only compact results come back from the workers
+            self.assertIsNone( p_batch.training_set.data_matrix )
+
+        serial.GenerateStats()
+        parallel.GenerateStats()
+        self.assertEqual( serial.classification_accuracy, parallel.classification_accuracy )
+
+    # -------------------------------------------------------------------
+    def test_FeatureCountSweep(self):
+        """DISCRETE incremental feature count sweep matches ShuffleSplit at each count"""
+
+        for n_samples_per_group in ( 1, 4 ):
+            fs = CreateArtificialFeatureSpace_Discrete( n_samples=80, n_classes=3,
+                    num_features_per_signal_type=10, noise_gradient=50, initial_noise_sigma=75,
+                    n_samples_per_group=n_samples_per_group, random_state=42 )
+
+            ss_kwargs = {}
+            ss_kwargs['quiet'] = True
+            ss_kwargs['n_iter'] = 3
+            ss_kwargs['random_state'] = 42
+            feature_counts = [ 1, 2, 5, 13, 20 ]
+            sweep = FeatureSpaceClassificationExperiment.FeatureCountSweep( fs,
+                    feature_counts, **ss_kwargs )
+            self.assertEqual( sorted( sweep.keys() ), feature_counts )
+            for n_features in feature_counts:
+                exp = FeatureSpaceClassificationExperiment.NewShuffleSplit( fs,
+                        features_size=n_features, **ss_kwargs ).GenerateStats()
+                self.assertAlmostEqual( sweep[ n_features ], exp.classification_accuracy )
+
+    # -------------------------------------------------------------------
+    def test_FeatureWeightsGridSearch(self):
+        """DISCRETE grid search returns the experiment its best feature count was picked from"""
+
+        fs = CreateArtificialFeatureSpace_Discrete( n_samples=80, n_classes=3,
+                num_features_per_signal_type=10, noise_gradient=50, initial_noise_sigma=75,
+                random_state=42 )
+        # Default random_state, i.e., seeds from the global RNG
+        best_exp = FeatureSpaceClassificationExperiment.FeatureWeightsGridSearch( start=1,
+                stop=30, step=4, feature_space=fs, n_iter=3, quiet=True )
+        accuracies = best_exp.features_accuracy_dict
+        best_n_features = len( best_exp.individual_results[0].feature_weights.feature_names )
+        self.assertEqual( accuracies[ best_n_features ], max( accuracies.values() ) )
+        self.assertEqual( best_exp.classification_accuracy, accuracies[ best_n_features ] )
+
+    # -------------------------------------------------------------------
+    def test_NewNFold(self):
+        """DISCRETE N-fold cross validation tests each sample group exactly once"""
+
+        from wndcharm.FeatureWeights import FisherFeatureWeights
+        from wndcharm.FeatureSpacePrediction import FeatureSpaceClassification
+
+        fs = CreateArtificialFeatureSpace_Discrete( n_samples=60, n_classes=3,
+                num_features_per_signal_type=10, noise_gradient=50, initial_noise_sigma=75,
+                n_samples_per_group=4, random_state=42 )
+        all_group_ids = sorted( set( fs._contiguous_sample_group_ids ) )
+        # SampleReduce renumbers sample groups, so go by sample name
+        group_of_sample = dict( zip( fs._contiguous_sample_names, fs._contiguous_sample_group_ids ) )
+
+        for scheme in ( 'kfold', 'stratified', 'leave_one_group_out' ):
+            exp = FeatureSpaceClassificationExperiment.NewNFold( fs, num_folds=4,
+                    scheme=scheme, features_size=10, random_state=42, quiet=True )
+            tested = [ r.source_filepath for batch in exp.individual_results
+                    for r in batch.individual_results ]
+            self.assertEqual( sorted( tested ), sorted( fs._contiguous_sample_names ) )
+            for batch in exp.individual_results:
+                for tile_results in [ r.tiled_results for r in batch.tiled_results ]:
+                    self.assertEqual( len( set( group_of_sample[ r.source_filepath ]
+                            for r in tile_results ) ), 1 )
+            self.assertEqual( sum( len( batch.tiled_results ) for batch in exp.individual_results ),
+                    len( all_group_ids ) )
+            if scheme != 'leave_one_group_out':
+                self.assertEqual( len( exp.individual_results ), 4 )
+            else:
+                self.assertEqual( len( exp.individual_results ), len( all_group_ids ) )
+
+        # Each fold matches training from scratch on the fold's training set
+        exp = FeatureSpaceClassificationExperiment.NewNFold( fs, num_folds=3,
+                features_size=10, random_state=42, quiet=True )
+        for batch in exp.individual_results:
+            test_group_ids = sorted( set( [ group_of_sample[ r.source_filepath ]
+                    for r in batch.individual_results ] ) )
+            train_set = fs.SampleReduce( leave_out_sample_group_ids=test_group_ids, quiet=True )
+            test_set = fs.SampleReduce( leave_in_sample_group_ids=test_group_ids, quiet=True )
+            train_set.Normalize( quiet=True )
+            weights = FisherFeatureWeights.NewFromFeatureSpace( train_set ).Threshold( 10 )
+            self.assertEqual( weights.feature_names, batch.feature_weights.feature_names )
+            for a, b in zip( weights.values, batch.feature_weights.values ):
+                self.assertAlmostEqual( a, b, places=6 )
+            train_set = train_set.FeatureReduce( weights, quiet=True )
+            test_set = test_set.FeatureReduce( weights, quiet=True ).Normalize( train_set, quiet=True )
+            expected = FeatureSpaceClassification.NewWND5( train_set, test_set, weights, quiet=True )
+            self.assertEqual( [ r.predicted_class_name for r in expected.individual_results ],
+                    [ r.predicted_class_name for r in batch.individual_results ] )
+
+        # Folds in worker processes give the same results
+        parallel = FeatureSpaceClassificationExperiment.NewNFold( fs, num_folds=3,
+                features_size=10, random_state=42, quiet=True, n_jobs=2 )
+        for s_batch, p_batch in zip( exp.individual_results, parallel.individual_results ):
+            self.assertEqual( s_batch.feature_weights.feature_names,
+                    p_batch.feature_weights.feature_names )
+            self.assertEqual( [ r.marginal_probabilities for r in s_batch.individual_results ],
+                    [ r.marginal_probabilities for r in p_batch.individual_results ] )
+        self.assertEqual( exp.GenerateStats().classification_accuracy,
+                parallel.GenerateStats().classification_accuracy )
+
+    # -------------------------------------------------------------------
+    def test_Checkpoint(self):
+        """DISCRETE interrupted ShuffleSplit/NFold resume from checkpoint file"""
+
+        import os
+        from tempfile import mkdtemp
+        from shutil import rmtree
+
+        fs = CreateArtificialFeatureSpace_Discrete( n_samples=40, n_classes=2,
+                num_features_per_signal_type=10, noise_gradient=50, initial_noise_sigma=75,
+                random_state=42, interpolatable=True )
+        ss_kwargs = { 'quiet': True, 'train_size': 8, 'test_size': 2, 'random_state': 42 }
+        expected = FeatureSpaceClassificationExperiment.NewShuffleSplit( fs, n_iter=4, **ss_kwargs )
+
+        tempdir = mkdtemp()
+        try:
+            path = os.path.join( tempdir, 'results.pickled' )
+            serial = FeatureSpaceClassificationExperiment.NewShuffleSplit( fs, n_iter=2,
+                    checkpoint=path, **ss_kwargs )
+            # Only the checkpointed copies of the results lose their feature matrices
+            for batch in serial.individual_results:
+                self.assertIsNotNone( batch.training_set.data_matrix )
+                self.assertIsNotNone( batch.test_set.data_matrix )
+            # Died while writing the third record
+            with open( path, 'ab' ) as outfile:
+                outfile.write( '\x80\x02}q\x00(U\x03key' )
+            # Another experiment's records are ignored
+            FeatureSpaceClassificationExperiment.NewShuffleSplit( fs, n_iter=1, features_size=3,
+                    checkpoint=path, **ss_kwargs )
+            resumed = FeatureSpaceClassificationExperiment.NewShuffleSplit( fs, n_iter=4,
+                    checkpoint=path, n_jobs=2, **ss_kwargs )
+            # The partial record was truncated, and only iterations 2 and 3 were run
+            import pickle
+            records = []
+            with open( path, 'rb' ) as infile:
+                while infile.tell() < os.path.getsize( path ):
+                    records.append( pickle.load( infile ) )
+            self.assertEqual( [ r[ 'index' ] for r in records ], [ 0, 1, 0, 2, 3 ] )
+            self.assertEqual( [ r[ 'key' ] == records[0][ 'key' ] for r in records ],
+                    [ True, True, False, True, True ] )
+            self.assertIsNone( records[0][ 'batch_result' ].training_set.data_matrix )
+
+            for e_batch, r_batch in zip( expected.individual_results, resumed.individual_results ):
+                self.assertEqual( e_batch.batch_number, r_batch.batch_number )
+                self.assertEqual( e_batch.feature_weights.feature_names,
+                        r_batch.feature_weights.feature_names )
+                self.assertEqual( [ r.marginal_probabilities for r in e_batch.individual_results ],
+                        [ r.marginal_probabilities for r in r_batch.individual_results ] )
+            self.assertEqual( expected.GenerateStats().classification_accuracy,
+                    resumed.GenerateStats().classification_accuracy )
+
+            # Unseeded folds are read back from the file, and nothing is rerun
+            path = os.path.join( tempdir, 'nfold.pickled' )
+            first = FeatureSpaceClassificationExperiment.NewNFold( fs, num_folds=3,
+                    features_size=10, random_state=True, quiet=True, checkpoint=path )
+            size = os.path.getsize( path )
+            again = FeatureSpaceClassificationExperiment.NewNFold( fs, num_folds=3,
+                    features_size=10, random_state=True, quiet=True, checkpoint=path )
+            self.assertEqual( size, os.path.getsize( path ) )
+            for f_batch, a_batch in zip( first.individual_results, again.individual_results ):
+                self.assertEqual( [ r.source_filepath for r in f_batch.individual_results ],
+                        [ r.source_filepath for r in a_batch.individual_results ] )
+        finally:
+            rmtree( tempdir )
+
+    # -------------------------------------------------------------------
+    def test_PermutationTest(self):
+        """DISCRETE permutation test accuracy matches ShuffleSplit, and separated classes
+        are significant"""
+
+        for n_samples_per_group in ( 1, 4 ):
+            fs = CreateArtificialFeatureSpace_Discrete( n_samples=80, n_classes=3,
+                    num_features_per_signal_type=10, noise_gradient=50, initial_noise_sigma=75,
+                    n_samples_per_group=n_samples_per_group, random_state=42 )
+            ss_kwargs = { 'quiet': True, 'n_iter': 3, 'random_state': 42 }
+            accuracy, null_accuracies, p_value = \
+                FeatureSpaceClassificationExperiment.PermutationTest( fs,
+                    n_permutations=20, **ss_kwargs )
+            exp = FeatureSpaceClassificationExperiment.NewShuffleSplit( fs,
+                    **ss_kwargs ).GenerateStats()
+            self.assertAlmostEqual( accuracy, exp.classification_accuracy )
+            self.assertEqual( len( null_accuracies ), 20 )
+            self.assertLess( null_accuracies.mean(), 0.6 )
+            self.assertAlmostEqual( p_value, 1.0 / 21 )
+
+            parallel = FeatureSpaceClassificationExperiment.PermutationTest( fs,
+                    n_permutations=20, n_jobs=2, **ss_kwargs )
+            self.assertEqual( parallel[0], accuracy )
+            self.assertEqual( list( parallel[1] ), list( null_accuracies ) )
+
+        # A view gives the same results as a copy of its features, and stays a view
+        from wndcharm.FeatureSpace import _SharedWithViews
+        features = fs.feature_names[ ::2 ]
+        groups = sorted( set( fs._contiguous_sample_group_ids ) )[ 2 : -3 ]
+        view = fs.FeatureReduce( features, view=True, quiet=True ).SampleReduce( groups,
+                view=True, quiet=True )
+        copied = fs.FeatureReduce( features, quiet=True ).SampleReduce( groups, quiet=True )
+        from_view = FeatureSpaceClassificationExperiment.PermutationTest( view,
+                n_permutations=5, **ss_kwargs )
+        self.assertTrue( view.is_view )
+        self.assertIs( view._view_source, fs.data_matrix )
+        self.assertTrue( _SharedWithViews( fs.data_matrix ) )
+        from_copy = FeatureSpaceClassificationExperiment.PermutationTest( copied,
+                n_permutations=5, **ss_kwargs )
+        self.assertEqual( from_view[0], from_copy[0] )
+        self.assertEqual( list( from_view[1] ), list( from_copy[1] ) )
+
+    # -------------------------------------------------------------------
+    def test_Instrumentation(self):
+        """DISCRETE ShuffleSplit emits span and progress events to attached sinks"""
+
+        from wndcharm import instrumentation
+        import json
+        from StringIO import StringIO
+
+        fs = CreateArtificialFeatureSpace_Discrete( n_samples=60, n_classes=2,
+                num_features_per_signal_type=5, random_state=42 )
+        events = []
+        stream = StringIO()
+        with instrumentation.Attached( instrumentation.CallbackSink( events.append ) ):
+            with instrumentation.Attached( instrumentation.JSONLinesSink( stream ) ):
+                exp = FeatureSpaceClassificationExperiment.NewShuffleSplit( fs, n_iter=3,
+                        quiet=True, random_state=42 )
+        self.assertFalse( instrumentation.Enabled() )
+
+        spans = [ e.name for e in events if e.kind == 'span' ]
+        self.assertEqual( spans.count( 'FeatureSpaceClassification.NewWND5' ), 3 )
+        self.assertEqual( spans.count( 'FeatureSpacePredictionExperiment.NewShuffleSplit.iteration' ), 3 )
+        self.assertEqual( spans[-1], 'FeatureSpacePredictionExperiment.NewShuffleSplit' )
+        progress = [ ( e.value, e.total ) for e in events if e.kind == 'progress' and \
+                e.name == 'FeatureSpacePredictionExperiment.NewShuffleSplit.iteration' ]
+        self.assertEqual( progress, [ ( 1, 3 ), ( 2, 3 ), ( 3, 3 ) ] )
+        # quiet only silences the printing: each test sample's result is still a record
+        records = [ e for e in events if e.kind == 'record' ]
+        self.assertEqual( len( records ), sum( len( batch.individual_results ) for batch in \
+                exp.individual_results ) )
+        self.assertEqual( set( e.name for e in records ),
+                set( [ 'FeatureSpaceClassification.NewWND5.result' ] ) )
+        self.assertEqual( [ e.attributes[ 'predicted_class_name' ] for e in records[ :5 ] ],
+                [ r.predicted_class_name for r in exp.individual_results[0].individual_results[ :5 ] ] )
+        lines = [ json.loads( line ) for line in stream.getvalue().splitlines() ]
+        self.assertEqual( [ line[ 'name' ] for line in lines ], [ e.name for e in events ] )
+
+        # Nothing is emitted once the sinks are detached
+        del events[:]
+        FeatureSpaceClassificationExperiment.NewShuffleSplit( fs, n_iter=1, quiet=True,
+                random_state=42 )
+        self.assertEqual( events, [] )
+
 if __name__ == '__main__':
     unittest.main()
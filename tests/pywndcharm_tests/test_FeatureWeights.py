@@ -36,7 +36,8 @@ wndchrm_test_dir = join( dirname( pychrm_test_dir ), 'wndchrm_tests' )
 test_dir = wndchrm_test_dir
 
 from wndcharm.FeatureSpace import FeatureSpace
-from wndcharm.FeatureWeights import FisherFeatureWeights
+from wndcharm.FeatureWeights import FisherFeatureWeights, PearsonFeatureWeights, \
+		FisherScoreAccumulator, mRMRFeatureWeights
 
 class TestFisherFeatureWeights( unittest.TestCase ):
 	"""Fisher score calculation"""
@@ -62,5 +63,187 @@ class TestFisherFeatureWeights( unittest.TestCase ):
 	 	for target_val, res_val in zip( target_weights.values, result_weights.values ):
 			self.assertAlmostEqual( target_val, res_val, delta=self.epsilon )
 
+	# --------------------------------------------------------------------------
+	def test_ThresholdAndSlice( self ):
+		"""Top-k selection matches a full stable sort, ties included"""
+
+		import numpy as np
+		feature_names = [ 'feature {0}'.format(i) for i in range( 50 ) ]
+		fw = FisherFeatureWeights( name='test' )
+		fw.feature_names = feature_names
+		fw.values = np.random.RandomState( 42 ).randint( 1, 10, size=50 ).astype( float )
+		fw.values[ 45: ] = 0
+		fw.feature_indices = np.arange( 50 )
+
+		ranked = sorted( zip( fw.values, fw.feature_names, range( 50 ) ),
+				key=lambda a: a[0], reverse=True )
+		for n in ( 1, 7, 45 ):
+			reduced = fw.Threshold( n )
+			self.assertEqual( reduced.feature_names, [ r[1] for r in ranked[ :n ] ] )
+			np.testing.assert_array_equal( reduced.values, [ r[0] for r in ranked[ :n ] ] )
+			np.testing.assert_array_equal( reduced.feature_indices, [ r[2] for r in ranked[ :n ] ] )
+
+		self.assertRaises( ValueError, fw.Threshold, 46 )
+		self.assertEqual( len( fw.Threshold( 50, _all='non-zero' ) ), 45 )
+		self.assertEqual( len( fw.EliminateZeros() ), 45 )
+
+		sliced = fw.Slice( 10, 20 )
+		self.assertEqual( sliced.feature_names, feature_names[ 10:20 ] )
+		np.testing.assert_array_equal( sliced.values, fw.values[ 10:20 ] )
+
+class TestPearsonFeatureWeights( unittest.TestCase ):
+	"""Pearson/Spearman correlation calculation"""
+
+	# --------------------------------------------------------------------------
+	def test_NewFromFeatureSpace( self ):
+		"""Columnwise statistics match per-feature scipy linregress/spearmanr"""
+
+		import numpy as np
+		from scipy.stats import linregress, spearmanr
+		from wndcharm.ArtificialFeatureSpace import CreateArtificialFeatureSpace_Continuous
+
+		fs = CreateArtificialFeatureSpace_Continuous( n_samples=50,
+				num_features_per_signal_type=5, noise_gradient=5, initial_noise_sigma=10,
+				random_state=42 )
+		fs.Normalize( quiet=True )
+		# round a column to introduce ties, and make a constant one
+		fs.data_matrix[:,0] = np.round( fs.data_matrix[:,0] / 20 )
+		fs.data_matrix[:,1] = 50
+
+		fw = PearsonFeatureWeights.NewFromFeatureSpace( fs )
+
+		old_settings = np.seterr( all='ignore' )
+		gt = np.array( fs.ground_truth_values, dtype=float )
+		for i in range( fs.num_features ):
+			col = fs.data_matrix[:,i]
+			slope, intercept, r, p, stderr = linregress( gt, col )
+			rho, rho_p = spearmanr( gt, col )
+			if np.isnan( rho ):
+				# scipy returns NaN for constant input, which used to raise under seterr
+				rho, rho_p = ( 0, 1 )
+			np.testing.assert_allclose(
+				[ fw.slopes[i], fw.intercepts[i], fw.pearson_coeffs[i], fw.pearson_p_values[i],
+					fw.pearson_stderrs[i], fw.spearman_coeffs[i], fw.spearman_p_values[i] ],
+				[ slope, intercept, r, p, stderr, rho, rho_p ], rtol=1e-7, atol=1e-12 )
+		np.seterr( **old_settings )
+
+		self.assertEqual( fw.values[1], 0 )
+		self.assertAlmostEqual( sum( fw.values ), 1.0 )
+
+class TestFisherScoreAccumulator( unittest.TestCase ):
+	"""Incremental Fisher score calculation"""
+
+	# --------------------------------------------------------------------------
+	def test_MatchesBatchCalculation( self ):
+		"""Adding, removing and merging samples agrees with NewFromFeatureSpace"""
+
+		import numpy as np
+		from wndcharm.ArtificialFeatureSpace import CreateArtificialFeatureSpace_Discrete
+
+		fs = CreateArtificialFeatureSpace_Discrete( n_samples=90, n_classes=3,
+				num_features_per_signal_type=5, random_state=42 )
+		# raw units far from the normalized range, plus invalid values
+		fs.data_matrix *= 1e4
+		fs.data_matrix += 1e6
+		fs.data_matrix[ 3, 0 ] = np.nan
+		fs.data_matrix[ 5, 1 ] = np.inf
+		fs.data_matrix[ 7, 1 ] = -np.inf
+		fs.data_matrix[ :, 2 ] = 7
+
+		def batch_weights( rows ):
+			if len( rows ) == fs.num_samples:
+				reduced = fs.Derive()
+			else:
+				reduced = fs.SampleReduce( [ fs._contiguous_sample_group_ids[i] for i in rows ], quiet=True )
+			reduced.Normalize( quiet=True )
+			return np.array( FisherFeatureWeights.NewFromFeatureSpace( reduced ).values )
+
+		labels = fs._contiguous_ground_truth_labels
+		all_rows = range( fs.num_samples )
+		acc = FisherScoreAccumulator.NewFromFeatureSpace( fs )
+		target = batch_weights( all_rows )
+		np.testing.assert_allclose( acc.GetFisherFeatureWeights().values, target, rtol=1e-9 )
+		self.assertEqual( sum( acc.class_sizes ), fs.num_samples )
+
+		# shards merged together
+		shard_a = FisherScoreAccumulator().AddSamples( fs.data_matrix[ :40 ], labels[ :40 ] )
+		shard_b = FisherScoreAccumulator().AddSamples( fs.data_matrix[ 40: ], labels[ 40: ] )
+		np.testing.assert_allclose( shard_a.Merge( shard_b ).GetFisherFeatureWeights().values,
+				target, rtol=1e-9 )
+
+		# remove every fourth sample, including one of the INFs
+		kept_rows = [ i for i in all_rows if i % 4 != 1 ]
+		removed_rows = [ i for i in all_rows if i % 4 == 1 ]
+		acc.RemoveSamples( fs.data_matrix[ removed_rows ], [ labels[i] for i in removed_rows ] )
+		np.testing.assert_allclose( acc.GetFisherFeatureWeights().values,
+				batch_weights( kept_rows ), rtol=1e-7 )
+
+		self.assertRaises( ValueError, acc.RemoveSamples, fs.data_matrix[ :1 ], [ 'no such class' ] )
+
+class TestmRMRFeatureWeights( unittest.TestCase ):
+	"""Minimum redundancy maximum relevance feature selection"""
+
+	# --------------------------------------------------------------------------
+	def test_NewFromFeatureSpace( self ):
+		"""Picks the same features with the same scores as a per-pair calculation"""
+
+		import numpy as np
+		from wndcharm.ArtificialFeatureSpace import CreateArtificialFeatureSpace_Discrete
+
+		fs = CreateArtificialFeatureSpace_Discrete( n_samples=60, n_classes=3,
+				num_features_per_signal_type=4, random_state=42 )
+		# a copy of a feature is as relevant as the original, and completely redundant
+		fs.data_matrix[:,1] = fs.data_matrix[:,0]
+		fs.Normalize( quiet=True )
+
+		def entropy( *variables ):
+			joint = np.array( variables ).T
+			counts = np.unique( [ str( list( row ) ) for row in joint ], return_counts=True )[1]
+			p = counts / float( len( joint ) )
+			return -np.sum( p * np.log2( p ) )
+		def mutual_information( a, b ):
+			return entropy( a ) + entropy( b ) - entropy( a, b )
+
+		data = fs.data_matrix
+		states = ( data >= data.mean( axis=0 ) - data.std( axis=0 ) ).astype( int ) + \
+				( data > data.mean( axis=0 ) + data.std( axis=0 ) )
+		classes = np.repeat( np.arange( fs.num_classes ), fs.class_sizes )
+		relevances = [ mutual_information( states[:,i], classes ) for i in range( fs.num_features ) ]
+
+		n_picks = 10
+		for scheme in ( 'MID', 'MIQ' ):
+			selected = [ int( np.argmax( relevances ) ) ]
+			scores = [ max( relevances ) ]
+			while len( selected ) < n_picks:
+				best = None
+				for i in range( fs.num_features ):
+					if i in selected:
+						continue
+					redundancy = np.mean( [ mutual_information( states[:,i], states[:,j] ) for j in selected ] )
+					if scheme == 'MID':
+						score = relevances[i] - redundancy
+					else:
+						score = relevances[i] / ( redundancy + 0.0001 )
+					if best is None or score > best[1] + 1e-9:
+						best = ( i, score )
+				selected.append( best[0] )
+				scores.append( best[1] )
+
+			for n_jobs in ( None, 3 ):
+				fw = mRMRFeatureWeights.NewFromFeatureSpace( fs, n_picks, scheme=scheme, n_jobs=n_jobs )
+				self.assertEqual( list( fw.feature_indices ), selected )
+				self.assertEqual( fw.feature_names, [ fs.feature_names[i] for i in selected ] )
+				np.testing.assert_allclose( fw.values, np.clip( scores, 0, None ), atol=1e-9 )
+				np.testing.assert_allclose( fw.relevances, [ relevances[i] for i in selected ], atol=1e-9 )
+
+			self.assertFalse( 0 in selected and 1 in selected )
+			prefix = fw.Threshold( 4 )
+			self.assertEqual( prefix.feature_names, fw.feature_names[ :4 ] )
+			np.testing.assert_array_equal( prefix.values, fw.values[ :4 ] )
+
+		self.assertRaises( ValueError, mRMRFeatureWeights.NewFromFeatureSpace, fs, 0 )
+		self.assertRaises( ValueError, mRMRFeatureWeights.NewFromFeatureSpace, fs, 5, scheme='MAX' )
+		self.assertRaises( ValueError, fw.Threshold, n_picks + 1 )
+
 if __name__ == '__main__':
 	unittest.main()
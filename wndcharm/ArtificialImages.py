@@ -0,0 +1,274 @@
+"""
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+ Copyright (C) 2015 National Institutes of Health
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+ Written by:  Christopher Coletta (github.com/colettace)
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Deterministic synthetic microscopy-like images in separable classes, the image
+analog of ArtificialFeatureSpace, for exercising feature calculation and the
+whole NewFromDirectory -> NewShuffleSplit pipeline at any scale without real data.
+
+Each image is a mix of up to three kinds of content, each of which depends on
+the image's class:
+    blobs   - bright discs on a dark background (ObjectFeatures, BWlabel);
+              more and smaller discs with increasing class index
+    grating - oriented sinusoidal stripes (Gabor, Radon); the orientation is
+              spread evenly over 180 degrees across the classes
+    noise   - smoothed gaussian noise fields (Haralick, Tamura); the smoothing
+              length grows with class index
+Sample-to-sample variation (blob positions, grating phase, noise, small parameter
+jitter) comes from random_state, so the same seed always gives the same pixels."""
+
+import os
+import numpy as np
+
+content_types = ( 'blobs', 'grating', 'noise' )
+
+#============================================================================
+def _RandomState( random_state ):
+    """Returns a RandomState, from an int seed, a RandomState or True (the global one)."""
+
+    from numpy.random import RandomState
+    if random_state is True:
+        return np.random.mtrand._rand
+    elif type( random_state ) is RandomState:
+        return random_state
+    elif type( random_state ) is int:
+        return RandomState( random_state )
+    raise ValueError( 'Arg random_state must be an instance of np.random.RandomState, an int, or the value True' )
+
+#============================================================================
+def _Blobs( height, width, class_index, n_classes, rs ):
+    """Returns a float image in [0,1] of bright discs with soft edges."""
+
+    area_scale = ( height * width ) / ( 128.0 * 128.0 )
+    num_blobs = max( 1, int( round( ( 4 + 6 * class_index ) * area_scale ) ) )
+    radius = min( height, width ) * ( 0.12 - 0.08 * class_index / max( 1, n_classes - 1 ) )
+    pixels = np.zeros( ( height, width ) )
+    for i in xrange( num_blobs ):
+        r = radius * rs.uniform( 0.8, 1.2 )
+        cy, cx = rs.uniform( 0, height ), rs.uniform( 0, width )
+        brightness = rs.uniform( 0.6, 1.0 )
+        # Only the disc's bounding box is touched
+        top, bottom = max( 0, int( cy - r - 2 ) ), min( height, int( cy + r + 3 ) )
+        left, right = max( 0, int( cx - r - 2 ) ), min( width, int( cx + r + 3 ) )
+        y, x = np.ogrid[ top : bottom, left : right ]
+        dist = np.sqrt( ( y - cy ) ** 2 + ( x - cx ) ** 2 )
+        disc = brightness * np.clip( r + 0.5 - dist, 0, 1 )
+        np.maximum( pixels[ top : bottom, left : right ], disc,
+                out=pixels[ top : bottom, left : right ] )
+    return pixels
+
+#============================================================================
+def _Grating( height, width, class_index, n_classes, rs ):
+    """Returns a float image in [0,1] of sinusoidal stripes with a class-specific orientation."""
+
+    theta = np.pi * ( class_index + rs.uniform( -0.1, 0.1 ) ) / n_classes
+    wavelength = min( height, width ) / 8.0 * rs.uniform( 0.9, 1.1 )
+    phase = rs.uniform( 0, 2 * np.pi )
+    y, x = np.ogrid[ 0 : height, 0 : width ]
+    return 0.5 + 0.5 * np.sin( 2 * np.pi * ( x * np.cos( theta ) + y * np.sin( theta ) ) \
+            / wavelength + phase )
+
+#============================================================================
+def _Noise( height, width, class_index, n_classes, rs ):
+    """Returns a float image in [0,1] of gaussian noise smoothed over a class-specific length."""
+
+    sigma = ( 0.5 + 1.5 * class_index ) * rs.uniform( 0.9, 1.1 )
+    field = rs.normal( 0, 1, ( height, width ) )
+    # Gaussian low pass filter in the frequency domain
+    fy = np.fft.fftfreq( height )[ :, np.newaxis ]
+    fx = np.fft.rfftfreq( width )[ np.newaxis, : ]
+    transfer = np.exp( -2 * ( np.pi * sigma ) ** 2 * ( fy ** 2 + fx ** 2 ) )
+    field = np.fft.irfft2( np.fft.rfft2( field ) * transfer, s=( height, width ) )
+    field -= field.min()
+    field_max = field.max()
+    if field_max > 0:
+        field /= field_max
+    return field
+
+_generators = { 'blobs': _Blobs, 'grating': _Grating, 'noise': _Noise }
+
+#============================================================================
+def CreateArtificialImage( class_index=0, n_classes=2, width=128, height=128, bits=8,
+        color=False, content=content_types, random_state=42 ):
+    """Returns a synthetic image of class class_index as a numpy array of dtype
+    uint8 (bits=8) or uint16 (bits=16), of shape ( height, width ), or ( height, width, 3 )
+    if color is True.
+
+    content - which of the kinds of content in ArtificialImages.content_types to mix.
+        Grayscale images are an equal mix of them. In color images the content is split
+        up over the channels: blobs in red, grating in green, noise in blue (any missing
+        content leaves its channel dark).
+    random_state - int seed, np.random.RandomState, or True to use numpy's global one.
+
+    A dim background and shot noise are added, so no image is entirely flat."""
+
+    if bits not in ( 8, 16 ):
+        raise ValueError( 'Arg bits must be 8 or 16, got {0}'.format( bits ) )
+    if n_classes < 1 or not 0 <= class_index < n_classes:
+        raise ValueError( 'Arg class_index must be in [0, n_classes), got {0} with n_classes={1}'.format(
+            class_index, n_classes ) )
+    if width < 1 or height < 1:
+        raise ValueError( "Can't make an image {0} pixels wide and {1} high".format( width, height ) )
+    content = tuple( content )
+    for kind in content:
+        if kind not in content_types:
+            raise ValueError( 'Unknown image content "{0}", must be one of {1}'.format(
+                kind, ', '.join( content_types ) ) )
+    if not content:
+        raise ValueError( 'Arg content must name at least one kind of image content' )
+    rs = _RandomState( random_state )
+
+    # Always draw the content in the same order so a given seed gives the same pixels
+    # regardless of the order of the content arg.
+    layers = {}
+    for kind in content_types:
+        if kind in content:
+            layers[ kind ] = _generators[ kind ]( height, width, class_index, n_classes, rs )
+
+    if color:
+        pixels = np.zeros( ( height, width, 3 ) )
+        for channel, kind in enumerate( content_types ):
+            if kind in layers:
+                pixels[ :, :, channel ] = layers[ kind ]
+    else:
+        pixels = sum( layers[ kind ] for kind in content_types if kind in layers ) / len( layers )
+
+    max_val = 2 ** bits - 1
+    pixels = 0.05 + 0.9 * pixels
+    # shot noise
+    pixels = rs.poisson( pixels * 500 ) / 500.0
+    pixels = np.clip( np.round( pixels * max_val ), 0, max_val )
+    return pixels.astype( np.uint8 if bits == 8 else np.uint16 )
+
+#============================================================================
+def WriteTIFF( pixels, path ):
+    """Write a 2D (grayscale) or 3D ( height, width, 3 ) (RGB) uint8 or uint16 array to path as
+    an uncompressed, single strip, little endian TIFF, the layout ImageMatrix::OpenImage()
+    reads with libtiff. Doesn't depend on any imaging library."""
+
+    from struct import pack
+    pixels = np.asarray( pixels )
+    if pixels.dtype not in ( np.uint8, np.uint16 ):
+        raise ValueError( 'Can only write uint8 or uint16 pixels to TIFF, got {0}'.format( pixels.dtype ) )
+    if pixels.ndim == 2:
+        spp = 1
+    elif pixels.ndim == 3 and pixels.shape[2] == 3:
+        spp = 3
+    else:
+        raise ValueError( 'Pixels must have shape ( height, width ) or ( height, width, 3 ), got {0}'.format(
+            pixels.shape ) )
+    height, width = pixels.shape[:2]
+    bits = pixels.dtype.itemsize * 8
+    image_data = np.ascontiguousarray( pixels, dtype=pixels.dtype.newbyteorder( '<' ) ).tostring()
+
+    # Layout: header, image data, bits per sample array (RGB only), IFD
+    header_size = 8
+    data_offset = header_size
+    bps_offset = data_offset + len( image_data ) + ( len( image_data ) % 2 )
+    ifd_offset = bps_offset + ( 6 if spp == 3 else 0 )
+    # tag, type (3 = SHORT, 4 = LONG), count, value
+    SHORT, LONG = 3, 4
+    entries = [
+        ( 256, LONG, 1, width ),                        # ImageWidth
+        ( 257, LONG, 1, height ),                       # ImageLength
+        ( 258, SHORT, spp, bps_offset if spp == 3 else bits ), # BitsPerSample
+        ( 259, SHORT, 1, 1 ),                           # Compression: none
+        ( 262, SHORT, 1, 2 if spp == 3 else 1 ),        # Photometric: RGB or BlackIsZero
+        ( 273, LONG, 1, data_offset ),                  # StripOffsets
+        ( 277, SHORT, 1, spp ),                         # SamplesPerPixel
+        ( 278, LONG, 1, height ),                       # RowsPerStrip
+        ( 279, LONG, 1, len( image_data ) ),            # StripByteCounts
+        ( 284, SHORT, 1, 1 ),                           # PlanarConfiguration: contiguous
+    ]
+    with open( path, 'wb' ) as outfile:
+        outfile.write( pack( '<2sHI', 'II', 42, ifd_offset ) )
+        outfile.write( image_data )
+        if len( image_data ) % 2:
+            outfile.write( '\0' )
+        if spp == 3:
+            outfile.write( pack( '<3H', bits, bits, bits ) )
+        outfile.write( pack( '<H', len( entries ) ) )
+        for tag, tag_type, count, value in entries:
+            if tag_type == SHORT and count == 1:
+                outfile.write( pack( '<HHIHH', tag, tag_type, count, value, 0 ) )
+            else:
+                outfile.write( pack( '<HHII', tag, tag_type, count, value ) )
+        outfile.write( pack( '<I', 0 ) )
+    return path
+
+#============================================================================
+def NewImageMatrix( pixels ):
+    """Returns a PyImageMatrix with the pixels made by CreateArtificialImage().
+    Color images are passed through a temporary TIFF file, so they get the same
+    color planes as images read from disk."""
+
+    from .PyImageMatrix import PyImageMatrix
+    pixels = np.asarray( pixels )
+    bits = pixels.dtype.itemsize * 8
+    im = PyImageMatrix()
+    if pixels.ndim == 2:
+        height, width = pixels.shape
+        im.allocate( width, height )
+        im.as_ndarray()[:] = pixels
+        im.bits = bits
+        im.finish()
+        return im
+
+    from tempfile import mkstemp
+    fd, path = mkstemp( suffix='.tif' )
+    os.close( fd )
+    try:
+        WriteTIFF( pixels, path )
+        if 1 != im.OpenImage( path, 0, None, 0, 0 ):
+            raise ValueError( 'Could not build an ImageMatrix from the artificial color image' )
+    finally:
+        os.remove( path )
+    return im
+
+#============================================================================
+def CreateArtificialImageDirectory( top_level_dir, n_classes=2, n_samples_per_class=10,
+        width=128, height=128, bits=8, color=False, content=content_types, random_state=42 ):
+    """Writes n_samples_per_class TIFFs made by CreateArtificialImage() for each of n_classes
+    into one subdirectory per class, "class00", "class01", etc., of top_level_dir (created
+    if need be), the layout FeatureSpace.NewFromDirectory() expects.
+
+    Each image's seed is drawn up front from random_state, so any one image can be
+    regenerated on its own. Returns the list of lists of file paths, one list per class."""
+
+    rs = _RandomState( random_state )
+    seeds = rs.randint( 0, 2**31 - 1, size=( n_classes, n_samples_per_class ) )
+    paths = []
+    for class_index in xrange( n_classes ):
+        class_dir = os.path.join( top_level_dir, 'class{0:02d}'.format( class_index ) )
+        if not os.path.exists( class_dir ):
+            os.makedirs( class_dir )
+        class_paths = []
+        for sample_index in xrange( n_samples_per_class ):
+            pixels = CreateArtificialImage( class_index, n_classes, width, height, bits, color,
+                    content, int( seeds[ class_index, sample_index ] ) )
+            path = os.path.join( class_dir, 'class{0:02d}_sample{1:04d}.tif'.format(
+                class_index, sample_index ) )
+            class_paths.append( WriteTIFF( pixels, path ) )
+        paths.append( class_paths )
+    return paths
@@ -23,8 +23,10 @@
  Written by:  Christopher Coletta (github.com/colettace)
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~"""
 
+import weakref
 import numpy as np
-from .utils import output_railroad_switch, normalize_by_columns
+from .utils import output_railroad_switch, Normalizer
+from .instrumentation import instrumented, OutputStream
 from .FeatureVector import FeatureVector
 
 def CheckIfClassNamesAreInterpolatable( class_names ):
@@ -44,6 +46,53 @@ def CheckIfClassNamesAreInterpolatable( class_names ):
             break
     return interp_coeffs
 
+def _ComposeIndices( outer, inner, length ):
+    """Returns index array that selects with inner (int index array, slice or None
+    for everything) from the length items already selected by outer (int index
+    array, or None for all items)."""
+
+    if inner is None:
+        return outer
+    if isinstance( inner, slice ):
+        inner = np.arange( length )[ inner ]
+    else:
+        inner = np.asarray( inner, dtype=np.intp )
+    if outer is None:
+        return inner
+    return outer[ inner ]
+
+#: Weak references to the FeatureSpace views that are alive, by id( view )
+_live_views = {}
+
+def _RegisterView( view ):
+    """Keep track of the FeatureSpace view for as long as it's alive."""
+
+    key = id( view )
+    def _Forget( ref ):
+        if _live_views.get( key ) is ref:
+            del _live_views[ key ]
+    _live_views[ key ] = weakref.ref( view, _Forget )
+
+def _SharedWithViews( matrix ):
+    """True if the feature matrix is the source of any FeatureSpace view that's alive
+    and hasn't been materialized."""
+
+    for ref in _live_views.values():
+        view = ref()
+        if view is not None and view._view_source is matrix:
+            return True
+    return False
+
+def _StableArgsort( keys ):
+    """Returns int index array that stably sorts the list keys, i.e., the same order as
+    sorted( range( len( keys ) ), key=keys.__getitem__ )."""
+
+    key_array = np.array( keys )
+    if key_array.ndim == 1 and key_array.dtype.kind in 'SUbif':
+        return np.argsort( key_array, kind='mergesort' )
+    # e.g., None's mixed in with labels/values, let Python compare them
+    return np.array( sorted( xrange( len( keys ) ), key=keys.__getitem__ ), dtype=np.intp )
+
 #############################################################################
 # class definition of FeatureSpace
 #############################################################################
@@ -65,14 +114,17 @@ class FeatureSpace( object ):
 
     # Don't bother copying these "view" members which are rebuilt by self._RebuildViews()
     # Used for Derive, pickling operations, etc.
-    convenience_view_members = [ 'data_list', 'sample_names', 'sample_group_ids',\
+    convenience_view_members = [ '_data_list', 'sample_names', 'sample_group_ids',\
             'sample_sequence_ids', 'ground_truth_values', 'ground_truth_labels' ]
 
     #==============================================================
     def __init__( self, name=None, source_filepath=None, num_samples=None,
                   num_samples_per_group=1, feature_names=None,
-                  num_features=None, discrete=True, feature_set_version=None ):
-        """FeatureSpace constructor"""
+                  num_features=None, discrete=True, feature_set_version=None, dtype='double' ):
+        """FeatureSpace constructor
+
+        dtype - of the feature matrix, 'double' by default. 'float32' halves the memory
+            taken by the features, see AsType()."""
         
         # Let F = # features for a given 5D ROI.
         # Let S = total # samples (rows) in a feature set.
@@ -95,6 +147,14 @@ class FeatureSpace( object ):
         #: maxima/minima to transform feature space to normalized interval.
         self.normalized_against = None
 
+        #: If this FeatureSpace is a view (see SampleReduce(), FeatureReduce(), Split()),
+        #: the feature matrix of the parent FeatureSpace, and the indices of the rows and
+        #: columns selected from it (None for all), otherwise all None.
+        #: Only the indices are kept until the data_matrix is asked for.
+        self._view_source = None
+        self._view_rows = None
+        self._view_columns = None
+
         #: type: numpy.ndarray
         #: 2D numpy matrix with shape=(F,S) that contains all features.
         self.data_matrix = None
@@ -194,7 +254,7 @@ class FeatureSpace( object ):
         ### Now initialize array-like members if possible:
         if self.num_samples and self.num_features:
             self.shape = ( self.num_samples, self.num_features )
-            self.data_matrix = np.empty( self.shape, dtype='double' )
+            self.data_matrix = np.empty( self.shape, dtype=dtype )
 
         if self.num_samples:
             self._contiguous_sample_names = [None] * self.num_samples
@@ -206,6 +266,118 @@ class FeatureSpace( object ):
         if self.num_features and not self.feature_names:
             self.feature_names = [None] * self.num_features
 
+    #==============================================================
+    def _GetDataMatrix( self ):
+        if self._data_matrix is None and self._view_source is not None:
+            self.Materialize()
+        return self._data_matrix
+
+    def _SetDataMatrix( self, data_matrix ):
+        # New data makes a view concrete
+        self._data_matrix = data_matrix
+        self._view_source = self._view_rows = self._view_columns = None
+
+    data_matrix = property( _GetDataMatrix, _SetDataMatrix )
+
+    def _GetDataList( self ):
+        if self._data_list is None and self._view_source is not None:
+            self.Materialize()
+        return self._data_list
+
+    def _SetDataList( self, data_list ):
+        self._data_list = data_list
+
+    data_list = property( _GetDataList, _SetDataList )
+
+    @property
+    def is_view( self ):
+        """True if this FeatureSpace's features are still only row and column indices into
+        the feature matrix of the FeatureSpace it was reduced from."""
+        return self._view_source is not None
+
+    @property
+    def dtype( self ):
+        """numpy dtype of the feature values, without materializing a view."""
+        source = self._view_source if self._view_source is not None else self._data_matrix
+        return source.dtype if source is not None else None
+
+    #==============================================================
+    def AsType( self, dtype, inplace=False ):
+        """Store the features as numpy dtype, e.g., 'float32' to halve the memory they take,
+        or 'double' to go back. Feature values in sig files only have 6 significant digits,
+        so float32 holds them without loss.
+
+        Normalization, feature weights and the classifiers take float32 features and do
+        their sums in double, so their results agree with those from double features
+        to within float32 rounding of the feature values."""
+
+        dtype = np.dtype( dtype )
+        if dtype.kind != 'f':
+            raise ValueError( 'Arg "dtype" must be a floating point type, got {0}'.format( dtype ) )
+
+        newdata = {}
+        if self._view_source is not None:
+            # Gathered from the parent, so it's already a private copy
+            newdata[ 'data_matrix' ] = self.GetFeatureMatrix().astype( dtype, copy=False )
+        elif self._data_matrix.dtype != dtype:
+            newdata[ 'data_matrix' ] = self._data_matrix.astype( dtype )
+
+        if inplace:
+            retval = self.Update( **newdata )._RebuildViews( recalculate_class_metadata=False )
+        else:
+            retval = self.Derive( **newdata )
+        return retval
+
+    #==============================================================
+    def Materialize( self ):
+        """If this FeatureSpace is a view, gather its features out of the parent's feature
+        matrix into a contiguous data_matrix of its own, and drop the reference
+        to the parent's. Happens automatically when data_matrix or data_list is accessed."""
+
+        if self._view_source is not None:
+            self.data_matrix = self.GetFeatureMatrix()
+            self._RebuildViews( recalculate_class_metadata=False )
+        return self
+
+    #==============================================================
+    def GetFeatureMatrix( self, rows=None, columns=None ):
+        """Returns a new contiguous matrix containing the given rows and columns (int index
+        arrays or slices, None for all) of this FeatureSpace's features. Views gather these
+        straight out of their parent's feature matrix without materializing themselves."""
+
+        rows = _ComposeIndices( self._view_rows, rows, self.num_samples )
+        columns = _ComposeIndices( self._view_columns, columns, self.num_features )
+        if self._view_source is not None:
+            source = self._view_source
+        else:
+            source = self._data_matrix
+
+        if rows is None and columns is None:
+            return np.copy( source )
+        if columns is None:
+            return source.take( rows, axis=0 )
+        if rows is None:
+            return source.take( columns, axis=1 )
+        return source[ np.ix_( rows, columns ) ]
+
+    #==============================================================
+    def _ViewKwargs( self, rows=None, columns=None ):
+        """Returns the kwargs for Derive() or Update() that make a view selecting the given
+        rows and columns (int index arrays) of this FeatureSpace's features."""
+
+        newdata = {}
+        newdata[ '_data_matrix' ] = None
+        if self._view_source is not None:
+            newdata[ '_view_source' ] = self._view_source
+        else:
+            # Views rely on the parent's features not changing underneath them,
+            # e.g., Normalize( inplace=True ) makes a copy while they're alive.
+            newdata[ '_view_source' ] = self._data_matrix
+        newdata[ '_view_rows' ] = _ComposeIndices( self._view_rows, rows, self.num_samples )
+        newdata[ '_view_columns' ] = \
+                _ComposeIndices( self._view_columns, columns, self.num_features )
+        return newdata
+
     #==============================================================
     def Derive( self, **kwargs ):
         """Make a copy of this FeatureSpace, except members passed as kwargs"""
@@ -216,7 +388,7 @@ class FeatureSpace( object ):
         new_obj_namespace = vars( new_obj )
 
         # Are all keys in kwargs valid instance attribute names?
-        invalid_kwargs = set( kwargs.keys() ) - set( self_namespace.keys() )
+        invalid_kwargs = set( kwargs.keys() ) - set( self_namespace.keys() ) - set( ['data_matrix'] )
         if len( invalid_kwargs ) > 0:
             raise ValueError( "Invalid keyword arg(s) to Derive: {0}".format( invalid_kwargs ) )
 
@@ -227,8 +399,17 @@ class FeatureSpace( object ):
                 continue
             if key in kwargs:
                 new_obj_namespace[key] = kwargs[key]
+            elif key == '_data_matrix' and 'data_matrix' in kwargs:
+                continue
+            elif key == '_view_source':
+                # Views share their parent's feature matrix
+                new_obj_namespace[key] = self._view_source
             else:
                 new_obj_namespace[key] = deepcopy( self_namespace[key] )
+        if 'data_matrix' in kwargs:
+            new_obj.data_matrix = kwargs['data_matrix']
+        if new_obj._view_source is not None:
+            _RegisterView( new_obj )
         new_obj._RebuildViews()
         return new_obj
 
@@ -238,6 +419,9 @@ class FeatureSpace( object ):
 
         # FIXME: Should we call self._RebuildViews() at the end every time?
         self_namespace = vars( self )
+        if 'data_matrix' in kwargs:
+            kwargs = kwargs.copy()
+            self.data_matrix = kwargs.pop( 'data_matrix' )
         for key, val in kwargs.iteritems():
             if key in self_namespace:
                 #if self_namespace[ key ] != None and self_namespace[ key ] != val:
@@ -247,6 +431,8 @@ class FeatureSpace( object ):
             else:
                 raise AttributeError( 'No instance variable named "{0}" in class {1}'.format(
                   key, self.__class__.__name__ ) )
+        if self._view_source is not None:
+            _RegisterView( self )
         return self
 
     #==============================================================
@@ -260,19 +446,19 @@ class FeatureSpace( object ):
         """Prints out basic attributes about this training set, including name, path to
         source data, number and composition of image classes, number of features, etc."""
 
-        print 'Summary of {0} "{1}":'.format( self.__class__.__name__ , self.name )
+        print >> OutputStream(), 'Summary of {0} "{1}":'.format( self.__class__.__name__ , self.name )
         if self.name != self.source_filepath:
-            print 'source: "{0}"'.format( self.source_filepath )
-        print 'Total samples: {0} ({1} groups, {2} samples/group)'.format( self.num_samples,
+            print >> OutputStream(), 'source: "{0}"'.format( self.source_filepath )
+        print >> OutputStream(), 'Total samples: {0} ({1} groups, {2} samples/group)'.format( self.num_samples,
           len( set( self._contiguous_sample_group_ids ) ), self.num_samples_per_group )
-        print 'Total num features: {0}'.format( len( self.feature_names ) )
-        print 'Feature Set Version: {0}'.format( self.feature_set_version )
+        print >> OutputStream(), 'Total num features: {0}'.format( len( self.feature_names ) )
+        print >> OutputStream(), 'Feature Set Version: {0}'.format( self.feature_set_version )
 
         if self.discrete:
             rpt_str = '\tClass {0} "{1}": {2} samples ({3} groups)'
             if self.class_names is not None:
                 for i, class_name in enumerate( self.class_names ):
-                    print rpt_str.format( i, class_name, len( self.sample_names[i] ),
+                    print >> OutputStream(), rpt_str.format( i, class_name, len( self.sample_names[i] ),
                             len( set( self.sample_group_ids[i] ) ) )
 
         if verbose: # verbose implies print info for each sample
@@ -288,10 +474,10 @@ class FeatureSpace( object ):
                 header_str = "SAMP NAME\tGROUP INDEX\tTILE INDEX\tGROUND TRUTH\n===================================================================="
                 format_str = "{0}\t{1:03d}\t{2:02d}\t{3}"
 
-            print header_str
+            print >> OutputStream(), header_str
             for line_item in sample_metadata:
-                print format_str.format( *line_item )
-        print ""
+                print >> OutputStream(), format_str.format( *line_item )
+        print >> OutputStream(), ""
 
     #==============================================================
     def __repr__( self ):
@@ -360,13 +546,13 @@ class FeatureSpace( object ):
         if not filename.endswith( ".fit.pickled" ):
             raise ValueError( 'Not a pickled FeatureSpace file: {0}'.format( pathname ) )
 
-        print "Loading Training Set from pickled file {0}".format( pathname )
+        print >> OutputStream(), "Loading Training Set from pickled file {0}".format( pathname )
         the_training_set = None
         with open( pathname, "rb" ) as pkled_in:
             the_training_set = cls( pickle.load( pkled_in ) )
 
         # re-generate data_list views from data_matrix and class_sizes
-        if ("data_list" in the_training_set.__dict__):
+        if ("_data_list" in the_training_set.__dict__):
             the_training_set.data_list = [0] * the_training_set.num_classes
             sample_row = 0
             for i in range( the_training_set.num_classes ):
@@ -414,10 +600,11 @@ class FeatureSpace( object ):
                     outfile_pathname = self.source_filepath + ".fit.pickled"    
 
         if os.path.exists( outfile_pathname ):
-            print "Overwriting {0}".format( outfile_pathname )
+            print >> OutputStream(), "Overwriting {0}".format( outfile_pathname )
         else:
-            print "Writing {0}".format( outfile_pathname )
+            print >> OutputStream(), "Writing {0}".format( outfile_pathname )
 
+        self.Materialize()
         with open( outfile_pathname, 'wb') as outfile:
             pickle.dump( self.__dict__, outfile, pickle.HIGHEST_PROTOCOL )
 
@@ -443,13 +630,16 @@ class FeatureSpace( object ):
 
         if self.discrete == True:
             if recalculate_class_metadata:
-                seen = set()
-                seen_add = seen.add
-                self.class_names = [ x for x in self._contiguous_ground_truth_labels \
-                        if not (x in seen or seen_add(x) ) ]
+                # Class names in order of first appearance, with how many samples have each
+                label_array = np.array( self._contiguous_ground_truth_labels )
+                if label_array.ndim != 1:
+                    label_array = np.array( self._contiguous_ground_truth_labels, dtype=object )
+                unique_labels, first_rows, counts = np.unique( label_array,
+                        return_index=True, return_counts=True )
+                class_order = np.argsort( first_rows )
+                self.class_names = unique_labels[ class_order ].tolist()
                 self.num_classes = len( self.class_names )
-                self.class_sizes = [ self._contiguous_ground_truth_labels.count( label ) \
-                      for label in self.class_names ]
+                self.class_sizes = counts[ class_order ].tolist()
                    # The labels could all be None's
                 if self.class_names == [None]:
                     self.class_names = ["UNKNOWN"]
@@ -458,7 +648,11 @@ class FeatureSpace( object ):
 
             # Remember, for class-based classification problems, we construct per-class
             # views into the contiguous feature space/metadata that results in lists of lists
-            self.data_list = [None] * self.num_classes
+            # FeatureSpace views build their data_list when they're materialized
+            if self._view_source is None:
+                self.data_list = [None] * self.num_classes
+            else:
+                self.data_list = None
             self.sample_names = [None] * self.num_classes
             self.sample_group_ids = [None] * self.num_classes
             self.sample_sequence_ids = [None] * self.num_classes
@@ -470,8 +664,9 @@ class FeatureSpace( object ):
             class_bndry_index = 0
             for class_index in xrange( self.num_classes ):
                 n_class_samples = self.class_sizes[ class_index ]
-                self.data_list[ class_index ] = \
-                    self.data_matrix[ class_bndry_index : class_bndry_index + n_class_samples ]
+                if self._view_source is None:
+                    self.data_list[ class_index ] = \
+                        self.data_matrix[ class_bndry_index : class_bndry_index + n_class_samples ]
                 self.sample_names[ class_index ] = \
                     self._contiguous_sample_names[ class_bndry_index : class_bndry_index + n_class_samples ]
                 self.sample_group_ids[ class_index ] = \
@@ -487,7 +682,7 @@ class FeatureSpace( object ):
 
                 class_bndry_index += n_class_samples
         else:
-            self.data_list = self.data_matrix
+            self.data_list = self._data_matrix
             self.sample_names = self._contiguous_sample_names
             self.sample_group_ids = self._contiguous_sample_group_ids
             self.sample_sequence_ids = self._contiguous_sample_sequence_ids
@@ -500,27 +695,27 @@ class FeatureSpace( object ):
     def SortSamplesByGroundTruth( self, rebuild_views=True, inplace=False, quiet=False ):
         """Sort sample rows in self to be in ground truth label/value order."""
 
-        sample_data = zip( self._contiguous_ground_truth_labels,
-            self._contiguous_ground_truth_values, self.data_matrix,
-            self._contiguous_sample_names, self._contiguous_sample_sequence_ids )
-
-        from operator import itemgetter
         if self.discrete:
             # sort by the labels
-            sortfunc = itemgetter(0)
+            sort_keys = self._contiguous_ground_truth_labels
         else:
             # sort by the numeric values
-            sortfunc = itemgetter(1)
+            sort_keys = self._contiguous_ground_truth_values
 
-        # These are all tuples:
-        a, b, c, d, e = zip( *sorted( sample_data, key=sortfunc ) )
+        # Stable sort of the row indices, then permute rows only if order changed.
+        order = _StableArgsort( sort_keys )
 
         newdata = {}
-        newdata['_contiguous_ground_truth_labels'] = list(a)
-        newdata['_contiguous_ground_truth_values'] = list(b)
-        newdata['data_matrix'] = np.array(c)
-        newdata['_contiguous_sample_names'] = list(d)
-        newdata['_contiguous_sample_sequence_ids'] = list(e)
+        for member in ( '_contiguous_ground_truth_labels', '_contiguous_ground_truth_values',
+                '_contiguous_sample_names', '_contiguous_sample_sequence_ids' ):
+            values = getattr( self, member )
+            newdata[ member ] = [ values[i] for i in order ]
+
+        if np.any( order != np.arange( len( order ) ) ):
+            if self._view_source is not None:
+                newdata.update( self._ViewKwargs( rows=order ) )
+            else:
+                newdata['data_matrix'] = self._data_matrix.take( order, axis=0 )
 
         # Preserve new sort order by assigning new sample group ids:
         if self.num_samples_per_group != 1:
@@ -549,7 +744,10 @@ class FeatureSpace( object ):
         """By convention, the range of feature values in the WND-CHARM algorithm are
         normalized on the interval [0,100]. Normalizing is useful in making the variation
         of features human readable. Normalized samples are only comprable if they've been
-        normalized against the same feature maxima/minima."""
+        normalized against the same feature maxima/minima.
+
+        If inplace, the feature matrix is overwritten rather than copied, unless it is
+        shared with FeatureSpace views."""
 
         if self.normalized_against:
             # I've already been normalized, and you want to normalize me again?
@@ -560,8 +758,7 @@ class FeatureSpace( object ):
 
         if not reference_features:
             # Recalculate my feature space using my own maxima/minima
-            mins = None
-            maxs = None
+            normalizer = None
             newdata['normalized_against'] = 'self'
         else:
             # Recalculate my feature space according to maxima/minima in reference_features
@@ -579,13 +776,23 @@ class FeatureSpace( object ):
             if not reference_features.normalized_against:
                 reference_features.Normalize( quiet=quiet )
 
-            mins = reference_features.feature_minima
-            maxs = reference_features.feature_maxima
+            normalizer = reference_features.GetNormalizer()
             newdata['normalized_against'] = reference_features
 
-        newdata['data_matrix'] = np.copy( self.data_matrix )
-        newdata['feature_minima'], newdata['feature_maxima'] = \
-            normalize_by_columns( newdata['data_matrix'], mins, maxs )
+        if self._view_source is not None:
+            # Gathered from the parent, so it's already a private copy
+            data_matrix = out = self.GetFeatureMatrix()
+        elif inplace and not _SharedWithViews( self._data_matrix ):
+            data_matrix = out = self._data_matrix
+        else:
+            # Copied chunk by chunk as it's normalized
+            data_matrix, out = self._data_matrix, None
+
+        if normalizer is None:
+            normalizer = Normalizer.NewFromMatrix( data_matrix, self.feature_names )
+        newdata['data_matrix'] = normalizer.Apply( data_matrix, out=out )
+        newdata['feature_minima'] = normalizer.feature_minima
+        newdata['feature_maxima'] = normalizer.feature_maxima
 
         if inplace:
             retval = self.Update( **newdata )._RebuildViews( recalculate_class_metadata=False)
@@ -594,20 +801,31 @@ class FeatureSpace( object ):
 
         if not quiet:
             if not reference_features:
-                print 'NORMALIZED FEATURES AGAINST SELF FOR FEATURE SPACE:', str( retval )
+                print >> OutputStream(), 'NORMALIZED FEATURES AGAINST SELF FOR FEATURE SPACE:', str( retval )
             else:
-                print 'NORMALIZED FEATURES AGAINST {0} FOR FEATURE SPACE {1}'.format(
+                print >> OutputStream(), 'NORMALIZED FEATURES AGAINST {0} FOR FEATURE SPACE {1}'.format(
                     reference_features, retval )
         return retval
 
+    #==============================================================
+    def GetNormalizer( self ):
+        """Returns a Normalizer with the feature minima/maxima this FeatureSpace was
+        normalized with, which transforms other samples into the same normalized space."""
+
+        if self.feature_minima is None or self.feature_maxima is None:
+            raise ValueError( 'FeatureSpace "{0}" has no feature minima/maxima, call Normalize() first.'.format( self.name ) )
+        return Normalizer( self.feature_names[:], self.feature_minima, self.feature_maxima )
+
     #==============================================================
     @classmethod
+    @instrumented( 'FeatureSpace.NewFromFitFile' )
     def NewFromFitFile( cls, pathname, discrete=True, quiet=False,
-            global_sampling_options=None, **kwargs ):
+            global_sampling_options=None, dtype='double', **kwargs ):
         """Helper function which reads in a c-chrm fit file.
 
         tile_options - an integer N -> NxN tile scheme, or a tuple (N,M) -> NxM tile scheme
-        discrete_data - if false, try to interpret classes as continuous variable."""
+        discrete_data - if false, try to interpret classes as continuous variable.
+        dtype - of the feature matrix, e.g., 'float32' to halve its memory, see AsType()."""
 
         if not global_sampling_options:
             global_sampling_options = FeatureVector( **kwargs )
@@ -663,7 +881,7 @@ class FeatureSpace( object ):
                 num_samples = int( line )
                 new_fs.num_samples = num_samples
                 new_fs.shape = ( num_samples, num_features )
-                new_fs.data_matrix = np.empty( new_fs.shape, dtype='double' )
+                new_fs.data_matrix = np.empty( new_fs.shape, dtype=dtype )
                 new_fs._contiguous_sample_names = [None] * num_samples
 
             elif line_num < ( num_features + 3 ):
@@ -737,7 +955,7 @@ class FeatureSpace( object ):
         new_fs._RebuildViews( recalculate_class_metadata=False )
 
         if not quiet:
-            print "LOADED FEATURE SPACE FROM WND-CHARM .fit FILE {0}: {1}".format(
+            print >> OutputStream(), "LOADED FEATURE SPACE FROM WND-CHARM .fit FILE {0}: {1}".format(
                     pathname, new_fs )
         return new_fs
 
@@ -805,7 +1023,8 @@ class FeatureSpace( object ):
     #==============================================================
     @classmethod
     def NewFromDirectory( cls, top_level_dir_path, discrete=True, num_samples_per_group=1,
-      quiet=False, global_sampling_options=None, write_sig_files_to_disk=True, **kwargs ):
+      quiet=False, global_sampling_options=None, write_sig_files_to_disk=True, dtype='double',
+      **kwargs ):
         """@brief Equivalent to the "wndchrm train" command from the C++ implementation by Shamir.
         Read the the given directory and parse its structure for class membership.
         Populate a list of FeatureVector instances, then call helper functions to
@@ -815,7 +1034,7 @@ class FeatureSpace( object ):
             global_sampling_options = FeatureVector( **kwargs )
 
         if not quiet:
-            print "Creating Training Set from directories of images {0}".format( top_level_dir_path )
+            print >> OutputStream(), "Creating Training Set from directories of images {0}".format( top_level_dir_path )
 
         samples = []
         tile_num_rows = global_sampling_options.tile_num_rows
@@ -875,16 +1094,16 @@ class FeatureSpace( object ):
                source_filepath=top_level_dir_path, num_samples=None,
                num_samples_per_group=(tile_num_rows*tile_num_cols),
                num_features=global_sampling_options.num_features,
-               discrete=discrete, quiet=True )
+               discrete=discrete, quiet=True, dtype=dtype )
 
         if not quiet:
-            print "NEW FEATURE SPACE FROM DIRECTORY:", str( retval )
+            print >> OutputStream(), "NEW FEATURE SPACE FROM DIRECTORY:", str( retval )
         return retval
 
     #==============================================================
     @classmethod
     def NewFromFileOfFiles( cls, pathname, discrete=True, quiet=False,
-             global_sampling_options=None, write_sig_files_to_disk=True, **kwargs ):
+             global_sampling_options=None, write_sig_files_to_disk=True, dtype='double', **kwargs ):
         """Create a FeatureSpace from a file of files.
 
         The original FOF format (pre-2015) was just two columns, a path and a ground truth
@@ -1132,17 +1351,18 @@ class FeatureSpace( object ):
         retval = cls.NewFromListOfFeatureVectors( samples, name=file_name, source_filepath=pathname,
                num_samples=len(samp_name_to_samp_group_id_dict)*num_samples_per_group,
                num_samples_per_group=num_samples_per_group, num_features=num_features,
-               feature_set_version=feature_set_version, discrete=discrete, quiet=True )
+               feature_set_version=feature_set_version, discrete=discrete, quiet=True,
+               dtype=dtype )
 
         if not quiet:
-            print "NEW FEATURE SPACE FROM FILE LIST:", retval
+            print >> OutputStream(), "NEW FEATURE SPACE FROM FILE LIST:", retval
         return retval
 
     #==============================================================
     @classmethod
     def NewFromListOfFeatureVectors( cls, feature_vectors_list, num_samples, num_features,
         name=None, source_filepath=None, num_samples_per_group=1, feature_set_version=None,
-        discrete=True, quiet=True ):
+        discrete=True, quiet=True, dtype='double' ):
         """Input is list of FeatureVectors WHOSE FEATURES HAVE ALREADY BEEN CALCULATED."""
 
         new_fs = cls( name=name,
@@ -1152,7 +1372,8 @@ class FeatureSpace( object ):
                       feature_names=None,
                       num_features=num_features,
                       discrete=discrete,
-                      feature_set_version=feature_set_version )
+                      feature_set_version=feature_set_version,
+                      dtype=dtype )
 
         # For compound samples, e.g., multichannel, need to know the column offsets.
         # key: col index, value: index in data_matrix demarking rightmost feature for this column
@@ -1219,12 +1440,12 @@ class FeatureSpace( object ):
         new_fs._RebuildViews()
 
         if not quiet:
-            print "NEW FEATURE SPACE FROM LIST OF FEATURE VECTORS:", str( new_fs )
+            print >> OutputStream(), "NEW FEATURE SPACE FROM LIST OF FEATURE VECTORS:", str( new_fs )
 
         return new_fs
 
     #==============================================================
-    def FeatureReduce( self, requested_features, inplace=False, quiet=False  ):
+    def FeatureReduce( self, requested_features, inplace=False, view=False, quiet=False  ):
         """Returns a new FeatureSpace that contains a subset of the data by dropping
         features (columns), and/or rearranging columns.
 
@@ -1232,6 +1453,10 @@ class FeatureSpace( object ):
             (FeatureVector/FeatureSpace/FeatureWeights) or an iterable containing 
             strings that are feature names.
 
+        view := if True, the returned FeatureSpace only records which columns of self's
+            features it contains, and gathers them from self's feature matrix when its
+            data_matrix is first accessed. See Materialize().
+
         Implementation detail: compares input "requested_features" to self.feature_names,
         and "requested_features" becomes the self.feature_names of the returned FeatureSpace."""
 
@@ -1266,23 +1491,14 @@ class FeatureSpace( object ):
         newdata[ 'name' ] = self.name + "(feature reduced)"
         newdata[ 'feature_names' ] = requested_features
         newdata[ 'num_features' ] = num_features
-        data_matrix = np.empty( shape , dtype='double' )
-
-        # Columnwise operations in Numpy are a pig:
-        # %timeit thing = shuffle_my_cols[:,desired_cols]
-        # 1 loops, best of 3: 3.5 s per loop
-        #
-        # Yikes. Slightly faster to do the copying yourself:
-        # %%timeit
-        # thing = np.empty( (numrows, numcols/2))
-        # for new_index, old_index in enumerate( desired_cols ):
-        #    thing[ :, new_index ] = shuffle_my_cols[ :, old_index ]
-        # 1 loops, best of 3: 2.25 s per loop
-
-        new_order = [ self.feature_names.index( name ) for name in requested_features ]
-        for new_index, old_index in enumerate( new_order ):
-            data_matrix[ :, new_index ] = self.data_matrix[ :, old_index ]
-        newdata[ 'data_matrix' ] = data_matrix
+
+        feature_index = dict( ( name, i ) for i, name in enumerate( self.feature_names ) )
+        new_order = np.array( [ feature_index[ name ] for name in requested_features ],
+                dtype=np.intp )
+        if view:
+            newdata.update( self._ViewKwargs( columns=new_order ) )
+        else:
+            newdata[ 'data_matrix' ] = self.GetFeatureMatrix( columns=new_order )
 
         if self.feature_maxima is not None:
             newdata[ 'feature_maxima' ] = self.feature_maxima[ new_order ]
@@ -1300,13 +1516,13 @@ class FeatureSpace( object ):
             newfs = self.Derive( **newdata )
 
         if not quiet:
-            print "FEATURE-REDUCED FEATURE SPACE (orig len {0}) {1}:'".format(
+            print >> OutputStream(), "FEATURE-REDUCED FEATURE SPACE (orig len {0}) {1}:'".format(
                     orig_len, newfs )
         return newfs
 
     #==============================================================
     def SampleReduce( self, leave_in_sample_group_ids=None, leave_out_sample_group_ids=None,
-        inplace=False, override=False, quiet=False ):
+        inplace=False, override=False, view=False, quiet=False ):
         """Returns a new FeatureSpace that contains a subset of the data by dropping
         samples (rows), and/or rearranging rows.
 
@@ -1316,6 +1532,10 @@ class FeatureSpace( object ):
         leave_out_sample_group_ids := a list containing sample group ids
             that should be left OUT
 
+        view := if True, the returned FeatureSpace only records which rows of self's
+            features it contains, and gathers them from self's feature matrix when its
+            data_matrix is first accessed. See Materialize().
+
         Returns a near-deep copy of self including only the sample groups specified in the list.
         If no tiles, sample group reduces to just sample index."""
 
@@ -1369,11 +1589,6 @@ class FeatureSpace( object ):
         new_sg_count          = len( leave_in_sample_group_ids )
         new_samp_count        = new_sg_count * self.num_samples_per_group
         new_shape             = ( new_samp_count, self.num_features )
-        new_mat               = np.empty( new_shape, dtype='double' )
-        new_samp_names        = [None] * new_samp_count
-        new_samp_sequence_ids = [None] * new_samp_count
-        new_gt_values         = [None] * new_samp_count
-        new_gt_labels         = [None] * new_samp_count
 
         # Alias:
         group_len = self.num_samples_per_group
@@ -1381,19 +1596,17 @@ class FeatureSpace( object ):
         new_sg_ids = [ sgid for sgid in leave_in_sample_group_ids \
                 for j in xrange( group_len ) ]
 
-        for target_row in xrange( 0, new_samp_count, group_len ):
-            sgid = new_sg_ids[ target_row ]
-            source_row = self._contiguous_sample_group_ids.index( sgid )
-            np.copyto( new_mat[ target_row : target_row + group_len ],
-                    self.data_matrix[ source_row : source_row + group_len ] )
-            new_samp_names[ target_row : target_row + group_len ] = \
-               self._contiguous_sample_names[ source_row : source_row + group_len ]
-            new_samp_sequence_ids[ target_row : target_row + group_len ] = \
-               self._contiguous_sample_sequence_ids[ source_row : source_row + group_len ]
-            new_gt_values[ target_row : target_row + group_len ] = \
-               self._contiguous_ground_truth_values[ source_row : source_row + group_len ]
-            new_gt_labels[ target_row : target_row + group_len ] = \
-               self._contiguous_ground_truth_labels[ source_row : source_row + group_len ]
+        # Rows of a sample group are contiguous, starting at the group's first row
+        first_rows = {}
+        for row, sgid in enumerate( self._contiguous_sample_group_ids ):
+            first_rows.setdefault( sgid, row )
+        rows = np.array( [ first_rows[ sgid ] + j for sgid in leave_in_sample_group_ids \
+                for j in xrange( group_len ) ], dtype=np.intp )
+
+        new_samp_names = [ self._contiguous_sample_names[i] for i in rows ]
+        new_samp_sequence_ids = [ self._contiguous_sample_sequence_ids[i] for i in rows ]
+        new_gt_values = [ self._contiguous_ground_truth_values[i] for i in rows ]
+        new_gt_labels = [ self._contiguous_ground_truth_labels[i] for i in rows ]
 
         newdata = {}
         if self.source_filepath:
@@ -1401,7 +1614,10 @@ class FeatureSpace( object ):
         newdata[ 'name' ] = self.name + " (subset)"
         newdata[ 'num_samples' ] = new_samp_count
         newdata[ 'shape' ] = new_shape
-        newdata[ 'data_matrix' ] = new_mat
+        if view:
+            newdata.update( self._ViewKwargs( rows=rows ) )
+        else:
+            newdata[ 'data_matrix' ] = self.GetFeatureMatrix( rows=rows )
         newdata[ '_contiguous_sample_names' ] = new_samp_names
         newdata[ '_contiguous_sample_group_ids' ] = new_sg_ids
         newdata[ '_contiguous_sample_sequence_ids' ] = new_samp_sequence_ids
@@ -1416,12 +1632,12 @@ class FeatureSpace( object ):
         retval.SortSamplesByGroundTruth( rebuild_views=True, inplace=True )
 
         if not quiet:
-            print "SAMPLE REDUCED FEATURE SPACE: ", str( retval )
+            print >> OutputStream(), "SAMPLE REDUCED FEATURE SPACE: ", str( retval )
         return retval
 
     #==============================================================
     def Split( self, train_size=None, test_size=None, random_state=True,
-                    balanced_classes=True, quiet=False ):
+                    balanced_classes=True, view=False, quiet=False ):
         """Used for dividing the current FeatureSpace into two subsets used for classifier
         cross-validation (i.e., training set and test set).
 
@@ -1446,7 +1662,11 @@ class FeatureSpace( object ):
                     If true, generate a new random split. If int or Pseudo-random number
                     generator state used for random sampling. If value evaluates to false,
                     then do not randomize, but take the first samples in the order
-                    the occur in the FeatureSpace/class."""
+                    the occur in the FeatureSpace/class.
+
+        view : boolean
+                    If True, the training and test sets are views that only record which
+                    of self's samples they contain, see SampleReduce()."""
 
         # Step 1: Determine composition of split classes, i.e.,
         # figure out how many images/samples goes into the train and test sets respectively.
@@ -1582,15 +1802,15 @@ class FeatureSpace( object ):
             if not any( test_groups ):
                 training_set_only = True
 
-        training_set = self.SampleReduce( train_groups, inplace=False, quiet=True )
+        training_set = self.SampleReduce( train_groups, inplace=False, view=view, quiet=True )
         if not quiet:
-            print "SPLIT FEATURE SPACE INTO TRAINING SET: ", str( training_set )
+            print >> OutputStream(), "SPLIT FEATURE SPACE INTO TRAINING SET: ", str( training_set )
         if training_set_only:
             return training_set
 
-        test_set = self.SampleReduce( test_groups, inplace=False, quiet=True )
+        test_set = self.SampleReduce( test_groups, inplace=False, view=view, quiet=True )
         if not quiet:
-            print "TEST SET: ", str( test_set )
+            print >> OutputStream(), "TEST SET: ", str( test_set )
         return training_set, test_set
 
     #==============================================================
@@ -1616,11 +1836,11 @@ class FeatureSpace( object ):
                 leave_out_sample_group_ids=sample_group_ids_to_be_removed,
                 inplace=inplace, quiet=True )
         except:
-            print "Error removing class {0}".format( class_token )
+            print >> OutputStream(), "Error removing class {0}".format( class_token )
             raise
 
         if not quiet:
-            print "REMOVED CLASS {0}, RESULTANT FEATURE SPACE: {1}".format( class_token, retval )
+            print >> OutputStream(), "REMOVED CLASS {0}, RESULTANT FEATURE SPACE: {1}".format( class_token, retval )
         return retval
 
     #==============================================================
@@ -1652,7 +1872,8 @@ class FeatureSpace( object ):
         kwargs['num_samples'] = new_num_samples = self.num_samples + other_fs.num_samples
         kwargs['shape'] = ( new_num_samples, self.num_features )
 
-        kwargs['data_matrix'] = np.empty( kwargs['shape'] )
+        kwargs['data_matrix'] = np.empty( kwargs['shape'],
+                dtype=np.result_type( self.dtype, other_fs.dtype ) )
         kwargs['_contiguous_sample_names'] =  [None] * self.num_samples
         kwargs['_contiguous_sample_group_ids'] = [None] * self.num_samples
         kwargs['_contiguous_sample_sequence_ids'] = [None] * self.num_samples
@@ -1696,7 +1917,7 @@ class FeatureSpace( object ):
         retval.SortSamplesByGroundTruth( rebuild_views=True, inplace=True )
 
         if not quiet:
-            print "COMBINED SAMPLES INTO NEW FEATURE SPACE: ", str( retval )
+            print >> OutputStream(), "COMBINED SAMPLES INTO NEW FEATURE SPACE: ", str( retval )
         return retval
 
     #==============================================================
@@ -1714,8 +1935,49 @@ class FeatureSpace( object ):
         raise NotImplementedError()
 
     #==============================================================
-    def ScrambleGroundTruths( self ):
-        """For a future release. Produce an instant negative control training set"""
-        raise NotImplementedError()
+    def ScrambleGroundTruths( self, random_state=True, inplace=False, quiet=False ):
+        """Produce an instant negative control training set, by randomly reassigning the
+        ground truth labels/values among the sample groups. All the tiles of a sample
+        group keep sharing the same ground truth, and the number of sample groups with
+        each ground truth is unchanged. Samples are then resorted by their new ground truth.
+
+        random_state : True, int or RandomState, as in Split()."""
+
+        from numpy.random import RandomState
+        if random_state is True:
+            from numpy.random import permutation
+        elif type( random_state ) is RandomState:
+            permutation = random_state.permutation
+        elif type( random_state ) is int:
+            permutation = RandomState( random_state ).permutation
+        else:
+            raise ValueError( 'Arg random_state must be an instance of numpy.random.RandomState, an int, or the value True')
+
+        # Rows of a sample group are contiguous, starting at the group's first row
+        group_len = self.num_samples_per_group
+        unique_group_ids, first_rows = np.unique( self._contiguous_sample_group_ids,
+                return_index=True )
+        group_rows = first_rows[ :, np.newaxis ] + np.arange( group_len )
+        # Each sample takes the ground truth of the first sample of another group
+        source_rows = np.empty( self.num_samples, dtype=np.intp )
+        source_rows[ group_rows.ravel() ] = \
+                np.repeat( first_rows[ permutation( len( first_rows ) ) ], group_len )
+
+        newdata = {}
+        newdata[ 'name' ] = self.name + " (scrambled)"
+        for member in ( '_contiguous_ground_truth_labels', '_contiguous_ground_truth_values' ):
+            values = getattr( self, member )
+            if values:
+                newdata[ member ] = [ values[i] for i in source_rows ]
+        newdata[ 'samples_sorted_by_ground_truth' ] = False
+
+        if inplace:
+            retval = self.Update( **newdata )._RebuildViews()
+        else:
+            retval = self.Derive( **newdata )
+
+        if not quiet:
+            print >> OutputStream(), "SCRAMBLED GROUND TRUTHS FEATURE SPACE: ", str( retval )
+        return retval
 
 # END FeatureSpace class definition
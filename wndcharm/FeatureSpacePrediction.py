@@ -25,6 +25,8 @@
 
 import numpy as np
 from .utils import output_railroad_switch
+from . import instrumentation
+from .instrumentation import instrumented, OutputStream
 from .FeatureSpace import FeatureSpace
 from .FeatureWeights import FeatureWeights, FisherFeatureWeights, PearsonFeatureWeights
 from .SingleSamplePrediction import SingleSampleClassification, SingleSampleRegression
@@ -54,7 +56,7 @@ class FeatureSpacePrediction( object ):
         self.tiled_predicted_values = None
 
         # Give myself a number so that it looks good when I print out results
-        if not batch_number:
+        if batch_number is None:
             batch_number = self.__class__.obj_count
             self.__class__.obj_count += 1
 
@@ -310,6 +312,493 @@ class FeatureSpacePrediction( object ):
             outstr += '\n'
         return outstr
 
+#=================================================================================
+class ClassificationResultsTable( object ):
+    """Columnar storage for the classification results of one or more batches.
+
+    Instead of one SingleSampleClassification object per classified sample, every
+    attribute is a column with one entry per sample: numpy arrays for the codes,
+    normalization factors and values, an N x C matrix of marginal probabilities,
+    and lists for the sample metadata. Class names are stored once and referred to
+    by their index ("code") into the class name lists.
+
+    Statistics are calculated over the columns with group-bys (see ConfusionCounts()).
+    Row( i ) and Rows() create the equivalent SingleSampleClassification objects on
+    demand, for code that wants objects."""
+
+    #: predicted_class_name of rows that collided with every training sample
+    collision_class_name = "*Collided with every training sample*"
+    #: predicted_class_name of whole-sample results all of whose tiles collided
+    tiled_collision_class_name = "*Collided with every training image*"
+    #: Methods of AggregateTiles()
+    tile_aggregation_methods = ( 'mean', 'median', 'max_confidence', 'weighted' )
+
+    #==============================================================
+    def __init__( self, class_names, ground_truth_class_names, ground_truth_codes,
+            marginal_probabilities, normalization_factors, predicted_codes=None,
+            predicted_class_names=None, source_filepaths=None, names=None,
+            batch_numbers=None, batch_indices=None, sample_indices=None,
+            sample_group_ids=None, sample_sequence_ids=None, ground_truth_values=None,
+            interpolation_coefficients=None, tile_indices=None, num_samples_in_group=None,
+            error_bounds=None ):
+        """Marginal probabilities of samples that collided with every training sample are NaN.
+        If predicted_codes aren't given, they're the argmax of the marginal
+        probabilities, or for collisions the code of the first name in predicted_class_names
+        after the class names, by default collision_class_name.
+        names and batch_numbers can be given as a single value for all rows."""
+
+        #: Training set class names, the columns of marginal_probabilities
+        self.class_names = list( class_names )
+        #: Names of predicted_codes, class_names followed by non-class labels, e.g., collisions
+        if predicted_class_names is None:
+            predicted_class_names = self.class_names + [ self.collision_class_name ]
+        self.predicted_class_names = list( predicted_class_names )
+        #: Names of ground_truth_codes
+        self.ground_truth_class_names = list( ground_truth_class_names )
+
+        self.ground_truth_codes = np.asarray( ground_truth_codes, dtype=np.intp )
+        num_rows = len( self.ground_truth_codes )
+        self.marginal_probabilities = \
+            np.asarray( marginal_probabilities, dtype=float ).reshape( num_rows, len( self.class_names ) )
+        self.normalization_factors = np.asarray( normalization_factors, dtype=float )
+        if predicted_codes is None:
+            predicted_codes = np.where( self.Collisions(), len( self.class_names ),
+                self.marginal_probabilities.argmax( axis=1 ) if num_rows else [] )
+        self.predicted_codes = np.asarray( predicted_codes, dtype=np.intp )
+
+        #: The training set interpolation coefficients, if predicted values are interpolated
+        self.interpolation_coefficients = interpolation_coefficients
+        #: Interpolated predicted values, NaN for collisions
+        self.predicted_values = None
+        if interpolation_coefficients is not None:
+            # marginal probabilities can be tiny
+            oldsettings = np.seterr( under='ignore' )
+            self.predicted_values = \
+                ( self.marginal_probabilities * np.asarray( interpolation_coefficients ) ).sum( axis=1 )
+            np.seterr( **oldsettings )
+        if ground_truth_values is not None:
+            ground_truth_values = np.asarray( ground_truth_values, dtype=float )
+        self.ground_truth_values = ground_truth_values
+        #: Bounds on the error of approximate marginal probabilities, if approximated
+        if error_bounds is not None:
+            error_bounds = np.asarray( error_bounds, dtype=float )
+        self.error_bounds = error_bounds
+
+        #: Which batch (split) each row came from, as an index into the batches of the table
+        if batch_indices is None:
+            batch_indices = np.zeros( num_rows, dtype=np.intp )
+        self.batch_indices = np.asarray( batch_indices, dtype=np.intp )
+        #: Position of each row's sample in its test set
+        if sample_indices is None:
+            sample_indices = np.arange( num_rows )
+        self.sample_indices = np.asarray( sample_indices, dtype=np.intp )
+
+        def _Column( values ):
+            if isinstance( values, list ) or values is None:
+                return values
+            return [ values ] * num_rows
+
+        self.source_filepaths = _Column( source_filepaths )
+        self.names = _Column( names )
+        self.batch_numbers = _Column( batch_numbers )
+        self.sample_group_ids = _Column( sample_group_ids )
+        self.sample_sequence_ids = _Column( sample_sequence_ids )
+
+        #: Position of each tile within its sample group, if the test set is tiled
+        self.tile_indices = tile_indices
+        self.num_samples_in_group = num_samples_in_group
+
+        #: For tables of whole-sample results aggregated from tiles: the table of tile
+        #: results, and an int array of the rows in it making up each row of this table.
+        self.tile_table = None
+        self.tile_rows = None
+
+        # SingleSampleClassification objects handed out by Row()
+        self._rows = {}
+
+    #==============================================================
+    def __len__( self ):
+        return len( self.ground_truth_codes )
+
+    #==============================================================
+    def __str__( self ):
+        return '<{0} n={1} n_classes={2}>'.format( self.__class__.__name__, len( self ),
+                len( self.class_names ) )
+
+    #==============================================================
+    def __repr__( self ):
+        return str( self )
+
+    #==============================================================
+    @classmethod
+    def NewFromResults( cls, results, class_names, interpolation_coefficients=None ):
+        """Returns a new table with the contents of a list of SingleSampleClassification
+        objects, whose marginal probabilities are in the order of class_names."""
+
+        num_classes = len( class_names )
+        ground_truth_class_names = []
+        ground_truth_index = {}
+        predicted_class_names = list( class_names )
+        predicted_index = dict( [ ( name, i ) for i, name in enumerate( class_names ) ] )
+        no_call = [ np.nan ] * num_classes
+
+        ground_truth_codes = []
+        predicted_codes = []
+        marginal_probabilities = []
+        normalization_factors = []
+        for result in results:
+            name = result.ground_truth_class_name
+            if name not in ground_truth_index:
+                ground_truth_index[ name ] = len( ground_truth_class_names )
+                ground_truth_class_names.append( name )
+            ground_truth_codes.append( ground_truth_index[ name ] )
+
+            name = result.predicted_class_name
+            if name not in predicted_index:
+                predicted_index[ name ] = len( predicted_class_names )
+                predicted_class_names.append( name )
+            predicted_codes.append( predicted_index[ name ] )
+
+            if result.marginal_probabilities is None:
+                marginal_probabilities.append( no_call )
+            else:
+                marginal_probabilities.append( result.marginal_probabilities )
+            if result.normalization_factor is None:
+                normalization_factors.append( np.nan )
+            else:
+                normalization_factors.append( result.normalization_factor )
+
+        ground_truth_values = [ result.ground_truth_value for result in results ]
+        if any( [ value is None for value in ground_truth_values ] ):
+            ground_truth_values = None
+
+        table = cls( class_names, ground_truth_class_names, ground_truth_codes,
+                marginal_probabilities, normalization_factors, predicted_codes,
+                predicted_class_names, source_filepaths=[ r.source_filepath for r in results ],
+                names=[ r.name for r in results ], batch_numbers=[ r.batch_number for r in results ],
+                ground_truth_values=ground_truth_values,
+                interpolation_coefficients=interpolation_coefficients )
+        # The objects are already there
+        table._rows = dict( enumerate( results ) )
+        return table
+
+    #==============================================================
+    @classmethod
+    def Concatenate( cls, tables ):
+        """Returns a new table with the rows of all tables, e.g., results from several
+        batches. Codes are remapped by name, and batch_indices are renumbered so that
+        rows from different tables have different batch indices."""
+
+        if not tables:
+            raise ValueError( "Can't concatenate empty list of results tables." )
+        class_names = tables[0].class_names
+        for table in tables[1:]:
+            if table.class_names != class_names:
+                raise ValueError( "Can't concatenate results tables of different classes: {0} and {1}".format(
+                    class_names, table.class_names ) )
+
+        def _Union( name_lists ):
+            names = []
+            index = {}
+            for name_list in name_lists:
+                for name in name_list:
+                    if name not in index:
+                        index[ name ] = len( names )
+                        names.append( name )
+            return names, index
+
+        ground_truth_class_names, ground_truth_index = \
+                _Union( [ t.ground_truth_class_names for t in tables ] )
+        predicted_class_names, predicted_index = \
+                _Union( [ t.predicted_class_names for t in tables ] )
+
+        ground_truth_codes = []
+        predicted_codes = []
+        batch_indices = []
+        batch_offset = 0
+        for t in tables:
+            lookup = np.array( [ ground_truth_index[ n ] for n in t.ground_truth_class_names ], dtype=np.intp )
+            ground_truth_codes.append( lookup[ t.ground_truth_codes ] )
+            lookup = np.array( [ predicted_index[ n ] for n in t.predicted_class_names ], dtype=np.intp )
+            predicted_codes.append( lookup[ t.predicted_codes ] )
+            batch_indices.append( t.batch_indices + batch_offset )
+            if len( t ):
+                batch_offset += t.batch_indices.max() + 1
+
+        def _ListColumn( member ):
+            column = []
+            for t in tables:
+                values = getattr( t, member )
+                column.extend( values if values is not None else [ None ] * len( t ) )
+            return column
+
+        ground_truth_values = None
+        if all( [ t.ground_truth_values is not None for t in tables ] ):
+            ground_truth_values = np.concatenate( [ t.ground_truth_values for t in tables ] )
+        table = cls( class_names, ground_truth_class_names, np.concatenate( ground_truth_codes ),
+                np.concatenate( [ t.marginal_probabilities for t in tables ] ),
+                np.concatenate( [ t.normalization_factors for t in tables ] ),
+                np.concatenate( predicted_codes ), predicted_class_names,
+                source_filepaths=_ListColumn( 'source_filepaths' ), names=_ListColumn( 'names' ),
+                batch_numbers=_ListColumn( 'batch_numbers' ),
+                batch_indices=np.concatenate( batch_indices ),
+                sample_indices=np.concatenate( [ t.sample_indices for t in tables ] ),
+                sample_group_ids=_ListColumn( 'sample_group_ids' ),
+                sample_sequence_ids=_ListColumn( 'sample_sequence_ids' ),
+                ground_truth_values=ground_truth_values,
+                interpolation_coefficients=tables[0].interpolation_coefficients )
+        if all( [ t.error_bounds is not None for t in tables ] ):
+            table.error_bounds = np.concatenate( [ t.error_bounds for t in tables ] )
+        if all( [ t.predicted_values is not None for t in tables ] ):
+            table.predicted_values = np.concatenate( [ t.predicted_values for t in tables ] )
+        return table
+
+    #==============================================================
+    def AggregateTiles( self, tile_rows, method='mean' ):
+        """Returns a new table with one whole-sample result per row of the int array
+        tile_rows, which are the rows of self holding the sample's tiles.
+
+        Tiles that collided with every training sample are left out. If all of a
+        sample's tiles collided, so does the sample. A sample missing some of its tiles,
+        e.g., ones dropped by a normalization factor threshold, pads the end of its row
+        of tile_rows with -1, and those count as collided too. method is one of:
+        'mean' - average marginal probabilities and normalization factors of the tiles
+        'median' - per-class median marginal probabilities, rescaled to sum to 1,
+            and median normalization factor
+        'max_confidence' - marginal probabilities and normalization factor of the tile
+            with the highest single marginal probability
+        'weighted' - average marginal probabilities weighted by the tiles'
+            normalization factors, i.e., tiles close to the training samples count for
+            more, and average normalization factor
+
+        All of them are computed for all samples at once on the
+        ( num samples, tiles per sample, num classes ) stack of tile results."""
+
+        if method not in self.tile_aggregation_methods:
+            raise ValueError( 'Tile aggregation method must be one of "mean", "median", ' + \
+                    '"max_confidence" or "weighted", got "{0}"'.format( method ) )
+
+        tile_rows = np.asarray( tile_rows, dtype=np.intp ).reshape( -1, self.num_samples_in_group or 1 )
+        num_groups, tiles_per_group = tile_rows.shape
+        present = tile_rows >= 0
+        if np.array_equal( tile_rows.ravel(), np.arange( len( self ) ) ):
+            # Every row is a tile, in order, so no need to gather
+            tile_probabilities = self.marginal_probabilities.reshape(
+                    num_groups, tiles_per_group, len( self.class_names ) )
+            tile_norm_factors = self.normalization_factors.reshape( num_groups, tiles_per_group )
+        else:
+            gather_rows = np.where( present, tile_rows, 0 )
+            tile_probabilities = self.marginal_probabilities[ gather_rows ]
+            tile_norm_factors = self.normalization_factors[ gather_rows ].astype( float )
+            tile_probabilities[ ~present ] = np.nan
+            tile_norm_factors[ ~present ] = np.nan
+        called = ~np.isnan( tile_probabilities ).any( axis=2 )
+        num_called = called.sum( axis=1 )
+        collided = num_called == 0
+        divisors = np.where( collided, 1, num_called ).astype( float )
+
+        oldsettings = np.seterr( under='ignore' )
+        if method == 'median':
+            # Fill in all-collided samples so nanmedian doesn't warn about them
+            tile_probabilities = np.where( collided[ :, np.newaxis, np.newaxis ], 0, tile_probabilities )
+            tile_norm_factors = np.where( collided[ :, np.newaxis ], 0,
+                    np.where( called, tile_norm_factors, np.nan ) )
+            marginal_probabilities = np.nanmedian( tile_probabilities, axis=1 )
+            sums = marginal_probabilities.sum( axis=1 )
+            sums[ sums == 0 ] = 1
+            marginal_probabilities /= sums[ :, np.newaxis ]
+            normalization_factors = np.nanmedian( tile_norm_factors, axis=1 )
+        elif method == 'max_confidence':
+            confidences = np.where( called, np.where( called[ :, :, np.newaxis ],
+                tile_probabilities, 0 ).max( axis=2 ), -1 )
+            best_tiles = confidences.argmax( axis=1 )
+            groups = np.arange( num_groups )
+            marginal_probabilities = tile_probabilities[ groups, best_tiles ]
+            normalization_factors = tile_norm_factors[ groups, best_tiles ]
+        else:
+            called_probabilities = np.where( called[ :, :, np.newaxis ], tile_probabilities, 0 )
+            if method == 'weighted':
+                weights = np.where( called, tile_norm_factors, 0 )
+                called_probabilities *= weights[ :, :, np.newaxis ]
+                weight_sums = weights.sum( axis=1 )
+                weight_sums[ collided ] = 1
+            else:
+                weight_sums = divisors
+            marginal_probabilities = called_probabilities.sum( axis=1 ) / weight_sums[ :, np.newaxis ]
+            normalization_factors = np.where( called, tile_norm_factors, 0 ).sum( axis=1 ) / divisors
+        marginal_probabilities[ collided ] = np.nan
+        normalization_factors[ collided ] = np.nan
+        np.seterr( **oldsettings )
+
+        first_tiles = tile_rows[ :, 0 ]
+        last_tiles = tile_rows.max( axis=1 )
+        ground_truth_values = None
+        if self.ground_truth_values is not None:
+            ground_truth_values = self.ground_truth_values[ first_tiles ]
+        source_filepaths = None
+        if self.source_filepaths is not None:
+            source_filepaths = [ self.source_filepaths[ i ] for i in last_tiles ]
+
+        table = self.__class__( self.class_names, self.ground_truth_class_names,
+                self.ground_truth_codes[ first_tiles ], marginal_probabilities,
+                normalization_factors, predicted_class_names=self.class_names + \
+                    [ self.tiled_collision_class_name ], source_filepaths=source_filepaths,
+                batch_indices=self.batch_indices[ first_tiles ],
+                sample_indices=self.sample_indices[ first_tiles ],
+                ground_truth_values=ground_truth_values,
+                interpolation_coefficients=self.interpolation_coefficients )
+        table.tile_table = self
+        table.tile_rows = tile_rows
+        return table
+
+    #==============================================================
+    def Collisions( self ):
+        """Returns boolean array, True for rows that collided with every training sample,
+        i.e., that have no marginal probabilities."""
+        return np.isnan( self.marginal_probabilities ).any( axis=1 )
+
+    #==============================================================
+    def CalledMarginalProbabilities( self ):
+        """Returns the marginal probability matrix with zeros instead of NaNs for
+        collisions, ready for summing."""
+        return np.where( self.Collisions()[ :, np.newaxis ], 0, self.marginal_probabilities )
+
+    #==============================================================
+    def ConfusionCounts( self, rows=None ):
+        """Returns int array of shape ( len( ground_truth_class_names ),
+        len( predicted_class_names ) ) of the number of rows with each ground truth code
+        and predicted code. rows optionally selects a subset of rows."""
+
+        ground_truth_codes = self.ground_truth_codes
+        predicted_codes = self.predicted_codes
+        if rows is not None:
+            ground_truth_codes = ground_truth_codes[ rows ]
+            predicted_codes = predicted_codes[ rows ]
+        num_gt = len( self.ground_truth_class_names )
+        num_pred = len( self.predicted_class_names )
+        return np.bincount( ground_truth_codes * num_pred + predicted_codes,
+                minlength=num_gt * num_pred ).reshape( num_gt, num_pred )
+
+    #==============================================================
+    def CorrectPredictions( self ):
+        """Returns boolean array, True for rows whose predicted class name
+        is the ground truth class name."""
+
+        predicted_index = dict( [ ( name, i ) for i, name in enumerate( self.predicted_class_names ) ] )
+        same_code = np.array( [ predicted_index.get( name, -1 ) for name in
+                self.ground_truth_class_names ], dtype=np.intp )
+        return self.predicted_codes == same_code[ self.ground_truth_codes ]
+
+    #==============================================================
+    def _NewRow( self, index ):
+        """Returns a new SingleSampleClassification with the contents of row index."""
+
+        result = SingleSampleClassification()
+        if self.source_filepaths is not None:
+            result.source_filepath = self.source_filepaths[ index ]
+        if self.names is not None:
+            result.name = self.names[ index ]
+        if self.batch_numbers is not None:
+            result.batch_number = self.batch_numbers[ index ]
+        result.ground_truth_class_name = self.ground_truth_class_names[ self.ground_truth_codes[ index ] ]
+        result.predicted_class_name = self.predicted_class_names[ self.predicted_codes[ index ] ]
+        if not np.isnan( self.normalization_factors[ index ] ):
+            result.normalization_factor = self.normalization_factors[ index ]
+        marginal_probabilities = self.marginal_probabilities[ index ]
+        if not np.isnan( marginal_probabilities ).any():
+            result.marginal_probabilities = marginal_probabilities.tolist()
+        if self.predicted_values is not None and not np.isnan( self.predicted_values[ index ] ):
+            result.predicted_value = self.predicted_values[ index ]
+        if self.ground_truth_values is not None:
+            result.ground_truth_value = self.ground_truth_values[ index ]
+        if self.error_bounds is not None and not np.isnan( self.error_bounds[ index ] ):
+            result.error_bound = self.error_bounds[ index ]
+        # Helps to identify which results correspond with which sample
+        if self.sample_group_ids is not None:
+            result.samplegroupid = self.sample_group_ids[ index ]
+        if self.sample_sequence_ids is not None:
+            result.samplesequenceid = self.sample_sequence_ids[ index ]
+        if self.tile_indices is not None:
+            result.tile_index = int( self.tile_indices[ index ] )
+            result.num_samples_in_group = self.num_samples_in_group
+        if self.tile_rows is not None:
+            result.tile_index = 'AVG'
+            tile_rows = self.tile_rows[ index ]
+            result.tiled_results = self.tile_table.Rows( tile_rows[ tile_rows >= 0 ] )
+        return result
+
+    #==============================================================
+    def Row( self, index ):
+        """Returns the SingleSampleClassification for row index, the same object
+        every time it's asked for."""
+
+        if index < 0:
+            index += len( self )
+        try:
+            return self._rows[ index ]
+        except KeyError:
+            result = self._rows[ index ] = self._NewRow( index )
+            return result
+
+    #==============================================================
+    def Rows( self, rows=None ):
+        """Returns a read-only sequence of the SingleSampleClassification objects for
+        the int array of rows (all rows if None), created as they're accessed."""
+        return _LazyRows( self, rows )
+
+    #==============================================================
+    def RecordRows( self, name, rows=None ):
+        """Emit a record event named name for each of rows (all if None), without
+        keeping the SingleSampleClassification objects around. Does nothing, not even
+        create the objects, if no instrumentation sink is attached."""
+
+        if not instrumentation.Enabled():
+            return
+        if rows is None:
+            rows = xrange( len( self ) )
+        for index in rows:
+            result = self._rows.get( index )
+            if result is None:
+                result = self._NewRow( index )
+            result.Record( name )
+
+#=================================================================================
+class _LazyRows( object ):
+    """Sequence of the SingleSampleClassification objects of a ClassificationResultsTable,
+    in place of a list. Objects are created the first time they're accessed."""
+
+    def __init__( self, table, rows=None ):
+        self.table = table
+        #: int array of table rows in this sequence, or None for all of them
+        self.rows = rows
+
+    def __len__( self ):
+        return len( self.table ) if self.rows is None else len( self.rows )
+
+    def __getitem__( self, index ):
+        if isinstance( index, slice ):
+            return [ self[i] for i in xrange( *index.indices( len( self ) ) ) ]
+        if index < 0:
+            index += len( self )
+        if index < 0 or index >= len( self ):
+            raise IndexError( 'results index out of range' )
+        return self.table.Row( index if self.rows is None else self.rows[ index ] )
+
+    def __iter__( self ):
+        for index in xrange( len( self ) ):
+            yield self[ index ]
+
+    def __repr__( self ):
+        return '<{0} of {1} results of {2}>'.format( self.__class__.__name__, len( self ), self.table )
+
+#=================================================================================
+def _GroupSums( keys, values, num_groups ):
+    """Returns ( num_groups, C ) array of the sums of the rows of the N x C array values
+    having each int key."""
+
+    return np.column_stack( [ np.bincount( keys, weights=values[ :, column ], minlength=num_groups )
+        for column in xrange( values.shape[1] ) ] ).reshape( num_groups, values.shape[1] )
+
 #=================================================================================
 class FeatureSpaceClassification( FeatureSpacePrediction ):
     """Container for SingleSampleClassification instances.
@@ -369,43 +858,50 @@ class FeatureSpaceClassification( FeatureSpacePrediction ):
         # Remember! Dicts are not guaranteed to maintain key order but lists are
         # When cycling through the matrix, iterate over the lists, and not the keys of the dict
         from collections import defaultdict # introduced Python 2.5
+        # partial instead of lambda, so that results can be pickled
+        from functools import partial
 
         # These are dicts of dicts in the form:
         # self.confusion_matrix[ <Ground Truth Class> ][ <Predicted Class> ] == count
-        self.confusion_matrix = defaultdict( lambda: defaultdict( int ) )
-        self.average_class_probability_matrix = defaultdict( lambda: defaultdict( float ) )
+        self.confusion_matrix = defaultdict( partial( defaultdict, int ) )
+        self.average_class_probability_matrix = defaultdict( partial( defaultdict, float ) )
 
         self.num_correct_classifications = 0
 
         self.num_classifications_per_class = defaultdict( int )
         self.num_correct_classifications_per_class = defaultdict( int )
 
-        classification_results = self.tiled_results if self.tiled_results else self.individual_results
+        # Count and sum over the columns of the results, grouped by ground truth code,
+        # then fill out the matrices one cell per (ground truth, predicted class) pair.
+        # FIXME: is there any possibility that the order of the values in the marginal
+        # probability array don't correspond with the order of the training set classes?
+        table = self.GetResultsTable()
+        counts = table.ConfusionCounts()
+        probability_sums = _GroupSums( table.ground_truth_codes,
+                table.CalledMarginalProbabilities(), len( table.ground_truth_class_names ) )
 
-        for indiv_result in classification_results:
-            gt_class = indiv_result.ground_truth_class_name
+        for gt_code, gt_class in enumerate( table.ground_truth_class_names ):
             if gt_class == None:
                 gt_class = "UNKNOWN"
-            pred_class = indiv_result.predicted_class_name
-
-            self.num_classifications_per_class[ gt_class ] += 1
-
-            if gt_class == pred_class:
-                self.num_correct_classifications += 1
-                self.num_correct_classifications_per_class[ gt_class ] += 1
-            
-            self.confusion_matrix[ gt_class ][ pred_class ] += 1
-
-            # FIXME: is there any possibility that the order of the values in the marginal
-            # probability array don't correspond with the order of the training set classes?
-            if indiv_result.marginal_probabilities is not None:
-                mp = zip( self.training_set.class_names, indiv_result.marginal_probabilities )
-                for putative_class, marg_prob in mp:
-                    self.average_class_probability_matrix[ gt_class ][ putative_class ] += marg_prob
+            gt_row = counts[ gt_code ]
+            if not gt_row.any():
+                continue
+            self.num_classifications_per_class[ gt_class ] += int( gt_row.sum() )
+            for pred_code in np.flatnonzero( gt_row ):
+                pred_class = table.predicted_class_names[ pred_code ]
+                count = int( gt_row[ pred_code ] )
+                self.confusion_matrix[ gt_class ][ pred_class ] += count
+                if gt_class == pred_class:
+                    self.num_correct_classifications += count
+                    self.num_correct_classifications_per_class[ gt_class ] += count
+            for putative_class, marg_prob_sum in zip( table.class_names, probability_sums[ gt_code ] ):
+                self.average_class_probability_matrix[ gt_class ][ putative_class ] += marg_prob_sum
 
         # Finalize the Average Class Probability Matrix by dividing each marginal probability
         # sum by the number of marginal probabilities for that ground truth:
         for row in self.test_set.class_names:
+            if not self.num_classifications_per_class[ row ]:
+                continue
             for col in self.training_set.class_names:
                 self.average_class_probability_matrix[ row ][ col ] /= \
                    self.num_classifications_per_class[ row ]
@@ -425,6 +921,28 @@ class FeatureSpaceClassification( FeatureSpacePrediction ):
         self.classification_accuracy = float( self.num_correct_classifications) / float( self.num_classifications )
         return self
 
+    #==============================================================
+    def GetResultsTable( self, tiled=None ):
+        """Returns the ClassificationResultsTable of this batch's results, the
+        whole-sample results if the test set was tiled, or the tile results if tiled=False.
+
+        If the results are SingleSampleClassification objects rather than a table,
+        e.g., read from an HTML report, a new table is made from them."""
+
+        if tiled is None:
+            tiled = bool( self.tiled_results )
+        results = self.tiled_results if tiled else self.individual_results
+        if isinstance( results, _LazyRows ) and results.rows is None:
+            return results.table
+        interpolation_coefficients = None
+        if self.training_set is not None:
+            interpolation_coefficients = self.training_set.interpolation_coefficients
+            if interpolation_coefficients is not None and \
+                    len( interpolation_coefficients ) != self.training_set.num_classes:
+                interpolation_coefficients = None
+        return ClassificationResultsTable.NewFromResults( list( results ),
+                self.training_set.class_names, interpolation_coefficients )
+
     #==============================================================
     @output_railroad_switch
     def Print( self ):
@@ -437,19 +955,19 @@ class FeatureSpaceClassification( FeatureSpacePrediction ):
 
         classification_results = self.tiled_results if self.tiled_results else self.individual_results
 
-        print '='*50
+        print >> OutputStream(), '='*50
         s = self.__class__.__name__
         if self.name:
             s += ' "' + self.name + '"'
         s += " (" + str( len( classification_results ) ) + " classifications)"
-        print s
+        print >> OutputStream(), s
 
         acc = self.classification_accuracy
         n = self.num_classifications
         n_correct = self.num_correct_classifications
 
         if not self.use_error_bars:
-            print "{0}/{1} correct = {2:0.2f}%".format( n_correct, n, acc * 100 )
+            print >> OutputStream(), "{0}/{1} correct = {2:0.2f}%".format( n_correct, n, acc * 100 )
         else:
             # Using either normal approximation of binomial distribution or the Wilson score interval
             # to calculate standard error of the mean, depending on the situation.
@@ -467,7 +985,7 @@ class FeatureSpaceClassification( FeatureSpacePrediction ):
                 # Using normal approximation:
                 std_error_of_mean = sqrt( acc * (1-acc) / n )
                 conf_interval = z * std_error_of_mean
-                print "{0}/{1} correct = {2:0.2f} +/- {3:0.2f}% w/ 95% conf. (normal approx. interval)".format(
+                print >> OutputStream(), "{0}/{1} correct = {2:0.2f} +/- {3:0.2f}% w/ 95% conf. (normal approx. interval)".format(
                     n_correct, n, acc * 100, conf_interval * 100 )
             else:
                 # Using Wilson approximation:
@@ -482,19 +1000,19 @@ class FeatureSpaceClassification( FeatureSpacePrediction ):
                     n_correct, n, raw_acc * 100, conf_interval * 100 )
                 outstr += " ({0:0.2f} +/- {1:0.2f}% w/ 95% conf. (Wilson score interval))".format(
                         acc * 100, conf_interval * 100)
-                print outstr
+                print >> OutputStream(), outstr
 
         if self.std_err is not None:
-            print "Standard Error: {0:0.4f}".format( self.std_err)
+            print >> OutputStream(), "Standard Error: {0:0.4f}".format( self.std_err)
         if self.pearson_coeff is not None:
-            print "Pearson Coefficient: {0:0.4f}".format( self.pearson_coeff )
+            print >> OutputStream(), "Pearson Coefficient: {0:0.4f}".format( self.pearson_coeff )
         if self.spearman_coeff is not None:
-            print "Spearman Coefficient: {0:0.4f}".format( self.spearman_coeff )
-        print "\n"
+            print >> OutputStream(), "Spearman Coefficient: {0:0.4f}".format( self.spearman_coeff )
+        print >> OutputStream(), "\n"
 
-        print self.ConfusionMatrix()
-        print self.SimilarityMatrix()
-        print self.AvgClassProbMatrix()
+        print >> OutputStream(), self.ConfusionMatrix()
+        print >> OutputStream(), self.SimilarityMatrix()
+        print >> OutputStream(), self.AvgClassProbMatrix()
     
     #==============================================================
     @output_railroad_switch
@@ -566,28 +1084,150 @@ class FeatureSpaceClassification( FeatureSpacePrediction ):
         #column_headers += "\t".join( [ '-'*len(name) for name in self.test_set.class_names ] )
         #print "Distance Matrix (method = '{0}'):".format( method )
         #print column_headers
-        print self.test_set.num_classes
+        print >> OutputStream(), self.test_set.num_classes
         for row in range( self.test_set.num_classes ):
             line = "{0}\t".format( self.test_set.class_names[ row ] )
             for col in range( self.test_set.num_classes ):
                 line += '{0:0.4f}\t'.format( output_matrix[ row, col ] )
-            print line
+            print >> OutputStream(), line
 
     #==============================================================
     @classmethod
     @output_railroad_switch
+    @instrumented( 'FeatureSpaceClassification.NewWND5' )
     def NewWND5( cls, training_set, test_set, feature_weights, name=None, batch_number=None,
-                quiet=False, norm_factor_threshold=None, error_bars=False ):
+                quiet=False, norm_factor_threshold=None, error_bars=False, tile_aggregation='mean',
+                num_neighbors=None, neighbor_index=None ):
         """The equivalent of the "wndcharm classify" command in the command line implementation
         of WND-CHARM. Input a training set, a test set, and feature weights, and returns a
         new instance of a FeatureSpaceClassification, with self.individual_results
         filled with a new instances of SingleSampleClassification.
 
+        tile_aggregation - if the test set is tiled, how the tiles' results are combined
+            into the whole sample's result in self.tiled_results, one of 'mean', 'median',
+            'max_confidence' or 'weighted'. See ClassificationResultsTable.AggregateTiles().
+        num_neighbors - if given, approximate WND5 by only evaluating the num_neighbors
+            closest training samples of each class, found with a WND5NeighborIndex.
+            Each individual result gets an error_bound on its marginal probabilities.
+        neighbor_index - a WND5NeighborIndex of training_set and feature_weights to reuse
+            when classifying many test sets against the same training set; built if None.
+
         FIXME: What happens when the ground truth is not known? Currently they would all be shoved
         into class 1, might not be a big deal since class name should be something
         like "UNKNOWN"
         """
 
+        classify_block = cls._WND5Block
+        if num_neighbors is not None:
+            if int( num_neighbors ) != num_neighbors or num_neighbors < 1:
+                raise ValueError( 'Arg "num_neighbors" must be a positive integer, got {0}'.format( num_neighbors ) )
+            if neighbor_index is None:
+                neighbor_index = WND5NeighborIndex.NewFromFeatureSpace( training_set, feature_weights )
+            elif neighbor_index.feature_names != feature_weights.feature_names or \
+                    neighbor_index.class_names != training_set.class_names:
+                raise ValueError( "Can't classify, neighbor index wasn't made from this training set and feature weights." )
+            classify_block = lambda train_set, test_block, weights: \
+                    neighbor_index.ClassifyBlock( test_block, int( num_neighbors ) )
+        elif neighbor_index is not None:
+            raise ValueError( 'Arg "neighbor_index" requires arg "num_neighbors"' )
+
+        return cls._New( 'NewWND5', classify_block, training_set, test_set, feature_weights,
+                name, batch_number, quiet, norm_factor_threshold, error_bars, tile_aggregation )
+
+    #==============================================================
+    @classmethod
+    @output_railroad_switch
+    @instrumented( 'FeatureSpaceClassification.NewWNN' )
+    def NewWNN( cls, training_set, test_set, feature_weights, name=None, batch_number=None,
+                quiet=False, norm_factor_threshold=None, error_bars=False, tile_aggregation='mean' ):
+        """Same as NewWND5(), but classifies with weighted nearest neighbor (WNN), the
+        equivalent of "wndchrm classify -w" in the command line implementation. See _WNNBlock()."""
+
+        return cls._New( 'NewWNN', cls._WNNBlock, training_set, test_set, feature_weights,
+                name, batch_number, quiet, norm_factor_threshold, error_bars, tile_aggregation )
+
+    #==============================================================
+    @staticmethod
+    def _WND5Block( training_set, test_block, feature_weights ):
+        """Classifies each row of the matrix test_block with SingleSampleClassification._WND5().
+        Returns the tuple ( marginal_probabilities, normalization_factors ), a row of NANs
+        and a NAN for non-calls."""
+
+        marginal_probabilities = np.empty( ( len( test_block ), training_set.num_classes ) )
+        normalization_factors = np.empty( len( test_block ) )
+        for row_index, one_image_features in enumerate( test_block ):
+            result = SingleSampleClassification._WND5( training_set, one_image_features, feature_weights )
+            if result.marginal_probabilities:
+                marginal_probabilities[ row_index ] = result.marginal_probabilities
+                normalization_factors[ row_index ] = result.normalization_factor
+            else:
+                # Sometimes the result comes back with a non-call, like when the sample image
+                # collides with every test image
+                marginal_probabilities[ row_index ] = np.nan
+                normalization_factors[ row_index ] = np.nan
+        return marginal_probabilities, normalization_factors
+
+    #==============================================================
+    @staticmethod
+    def _WNNBlock( training_set, test_block, feature_weights ):
+        """Weighted nearest neighbor classification of each row of the matrix test_block,
+        as TrainingSet::WNNclassify() of C++ wndchrm does it.
+
+        The distance between two samples is sqrt( sum( weight * difference^2 ) ), with the
+        weights not squared, unlike in WND5. Training samples at a distance of 0 from a
+        test sample are ignored. The marginal probability of each class is the inverse
+        of the distance to its nearest training sample, divided by the sum of these
+        inverses over all classes, which is the normalization factor.
+
+        The distances between the whole test block and each class's training samples are
+        calculated in one matrix product, in double, one class at a time, so float32
+        training sets are never converted to double all at once.
+
+        Returns the tuple ( marginal_probabilities, normalization_factors ), a row of
+        NANs and a NAN for test samples that have no training sample at a non-zero distance."""
+
+        weights = np.asarray( feature_weights, dtype=float )
+        test_block = np.asarray( test_block, dtype=float )
+        weighted_test_block = test_block * weights
+        test_sq = np.dot( test_block ** 2, weights )
+
+        oldsettings = np.seterr( all='ignore' )
+        min_dists = np.empty( ( len( test_block ), training_set.num_classes ) )
+        for class_index, class_matrix in enumerate( training_set.data_list ):
+            class_matrix = np.asarray( class_matrix, dtype=float )
+            # weighted |a - b|^2 = weighted a^2 + weighted b^2 - 2 * weighted a.b
+            train_sq = np.dot( class_matrix ** 2, weights )
+            sq_dists = np.dot( weighted_test_block, class_matrix.T )
+            sq_dists *= -2
+            sq_dists += test_sq[ :, None ]
+            sq_dists += train_sq
+            # Where the terms cancel out, the expansion loses the precision that telling
+            # identical samples apart needs, so recalculate those distances directly.
+            for test_index, train_index in zip( *np.nonzero(
+                    sq_dists <= 1e-8 * ( test_sq[ :, None ] + train_sq ) ) ):
+                diff = test_block[ test_index ] - class_matrix[ train_index ]
+                sq_dists[ test_index, train_index ] = np.dot( diff * diff, weights )
+            dists = np.sqrt( np.maximum( sq_dists, 0 ) )
+            # ignore images that are 100% identical
+            dists[ dists < 1e-200 ] = np.inf
+            min_dists[ :, class_index ] = dists.min( axis=1 )
+
+        inverse_dists = 1.0 / min_dists
+        normalization_factors = inverse_dists.sum( axis=1 )
+        normalization_factors[ normalization_factors == 0 ] = np.nan
+        marginal_probabilities = inverse_dists / normalization_factors[ :, None ]
+        np.seterr( **oldsettings )
+        return marginal_probabilities, normalization_factors
+
+    #==============================================================
+    @classmethod
+    def _New( cls, method_name, classify_block, training_set, test_set, feature_weights, name,
+            batch_number, quiet, norm_factor_threshold, error_bars, tile_aggregation ):
+        """Implements NewWND5() and NewWNN(). classify_block( training_set, test_block,
+        feature_weights.values ) returns the marginal probabilities and normalization
+        factors of the rows of test_block, as _WND5Block() does, optionally followed by
+        their error bounds, as WND5NeighborIndex.ClassifyBlock() does."""
+
         # type checking
         if not isinstance( training_set, FeatureSpace ):
             raise ValueError( 'First argument to New must be of type "FeatureSpace", you gave a {0}'.format( type( test_set ).__name__ ) )
@@ -595,6 +1235,9 @@ class FeatureSpaceClassification( FeatureSpacePrediction ):
             raise ValueError( 'Second argument to New must be of type "FeatureSpace", you gave a {0}'.format( type( test_set ).__name__ ) )
         if not isinstance( feature_weights, FeatureWeights ):
             raise ValueError( 'Third argument to New must be of type "FeatureWeights" or derived class, you gave a {0}'.format( type( feature_weights ).__name__ ) )
+        if tile_aggregation not in ClassificationResultsTable.tile_aggregation_methods:
+            raise ValueError( 'Arg "tile_aggregation" must be one of {0}, got "{1}"'.format(
+                ', '.join( ClassificationResultsTable.tile_aggregation_methods ), tile_aggregation ) )
     
         # feature comparison
         if test_set.feature_names != feature_weights.feature_names:
@@ -613,134 +1256,401 @@ class FeatureSpaceClassification( FeatureSpacePrediction ):
         batch_result.use_error_bars = error_bars
 
         # Are the samples to be classified tiled?
-        if test_set.num_samples_per_group > 1:
-            batch_result.tiled_results = []
-            batch_result.tiled_ground_truth_values = []
-            batch_result.tiled_predicted_values = []
+        tiled = test_set.num_samples_per_group > 1
 
         # Say what we're going to do
         if not quiet:
-            print "Classifying test set '{0}' ({1} features) against training set '{2}' ({3} features)".\
+            print >> OutputStream(), "Classifying test set '{0}' ({1} features) against training set '{2}' ({3} features)".\
                     format( test_set.name, test_set_len, training_set.name, train_set_len )
-            if batch_result.tiled_results:
-                print "Performing tiled classification."
+            if tiled:
+                print >> OutputStream(), "Performing tiled classification."
             column_header = "image\tnorm. fact.\t"
             column_header +=\
                 "".join( [ "p(" + class_name + ")\t" for class_name in training_set.class_names ] )
             column_header += "act. class\tpred. class\tpred. val."
-            print column_header
+            print >> OutputStream(), column_header
 
         # Will there be a numeric predicted value associated with this classification?
         train_set_interp_coeffs = None
         if training_set.interpolation_coefficients != None and len( training_set.interpolation_coefficients) != 0:
             train_set_interp_coeffs = np.array( training_set.interpolation_coefficients )
-            batch_result.predicted_values = []
 
         # Are there numeric ground truth values associated with the input samples?
         test_set_interp_coeffs = None
         if test_set.interpolation_coefficients != None and len( test_set.interpolation_coefficients ) != 0:
             test_set_interp_coeffs = np.array( test_set.interpolation_coefficients )
-            batch_result.ground_truth_values = []
 
+        # Results are collected column by column into a ClassificationResultsTable.
+        # SingleSampleClassification objects are only made if someone asks for them.
+        ground_truth_codes = []
+        sample_indices = []
+        marginal_probabilities = []
+        normalization_factors = []
+        error_bounds = []
+
+        # Each test sample is only read once, so a test set view gathers its samples
+        # straight from its parent one class at a time, rather than being materialized.
+        class_bndry_index = 0
         for test_class_index in range( test_set.num_classes ):
-            num_class_imgs, num_class_features = test_set.data_list[ test_class_index ].shape
-
-            # Get tiling ready if need be
-            if test_set.num_samples_per_group > 1:
-                tile_results_in_this_sample_group = []
+            num_class_imgs = test_set.class_sizes[ test_class_index ]
+            if test_set.is_view:
+                test_class_matrix = test_set.GetFeatureMatrix(
+                        rows=slice( class_bndry_index, class_bndry_index + num_class_imgs ) )
+            else:
+                test_class_matrix = test_set.data_list[ test_class_index ]
 
+            block = classify_block( training_set, test_class_matrix, feature_weights.values )
+            block_probabilities, block_norm_factors = block[:2]
+            block_error_bounds = block[2] if len( block ) > 2 else None
             for test_image_index in range( num_class_imgs ):
-                one_image_features = test_set.data_list[ test_class_index ][ test_image_index,: ]
-                result = SingleSampleClassification._WND5( training_set, one_image_features, feature_weights.values )
-                
-                if norm_factor_threshold and (result.normalization_factor > norm_factor_threshold):
+                norm_factor = block_norm_factors[ test_image_index ]
+                # non-calls have a NAN normalization factor, and are kept
+                if norm_factor_threshold and not np.isnan( norm_factor ) and \
+                        norm_factor > norm_factor_threshold:
                     continue
-                result.source_filepath = test_set.sample_names[ test_class_index ][ test_image_index ]
-                result.ground_truth_class_name = test_set.class_names[ test_class_index ]
-                result.batch_number = batch_number
-                result.name = name
-                if result.marginal_probabilities:
-                    # Sometimes the result comes back with a non-call, like when the sample image
-                    # collides with every test image
-                    marg_probs = np.array( result.marginal_probabilities )
-                    result.predicted_class_name = training_set.class_names[ marg_probs.argmax() ]
-                else:
-                    marg_probs = np.array( [np.nan] * training_set.num_classes )
-                    result.predicted_class_name = "*Collided with every training sample*"
-
-                # interpolated value, if applicable
-                if train_set_interp_coeffs is not None:
-                    interp_val = np.sum( marg_probs * train_set_interp_coeffs )
-                    result.predicted_value = interp_val
-                    batch_result.predicted_values.append( interp_val )
-
-                if test_set_interp_coeffs is not None:
-                    result.ground_truth_value = test_set_interp_coeffs[ test_class_index ]
-                    batch_result.ground_truth_values.append( test_set_interp_coeffs[ test_class_index ] )
-
-                # Helps to identify which results correspond with which sample
-                result.samplegroupid = test_set.sample_group_ids[ test_class_index ][ test_image_index ]
-                result.samplesequenceid = test_set.sample_sequence_ids[ test_class_index ][ test_image_index ]
-
-                if test_set.num_samples_per_group > 1:
-                    result.tile_index = len( tile_results_in_this_sample_group )
-                    result.num_samples_in_group = test_set.num_samples_per_group
-
-                if not quiet:
-                    result.Print( line_item=True )
-                batch_result.individual_results.append( result )
-
-                # TILING SECTION:
-                # Create a whole image classification result that
-                # is the average of all the calls from all the tiles
-                if test_set.num_samples_per_group > 1:
-                    tile_results_in_this_sample_group.append( result )
-                    if len( tile_results_in_this_sample_group ) >= test_set.num_samples_per_group:
-                        aggregated_result = SingleSampleClassification()
-                        # Use the last result from above
-                        aggregated_result.source_filepath = result.source_filepath
-                        aggregated_result.tile_index = 'AVG'
-                        aggregated_result.ground_truth_class_name = result.ground_truth_class_name
-                        marg_prob_lists = [ [] for i in xrange( training_set.num_classes ) ]
-                        norm_factor_list = []
-                        for tile_result in tile_results_in_this_sample_group:
-                            if tile_result.marginal_probabilities:
-                                # Sometimes the result comes back with a non-call, like when the sample image
-                                # collides with every test image
-                                for class_index, val in enumerate( tile_result.marginal_probabilities ):
-                                    marg_prob_lists[ class_index ].append( val )
-                                norm_factor_list.append( tile_result.normalization_factor )
-
-                        if any( [ len( class_marg_prob_list ) <= 0 for class_marg_prob_list in marg_prob_lists ] ):
-                            aggregated_result.marginal_probabilities = np.array( [np.nan] * training_set.num_classes )
-                            aggregated_result.predicted_class_name = "*Collided with every training image*"
-                        else:
-                            marg_probs = [ sum( l ) / float( len( l ) ) for l in marg_prob_lists ]
-                            aggregated_result.marginal_probabilities = marg_probs
-                            np_marg_probs = np.array( marg_probs )
-                            aggregated_result.predicted_class_name = training_set.class_names[ np_marg_probs.argmax() ]
-                            aggregated_result.normalization_factor = sum(norm_factor_list)/float(len(norm_factor_list))
-
-                            # interpolated value, if applicable
-                            if train_set_interp_coeffs is not None:
-                                aggregated_result.predicted_value = np.sum( np_marg_probs * train_set_interp_coeffs )
-                                batch_result.tiled_predicted_values.append( aggregated_result.predicted_value )
-                            if test_set_interp_coeffs is not None:
-                                aggregated_result.ground_truth_value = test_set_interp_coeffs[ test_class_index ]
-                                batch_result.tiled_ground_truth_values.append( aggregated_result.ground_truth_value )
-                        # Save references to the tiled results on the aggregated result
-                        # To facilitate creation of graphs, heatmaps, etc
-                        aggregated_result.tiled_results = tile_results_in_this_sample_group
-                        batch_result.tiled_results.append( aggregated_result )
-                        if not quiet:
-                            aggregated_result.Print( line_item=True )
-
-                        # now reset for the next sample group
-                        tile_results_in_this_sample_group = []
-                        tile_count = 0
+                ground_truth_codes.append( test_class_index )
+                sample_indices.append( class_bndry_index + test_image_index )
+                marginal_probabilities.append( block_probabilities[ test_image_index ].tolist() )
+                normalization_factors.append( norm_factor )
+                if block_error_bounds is not None:
+                    error_bounds.append( block_error_bounds[ test_image_index ] )
+            class_bndry_index += num_class_imgs
+            instrumentation.Progress( 'FeatureSpaceClassification.' + method_name,
+                    class_bndry_index, test_set.num_samples )
+
+        # Helps to identify which results correspond with which sample
+        sample_names = list( test_set._contiguous_sample_names )
+        group_ids = list( test_set._contiguous_sample_group_ids )
+        sequence_ids = list( test_set._contiguous_sample_sequence_ids )
+        ground_truth_values = None
+        if test_set_interp_coeffs is not None:
+            ground_truth_values = test_set_interp_coeffs[ ground_truth_codes ]
+        table = ClassificationResultsTable( training_set.class_names, test_set.class_names,
+                ground_truth_codes, marginal_probabilities, normalization_factors,
+                source_filepaths=[ sample_names[i] for i in sample_indices ],
+                names=name, batch_numbers=batch_number, sample_indices=sample_indices,
+                sample_group_ids=[ group_ids[i] for i in sample_indices ],
+                sample_sequence_ids=[ sequence_ids[i] for i in sample_indices ],
+                ground_truth_values=ground_truth_values,
+                interpolation_coefficients=train_set_interp_coeffs,
+                error_bounds=error_bounds if len( error_bounds ) == len( ground_truth_codes ) else None )
+        batch_result.individual_results = table.Rows()
+        if train_set_interp_coeffs is not None:
+            batch_result.predicted_values = table.predicted_values.tolist()
+        if test_set_interp_coeffs is not None:
+            batch_result.ground_truth_values = ground_truth_values.tolist()
+
+        # TILING SECTION:
+        # Create a whole image classification result for each sample group that
+        # is the average of all the calls from all the tiles
+        if tiled:
+            # Group the tiles by the sample group they came from, not by position, since
+            # the normalization factor threshold may have dropped some of them. Rows are
+            # in test set order, so each group's remaining tiles are consecutive.
+            samples_per_group = test_set.num_samples_per_group
+            row_sample_indices = np.asarray( sample_indices, dtype=np.intp )
+            row_groups = row_sample_indices // samples_per_group
+            new_group = np.ones( len( table ), dtype=bool )
+            new_group[ 1: ] = row_groups[ 1: ] != row_groups[ :-1 ]
+            group_numbers = np.cumsum( new_group ) - 1
+            group_starts = np.flatnonzero( new_group )
+            rows = np.arange( len( table ) )
+            tile_rows = np.full( ( len( group_starts ), samples_per_group ), -1, dtype=np.intp )
+            tile_rows[ group_numbers, rows - group_starts[ group_numbers ] ] = rows
+            table.tile_indices = row_sample_indices % samples_per_group
+            table.num_samples_in_group = samples_per_group
+
+            tiled_table = table.AggregateTiles( tile_rows, tile_aggregation )
+            batch_result.tiled_results = tiled_table.Rows()
+            called = ~tiled_table.Collisions()
+            if train_set_interp_coeffs is not None:
+                batch_result.tiled_predicted_values = tiled_table.predicted_values[ called ].tolist()
+            else:
+                batch_result.tiled_predicted_values = []
+            if test_set_interp_coeffs is not None:
+                batch_result.tiled_ground_truth_values = tiled_table.ground_truth_values[ called ].tolist()
+            else:
+                batch_result.tiled_ground_truth_values = []
+
+        # One record per result, printed as its line item unless quiet
+        record_name = 'FeatureSpaceClassification.' + method_name + '.result'
+        with instrumentation.Printing( quiet ):
+            if tiled and instrumentation.Enabled():
+                # Each whole-sample result follows its last tile
+                last_tiles = tiled_table.tile_rows.max( axis=1 )
+                start = 0
+                for group_index, last_tile in enumerate( last_tiles ):
+                    table.RecordRows( record_name, xrange( start, last_tile + 1 ) )
+                    tiled_table.RecordRows( record_name, [ group_index ] )
+                    start = last_tile + 1
+                table.RecordRows( record_name, xrange( start, len( table ) ) )
+            else:
+                table.RecordRows( record_name )
         np.seterr (all='raise')
         return batch_result
 
+#=================================================================================
+class WND5NeighborIndex( object ):
+    """Per-class spatial indexes (scipy.spatial.cKDTree) over a training set multiplied
+    by its feature weights, built once, for approximating WND5 on large training sets.
+
+    The WND5 similarity of a test sample to a class is the mean of d^-10 over the
+    class's training samples, d being the distance in the weight-scaled feature space,
+    so it's dominated by the closest ones. ClassifyBlock() evaluates the k nearest
+    training samples of each class exactly, and bounds the contribution of the rest
+    of the class by the distance to the k-th one.
+
+    Requires the package scipy."""
+
+    def __init__( self, name=None ):
+        """Constructor"""
+
+        self.name = name
+        #: Names of the features the index expects, in column order
+        self.feature_names = None
+        self.class_names = None
+        self.class_sizes = None
+        #: Feature weights the training samples were multiplied by
+        self.weights = None
+        #: One cKDTree per class
+        self.trees = None
+        #: The training samples of each class, unscaled, to check for collisions
+        self.training_matrices = None
+
+    #==============================================================
+    def __str__( self ):
+        outstr = '<' + self.__class__.__name__
+        if self.name:
+            outstr += ' "' + self.name + '"'
+        if self.feature_names is not None:
+            outstr += ' n_features=' + str( len( self.feature_names ) )
+        if self.class_sizes is not None:
+            outstr += ' n_training_samples=' + str( sum( self.class_sizes ) )
+        return outstr + '>'
+    #==============================================================
+    def __repr__( self ):
+        return str(self)
+
+    #==============================================================
+    @classmethod
+    def NewFromFeatureSpace( cls, training_set, feature_weights, name=None ):
+        """Build the trees over the classes of training_set times feature_weights."""
+
+        if not isinstance( training_set, FeatureSpace ):
+            raise ValueError( 'First argument to NewFromFeatureSpace must be of type "FeatureSpace", you gave a {0}'.format( type( training_set ).__name__ ) )
+        if not isinstance( feature_weights, FeatureWeights ):
+            raise ValueError( 'Second argument to NewFromFeatureSpace must be of type "FeatureWeights" or derived class, you gave a {0}'.format( type( feature_weights ).__name__ ) )
+        if training_set.feature_names != feature_weights.feature_names:
+            raise ValueError("Can't build index, features don't match. Try a FeatureReduce()" )
+
+        from scipy.spatial import cKDTree
+
+        if name is None:
+            name = training_set.name
+
+        new_index = cls( name=name )
+        new_index.feature_names = training_set.feature_names[:]
+        new_index.class_names = training_set.class_names[:]
+        new_index.class_sizes = list( training_set.class_sizes )
+        new_index.weights = np.array( feature_weights.values, dtype=float )
+        new_index.trees = [ cKDTree( class_matrix * new_index.weights ) \
+                for class_matrix in training_set.data_list ]
+        new_index.training_matrices = list( training_set.data_list )
+        return new_index
+
+    #==============================================================
+    def ClassifyBlock( self, test_block, num_neighbors ):
+        """Approximate WND5 classification of each row of the matrix test_block.
+
+        For each class, the WND5 sum over the num_neighbors nearest training samples
+        is exact, and each of the other n - num_neighbors samples of the class is at
+        least as far away as the num_neighbors-th one, so the class's similarity is
+        in [ lower, lower + ( n - num_neighbors ) * d_k^-10 ]. The marginal probabilities
+        are calculated from the lower ends, and each sample's error bound is the
+        largest difference, over all classes, between its marginal probability and
+        any marginal probability within the bounds of the similarities. The error bound
+        is 0 for classes with no more than num_neighbors training samples.
+
+        Training samples that collide with the test sample, i.e., whose features differ
+        by less than machine epsilon in total, are left out as in
+        SingleSampleClassification._WND5().
+
+        Returns the tuple ( marginal_probabilities, normalization_factors, error_bounds ),
+        a row of NANs and NANs for non-calls."""
+
+        test_block = np.asarray( test_block, dtype=float )
+        scaled_block = test_block * self.weights
+        num_samples = len( test_block )
+        num_classes = len( self.trees )
+
+        oldsettings = np.seterr( all='ignore' )
+        lower = np.empty( ( num_samples, num_classes ) )
+        upper = np.empty( ( num_samples, num_classes ) )
+        for class_index in range( num_classes ):
+            num_tiles = self.class_sizes[ class_index ]
+            k = min( num_neighbors, num_tiles )
+            lower[ :, class_index ], upper[ :, class_index ], crowded = \
+                self._ClassSimilarities( class_index, test_block, scaled_block, k )
+            # If the k-th neighbor may be a collision, not all of the collisions are
+            # necessarily among the neighbors, so those samples get all of the class.
+            if k < num_tiles and crowded.any():
+                lower[ crowded, class_index ], upper[ crowded, class_index ], _ = \
+                    self._ClassSimilarities( class_index, test_block[ crowded ],
+                            scaled_block[ crowded ], num_tiles )
+
+        normalization_factors = lower.sum( axis=1 )
+        marginal_probabilities = lower / normalization_factors[ :, None ]
+        # Each class's marginal probability is lowest when its similarity is at its
+        # lower end and the others' are at their upper ends, and vice versa.
+        lower_others = normalization_factors[ :, None ] - lower
+        upper_others = upper.sum( axis=1 )[ :, None ] - upper
+        lowest = lower / ( lower + upper_others )
+        highest = upper / ( upper + lower_others )
+        error_bounds = np.maximum( marginal_probabilities - lowest,
+                highest - marginal_probabilities ).max( axis=1 )
+        np.seterr( **oldsettings )
+        return marginal_probabilities, normalization_factors, error_bounds
+
+    #==============================================================
+    def _ClassSimilarities( self, class_index, test_block, scaled_block, k ):
+        """Returns the lower and upper bounds of the WND5 similarities of the rows of
+        test_block to class class_index from their k nearest neighbors, NAN for rows that
+        collided with the whole class, and a boolean array that's True for rows whose
+        k-th neighbor may be a collision."""
+
+        num_samples = len( test_block )
+        num_tiles = self.class_sizes[ class_index ]
+        epsilon = np.finfo( np.float ).eps
+        # The weighted distance of a collision can't be more than this
+        collision_dist = 2 * epsilon * np.abs( self.weights ).max()
+
+        dists, indices = self.trees[ class_index ].query( scaled_block, k=k )
+        dists = dists.reshape( num_samples, k )
+        indices = indices.reshape( num_samples, k )
+
+        collisions = np.zeros( dists.shape, dtype=bool )
+        training_matrix = self.training_matrices[ class_index ]
+        for row, col in zip( *np.nonzero( dists <= collision_dist ) ):
+            collisions[ row, col ] = np.sum( np.absolute(
+                    training_matrix[ indices[ row, col ] ] - test_block[ row ] ) ) < epsilon
+        denoms = num_tiles - collisions.sum( axis=1 )
+
+        # The exponent -5 is the "5" in "WND5"
+        wnd_sums = np.where( collisions, 0, np.square( dists ) ** -5 ).sum( axis=1 )
+        if k < num_tiles:
+            remainders = ( num_tiles - k ) * np.square( dists[ :, -1 ] ) ** -5
+        else:
+            remainders = 0
+        lower = wnd_sums / denoms
+        upper = ( wnd_sums + remainders ) / denoms
+        # This sample collided with every sample in the class: a non-call
+        lower[ denoms == 0 ] = np.nan
+        upper[ denoms == 0 ] = np.nan
+        return lower, upper, dists[ :, -1 ] <= collision_dist
+
+#=================================================================================
+class LeastSquaresRegressionModel( object ):
+    """A fitted linear least squares regression over a feature space weighed by
+    PearsonFeatureWeights. The system is solved once in NewFromFeatureSpace(); after that
+    any number of samples can be predicted via Predict() with a single matrix-vector product.
+
+    Instances contain only feature names and numpy arrays and can be pickled
+    for reuse outside of the experiment that fit them."""
+
+    def __init__( self, name=None ):
+        """Constructor"""
+
+        self.name = name
+        #: Names of the features the model expects, in column order
+        self.feature_names = None
+        #: Feature weights applied to the columns before the fit
+        self.weights = None
+        #: Regression coefficients for the weighed features
+        self.coefficients = None
+        #: The y-intercept
+        self.intercept = None
+        #: Rank of the augmented training matrix
+        self.rank = None
+        self.num_training_samples = None
+        #: Normalizer of the training set, to normalize raw samples in Predict()
+        self.normalizer = None
+
+    #==============================================================
+    def __str__( self ):
+        outstr = '<' + self.__class__.__name__
+        if self.name:
+            outstr += ' "' + self.name + '"'
+        if self.feature_names is not None:
+            outstr += ' n_features=' + str( len( self.feature_names ) )
+        if self.num_training_samples is not None:
+            outstr += ' n_training_samples=' + str( self.num_training_samples )
+        return outstr + '>'
+    #==============================================================
+    def __repr__( self ):
+        return str(self)
+
+    #==============================================================
+    @classmethod
+    def NewFromFeatureSpace( cls, training_set, feature_weights, name=None ):
+        """Solve the least squares system for training_set once, after multiplying the
+        feature space by the feature weights and augmenting it with a column of 1's
+        signifying the constant, i.e., the y-intercept."""
+
+        if not isinstance( training_set, FeatureSpace ):
+            raise ValueError( 'First argument to NewFromFeatureSpace must be of type "FeatureSpace", you gave a {0}'.format( type( training_set ).__name__ ) )
+        if not isinstance( feature_weights, FeatureWeights ):
+            raise ValueError( 'Second argument to NewFromFeatureSpace must be of type "FeatureWeights" or derived class, you gave a {0}'.format( type( feature_weights ).__name__ ) )
+        if training_set.feature_names != feature_weights.feature_names:
+            raise ValueError("Can't fit, features don't match. Try a FeatureReduce()" )
+
+        from numpy.linalg import lstsq
+
+        if name is None:
+            name = training_set.name
+
+        new_model = cls( name=name )
+        new_model.feature_names = training_set.feature_names[:]
+        new_model.weights = np.array( feature_weights.values, dtype='double' )
+        new_model.num_training_samples = training_set.num_samples
+        if training_set.feature_minima is not None:
+            new_model.normalizer = training_set.GetNormalizer()
+
+        oldsettings = np.seterr(all='ignore')
+        augmented_train_matrix = np.hstack( [ training_set.data_matrix * new_model.weights,
+                np.ones( ( training_set.num_samples, 1 ) ) ] )
+        solution, residues, new_model.rank, sing_vals = lstsq( augmented_train_matrix,
+                np.array( training_set._contiguous_ground_truth_values, dtype='double' ) )
+        np.seterr(**oldsettings)
+
+        new_model.coefficients = solution[:-1]
+        new_model.intercept = solution[-1]
+        return new_model
+
+    #==============================================================
+    def Predict( self, samples, normalize=False ):
+        """Returns a numpy array of predicted values, one per row.
+
+        samples - a FeatureSpace, or a 2D numpy array (or 1D for a single sample)
+            whose columns are in the same order as self.feature_names.
+        normalize - if True, samples are raw features, to be normalized like the
+            training set was first."""
+
+        if isinstance( samples, FeatureSpace ):
+            if samples.feature_names != self.feature_names:
+                raise ValueError("Can't predict, features don't match. Try a FeatureReduce()" )
+            samples = samples.data_matrix
+
+        if normalize:
+            if self.normalizer is None:
+                raise ValueError( "Can't normalize samples, model was fit on a training set that wasn't normalized." )
+            samples = self.normalizer.Apply( np.asarray( samples, dtype='double' ) )
+
+        oldsettings = np.seterr(all='ignore')
+        # ( X * w ) . c == X . ( w * c )
+        predicted_values = np.dot( samples, self.weights * self.coefficients ) + self.intercept
+        np.seterr(**oldsettings)
+        return predicted_values
+
 #=================================================================================
 class FeatureSpaceRegression( FeatureSpacePrediction ):
     """Container for SingleSampleRegression instances.
@@ -756,6 +1666,9 @@ class FeatureSpaceRegression( FeatureSpacePrediction ):
         super( FeatureSpaceRegression, self ).__init__( *args, **kwargs )
         self.predicted_values = []
 
+        #: The LeastSquaresRegressionModel used to generate predicted values, if applicable
+        self.model = None
+
     #==============================================================    
     def __str__( self ):
         outstr = '<' + self.__class__.__name__
@@ -785,14 +1698,15 @@ class FeatureSpaceRegression( FeatureSpacePrediction ):
         if self.std_err == None:
             self.GenerateStats()
 
-        print "==========================================="
-        print "Number of observations: {0}".format( self.num_classifications )
+        print >> OutputStream(), "==========================================="
+        print >> OutputStream(), "Number of observations: {0}".format( self.num_classifications )
         if self.std_err != None:
-            print "Standard error of predicted vs. ground truth values: {0}".format( self.std_err )
+            print >> OutputStream(), "Standard error of predicted vs. ground truth values: {0}".format( self.std_err )
         #print "p-value for this split: {0}".format( self.p_value )
 
     #=====================================================================
     @classmethod
+    @instrumented( 'FeatureSpaceRegression.NewMultivariateLinear' )
     def NewMultivariateLinear( cls, test_set, feature_weights, name=None, batch_number=None,
             quiet=False ):
         """Uses Pearson-coefficient weighted Multivatiate Linear classifier."""
@@ -810,13 +1724,13 @@ class FeatureSpaceRegression( FeatureSpacePrediction ):
         # say what we're gonna do
         if not quiet:
             out_str = 'Classifying test set "{0}" ({1} images, {2} features)\n\tagainst training set "{3}" ({4} images)'
-            print out_str.format( test_set.name, test_set.num_samples, \
+            print >> OutputStream(), out_str.format( test_set.name, test_set.num_samples, \
               len( test_set.feature_names ), feature_weights.associated_feature_space.name, \
               feature_weights.associated_feature_space.num_samples )
 
         if not quiet:
             column_header = "image\tground truth\tpred. val."
-            print column_header
+            print >> OutputStream(), column_header
 
         batch_result = cls( feature_weights.associated_feature_space, test_set, feature_weights,
                 name, batch_number )
@@ -833,18 +1747,75 @@ class FeatureSpaceRegression( FeatureSpacePrediction ):
             result.source_filepath = test_set.sample_names[ test_image_index ]
             result.ground_truth_value = test_set.ground_truth_values[ test_image_index ]
             batch_result.predicted_values.append( result.predicted_value )
-
-            if not quiet:
-                result.Print( line_item = True )
             batch_result.individual_results.append( result )
 
+        # One record per result, printed as its line item unless quiet
+        with instrumentation.Printing( quiet ):
+            if instrumentation.Enabled():
+                for result in batch_result.individual_results:
+                    result.Record( 'FeatureSpaceRegression.NewMultivariateLinear.result' )
+
         batch_result.GenerateStats()
         return batch_result
 
     #=====================================================================
     @classmethod
+    def _LeastSquaresLeaveOneOut( cls, A, ground_truth_values, sample_group_ids ):
+        """Leave-one-group-out least squares predictions for every row of the
+        augmented matrix A, computed from a single factorization of A.
+
+        Don't call this function directly, use NewLeastSquares() instead.
+
+        For a full-rank A with hat matrix H = A (A^T A)^-1 A^T and residuals e = y - Hy,
+        the prediction for the rows G of a left-out sample group by a model trained on
+        all other rows is y_G - (I - H_GG)^-1 e_G, i.e., the same value obtained by
+        solving lstsq() again without those rows. Groups for which I - H_GG is
+        ill-conditioned (removing the group makes the reduced problem rank-deficient)
+        and rank-deficient A's fall back to an explicit lstsq() on the remaining rows.
+
+        Returns a numpy array of predicted values in row order of A."""
+
+        from numpy.linalg import lstsq, svd, solve, cond
+
+        y = np.asarray( ground_truth_values, dtype='double' )
+        sample_group_ids = np.asarray( sample_group_ids )
+        num_samples, num_cols = A.shape
+        predicted_values = np.empty( num_samples )
+
+        U, s, Vt = svd( A, full_matrices=False )
+        rank_tol = s.max() * max( A.shape ) * np.finfo( s.dtype ).eps if len( s ) else 0
+        full_rank = np.sum( s > rank_tol ) == num_cols
+
+        if full_rank:
+            # Residuals from the full fit, H y = U U^T y
+            residuals = y - np.dot( U, np.dot( U.T, y ) )
+        # Beyond this condition number the reduced problem is effectively rank-deficient
+        max_cond = 1.0 / np.sqrt( np.finfo( s.dtype ).eps )
+
+        # Row indices belonging to each sample group
+        group_ids, group_index = np.unique( sample_group_ids, return_inverse=True )
+        group_order = np.argsort( group_index, kind='mergesort' )
+        group_bounds = np.cumsum( np.bincount( group_index ) )[:-1]
+
+        for rows in np.split( group_order, group_bounds ):
+            if full_rank:
+                U_g = U[ rows ]
+                M = np.eye( len( rows ) ) - np.dot( U_g, U_g.T )
+                if cond( M ) < max_cond:
+                    predicted_values[ rows ] = y[ rows ] - solve( M, residuals[ rows ] )
+                    continue
+            mask = np.ones( num_samples, dtype=bool )
+            mask[ rows ] = False
+            coeffs = lstsq( A[ mask ], y[ mask ] )[0]
+            predicted_values[ rows ] = np.dot( A[ rows ], coeffs )
+
+        return predicted_values
+
+    #=====================================================================
+    @classmethod
+    @instrumented( 'FeatureSpaceRegression.NewLeastSquares' )
     def NewLeastSquares( cls, training_set, test_set, feature_weights, name=None,
-            batch_number=None, leave_one_out=False, quiet=False ):
+            batch_number=None, leave_one_out=False, quiet=False, model=None ):
         """Uses Linear Least Squares Regression classifier in a feature space filtered/weighed
         by Pearson coefficients.
         
@@ -852,6 +1823,10 @@ class FeatureSpaceRegression( FeatureSpacePrediction ):
         1. if training_set != test_set and both not none: straight classification
         2. if training_set is not None and test_set is None = Leave one out cross validation
         3. if training_set == test_set == not None: Shuffle/Split cross validation
+
+        model - optional previously fit LeastSquaresRegressionModel to use instead of
+            solving the system again for training_set (ignored for leave-one-out).
+            The fitted model is saved in the returned object's "model" member.
         """
 
         # Type checking
@@ -866,29 +1841,31 @@ class FeatureSpaceRegression( FeatureSpacePrediction ):
 
         # If there's both a training_set and a test_set, they both have to have the same features
         if training_set and test_set:
-            if training_set.feature_names != training_set.feature_names:
+            if training_set.feature_names != test_set.feature_names:
                 raise ValueError("Can't classify, features don't match. Try a FeatureReduce()" )
         # Check feature_weights
         if training_set.feature_names != feature_weights.feature_names:
             raise ValueError("Can't classify, features don't match. Try a FeatureReduce()" )
-
-        # Least squares regression requires a featres matrix augmented with ones
-        # signifying the constant, i.e., the y-intercept
-        # Make a copy of the feature sets to augment while leaving original matrices unchanged.
-        from copy import deepcopy
-        augmented_train_set = deepcopy( training_set )
+        # A model to reuse must have been fit for the same features
+        if model is not None:
+            if not isinstance( model, LeastSquaresRegressionModel ):
+                raise ValueError( 'Arg "model" must be of type "LeastSquaresRegressionModel", you gave a {0}'.format( type( model ).__name__ ) )
+            if model.feature_names != feature_weights.feature_names or \
+                    len( model.weights ) != len( feature_weights.feature_names ):
+                raise ValueError( "Can't reuse model fit for {0} features with feature weights for {1} features, features don't match.".format(
+                    len( model.weights ), len( feature_weights.feature_names ) ) )
 
         # figure out what we're gonna do
         if training_set and not test_set:
             leave_one_out = True
             cross_validation = True
-            augmented_test_set = augmented_train_set 
+            samples_to_predict = training_set
         elif training_set is test_set:
             cross_validation = True
-            augmented_test_set = augmented_train_set
+            samples_to_predict = training_set
         else:
-            augmented_test_set = deepcopy( test_set )
             cross_validation = False
+            samples_to_predict = training_set if leave_one_out else test_set
 
         # say what we're gonna do
         if not quiet:
@@ -906,51 +1883,51 @@ class FeatureSpaceRegression( FeatureSpacePrediction ):
                       test_set.name, test_set.num_samples, len( test_set.feature_names ) )
                 out_str += '\n\tagainst training set "{0}" ({1} images)'.format(
                             training_set.name, training_set.num_samples )
-            print out_str
-
-        # Now, build the augmented feature matrices, which includes multiplying the feature
-        # space by the weights, and augmenting the matrices with 1's
-
-        oldsettings = np.seterr(all='ignore')
-
-        augmented_train_set.data_matrix *= feature_weights.values
-        augmented_train_set.data_matrix = np.hstack( 
-              [ augmented_train_set.data_matrix, np.ones( ( augmented_train_set.num_samples, 1 ) ) ] )
-        augmented_train_set.num_features += 1 # Tell the object it has a new feature column
-        if not cross_validation:
-            augmented_test_set.data_matrix *= feature_weights.values
-            augmented_test_set.data_matrix = np.hstack( 
-              [ augmented_test_set.data_matrix, np.ones( ( augmented_test_set.num_samples, 1 ) ) ] )
-            augmented_test_set.num_features += 1 # Tell the object it has a new feature column
+            print >> OutputStream(), out_str
 
         if not quiet:
-            print "image\tground truth\tpred. val."
+            print >> OutputStream(), "image\tground truth\tpred. val."
 
         batch_result = cls( training_set, test_set, feature_weights, name, batch_number )
 
-        if augmented_test_set.ground_truth_values is not None and \
-                len( augmented_test_set.ground_truth_values ) != 0:
-            batch_result.ground_truth_values = augmented_test_set.ground_truth_values
-
-        intermediate_train_set = augmented_train_set
-        for test_image_index in range( augmented_test_set.num_samples ):
-            if leave_one_out:
-                sample_group_id = augmented_train_set.sample_group_ids[ test_image_index ]
-                intermediate_train_set = augmented_train_set.SampleReduce(\
-                        leave_out_sample_group_ids = sample_group_id, override=True)
-            one_image_features = augmented_test_set.data_matrix[ test_image_index,: ]
-            result = SingleSampleRegression._LeastSquares( \
-                           one_image_features, intermediate_train_set )
+        if samples_to_predict.ground_truth_values is not None and \
+                len( samples_to_predict.ground_truth_values ) != 0:
+            batch_result.ground_truth_values = samples_to_predict._contiguous_ground_truth_values
+
+        oldsettings = np.seterr(all='ignore')
+
+        if leave_one_out:
+            # Build the augmented feature matrix, which includes multiplying the feature
+            # space by the weights, and augmenting the matrix with 1's signifying the constant,
+            # i.e., the y-intercept. A new matrix is built, leaving the original unchanged.
+            augmented_train_matrix = np.hstack( [ training_set.data_matrix * \
+                np.array( feature_weights.values ), np.ones( ( training_set.num_samples, 1 ) ) ] )
+            predicted_values = cls._LeastSquaresLeaveOneOut( augmented_train_matrix,
+                    training_set._contiguous_ground_truth_values,
+                    training_set._contiguous_sample_group_ids )
+        else:
+            if model is None:
+                model = LeastSquaresRegressionModel.NewFromFeatureSpace( training_set, feature_weights )
+            batch_result.model = model
+            predicted_values = model.Predict( samples_to_predict )
+
+        for test_image_index in range( samples_to_predict.num_samples ):
+            result = SingleSampleRegression()
+            result.predicted_value = predicted_values[ test_image_index ]
             result.batch_number = batch_result.batch_number
             result.name = name
-            result.source_filepath = augmented_test_set.sample_names[ test_image_index ]
-            result.ground_truth_value = augmented_test_set.ground_truth_values[ test_image_index ]
+            result.source_filepath = samples_to_predict._contiguous_sample_names[ test_image_index ]
+            result.ground_truth_value = \
+                    samples_to_predict._contiguous_ground_truth_values[ test_image_index ]
             batch_result.predicted_values.append( result.predicted_value )
-
-            if not quiet:
-                result.Print( line_item = True )
             batch_result.individual_results.append( result )
 
+        # One record per result, printed as its line item unless quiet
+        with instrumentation.Printing( quiet ):
+            if instrumentation.Enabled():
+                for result in batch_result.individual_results:
+                    result.Record( 'FeatureSpaceRegression.NewLeastSquares.result' )
+
         # return settings to original
         np.seterr(**oldsettings)
 
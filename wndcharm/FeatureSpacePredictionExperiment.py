@@ -26,10 +26,12 @@
 
 import numpy as np
 from .utils import output_railroad_switch
+from . import instrumentation
+from .instrumentation import instrumented, OutputStream
 from .FeatureSpace import FeatureSpace, CheckIfClassNamesAreInterpolatable
 from .FeatureSpacePrediction import FeatureSpacePrediction, FeatureSpaceClassification, \
-        FeatureSpaceRegression
-from .FeatureWeights import FisherFeatureWeights, PearsonFeatureWeights
+        FeatureSpaceRegression, ClassificationResultsTable, _GroupSums
+from .FeatureWeights import FisherFeatureWeights, PearsonFeatureWeights, FisherScoreAccumulator
 from .SingleSamplePrediction import SingleSampleClassification
 
 #============================================================================
@@ -140,26 +142,60 @@ class FeatureSpacePredictionExperiment( FeatureSpacePrediction ):
     @output_railroad_switch
     def FeatureWeightsGridSearch( cls, start=None, stop=None, step=10, **kwargs ):
         """Takes same args as NewShuffleSplit. Calls ShuffleSplit for varying number of features.
+
+        For WND5 classification of a discrete feature space (classifier 'wnd5', the
+        default), the accuracy for every number of features is first obtained from a
+        single FeatureCountSweep() over the same splits, and NewShuffleSplit is only
+        called for the best one. Other classifiers call NewShuffleSplit for every
+        number of features.
+
+        A random_state of True or a RandomState is first turned into a single int
+        seed, so that every number of features, in the sweep and in the NewShuffleSplit
+        calls, is tested on the same splits.
+
+        A checkpoint file passed in kwargs is shared by the NewShuffleSplit calls for
+        all numbers of features, so an interrupted grid search resumes where it left off.
+        That takes an int random_state: otherwise the seed, and so the splits, differ
+        from one grid search to the next.
         
         Returns the instance of FeatureSpacePredictionExperiment that has best figure of merit."""
 
         best_exp = None
         max_classification_accuracy = 0
         features_accuracy_dict = {}
+        kwargs.pop( 'features_size', None )
+        feature_space = kwargs.get( 'feature_space' )
+        random_state = kwargs.get( 'random_state', True )
+        if random_state and type( random_state ) is not int:
+            kwargs[ 'random_state' ] = int( _GenerateSplitSeeds( random_state, 1 )[0] )
 
         try:
-            for n_features in xrange( start, stop, step ):
-                exp = cls.NewShuffleSplit( **kwargs ).GenerateStats()
-                features_accuracy_dict[ n_features ] = exp.classification_accuracy
-                if exp.classification_accuracy > max_classification_accuracy:
-                    best_exp = exp
-                    max_classification_accuracy = exp.classification_accuracy
+            # The sweep is WND5 only
+            if issubclass( cls, FeatureSpaceClassificationExperiment ) and \
+                    feature_space is not None and feature_space.discrete and \
+                    kwargs.get( 'classifier' ) in ( None, 'wnd5' ):
+                sweep_kwargs = dict( [ ( key, kwargs[ key ] ) for key in \
+                    ( 'n_iter', 'train_size', 'test_size', 'random_state', 'quiet' ) if key in kwargs ] )
+                features_accuracy_dict = cls.FeatureCountSweep( feature_space,
+                        range( start, stop, step ), **sweep_kwargs )
+                # Highest accuracy, and fewest features of those tied for it
+                best_n_features = min( features_accuracy_dict,
+                        key=lambda n: ( -features_accuracy_dict[ n ], n ) )
+                best_exp = cls.NewShuffleSplit( features_size=best_n_features, **kwargs ).GenerateStats()
+            else:
+                for n_features in xrange( start, stop, step ):
+                    exp = cls.NewShuffleSplit( features_size=n_features, **kwargs ).GenerateStats()
+                    features_accuracy_dict[ n_features ] = exp.classification_accuracy
+                    if exp.classification_accuracy > max_classification_accuracy:
+                        best_exp = exp
+                        max_classification_accuracy = exp.classification_accuracy
         finally:
-            print "==================================================="
+            print >> OutputStream(), "==================================================="
             for n_features in sorted( features_accuracy_dict.keys() ):
-                print n_features, ',' , features_accuracy_dict[ n_features ] 
-            print "==================================================="
-            best_exp.features_accuracy_dict = features_accuracy_dict
+                print >> OutputStream(), n_features, ',' , features_accuracy_dict[ n_features ] 
+            print >> OutputStream(), "==================================================="
+            if best_exp is not None:
+                best_exp.features_accuracy_dict = features_accuracy_dict
 
         return best_exp
 
@@ -190,11 +226,27 @@ class FeatureSpacePredictionExperiment( FeatureSpacePrediction ):
 
     #=====================================================================
     @classmethod
+    @instrumented( 'FeatureSpacePredictionExperiment.NewShuffleSplit' )
     def NewShuffleSplit( cls, feature_space, n_iter=5, name=None, features_size=0.15,
                            train_size=None, test_size=None, random_state=True, classifier=None,
-                           quiet=False, display=15 ):
+                           quiet=False, display=15, n_jobs=None, checkpoint=None ):
         """args train_size, test_size, and random_state are all passed through to Split()
-        feature_size if a float is feature usage fraction, if in is top n features."""
+        feature_size if a float is feature usage fraction, if in is top n features.
+
+        classifier - 'wnd5' (the default) or 'wnn' for discrete feature spaces,
+            'lstsq' (the default) or 'linear' for continuous ones.
+
+        n_jobs - number of worker processes to run the shuffle split iterations in.
+            None or 1 runs them serially in this process, -1 uses all CPUs. Workers
+            are forked from this process and share the memory pages of
+            feature_space.data_matrix, so only split seeds are sent to the workers,
+            and batch results stripped of their feature matrices are sent back.
+            For a given random_state, the results are identical to a serial run.
+        checkpoint - path to a results file. Each iteration's batch result is appended
+            to it as soon as the iteration finishes. Calling again with the same feature
+            space and args skips the iterations already in the file, so an interrupted
+            run can be resumed, or extended with a bigger n_iter if random_state is an int.
+            As with n_jobs, batch results don't keep their feature matrices."""
 
         experiment = cls( training_set=feature_space, test_set=feature_space, name=name )
         if isinstance( features_size, float ):
@@ -208,74 +260,586 @@ class FeatureSpacePredictionExperiment( FeatureSpacePrediction ):
         else:
             raise ValueError( 'Arg "features_size" must be valid float or int.' )
 
+        if n_jobs is not None and ( type( n_jobs ) is not int or n_jobs == 0 or n_jobs < -1 ):
+            raise ValueError( 'Arg "n_jobs" must be a positive int, -1 or None, got {0}'.format( n_jobs ) )
+
         if not quiet:
-            print "using top " + str( num_features ) + " features"
-
-        # If you passed the same random_state into Split, you'd get the same exact split for
-        # all n_iter. Therefore use the seed passed in here to predictably generate seeds
-        # for the Split() iterations.
-        if random_state:
-            from numpy.random import RandomState
-            from functools import partial
-            maxint = 2 ** 32 - 1
-            if random_state is True:
-                from numpy.random import randint as np_randint
-                randint = partial( np_randint, low=0, high=maxint )
-            elif type( random_state ) is int:
-                randint = partial( RandomState( random_state ).randint, low=0, high=maxint )
-            elif type( random_state ) is RandomState:
-                randint = partial( random_state.randint, low=0, high=maxint )
-            else:
-                raise ValueError( "arg random_state must be an int, instance of numpy.random.RandomState, or True")
-            experiment.use_error_bars = True
+            print >> OutputStream(), "using top " + str( num_features ) + " features"
+
+        # Draw all the seeds up front so that the splits don't depend on
+        # which process runs which iteration.
+        split_seeds = _GenerateSplitSeeds( random_state, n_iter )
+        experiment.use_error_bars = bool( random_state )
+        iteration_kwargs = { 'train_size': train_size, 'test_size': test_size,
+                'num_features': num_features, 'classifier': classifier,
+                'error_bars': experiment.use_error_bars }
+
+        if checkpoint is not None:
+            # n_iter isn't part of the key: the seeds for a given int random_state
+            # don't depend on it.
+            checkpoint = _Checkpoint( checkpoint, _CheckpointKey( 'NewShuffleSplit',
+                feature_space, random_state=random_state, **iteration_kwargs ) )
+
+        _RunIterations( experiment, feature_space, _ShuffleSplitIteration, _ShuffleSplitWorker,
+                list( enumerate( split_seeds ) ), iteration_kwargs, n_jobs, checkpoint,
+                'FeatureSpacePredictionExperiment.NewShuffleSplit.iteration',
+                "SHUFFLE SPLIT ITERATION", quiet, display )
+
+        if not quiet:
+            experiment.Print()
+        return experiment
+
+    #=====================================================================
+    @classmethod
+    @instrumented( 'FeatureSpacePredictionExperiment.NewNFold' )
+    def NewNFold( cls, feature_space, num_folds=5, name=None, features_size=0.15,
+            scheme=None, random_state=True, classifier=None, quiet=False,
+            display=15, n_jobs=None, checkpoint=None ):
+        """Cross-validation in which every sample is tested exactly once. Tiles/samples
+        sharing a sample group id are always kept in the same fold.
+
+        num_folds - number of folds, ignored when scheme='leave_one_group_out'
+        scheme - 'kfold': sample groups are dealt into folds irrespective of class,
+                 'stratified': each class is spread evenly over the folds (discrete
+                   feature spaces only),
+                 'leave_one_group_out': each sample group is its own fold.
+                 If None, 'stratified' for discrete feature spaces, otherwise 'kfold'.
+        random_state - True, int or RandomState to shuffle sample groups before
+            dealing them into folds, or False to use the order in the feature space.
+        n_jobs - as in NewShuffleSplit(), number of worker processes folds run in.
+        checkpoint - as in NewShuffleSplit(), path to a results file folds are appended
+            to as they finish. When resuming, the fold assignment is read back from
+            the file, so it's the same even if random_state is True.
+        Other args as in NewShuffleSplit().
+
+        For discrete feature spaces, per-class statistics and feature minima/maxima are
+        accumulated once per fold. Each fold's training set Fisher weights and
+        normalization ranges come from combining the other folds' statistics, so the full
+        feature matrix is only scanned once. Only the selected features of each
+        fold's samples are normalized and classified."""
+
+        if isinstance( features_size, float ):
+            if features_size < 0 or features_size > 1.0:
+                raise ValueError('Arg "features_size" must be on interval [0,1] if a float.')
+            num_features = int( round( features_size * feature_space.num_features ) )
+        elif isinstance( features_size, int ):
+            if features_size < 0 or features_size > feature_space.num_features:
+                raise ValueError( 'must specify num_features or feature_usage_fraction in kwargs')
+            num_features = features_size
         else:
-            # Samples split the same way all iterations,
-            # not useful except for testing results aggregation:
-            randint = lambda: None
-            experiment.use_error_bars = False
+            raise ValueError( 'Arg "features_size" must be valid float or int.' )
 
-        for split_index in range( n_iter ):
-            if not quiet:
-                print "=========================================="
-                print "SHUFFLE SPLIT ITERATION", str( split_index )
-            train_set, test_set = feature_space.Split(
-                train_size, test_size, random_state=randint(), quiet=quiet )
-            train_set.Normalize( quiet=quiet )
-            
-            if feature_space.discrete:
-                weights = \
-                  FisherFeatureWeights.NewFromFeatureSpace( train_set ).Threshold( num_features )
-            else:    
-                weights = \
-                  PearsonFeatureWeights.NewFromFeatureSpace( train_set ).Threshold( num_features )
+        if n_jobs is not None and ( type( n_jobs ) is not int or n_jobs == 0 or n_jobs < -1 ):
+            raise ValueError( 'Arg "n_jobs" must be a positive int, -1 or None, got {0}'.format( n_jobs ) )
+
+        if scheme is None:
+            scheme = 'stratified' if feature_space.discrete else 'kfold'
+        iteration_kwargs = { 'num_features': num_features, 'classifier': classifier }
+
+        if checkpoint is not None:
+            checkpoint = _Checkpoint( checkpoint, _CheckpointKey( 'NewNFold', feature_space,
+                num_folds=num_folds, scheme=scheme, random_state=random_state,
+                **iteration_kwargs ) )
+        if checkpoint is not None and checkpoint.completed:
+            folds = checkpoint.completed.values()[0][ 'folds' ]
+        else:
+            folds = _AssignFolds( feature_space, num_folds, scheme, random_state )
+        if checkpoint is not None:
+            checkpoint.record_items[ 'folds' ] = folds
+        experiment = cls( training_set=feature_space, test_set=feature_space, name=name )
+        experiment.use_error_bars = True
+
+        if not quiet:
+            print >> OutputStream(), "using top {0} features, {1} folds".format( num_features, len( folds ) )
+
+        # Accumulate each fold's statistics in one pass, then combine the statistics of
+        # all folds but one with running prefix and suffix merges.
+        train_accumulators = [ None ] * len( folds )
+        if feature_space.discrete:
+            group_ids = np.array( feature_space._contiguous_sample_group_ids )
+            labels = feature_space._contiguous_ground_truth_labels
+            fold_accumulators = []
+            for fold_group_ids in folds:
+                rows = np.flatnonzero( np.in1d( group_ids, fold_group_ids ) )
+                fold_accumulators.append( FisherScoreAccumulator(
+                    feature_names=feature_space.feature_names[:] ).AddSamples(
+                        feature_space.data_matrix[ rows ], [ labels[i] for i in rows ] ) )
+
+            prefixes = [ FisherScoreAccumulator( feature_names=feature_space.feature_names[:] ) ]
+            for acc in fold_accumulators[ : -1 ]:
+                prefixes.append( prefixes[-1].Merge( acc ) )
+            suffix = FisherScoreAccumulator( feature_names=feature_space.feature_names[:] )
+            for fold_index in reversed( range( len( folds ) ) ):
+                train_accumulators[ fold_index ] = prefixes[ fold_index ].Merge( suffix )
+                suffix = suffix.Merge( fold_accumulators[ fold_index ] )
+
+        tasks = zip( range( len( folds ) ), folds, train_accumulators )
+        _RunIterations( experiment, feature_space, _NFoldIteration, _NFoldWorker, tasks,
+                iteration_kwargs, n_jobs, checkpoint,
+                'FeatureSpacePredictionExperiment.NewNFold.iteration', "N-FOLD ITERATION",
+                quiet, display )
+
+        if not quiet:
+            experiment.Print()
+        return experiment
+
+#============================================================================
+def _AssignFolds( feature_space, num_folds, scheme, random_state ):
+    """Returns a list of lists of sample group ids, one list per fold."""
+
+    # Uniquify the sample group list, maintaining order
+    seen = set()
+    seen_add = seen.add
+    group_ids = [ x for x in feature_space._contiguous_sample_group_ids \
+            if not (x in seen or seen_add(x) ) ]
+
+    if scheme == 'leave_one_group_out':
+        num_folds = len( group_ids )
+    elif scheme not in ( 'kfold', 'stratified' ):
+        raise ValueError( 'Arg "scheme" must be one of "kfold", "stratified" or "leave_one_group_out", got {0}'.format( scheme ) )
+    if type( num_folds ) is not int or num_folds < 2 or num_folds > len( group_ids ):
+        raise ValueError( 'Arg num_folds must be an int on the interval [2,{0}] (# sample groups), got {1}'.format(
+            len( group_ids ), num_folds ) )
+
+    if random_state:
+        from numpy.random import RandomState
+        if random_state is True:
+            from numpy.random import shuffle
+        elif type( random_state ) is RandomState:
+            shuffle = random_state.shuffle
+        elif type( random_state ) is int:
+            shuffle = RandomState( random_state ).shuffle
+        else:
+            raise ValueError( 'Arg random_state must be an instance of numpy.random.RandomState, an int, or the value True')
+    else:
+        shuffle = lambda x: None
+
+    folds = [ [] for i in range( num_folds ) ]
+    if scheme == 'stratified':
+        if not feature_space.discrete:
+            raise ValueError( 'Stratified folds require a discrete feature space, "{0}" is continuous.'.format( feature_space.name ) )
+        group_labels = dict( zip( reversed( feature_space._contiguous_sample_group_ids ),
+                reversed( feature_space._contiguous_ground_truth_labels ) ) )
+        # Deal out each class' groups round robin, continuing where the last class left
+        # off, so the folds are balanced in size as well as class composition.
+        next_fold = 0
+        for class_name in feature_space.class_names:
+            class_group_ids = [ x for x in group_ids if group_labels[ x ] == class_name ]
+            shuffle( class_group_ids )
+            for group_id in class_group_ids:
+                folds[ next_fold ].append( group_id )
+                next_fold = ( next_fold + 1 ) % num_folds
+    else:
+        shuffle( group_ids )
+        for fold_index, fold_group_ids in enumerate( np.array_split( group_ids, num_folds ) ):
+            folds[ fold_index ] = [ int( x ) for x in fold_group_ids ]
+
+    return [ sorted( fold ) for fold in folds ]
 
+#============================================================================
+def _GenerateSplitSeeds( random_state, n_iter ):
+    """Returns a list of n_iter seeds to pass to FeatureSpace.Split().
+
+    If you passed the same random_state into Split, you'd get the same exact split for
+    all n_iter. Therefore use the seed passed in here to predictably generate seeds
+    for the Split() iterations."""
+
+    if random_state:
+        from numpy.random import RandomState
+        from functools import partial
+        maxint = 2 ** 32 - 1
+        if random_state is True:
+            from numpy.random import randint as np_randint
+            randint = partial( np_randint, low=0, high=maxint )
+        elif type( random_state ) is int:
+            randint = partial( RandomState( random_state ).randint, low=0, high=maxint )
+        elif type( random_state ) is RandomState:
+            randint = partial( random_state.randint, low=0, high=maxint )
+        else:
+            raise ValueError( "arg random_state must be an int, instance of numpy.random.RandomState, or True")
+    else:
+        # Samples split the same way all iterations,
+        # not useful except for testing results aggregation:
+        randint = lambda: None
+
+    return [ randint() for split_index in range( n_iter ) ]
+
+#============================================================================
+def _ShuffleSplitIteration( feature_space, split_index, seed, train_size, test_size,
+        num_features, classifier, error_bars, quiet, display ):
+    """Runs a single iteration of NewShuffleSplit: Split, normalize, weigh, reduce
+    and classify. Returns the batch result."""
+
+    # The test set stays a view until its reduced features are normalized
+    train_set, test_set = feature_space.Split(
+        train_size, test_size, random_state=seed, view=True, quiet=quiet )
+    train_set.Normalize( quiet=quiet )
+
+    if feature_space.discrete:
+        weights = \
+          FisherFeatureWeights.NewFromFeatureSpace( train_set ).Threshold( num_features )
+    else:
+        weights = \
+          PearsonFeatureWeights.NewFromFeatureSpace( train_set ).Threshold( num_features )
+
+    if not quiet:
+        weights.Print( display=display )
+    reduced_train_set = train_set.FeatureReduce( weights, quiet=quiet )
+    reduced_test_set = test_set.FeatureReduce( weights, view=True, quiet=quiet )
+    reduced_test_set.Normalize( reduced_train_set, quiet=quiet )
+
+    return _Classify( feature_space.discrete, reduced_train_set, reduced_test_set, weights,
+            split_index, classifier, error_bars, quiet )
+
+#============================================================================
+def _NFoldIteration( feature_space, fold_index, test_group_ids, train_accumulator,
+        num_features, classifier, quiet, display ):
+    """Runs a single fold of NewNFold, with the sample groups in test_group_ids
+    as the test set. Returns the batch result.
+
+    train_accumulator is the FisherScoreAccumulator of the training set for discrete
+    feature spaces, and None for continuous ones."""
+
+    if feature_space.discrete:
+        weights = train_accumulator.GetFisherFeatureWeights().Threshold( num_features )
+        # Only the selected features of the samples in this fold need normalizing
+        reduced = feature_space.FeatureReduce( weights, view=True, quiet=True )
+        reduced_train_set = reduced.SampleReduce(
+                leave_out_sample_group_ids=test_group_ids, view=True, quiet=quiet )
+        reduced_test_set = reduced.SampleReduce(
+                leave_in_sample_group_ids=test_group_ids, view=True, quiet=quiet )
+        reduced_train_set.Normalize( quiet=quiet )
+    else:
+        train_set = feature_space.SampleReduce(
+                leave_out_sample_group_ids=test_group_ids, view=True, quiet=quiet )
+        test_set = feature_space.SampleReduce(
+                leave_in_sample_group_ids=test_group_ids, view=True, quiet=quiet )
+        train_set.Normalize( quiet=quiet )
+        weights = \
+          PearsonFeatureWeights.NewFromFeatureSpace( train_set ).Threshold( num_features )
+        reduced_train_set = train_set.FeatureReduce( weights, quiet=quiet )
+        reduced_test_set = test_set.FeatureReduce( weights, view=True, quiet=quiet )
+
+    if not quiet:
+        weights.Print( display=display )
+    reduced_test_set.Normalize( reduced_train_set, quiet=quiet )
+
+    return _Classify( feature_space.discrete, reduced_train_set, reduced_test_set, weights,
+            fold_index, classifier, True, quiet )
+
+#============================================================================
+def _Classify( discrete, reduced_train_set, reduced_test_set, weights, batch_number,
+        classifier, error_bars, quiet ):
+    """Classify the normalized, feature reduced test set with the classifier
+    appropriate for the feature space. Returns the batch result."""
+
+    if discrete:
+        if classifier == 'wnn':
+            batch_result = FeatureSpaceClassification.NewWNN( reduced_train_set, \
+             reduced_test_set, weights, batch_number=batch_number, quiet=quiet,\
+             error_bars=error_bars )
+        else: # default classifier == 'wnd5':
+            batch_result = FeatureSpaceClassification.NewWND5( reduced_train_set, \
+             reduced_test_set, weights, batch_number=batch_number, quiet=quiet,\
+             error_bars=error_bars )
+    else:
+        if classifier == 'linear':
+            batch_result = FeatureSpaceRegression.NewMultivariateLinear(
+                    reduced_train_set, weights, batch_number=batch_number, quiet=quiet )
+        else: # default classifier == 'lstsq':
+            batch_result = FeatureSpaceRegression.NewLeastSquares(
+                reduced_train_set, reduced_test_set, weights, batch_number=batch_number, quiet=quiet )
+
+    batch_result.GenerateStats()
+    return batch_result
+
+#============================================================================
+def _RunIterations( experiment, feature_space, iteration, worker, tasks, iteration_kwargs,
+        n_jobs, checkpoint, event_name, heading, quiet, display ):
+    """Calls iteration( feature_space, *task ) for each task, or worker( task ) in n_jobs
+    worker processes, and appends the batch results to experiment.individual_results in
+    the order of tasks. The first item of a task is its iteration index.
+    Each iteration is timed by a span named event_name, and its progress is reported under
+    the same name. heading is printed before each iteration's output unless quiet.
+
+    Tasks already recorded in the _Checkpoint checkpoint are skipped, and the batch
+    results of the others are recorded as they finish."""
+
+    completed = {}
+    if checkpoint is not None:
+        completed = dict( [ ( index, record[ 'batch_result' ] ) for index, record in \
+                checkpoint.completed.iteritems() ] )
+    pending = [ task for task in tasks if task[0] not in completed ]
+    if not quiet and completed:
+        print >> OutputStream(), "Resuming from {0}: {1} of {2} iterations already completed".format(
+                checkpoint.path, len( tasks ) - len( pending ), len( tasks ) )
+
+    num_done = len( tasks ) - len( pending )
+    if n_jobs is None or n_jobs == 1 or len( pending ) < 2:
+        for task in tasks:
             if not quiet:
-                weights.Print( display=display )
-            reduced_train_set = train_set.FeatureReduce( weights, quiet=quiet )
-            reduced_test_set = test_set.FeatureReduce( weights, quiet=quiet )
-            reduced_test_set.Normalize( reduced_train_set, quiet=quiet )
-
-            if feature_space.discrete:
-                batch_result = FeatureSpaceClassification.NewWND5( reduced_train_set, \
-                 reduced_test_set, weights, batch_number=split_index, quiet=quiet,\
-                 error_bars=experiment.use_error_bars )
+                print >> OutputStream(), "=========================================="
+                print >> OutputStream(), heading, str( task[0] )
+            if task[0] in completed:
+                batch_result = completed[ task[0] ]
+                if not quiet:
+                    batch_result.feature_weights.Print( display=display )
             else:
-                if classifier == 'linear':
-                    batch_result = FeatureSpaceRegression.NewMultivariateLinear(
-                            reduced_train_set, weights, batch_number=split_index, quiet=quiet )
-                else: # default classifier == 'lstsq':
-                    batch_result = FeatureSpaceRegression.NewLeastSquares(
-                        reduced_train_set, reduced_test_set, weights, batch_number=split_index, quiet=quiet )
-
-            batch_result.GenerateStats()
+                with instrumentation.Span( event_name, index=task[0] ):
+                    batch_result = iteration( feature_space, *task, quiet=quiet, display=display,
+                            **iteration_kwargs )
+                if checkpoint is not None:
+                    checkpoint.Append( task, _StrippedCopy( batch_result ) )
+                num_done += 1
+                instrumentation.Progress( event_name, num_done, len( tasks ) )
             if not quiet:
                 batch_result.Print()
-
+            experiment.individual_results.append( batch_result )
+    else:
+        progress = [ num_done ]
+        def callback( task, batch_result ):
+            if checkpoint is not None:
+                checkpoint.Append( task, batch_result )
+            progress[0] += 1
+            instrumentation.Progress( event_name, progress[0], len( tasks ) )
+        for task, batch_result in zip( pending, _MapInWorkerPool( worker, pending, n_jobs,
+                feature_space, iteration_kwargs, callback ) ):
+            completed[ task[0] ] = batch_result
+
+        for task in tasks:
+            batch_result = completed[ task[0] ]
+            if not quiet:
+                print >> OutputStream(), "=========================================="
+                print >> OutputStream(), heading, str( task[0] )
+                batch_result.feature_weights.Print( display=display )
+                batch_result.Print()
             experiment.individual_results.append( batch_result )
 
-        if not quiet:
-            experiment.Print()
-        return experiment
+#============================================================================
+def _CheckpointKey( method, feature_space, **params ):
+    """Returns a fingerprint of the experiment method, its params and the
+    feature space's samples and features, identifying the experiment's records in
+    a checkpoint file. The feature values themselves aren't included."""
+
+    from hashlib import sha1
+    random_state = params.get( 'random_state' )
+    if type( random_state ) is not int:
+        # Only int seeds reproduce the same splits, so a run with True or a
+        # RandomState resumes with the recorded splits and draws new ones for the rest.
+        params[ 'random_state' ] = bool( random_state )
+    fingerprint = ( method, feature_space.name, feature_space.num_samples,
+            feature_space.num_features, feature_space.feature_names,
+            feature_space._contiguous_sample_names, feature_space._contiguous_sample_group_ids,
+            feature_space._contiguous_ground_truth_labels,
+            feature_space._contiguous_ground_truth_values, sorted( params.items() ) )
+    return sha1( repr( fingerprint ) ).hexdigest()
+
+#============================================================================
+class _Checkpoint( object ):
+    """Append-only file of pickled records of completed experiment iterations.
+
+    Each record is a dict with the experiment key, the iteration index, the second
+    item of the iteration's task (the split seed for shuffle splits, the test set sample
+    group ids for n-fold), a (feature name, weight) summary of the feature weights, the
+    batch result, and any items in record_items.
+
+    Records are only ever appended, and flushed to disk as they're written, so an
+    interruption loses at most the iteration that was running. A record cut short by
+    the interruption is truncated away when the file is read back."""
+
+    def __init__( self, path, key ):
+        self.path = path
+        self.key = key
+        #: dict of iteration index -> record, for this experiment's records already in the file
+        self.completed = {}
+        #: extra items to write with every record
+        self.record_items = {}
+        self.Load()
+
+    def Load( self ):
+        import os
+        import cPickle as pickle
+        if not os.path.exists( self.path ):
+            return self
+        end_of_last_record = 0
+        with open( self.path, 'rb' ) as infile:
+            while True:
+                try:
+                    record = pickle.load( infile )
+                except EOFError:
+                    break
+                except Exception:
+                    # partially written record
+                    break
+                end_of_last_record = infile.tell()
+                if record[ 'key' ] == self.key:
+                    self.completed[ record[ 'index' ] ] = record
+        if end_of_last_record < os.path.getsize( self.path ):
+            with open( self.path, 'r+b' ) as outfile:
+                outfile.truncate( end_of_last_record )
+        return self
+
+    def Append( self, task, batch_result ):
+        """Write the record for the iteration run for task and return the batch result."""
+
+        import os
+        import cPickle as pickle
+        weights = batch_result.feature_weights
+        record = { 'key': self.key, 'index': task[0], 'task': task[1],
+                'feature_weights': zip( weights.feature_names, weights.values ),
+                'batch_result': batch_result }
+        record.update( self.record_items )
+        with open( self.path, 'ab' ) as outfile:
+            pickle.dump( record, outfile, pickle.HIGHEST_PROTOCOL )
+            outfile.flush()
+            os.fsync( outfile.fileno() )
+        self.completed[ task[0] ] = record
+        return batch_result
+
+# Per-process state of NewShuffleSplit/NewNFold worker processes
+_worker_state = {}
+
+#============================================================================
+def _InitWorker( feature_space, iteration_kwargs ):
+    """Pool initializer. With the fork start method the arguments are inherited
+    from the parent rather than pickled, so the feature matrix isn't copied."""
+
+    _worker_state[ 'feature_space' ] = feature_space
+    _worker_state[ 'iteration_kwargs' ] = iteration_kwargs
+
+#============================================================================
+def _MapInWorkerPool( worker, tasks, n_jobs, feature_space, iteration_kwargs, callback=None ):
+    """Returns list of results of worker applied to each task in n_jobs processes,
+    in the order of tasks. If given, callback( task, result ) is called in this
+    process as results come in."""
+
+    from multiprocessing import Pool, cpu_count
+    from itertools import izip
+    if n_jobs == -1:
+        n_jobs = cpu_count()
+    pool = Pool( processes=min( n_jobs, len( tasks ) ), initializer=_InitWorker,
+            initargs=( feature_space, iteration_kwargs ) )
+    try:
+        results = []
+        for task, result in izip( tasks, pool.imap( worker, tasks, chunksize=1 ) ):
+            if callback is not None:
+                callback( task, result )
+            results.append( result )
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
+#============================================================================
+def _StripFeatureMatrices( batch_result ):
+    """Drop the feature matrices from a batch result computed in a worker process,
+    since the parent doesn't need them."""
+
+    for fs in ( batch_result.training_set, batch_result.test_set,
+            batch_result.feature_weights.associated_feature_space ):
+        if fs is not None:
+            fs.data_matrix = None
+            fs.data_list = None
+    return batch_result
+
+#============================================================================
+def _StrippedCopy( batch_result ):
+    """Returns a shallow copy of batch_result whose feature spaces are shallow copies
+    without their feature matrices, for writing to a checkpoint while batch_result
+    itself keeps them."""
+
+    from copy import copy
+    copies = {}
+    def _Copy( fs ):
+        if fs is not None and id( fs ) not in copies:
+            copies[ id( fs ) ] = copy( fs )
+        return copies.get( id( fs ) )
+
+    new_result = copy( batch_result )
+    new_result.training_set = _Copy( batch_result.training_set )
+    new_result.test_set = _Copy( batch_result.test_set )
+    new_result.feature_weights = copy( batch_result.feature_weights )
+    new_result.feature_weights.associated_feature_space = \
+            _Copy( batch_result.feature_weights.associated_feature_space )
+    return _StripFeatureMatrices( new_result )
+
+#============================================================================
+def _ShuffleSplitWorker( split_index_and_seed ):
+    """Runs one shuffle split iteration in a worker process."""
+
+    split_index, seed = split_index_and_seed
+    return _StripFeatureMatrices( _ShuffleSplitIteration( _worker_state[ 'feature_space' ],
+            split_index, seed, quiet=True, display=None, **_worker_state[ 'iteration_kwargs' ] ) )
+
+#============================================================================
+def _NFoldWorker( task ):
+    """Runs one fold of NewNFold in a worker process."""
+
+    fold_index, test_group_ids, train_accumulator = task
+    return _StripFeatureMatrices( _NFoldIteration( _worker_state[ 'feature_space' ],
+            fold_index, test_group_ids, train_accumulator, quiet=True, display=None,
+            **_worker_state[ 'iteration_kwargs' ] ) )
+
+#============================================================================
+def _PermutationAccuracy( splits, group_codes, feature_names, num_features, tiled,
+        permutation=None ):
+    """Returns the WND5 classification accuracy over the normalized splits prepared by
+    FeatureSpaceClassificationExperiment.PermutationTest(), with the class codes of the
+    sample groups reassigned by the index array permutation, or as they are if None.
+    The Fisher weights are calculated as in FisherFeatureWeights.NewFromFeatureSpace()."""
+
+    if permutation is not None:
+        group_codes = group_codes[ permutation ]
+    class_columns = np.empty( group_codes.max() + 1, dtype=int )
+
+    num_correct = 0
+    num_classified = 0
+    for split in splits:
+        train_matrix = split[ 'train_matrix' ]
+        train_codes = group_codes[ split[ 'train_groups' ] ]
+        classes = np.unique( train_codes )
+        class_columns[:] = -1
+        class_columns[ classes ] = np.arange( len( classes ) )
+
+        intra_class_means = np.empty( ( len( classes ), train_matrix.shape[1] ) )
+        intra_class_variances = np.empty( ( len( classes ), train_matrix.shape[1] ) )
+        oldsettings = np.seterr(all='ignore')
+        for class_index, code in enumerate( classes ):
+            class_feature_matrix = train_matrix[ train_codes == code ]
+            intra_class_means[ class_index ] = np.mean( class_feature_matrix, axis=0 )
+            # Note that by default, numpy divides by N instead of the more common N-1, hence ddof=1.
+            intra_class_variances[ class_index ] = np.var( class_feature_matrix, axis=0, ddof=1 )
+        np.seterr(**oldsettings)
+
+        weights = FisherFeatureWeights()
+        weights.feature_names = feature_names
+        weights.values = FisherFeatureWeights._Scores( split[ 'population_means' ],
+                intra_class_means, intra_class_variances )
+        weights.feature_indices = np.arange( len( feature_names ) )
+        weights = weights.Threshold( num_features )
+        columns = weights.feature_indices
+
+        class_membership = ( train_codes[ :, np.newaxis ] == classes ).astype( 'double' )
+        test_groups = split[ 'test_groups' ]
+        correct, num_split_classifications = \
+            FeatureSpaceClassificationExperiment._WND5MatrixSweep(
+                train_matrix[ :, columns ], class_membership, split[ 'test_matrix' ][ :, columns ],
+                class_columns[ group_codes[ test_groups ] ], test_groups if tiled else None,
+                weights.values, [ num_features ] )
+        num_correct += correct[ num_features ]
+        num_classified += num_split_classifications
+
+    return float( num_correct ) / num_classified
+
+#============================================================================
+def _PermutationWorker( task ):
+    """Evaluates one permutation of PermutationTest in a worker process."""
+
+    permutation_index, permutation = task
+    return _PermutationAccuracy( permutation=permutation, **_worker_state[ 'iteration_kwargs' ] )
 
 #============================================================================
 class FeatureSpaceClassificationExperiment( FeatureSpacePredictionExperiment ):
@@ -341,11 +905,13 @@ class FeatureSpaceClassificationExperiment( FeatureSpacePredictionExperiment ):
         # When cycling through the matrix, iterate over the lists
         # and not the keys of the dict.
         from collections import defaultdict # introduced Python 2.5
+        # partial instead of lambda, so that results can be pickled
+        from functools import partial
 
         # These are dicts of dicts in the form:
         # self.confusion_matrix[ <Ground Truth Class> ][ <Predicted Class> ] == count
-        self.confusion_matrix = defaultdict( lambda: defaultdict( int ) )
-        self.average_class_probability_matrix = defaultdict( lambda: defaultdict( float ) )
+        self.confusion_matrix = defaultdict( partial( defaultdict, int ) )
+        self.average_class_probability_matrix = defaultdict( partial( defaultdict, float ) )
 
         self.num_correct_classifications = 0
 
@@ -353,37 +919,55 @@ class FeatureSpaceClassificationExperiment( FeatureSpacePredictionExperiment ):
         self.num_correct_classifications_per_class = defaultdict( int )
 
         self.num_classifications = 0
-        # Iterate over all the splits:
         for batch_result in self.individual_results:
             if batch_result.classification_accuracy == None:
                 batch_result.GenerateStats()
             self.num_classifications += len( batch_result )
-            # Iterate over the rows in the confusion matrix:
-            for gt_class in self.test_set.class_names:
-                gt_row_dict = batch_result.confusion_matrix[ gt_class ]
-                # Iterate over the columns in the confusion matrix:
-                for pred_class in self.training_set.class_names:
-                    if pred_class not in gt_row_dict:
-                        # Important to try to add 0 since it will create that cell 
-                        # in the matrix in the defaultdict if it doesn't exist yet.
-                        count = 0
-                    else:
-                        count = gt_row_dict[ pred_class ]
-                    self.confusion_matrix[ gt_class ][ pred_class ] += count
-                    self.num_classifications_per_class[ gt_class ] += count
-                    if gt_class == pred_class:
-                        self.num_correct_classifications += count
-                        self.num_correct_classifications_per_class[ gt_class ] += count
 
-                    self.average_class_probability_matrix[ gt_class ][ pred_class ] += \
-                      batch_result.average_class_probability_matrix[ gt_class ][ pred_class ]
-
-        # Finalize the Average Class Probability Matrix by dividing each marginal
-        # probability sum by the number of splits:
+        # Stack the results of all the splits into one table, and group by
+        # ground truth code (and split, for the average class probabilities).
+        table = ClassificationResultsTable.Concatenate(
+                [ batch_result.GetResultsTable() for batch_result in self.individual_results ] )
+        counts = table.ConfusionCounts()
+        num_gt = len( table.ground_truth_class_names )
+        num_batches = len( self.individual_results )
+        keys = table.batch_indices * num_gt + table.ground_truth_codes
+        batch_class_counts = np.bincount( keys, minlength=num_batches * num_gt ).astype( float )
+        batch_class_counts[ batch_class_counts == 0 ] = 1
+        oldsettings = np.seterr( under='ignore' )
+        # The average of each split's average class probability matrix
         # FIXME: This assumes there were an equal number of classifications in each batch
-        for row in sorted( self.test_set.class_names ):
-            for col in sorted( self.training_set.class_names ):
-                self.average_class_probability_matrix[ row ][ col ] /= len( self )
+        average_class_probabilities = ( _GroupSums( keys, table.CalledMarginalProbabilities(),
+            num_batches * num_gt ) / batch_class_counts[ :, np.newaxis ] ).reshape(
+                num_batches, num_gt, len( table.class_names ) ).sum( axis=0 ) / len( self )
+        np.seterr( **oldsettings )
+
+        gt_index = dict( [ ( name, i ) for i, name in enumerate( table.ground_truth_class_names ) ] )
+        pred_index = dict( [ ( name, i ) for i, name in enumerate( table.predicted_class_names ) ] )
+        class_index = dict( [ ( name, i ) for i, name in enumerate( table.class_names ) ] )
+        # Iterate over the rows in the confusion matrix:
+        for gt_class in self.test_set.class_names:
+            gt_code = gt_index.get( gt_class )
+            # Iterate over the columns in the confusion matrix:
+            for pred_class in self.training_set.class_names:
+                pred_code = pred_index.get( pred_class )
+                if gt_code is None or pred_code is None:
+                    count = 0
+                else:
+                    count = int( counts[ gt_code, pred_code ] )
+                # Important to add even if 0 since it will create that cell
+                # in the matrix in the defaultdict if it doesn't exist yet.
+                self.confusion_matrix[ gt_class ][ pred_class ] += count
+                self.num_classifications_per_class[ gt_class ] += count
+                if gt_class == pred_class:
+                    self.num_correct_classifications += count
+                    self.num_correct_classifications_per_class[ gt_class ] += count
+
+                if gt_code is not None and pred_class in class_index:
+                    self.average_class_probability_matrix[ gt_class ][ pred_class ] += \
+                            average_class_probabilities[ gt_code, class_index[ pred_class ] ]
+                else:
+                    self.average_class_probability_matrix[ gt_class ][ pred_class ] += 0
 
         # The similarity matrix is just the average class probability matrix
         # normalized to have 1's in the diagonal.
@@ -414,24 +998,24 @@ class FeatureSpaceClassificationExperiment( FeatureSpacePredictionExperiment ):
             if n_feature_weights <= display:
                 if n_feature_weights > 0:
                     display = n_feature_weights
-                    print "Displaying feature weight statistics for all {0} features".format(
+                    print >> OutputStream(), "Displaying feature weight statistics for all {0} features".format(
                             display )
         else:
             display = False
 
-        print '='*50
+        print >> OutputStream(), '='*50
         s = self.__class__.__name__
         if self.name:
             s += ' "' + self.name + '"'
         s += " (" + str( len( self.individual_results ) ) + " iterations)"
-        print s
+        print >> OutputStream(), s
 
         acc = self.classification_accuracy
         n = self.num_classifications
         n_correct = self.num_correct_classifications
 
         if not self.use_error_bars:
-            print "{0}/{1} correct = {2:0.2f}%".format( n_correct, n, acc * 100 )
+            print >> OutputStream(), "{0}/{1} correct = {2:0.2f}%".format( n_correct, n, acc * 100 )
         else:
             # Using either normal approximation of binomial distribution or the Wilson score interval
             # to calculate standard error of the mean, depending on the situation.
@@ -449,7 +1033,7 @@ class FeatureSpaceClassificationExperiment( FeatureSpacePredictionExperiment ):
                 # Using normal approximation:
                 std_error_of_mean = sqrt( acc * (1-acc) / n )
                 conf_interval = z * std_error_of_mean
-                print "{0}/{1} correct = {2:0.2f} +/- {3:0.2f}% w/ 95% conf. (normal approx. interval)".format(
+                print >> OutputStream(), "{0}/{1} correct = {2:0.2f} +/- {3:0.2f}% w/ 95% conf. (normal approx. interval)".format(
                     n_correct, n, acc * 100, conf_interval * 100 )
             else:
                 # Using Wilson approximation:
@@ -464,19 +1048,263 @@ class FeatureSpaceClassificationExperiment( FeatureSpacePredictionExperiment ):
                     n_correct, n, raw_acc * 100, conf_interval * 100 )
                 outstr += " ({0:0.2f} +/- {1:0.2f}% w/ 95% conf. (Wilson score interval))".format(
                         acc * 100, conf_interval * 100)
-                print outstr
+                print >> OutputStream(), outstr
 
-        print self.ConfusionMatrix(), '\n'
-        print self.SimilarityMatrix(), '\n'
-        print self.AvgClassProbMatrix(), '\n'
+        print >> OutputStream(), self.ConfusionMatrix(), '\n'
+        print >> OutputStream(), self.SimilarityMatrix(), '\n'
+        print >> OutputStream(), self.AvgClassProbMatrix(), '\n'
 
         if display:
             outstr = "{0}\t{1:0.3f}\t{2:>3}\t{3:0.3f}\t{4:0.3f}\t{5:0.3f}\t{6}"
-            print "Feature Weight Analysis (top {0} features):".format( display )
-            print "Rank\tmean\tcount\tStdDev\tMin\tMax\tName"
-            print "----\t----\t-----\t------\t---\t---\t----"
+            print >> OutputStream(), "Feature Weight Analysis (top {0} features):".format( display )
+            print >> OutputStream(), "Rank\tmean\tcount\tStdDev\tMin\tMax\tName"
+            print >> OutputStream(), "----\t----\t-----\t------\t---\t---\t----"
             for count, fw_stat in enumerate( self.feature_weight_statistics[:display], 1 ):
-                print outstr.format( count, *fw_stat )
+                print >> OutputStream(), outstr.format( count, *fw_stat )
+
+    #=====================================================================
+    @classmethod
+    @instrumented( 'FeatureSpaceClassificationExperiment.FeatureCountSweep' )
+    def FeatureCountSweep( cls, feature_space, feature_counts, n_iter=5, train_size=None,
+            test_size=None, random_state=True, quiet=False ):
+        """Returns a dict { number of features : classification accuracy } with the
+        accuracy NewShuffleSplit would attain with the same arguments, for each number
+        of features in the iterable feature_counts.
+
+        The splits, normalization and Fisher weight ranking are done once per split,
+        for the largest feature count. WND5 weighted distances are sums over features, so
+        the distances between test and training samples are then accumulated one feature
+        at a time in rank order, and the WND5 classification for each requested number
+        of features is evaluated from the running sums. The whole sweep costs about as
+        much as one classification per split using the largest feature count."""
+
+        if not feature_space.discrete:
+            raise ValueError( 'FeatureCountSweep requires a discrete feature space, "{0}" is continuous.'.format( feature_space.name ) )
+
+        feature_counts = sorted( set( feature_counts ) )
+        if not feature_counts or feature_counts[0] < 1 or \
+                feature_counts[-1] > feature_space.num_features:
+            raise ValueError( 'Feature counts must be on the interval [1,{0}]'.format( feature_space.num_features ) )
+        max_num_features = feature_counts[-1]
+
+        num_correct = dict( [ ( n, 0 ) for n in feature_counts ] )
+        num_classified = 0
+
+        for split_index, seed in enumerate( _GenerateSplitSeeds( random_state, n_iter ) ):
+            if not quiet:
+                print >> OutputStream(), "FEATURE COUNT SWEEP, SHUFFLE SPLIT ITERATION", str( split_index )
+            train_set, test_set = feature_space.Split(
+                train_size, test_size, random_state=seed, view=True, quiet=True )
+            train_set.Normalize( quiet=True )
+            weights = \
+              FisherFeatureWeights.NewFromFeatureSpace( train_set ).Threshold( max_num_features )
+            # Features are now in rank order
+            reduced_train_set = train_set.FeatureReduce( weights, quiet=True )
+            reduced_test_set = test_set.FeatureReduce( weights, view=True, quiet=True )
+            reduced_test_set.Normalize( reduced_train_set, quiet=True )
+
+            correct, num_split_classifications = cls._WND5FeatureCountSweep(
+                    reduced_train_set, reduced_test_set, weights.values, feature_counts )
+            for n_features in feature_counts:
+                num_correct[ n_features ] += correct[ n_features ]
+            num_classified += num_split_classifications
+
+        features_accuracy_dict = dict( [ ( n, float( num_correct[ n ] ) / num_classified ) \
+                for n in feature_counts ] )
+        if not quiet:
+            for n_features in feature_counts:
+                print >> OutputStream(), n_features, ',' , features_accuracy_dict[ n_features ]
+        return features_accuracy_dict
+
+    #=====================================================================
+    @classmethod
+    @instrumented( 'FeatureSpaceClassificationExperiment.PermutationTest' )
+    def PermutationTest( cls, feature_space, n_permutations=100, n_iter=5, features_size=0.15,
+            train_size=None, test_size=None, random_state=True, quiet=False, n_jobs=None ):
+        """Tests the significance of the classification accuracy NewShuffleSplit would
+        attain with the same arguments, against the null distribution of accuracies attained
+        after randomly reassigning the ground truths among the sample groups, as in
+        ScrambleGroundTruths(). Every permutation is evaluated on the same n_iter splits.
+
+        Returns tuple ( accuracy, 1D array of the n_permutations null accuracies, p-value ),
+        with the empirical p-value ( 1 + # null accuracies >= accuracy ) / ( 1 + n_permutations ).
+
+        Only the ground truths and the Fisher weights change from one permutation to the
+        next. Each split's training set is normalized once, and its test set against it,
+        then for every permutation the Fisher weights are recalculated from the normalized
+        training set, and the test set is classified with WND5 on whole matrices, as
+        in FeatureCountSweep().
+
+        n_jobs - as in NewShuffleSplit(), number of worker processes the permutations are
+            evaluated in. The workers are forked after the splits are normalized and share them."""
+
+        if not feature_space.discrete:
+            raise ValueError( 'PermutationTest requires a discrete feature space, "{0}" is continuous.'.format( feature_space.name ) )
+        if type( n_permutations ) is not int or n_permutations < 1:
+            raise ValueError( 'Arg "n_permutations" must be a positive int, got {0}'.format( n_permutations ) )
+
+        if isinstance( features_size, float ):
+            if features_size < 0 or features_size > 1.0:
+                raise ValueError('Arg "features_size" must be on interval [0,1] if a float.')
+            num_features = int( round( features_size * feature_space.num_features ) )
+        elif isinstance( features_size, int ):
+            if features_size < 0 or features_size > feature_space.num_features:
+                raise ValueError( 'must specify num_features or feature_usage_fraction in kwargs')
+            num_features = features_size
+        else:
+            raise ValueError( 'Arg "features_size" must be valid float or int.' )
+
+        if n_jobs is not None and ( type( n_jobs ) is not int or n_jobs == 0 or n_jobs < -1 ):
+            raise ValueError( 'Arg "n_jobs" must be a positive int, -1 or None, got {0}'.format( n_jobs ) )
+
+        # The split seeds are the ones NewShuffleSplit would draw,
+        # the permutations are drawn from the rest of the stream.
+        seeds = _GenerateSplitSeeds( random_state, n_iter + n_permutations )
+
+        # Split rows are then indices into feature_space's own rows. A view is gathered
+        # into a local copy rather than materialized, leaving the caller's view as it is.
+        if feature_space.is_view:
+            feature_space = feature_space.Derive( data_matrix=feature_space.GetFeatureMatrix() )
+        unique_group_ids, first_rows, row_groups = np.unique(
+                feature_space._contiguous_sample_group_ids, return_index=True, return_inverse=True )
+        class_codes = dict( [ ( name, i ) for i, name in enumerate( feature_space.class_names ) ] )
+        group_codes = np.array( [ class_codes[ feature_space._contiguous_ground_truth_labels[i] ] \
+                for i in first_rows ] )
+
+        if not quiet:
+            print >> OutputStream(), "PERMUTATION TEST: {0} permutations of {1} sample groups, {2} splits, top {3} features".format(
+                    n_permutations, len( group_codes ), n_iter, num_features )
+
+        splits = []
+        for seed in seeds[ : n_iter ]:
+            train_set, test_set = feature_space.Split(
+                train_size, test_size, random_state=seed, view=True, quiet=True )
+            if test_set is None:
+                raise ValueError( 'PermutationTest requires a test set, got test_size={0}'.format( test_size ) )
+            split = { 'train_groups': row_groups[ train_set._view_rows ],
+                    'test_groups': row_groups[ test_set._view_rows ] }
+            train_set.Normalize( quiet=True )
+            test_set.Normalize( train_set, quiet=True )
+            split[ 'train_matrix' ] = train_set.data_matrix
+            split[ 'test_matrix' ] = test_set.data_matrix
+            split[ 'population_means' ] = np.mean( train_set.data_matrix, axis=0, dtype='double' )
+            splits.append( split )
+
+        iteration_kwargs = { 'splits': splits, 'group_codes': group_codes,
+                'feature_names': feature_space.feature_names, 'num_features': num_features,
+                'tiled': feature_space.num_samples_per_group > 1 }
+        accuracy = _PermutationAccuracy( **iteration_kwargs )
+
+        from numpy.random import RandomState
+        tasks = [ ( permutation_index, RandomState( seed ).permutation( len( group_codes ) ) ) \
+                for permutation_index, seed in enumerate( seeds[ n_iter : ] ) ]
+        if n_jobs is None or n_jobs == 1 or len( tasks ) < 2:
+            null_accuracies = [ _PermutationAccuracy( permutation=permutation, **iteration_kwargs ) \
+                    for permutation_index, permutation in tasks ]
+        else:
+            null_accuracies = _MapInWorkerPool( _PermutationWorker, tasks, n_jobs,
+                    feature_space, iteration_kwargs )
+        null_accuracies = np.array( null_accuracies )
+        p_value = ( 1 + np.count_nonzero( null_accuracies >= accuracy ) ) / float( 1 + n_permutations )
+
+        if not quiet:
+            print >> OutputStream(), "accuracy: {0:0.4f}, null accuracy: {1:0.4f} +/- {2:0.4f}, p-value: {3:0.4g}".format(
+                    accuracy, null_accuracies.mean(), null_accuracies.std(), p_value )
+        return accuracy, null_accuracies, p_value
+
+    #=====================================================================
+    @staticmethod
+    def _WND5FeatureCountSweep( training_set, test_set, feature_weights, feature_counts ):
+        """Returns tuple ( dict { number of features : number of correct classifications },
+        number of classifications ) for WND5 classification of test_set using the leading
+        columns of training_set, test_set and feature_weights.
+
+        Follows SingleSampleClassification._WND5() and the tile averaging in
+        FeatureSpaceClassification.NewWND5()."""
+
+        # One-hot matrix num_train * num_classes for summing over each class' samples
+        train_labels = training_set._contiguous_ground_truth_labels
+        class_membership = np.array( [ [ label == class_name for class_name in \
+                training_set.class_names ] for label in train_labels ], dtype='double' )
+
+        test_class_indices = np.array( [ training_set.class_names.index( label ) \
+                if label in training_set.class_names else -1 \
+                for label in test_set._contiguous_ground_truth_labels ] )
+
+        group_ids = None
+        if test_set.num_samples_per_group > 1:
+            group_ids = test_set._contiguous_sample_group_ids
+
+        return FeatureSpaceClassificationExperiment._WND5MatrixSweep( training_set.data_matrix,
+                class_membership, test_set.data_matrix, test_class_indices, group_ids,
+                feature_weights, feature_counts )
+
+    #=====================================================================
+    @staticmethod
+    def _WND5MatrixSweep( train_matrix, class_membership, test_matrix, test_class_indices,
+            group_ids, feature_weights, feature_counts ):
+        """_WND5FeatureCountSweep() on arrays: class_membership is the one-hot
+        num_train * num_classes matrix of the training samples' classes, test_class_indices
+        the column of each test sample's class in it (-1 for none), and group_ids the sample
+        group ids of the test samples if their tiles are to be averaged, otherwise None."""
+
+        epsilon = np.finfo( np.float ).eps
+        weights_squared = np.square( np.asarray( feature_weights, dtype='double' ) )
+        num_classes = class_membership.shape[1]
+        num_samples_per_class = class_membership.sum( axis=0 )
+
+        # Tiles are averaged over sample groups
+        tiled = group_ids is not None
+        if tiled:
+            unique_group_ids, group_index = np.unique( group_ids, return_inverse=True )
+            num_groups = len( unique_group_ids )
+            group_class_indices = np.empty( num_groups, dtype=int )
+            group_class_indices[ group_index ] = test_class_indices
+            num_classifications = num_groups
+        else:
+            num_classifications = len( test_class_indices )
+
+        oldsettings = np.seterr(all='ignore')
+        wnd_dists = np.zeros( ( len( test_matrix ), len( train_matrix ) ) )
+        abs_dists = np.zeros( ( len( test_matrix ), len( train_matrix ) ) )
+        num_correct = {}
+        counts_to_evaluate = set( feature_counts )
+
+        for feature_index in range( feature_counts[-1] ):
+            diffs = np.subtract( test_matrix[ :, feature_index, None ],
+                    train_matrix[ None, :, feature_index ], dtype='double' )
+            abs_dists += np.absolute( diffs )
+            diffs *= diffs
+            diffs *= weights_squared[ feature_index ]
+            wnd_dists += diffs
+
+            if feature_index + 1 not in counts_to_evaluate:
+                continue
+
+            collided = abs_dists < epsilon
+            similarities = np.where( collided, 0, wnd_dists ** -5 )
+            # num_test * num_classes
+            class_similarities = np.dot( similarities, class_membership )
+            denoms = num_samples_per_class - np.dot( collided.astype( 'double' ), class_membership )
+            non_call = ( denoms == 0 ).any( axis=1 )
+            class_similarities /= denoms
+            marginal_probabilities = class_similarities / class_similarities.sum( axis=1 )[ :, None ]
+
+            if tiled:
+                # Average marginal probabilities over the tiles that were called
+                called = ~non_call
+                group_sums = np.zeros( ( num_groups, num_classes ) )
+                np.add.at( group_sums, group_index[ called ], marginal_probabilities[ called ] )
+                group_counts = np.bincount( group_index[ called ], minlength=num_groups )
+                predicted = group_sums.argmax( axis=1 )
+                correct = ( predicted == group_class_indices ) & ( group_counts > 0 )
+            else:
+                predicted = marginal_probabilities.argmax( axis=1 )
+                correct = ( predicted == test_class_indices ) & ~non_call
+            num_correct[ feature_index + 1 ] = int( correct.sum() )
+
+        np.seterr(**oldsettings)
+        return num_correct, num_classifications
 
     #=====================================================================
     @classmethod
@@ -616,67 +1444,58 @@ class FeatureSpaceClassificationExperiment( FeatureSpacePredictionExperiment ):
         if self.individual_results == 0:
             raise ValueError( 'No batch results to analyze' )
 
+        # Group the rows of all the splits' results by sample name
+        table = ClassificationResultsTable.Concatenate(
+                [ batch.GetResultsTable( tiled=False ) for batch in self.individual_results ] )
+        sorted_images, first_rows, sample_codes = np.unique( np.array( table.source_filepaths,
+                dtype=object ), return_index=True, return_inverse=True )
+        num_samples = len( sorted_images )
+        times_tested = np.bincount( sample_codes, minlength=num_samples )
+        times_correct = np.bincount( sample_codes, weights=table.CorrectPredictions(),
+                minlength=num_samples )
+        oldsettings = np.seterr( under='ignore' )
+        mp_avgs = _GroupSums( sample_codes, table.CalledMarginalProbabilities(), num_samples ) / \
+                times_tested[ :, np.newaxis ]
+        np.seterr( **oldsettings )
+        # Rows of each sample, in split order
+        sample_rows = np.split( np.argsort( sample_codes, kind='mergesort' ),
+                np.cumsum( times_tested )[ : -1 ] )
+
         #self.predicted_values = []
         self.ground_truth_values = []
 
         self.accumulated_individual_results = {}
         self.individual_stats = {}
 
-        for batch in self.individual_results:
-            for result in batch.individual_results:
-                if not result.source_filepath in self.accumulated_individual_results:
-                    # initialize list of individual results for this file
-                    self.accumulated_individual_results[ result.source_filepath ] = []
-                self.accumulated_individual_results[ result.source_filepath ].append( result )
-
-        for filename in self.accumulated_individual_results:
-
-            # Get marginal probability averages
-            mp_totals = None
-            for result in self.accumulated_individual_results[filename]:
-                if not mp_totals:
-                    mp_totals = result.marginal_probabilities[:]
-                else:
-                    new_total = []
-                    for class_total, new_mp in zip( mp_totals, result.marginal_probabilities ):
-                        new_total.append( class_total + new_mp )
-                    mp_totals = new_total
-
-            mp_avgs = [ float(mp_totals[i]) / len( self.accumulated_individual_results[filename] ) for i in range( len( mp_totals ) ) ]
-            #vals = np.array ([result.predicted_value for result in self.accumulated_individual_results[filename] ])
-            vals = [result.predicted_class_name for result in self.accumulated_individual_results[filename] ]
-            #self.ground_truth_values.append( self.accumulated_individual_results[filename][0].ground_truth_value )
-            gt_class = self.accumulated_individual_results[filename][0].ground_truth_class_name
+        for sample_code, filename in enumerate( sorted_images ):
+            self.accumulated_individual_results[ filename ] = table.Rows( sample_rows[ sample_code ] )
+            gt_class = table.ground_truth_class_names[
+                    table.ground_truth_codes[ first_rows[ sample_code ] ] ]
             self.ground_truth_values.append( gt_class )
-            #self.predicted_values.append( np.mean(vals) )
-            self.individual_stats[filename] = ( len(vals), float( vals.count( gt_class ) ) / len(vals), mp_avgs, gt_class )
+            n = int( times_tested[ sample_code ] )
+            self.individual_stats[ filename ] = ( n, times_correct[ sample_code ] / n,
+                    mp_avgs[ sample_code ].tolist(), gt_class )
 
-        print "==========================================="
-        print '{0} "{1}" per-sample statistics\n'.format( self.__class__.__name__, self.name )
+        print >> OutputStream(), "==========================================="
+        print >> OutputStream(), '{0} "{1}" per-sample statistics\n'.format( self.__class__.__name__, self.name )
 
         mp_delim = "  "
         discrlineoutstr = "\tsplit {split_num:02d}: pred: {pred_class}\tact: {actual_class}\tnorm factor: {norm_factor:0.3g},\tmarg probs: ( {norm_dists} )"
         outstr = "\t---> Tested {0} times, avg correct: {1:0.3f}, avg marg probs ( {2} )"
 
-        #create view
-        res_dict = self.accumulated_individual_results
-
-        # sort by ground truth, then alphanum
-        sort_func = lambda A, B: cmp( A, B ) if res_dict[A][0].ground_truth_class_name == res_dict[B][0].ground_truth_class_name else cmp( res_dict[A][0].source_filepath, res_dict[B][0].source_filepath  ) 
-        sorted_images = sorted( self.accumulated_individual_results.iterkeys(), sort_func )
-
-        for samplename in sorted_images:
-            print 'File "' + samplename + '"'
-            for result in self.accumulated_individual_results[ samplename ]:
-                marg_probs = [ "{0:0.3f}".format( num ) for num in result.marginal_probabilities ]
-                print discrlineoutstr.format( split_num = result.batch_number, \
-                                         pred_class = result.predicted_class_name, \
-                                         actual_class = result.ground_truth_class_name, \
-                                         norm_factor = result.normalization_factor, \
+        # sorted by sample name
+        for sample_code, samplename in enumerate( sorted_images ):
+            print >> OutputStream(), 'File "' + samplename + '"'
+            for row in sample_rows[ sample_code ]:
+                marg_probs = [ "{0:0.3f}".format( num ) for num in table.marginal_probabilities[ row ] ]
+                print >> OutputStream(), discrlineoutstr.format( split_num = table.batch_numbers[ row ], \
+                                         pred_class = table.predicted_class_names[ table.predicted_codes[ row ] ], \
+                                         actual_class = table.ground_truth_class_names[ table.ground_truth_codes[ row ] ], \
+                                         norm_factor = table.normalization_factors[ row ], \
                                          norm_dists = mp_delim.join( marg_probs ) )
 
             marg_probs = [ "{0:0.3f}".format( num ) for num in self.individual_stats[ samplename ][2] ]
-            print outstr.format( self.individual_stats[ samplename ][0], self.individual_stats[ samplename ][1], mp_delim.join( marg_probs ) )
+            print >> OutputStream(), outstr.format( self.individual_stats[ samplename ][0], self.individual_stats[ samplename ][1], mp_delim.join( marg_probs ) )
 
         # If 2 or 3 class problem, plot individuals in marginal probability space
 # END class definition for FeatureSpaceClassificationExperiment
@@ -749,20 +1568,20 @@ class FeatureSpaceRegressionExperiment( FeatureSpacePredictionExperiment ):
         if self.std_err == None:
             self.GenerateStats()
 
-        print "\n==========================================="
-        print '{0} "{1}"'.format( self.__class__.__name__, self.name )
-        print 'Num iterations ("splits"): {0}'.format( len( self.individual_results ) )
-        print "Total num classifications: {0}".format( self.num_classifications )
-        print "Standard error: {0}".format( self.std_err )
-        print "Pearson corellation coefficient: {0}".format( self.pearson_coeff )
-        print "Pearson p-value: {0}".format( self.pearson_p_value )        
+        print >> OutputStream(), "\n==========================================="
+        print >> OutputStream(), '{0} "{1}"'.format( self.__class__.__name__, self.name )
+        print >> OutputStream(), 'Num iterations ("splits"): {0}'.format( len( self.individual_results ) )
+        print >> OutputStream(), "Total num classifications: {0}".format( self.num_classifications )
+        print >> OutputStream(), "Standard error: {0}".format( self.std_err )
+        print >> OutputStream(), "Pearson corellation coefficient: {0}".format( self.pearson_coeff )
+        print >> OutputStream(), "Pearson p-value: {0}".format( self.pearson_p_value )        
 
         outstr = "{0}\t{1:0.3f}\t{2:>3}\t{3:0.3f}\t{4:0.3f}\t{5:0.3f}\t{6}"
-        print "Feature Weight Analysis (top 50 features):"
-        print "Rank\tmean\tcount\tStdDev\tMin\tMax\tName"
-        print "----\t----\t-----\t------\t---\t---\t----"
+        print >> OutputStream(), "Feature Weight Analysis (top 50 features):"
+        print >> OutputStream(), "Rank\tmean\tcount\tStdDev\tMin\tMax\tName"
+        print >> OutputStream(), "----\t----\t-----\t------\t---\t---\t----"
         for count, fw_stat in enumerate( self.feature_weight_statistics, 1 ):
-            print outstr.format( count, *fw_stat )
+            print >> OutputStream(), outstr.format( count, *fw_stat )
             if count >= 50:
                 break
 
@@ -796,8 +1615,8 @@ class FeatureSpaceRegressionExperiment( FeatureSpacePredictionExperiment ):
             self.individual_stats[filename] = ( len(vals), np.min(vals), np.mean(vals), \
                 np.max(vals), np.std(vals) ) 
 
-        print "==========================================="
-        print '{0} "{1}" per-sample statistics\n'.format( self.__class__.__name__, self.name )
+        print >> OutputStream(), "==========================================="
+        print >> OutputStream(), '{0} "{1}" per-sample statistics\n'.format( self.__class__.__name__, self.name )
         mp = "  "
         contlineoutstr = "\tsplit {split_num:02d} '{batch_name}': actual: {actual_class}. Predicted val: {pred_val:0.3f}"
         outstr = "\t---> Tested {0} times, low {1:0.3f}, mean {2:0.3f}, high {3:0.3f}, std dev {4:0.3f}"
@@ -810,11 +1629,11 @@ class FeatureSpaceRegressionExperiment( FeatureSpacePredictionExperiment ):
         sorted_images = sorted( self.accumulated_individual_results.iterkeys(), sort_func )
 
         for samplename in sorted_images:
-            print 'File "' + samplename + '"'
+            print >> OutputStream(), 'File "' + samplename + '"'
             for result in self.accumulated_individual_results[ samplename ]:
-                print contlineoutstr.format( split_num = result.batch_number, \
+                print >> OutputStream(), contlineoutstr.format( split_num = result.batch_number, \
                                          batch_name = result.name, \
                                          actual_class = result.ground_truth_value, \
                                          pred_val = result.predicted_value )
-            print outstr.format( *self.individual_stats[ samplename ] )
+            print >> OutputStream(), outstr.format( *self.individual_stats[ samplename ] )
 
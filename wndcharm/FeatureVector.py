@@ -28,7 +28,8 @@ import wndcharm
 import numpy as np
 from . import feature_vector_major_version
 from . import feature_vector_minor_version_from_num_features
-from .utils import normalize_by_columns
+from .utils import Normalizer
+from .instrumentation import instrumented, OutputStream
 
 class WrongFeatureSetVersionError( Exception ):
     pass
@@ -389,6 +390,7 @@ class FeatureVector( object ):
         return base + '.sig'
 
     #================================================================
+    @instrumented( 'FeatureVector.GenerateFeatures' )
     def GenerateFeatures( self, write_to_disk=True, quiet=True ):
         """@brief Loads precalculated features, or calculates new ones, based on which instance
         attributes have been set, and what their values are.
@@ -426,7 +428,7 @@ class FeatureVector( object ):
         except IncompleteFeatureSetError:
             # LoadSigFile should create a FeatureComputationPlan
             if not quiet:
-                print 'Loaded {0} features from disk for sample "{1}"'.format(
+                print >> OutputStream(), 'Loaded {0} features from disk for sample "{1}"'.format(
                         len( self.temp_names ), self.name )
             partial_load = True
             pass
@@ -551,10 +553,10 @@ class FeatureVector( object ):
 
         if not quiet:
             if len( comp_vals ) != len( self ):
-                print "CALCULATED {0} TOTAL FEATURES, REDUCED TO: {1}".format(
+                print >> OutputStream(), "CALCULATED {0} TOTAL FEATURES, REDUCED TO: {1}".format(
                         len( comp_vals ), self )
             else:
-                print "CALCULATED: " + str( self )
+                print >> OutputStream(), "CALCULATED: " + str( self )
 
         # FIXME: maybe write to disk BEFORE feature reduce? Provide flag to let user decide?
         if write_to_disk:
@@ -633,7 +635,7 @@ class FeatureVector( object ):
             if not quiet:
                 # Specific to FeatureVector implementation:
                 # no num_samples member:
-                print 'Normalizing {0} "{1}" ({2} features) against {3} "{4}"'.format(
+                print >> OutputStream(), 'Normalizing {0} "{1}" ({2} features) against {3} "{4}"'.format(
                     self.__class__.__name__, self.name, len( self.feature_names),
                     reference_features.__class__.__name__, reference_features.name )
 
@@ -641,13 +643,13 @@ class FeatureVector( object ):
             if not reference_features.normalized_against:
                 reference_features.Normalize( quiet=quiet )
 
-            mins = reference_features.feature_minima
-            maxs = reference_features.feature_maxima
+            normalizer = Normalizer( reference_features.feature_names,
+                    reference_features.feature_minima, reference_features.feature_maxima )
             newdata['normalized_against'] = reference_features
 
-        newdata['values'] = np.copy( self.values )
-        newdata['feature_minima'], newdata['feature_maxima'] = \
-            normalize_by_columns( newdata['values'], mins, maxs )
+        newdata['values'] = normalizer.Apply( np.asarray( self.values, dtype='double' ) )
+        newdata['feature_minima'] = normalizer.feature_minima
+        newdata['feature_maxima'] = normalizer.feature_maxima
 
         if inplace:
             return self.Update( **newdata )
@@ -716,10 +718,11 @@ class FeatureVector( object ):
             newfv = self.Derive( **newdata )
 
         if not quiet:
-            print "FEATURE VECTOR REDUCED (orig len {0}): {1}".format( orig_len, newfv )
+            print >> OutputStream(), "FEATURE VECTOR REDUCED (orig len {0}): {1}".format( orig_len, newfv )
         return newfv
 
     #================================================================
+    @instrumented( 'FeatureVector.LoadSigFile' )
     def LoadSigFile( self, sigfile_path=None, quiet=False ):
         """Load computed features from a sig file.
 
@@ -843,7 +846,7 @@ class FeatureVector( object ):
                 self.Update( **result.groupdict() )
 
         if not quiet:
-            print "LOADED ", str( self )
+            print >> OutputStream(), "LOADED ", str( self )
         return self
 
     #================================================================
@@ -870,9 +873,9 @@ class FeatureVector( object ):
 
         if not quiet:
             if exists( path ):
-                print "Overwriting {0}".format( path )
+                print >> OutputStream(), "Overwriting {0}".format( path )
             else:
-                print 'Writing signature file "{0}"'.format( path )
+                print >> OutputStream(), 'Writing signature file "{0}"'.format( path )
         
         with open( path, "w" ) as out:
             # FIXME: line 1 contains class membership and version
@@ -26,6 +26,7 @@
 import numpy as np
 import wndcharm
 from .utils import output_railroad_switch
+from .instrumentation import OutputStream
 
 #############################################################################
 # class definition of FeatureWeights
@@ -40,14 +41,24 @@ class FeatureWeights( object ):
     pattern recognition algorithm that calculates the same image descriptors for all
     images, it is through features weights that trained classifiers can zero-in on only
     those features which provide distinctiveness across classes and ignore noisy features.
-    Thus any instance of a FeatureWeights class is context-specific."""
+    Thus any instance of a FeatureWeights class is context-specific.
+
+    The weights and any other per-feature statistics are stored as numpy arrays
+    parallel to the list feature_names."""
+
+    #: Members that are numpy arrays with one element per feature, which are carried
+    #: along when the feature weights are thresholded or sliced
+    _per_feature_arrays = ( 'values', )
 
     def __init__( self, name=None, size=None ):
         self.name = name
         self.associated_feature_space = None
+        #: numpy int array: column index of each feature in associated_feature_space,
+        #: or None if not known (e.g., weights loaded from a file)
+        self.feature_indices = None
         if size is not None:
             self.feature_names = [None] * size
-            self.values = [None] * size
+            self.values = np.zeros( size )
         else:
             self.feature_names = None
             self.values = None
@@ -82,6 +93,53 @@ class FeatureWeights( object ):
         """@breif Returns an instance of a FeatureWeights class with the top n relevant features in that order"""
         raise NotImplementedError
 
+    #================================================================
+    @staticmethod
+    def _RankedIndices( scores, num_features ):
+        """Returns int array of the indices of the num_features highest scores, from
+        highest to lowest. Ties keep their original order, as in a stable sort, and NANs
+        rank last.
+
+        Only the top num_features are sorted, after an O(n) argpartition."""
+
+        oldsettings = np.seterr(all='ignore')
+        scores = np.asarray( scores, dtype='double' )
+        scores = np.where( np.isnan( scores ), -np.inf, scores )
+        if num_features >= len( scores ):
+            top = np.arange( len( scores ) )
+        elif num_features <= 0:
+            top = np.arange( 0 )
+        else:
+            kth_score = scores[ np.argpartition( -scores, num_features - 1 )[ num_features - 1 ] ]
+            above = np.flatnonzero( scores > kth_score )
+            ties = np.flatnonzero( scores == kth_score )[ : num_features - len( above ) ]
+            top = np.concatenate( ( above, ties ) )
+        ranked = top[ np.argsort( -scores[ top ], kind='mergesort' ) ]
+        np.seterr(**oldsettings)
+        return ranked
+
+    #================================================================
+    def _Subset( self, indices, name=None ):
+        """Returns a new instance of this class containing only the features at
+        the given positions, in that order.
+
+        indices - int array, or a slice object, in which case the per-feature
+            arrays of the new instance are views of this instance's arrays."""
+
+        new_weights = self.__class__( name=name )
+        if isinstance( indices, slice ):
+            new_weights.feature_names = self.feature_names[ indices ]
+        else:
+            new_weights.feature_names = [ self.feature_names[i] for i in indices ]
+        for member in self._per_feature_arrays:
+            val = getattr( self, member )
+            if val is not None:
+                setattr( new_weights, member, np.asarray( val )[ indices ] )
+        if self.feature_indices is not None:
+            new_weights.feature_indices = self.feature_indices[ indices ]
+        new_weights.associated_feature_space = self.associated_feature_space
+        return new_weights
+
     #================================================================
     @classmethod
     def NewFromFeatureSpace( cls, num_features_to_be_used  ):
@@ -125,7 +183,7 @@ class FisherFeatureWeights( FeatureWeights ):
             raw_vals, raw_names = \
               zip( *[ line.strip().split( None, 1 ) for line in weights_file.read().splitlines() ] )
 
-        weights.values = [ float( val ) for val in raw_vals ]
+        weights.values = np.array( [ float( val ) for val in raw_vals ] )
         weights.feature_names = [None] * len( raw_names )
 
         for i, name_raw_str in enumerate( raw_names ):
@@ -158,7 +216,7 @@ class FisherFeatureWeights( FeatureWeights ):
         oldsettings = np.seterr(all='ignore')
 
         # 1D matrix 1 * F
-        population_means = np.mean( fs.data_matrix, axis = 0 )
+        population_means = np.mean( fs.data_matrix, axis = 0, dtype='double' )
 
         # WARNING, this only works in python27:
         # ====================================
@@ -185,11 +243,30 @@ class FisherFeatureWeights( FeatureWeights ):
 
         class_index = 0
         for class_feature_matrix in fs.data_list:
-            intra_class_means[ class_index ] = np.mean( class_feature_matrix, axis=0 )
+            intra_class_means[ class_index ] = np.mean( class_feature_matrix, axis=0, dtype='double' )
             # Note that by default, numpy divides by N instead of the more common N-1, hence ddof=1.
-            intra_class_variances[ class_index ] = np.var( class_feature_matrix, axis=0, ddof=1 )
+            intra_class_variances[ class_index ] = \
+                    np.var( class_feature_matrix, axis=0, ddof=1, dtype='double' )
             class_index += 1
 
+        # return numpy error settings to original
+        np.seterr(**oldsettings)
+
+        new_fw = cls()
+        new_fw.feature_names = fs.feature_names[:]
+        new_fw.values = cls._Scores( population_means, intra_class_means, intra_class_variances )
+        new_fw.associated_feature_space = fs
+        new_fw.feature_indices = np.arange( fs.num_features )
+
+        return new_fw
+
+    #================================================================
+    @staticmethod
+    def _Scores( population_means, intra_class_means, intra_class_variances ):
+        """Returns 1D array of Fisher scores from the 1 * F population means and the
+        N * F matrices of intra-class means and variances. Invalid scores are 0."""
+
+        oldsettings = np.seterr(all='ignore')
         # 1D matrix 1 * F
         # we deal with NANs/INFs separately, so turn off numpy warnings about invalid floats.
         # for the record, in numpy:
@@ -201,28 +278,18 @@ class FisherFeatureWeights( FeatureWeights ):
         denom[denom == 0] = np.nan
         feature_weights_m =  np.ma.masked_invalid (
             ( np.square( population_means - intra_class_means ).sum( axis = 0 ) /
-            ( fs.num_classes - 1 ) ) / denom )
+            ( len( intra_class_means ) - 1 ) ) / denom )
         # return numpy error settings to original
         np.seterr(**oldsettings)
-
-        new_fw = cls()
-        new_fw.feature_names = fs.feature_names[:]
         # the filled(0) method of the masked array sets all nan and infs to 0
-        new_fw.values = feature_weights_m.filled(0).tolist()
-        new_fw.associated_feature_space = fs
-
-        return new_fw
+        return feature_weights_m.filled(0)
 
     #================================================================
     def EliminateZeros( self ):
         """Eliminates any features with a weight of zero, and returns a new instance of
         FisherFeatureWeights without those features."""
 
-        new_weights = FisherFeatureWeights()
-        scores = zip( self.feature_names, self.values )
-        nonzero_scores = [ (name, weight) for name, weight in scores if weight != 0 ]
-        new_weights.feature_names, new_weights.values = zip( *nonzero_scores )
-        return new_weights
+        return self._Subset( np.flatnonzero( np.asarray( self.values ) != 0 ) )
 
     #================================================================
     def Threshold( self, num_features_to_be_used=None, _all=False ):
@@ -248,37 +315,24 @@ class FisherFeatureWeights( FeatureWeights ):
             raise ValueError('Cannot reduce a set of {0} feature weights to requested {1} features.'.\
                                   format( len( self.values ), num_features_to_be_used ) )
 
-        new_weights = self.__class__()
-        raw_featureweights = zip( self.values, self.feature_names )
-        # raw_featureweights is now a list of tuples := [ (value1, name1), (value2, name2), ... ]
-
-        sorted_featureweights = sorted( raw_featureweights, key=lambda a: a[0], reverse = True )
-        # take top N features
-        from itertools import islice
-        use_these_feature_weights = list( islice( sorted_featureweights, num_features_to_be_used ) )
+        ranked = self._RankedIndices( self.values, num_features_to_be_used )
 
         if _all is not True:
             # You have a problem if any of the features have corellation coefficients of 0
-            for i, feat_fig_of_merit in enumerate( [ line[0] for line in use_these_feature_weights ] ):
-                if feat_fig_of_merit == 0:
-                    if _all == 'non-zero':
-                        print "Features rank index {0} and below have a correllation coefficient of 0. ".format( i )
-                        print 'Using {0} features'.format( i )
-                        use_these_feature_weights = use_these_feature_weights[ : i ]
-                        break
-                    else:
-                        err_msg = "Can't reduce feature weights \"{0}\" to {1} features. ".format( self.name, num_features_to_be_used )
-                        err_msg += "Features ranked {0} and below have a Fisher score of 0. ".format( i )
-                        err_msg += "Request less features. "
-                        raise ValueError( err_msg )
-
-        # we want lists, not tuples!
-        new_weights.values, new_weights.feature_names =\
-          [ list( unzipped_tuple ) for unzipped_tuple in zip( *use_these_feature_weights ) ]
-
-        new_weights.associated_feature_space = self.associated_feature_space
-
-        return new_weights
+            zero_ranks = np.flatnonzero( np.asarray( self.values )[ ranked ] == 0 )
+            if len( zero_ranks ):
+                i = zero_ranks[0]
+                if _all == 'non-zero':
+                    print >> OutputStream(), "Features rank index {0} and below have a correllation coefficient of 0. ".format( i )
+                    print >> OutputStream(), 'Using {0} features'.format( i )
+                    ranked = ranked[ : i ]
+                else:
+                    err_msg = "Can't reduce feature weights \"{0}\" to {1} features. ".format( self.name, num_features_to_be_used )
+                    err_msg += "Features ranked {0} and below have a Fisher score of 0. ".format( i )
+                    err_msg += "Request less features. "
+                    raise ValueError( err_msg )
+
+        return self._Subset( ranked )
 
     #================================================================
     def Slice( self, start_index, stop_index ):
@@ -298,19 +352,7 @@ class FisherFeatureWeights( FeatureWeights ):
         if (min_index < 0) or ( max_index > len( self.values ) ):
             raise ValueError( 'Cannot slice, check your start and stop indices.' )
 
-        new_weights = self.__class__()
-        raw_featureweights = zip( self.feature_names, self.values )
-
-        use_these_feature_weights = \
-                list( itertools.islice( raw_featureweights, min_index, max_index ) )
-
-        # we want lists, not tuples!
-        new_weights.feature_names, new_weights.values =\
-          [ list( unzipped_tuple ) for unzipped_tuple in zip( *use_these_feature_weights ) ]
-
-        new_weights.associated_feature_space = self.associated_feature_space
-
-        return new_weights
+        return self._Subset( slice( min_index, max_index ) )
 
     #================================================================
     @output_railroad_switch
@@ -330,14 +372,340 @@ class FisherFeatureWeights( FeatureWeights ):
         if self.name:
             s += ' "{0}:"'.format( self.name )
         s += " ({0} features)".format( len( self ) )
-        print s
-        print "Rank\tValue\tName"
-        print "====\t=====\t===="
+        print >> OutputStream(), s
+        print >> OutputStream(), "Rank\tValue\tName"
+        print >> OutputStream(), "====\t=====\t===="
         for i, (val, name) in enumerate( features, start=1 ):
-            print "{0}\t{1:.6f}\t{2}".format( i, val, name )
+            print >> OutputStream(), "{0}\t{1:.6f}\t{2}".format( i, val, name )
 
         if remainder:
-            print "<output truncated by user via \"display\" arg, {0} more feature weights>".format( remainder )
+            print >> OutputStream(), "<output truncated by user via \"display\" arg, {0} more feature weights>".format( remainder )
+
+#############################################################################
+# class definition of FisherScoreAccumulator
+#############################################################################
+class FisherScoreAccumulator( object ):
+    """Keeps running per-class statistics of a discrete training set so that
+    Fisher scores can be recalculated as annotated samples are added or removed,
+    without revisiting the samples that were already seen.
+
+    Statistics are kept in raw (unnormalized) feature units as per-class counts,
+    means and sums of squared deviations from the mean (Welford/Chan), which are
+    numerically stable for large feature values. Feature minima and maxima are
+    tracked as well, and GetFisherFeatureWeights() returns the same weights that
+    FisherFeatureWeights.NewFromFeatureSpace() would calculate on a copy of the
+    accumulated samples normalized against themselves, including the treatment of
+    NANs/INFs by utils.normalize_by_columns().
+
+    Minima and maxima cannot shrink when samples are removed. Fisher scores do not
+    depend on the normalization range, so this only matters to the extent that
+    the removed samples were the only ones that took on extreme values."""
+
+    def __init__( self, feature_names=None, name=None ):
+        """Constructor"""
+
+        self.name = name
+        self.feature_names = feature_names
+        if feature_names is not None:
+            self.num_features = len( feature_names )
+        else:
+            self.num_features = None
+
+        #: Class labels in the order of the rows of the statistics arrays below
+        self.class_names = []
+        #: 2D arrays shape num_classes * num_features:
+        #: number of finite values
+        self.counts = None
+        #: mean of finite values
+        self.means = None
+        #: sum of squared deviations from the mean of finite values
+        self.sq_devs = None
+        #: number of NANs and -INFs, which normalize to 0
+        self.low_counts = None
+        #: number of +INFs, which normalize to 100
+        self.high_counts = None
+
+        #: 1D arrays of the min and max finite value seen for each feature
+        self.feature_minima = None
+        self.feature_maxima = None
+
+    #==============================================================
+    def __str__( self ):
+        outstr = '<' + self.__class__.__name__
+        if self.name:
+            outstr += ' "' + self.name + '"'
+        if self.num_features is not None:
+            outstr += ' n_features=' + str( self.num_features )
+        outstr += ' n_classes=' + str( len( self.class_names ) )
+        if self.class_names:
+            outstr += ' samples_per_class=(' + ', '.join( [ '"{0}": {1}'.format( name, count ) \
+                    for name, count in zip( self.class_names, self.class_sizes ) ] ) + ')'
+        return outstr + '>'
+    #==============================================================
+    def __repr__( self ):
+        return str(self)
+
+    #==============================================================
+    @property
+    def class_sizes( self ):
+        """Number of samples per class."""
+        if not self.class_names:
+            return []
+        return ( self.counts[:,0] + self.low_counts[:,0] + self.high_counts[:,0] ).tolist()
+
+    #==============================================================
+    @classmethod
+    def NewFromFeatureSpace( cls, fs, name=None ):
+        """Returns a new accumulator containing all the samples in FeatureSpace fs.
+        Unlike FisherFeatureWeights.NewFromFeatureSpace(), fs need not be normalized."""
+
+        if name is None:
+            name = fs.name
+        new_acc = cls( feature_names=fs.feature_names[:], name=name )
+        new_acc.AddSamples( fs )
+        return new_acc
+
+    #==============================================================
+    def _CheckInput( self, samples, class_labels ):
+        """Returns tuple of ( 2D data matrix, list of class labels )"""
+
+        from .FeatureSpace import FeatureSpace
+
+        if isinstance( samples, FeatureSpace ):
+            if not samples.discrete:
+                raise ValueError( 'Fisher scores require a discrete feature space, "{0}" is continuous.'.format( samples.name ) )
+            if self.feature_names is None:
+                self.feature_names = samples.feature_names[:]
+                self.num_features = len( self.feature_names )
+            elif samples.feature_names != self.feature_names:
+                raise ValueError( "Can't accumulate samples, features don't match. Try a FeatureReduce()" )
+            if class_labels is None:
+                class_labels = samples._contiguous_ground_truth_labels
+            samples = samples.data_matrix
+        else:
+            samples = np.asarray( samples, dtype='double' )
+            if samples.ndim == 1:
+                samples = samples.reshape( 1, -1 )
+            if self.num_features is None:
+                self.num_features = samples.shape[1]
+            elif samples.shape[1] != self.num_features:
+                raise ValueError( "Can't accumulate samples with {0} features into an accumulator with {1}.".format(
+                    samples.shape[1], self.num_features ) )
+            if class_labels is None:
+                raise ValueError( "Class labels are required when samples aren't in a FeatureSpace." )
+
+        if len( class_labels ) != len( samples ):
+            raise ValueError( "Got {0} class labels for {1} samples.".format( len( class_labels ), len( samples ) ) )
+
+        return samples, list( class_labels )
+
+    #==============================================================
+    def _ClassIndex( self, class_name ):
+        """Returns row index of the statistics for class_name, adding a row if necessary"""
+
+        try:
+            return self.class_names.index( class_name )
+        except ValueError:
+            pass
+
+        zeros = np.zeros( ( 1, self.num_features ) )
+        if not self.class_names:
+            self.counts, self.means, self.sq_devs, self.low_counts, self.high_counts = \
+                    [ zeros.copy() for i in range(5) ]
+        else:
+            self.counts = np.vstack( ( self.counts, zeros ) )
+            self.means = np.vstack( ( self.means, zeros ) )
+            self.sq_devs = np.vstack( ( self.sq_devs, zeros ) )
+            self.low_counts = np.vstack( ( self.low_counts, zeros ) )
+            self.high_counts = np.vstack( ( self.high_counts, zeros ) )
+        self.class_names.append( class_name )
+        return len( self.class_names ) - 1
+
+    #==============================================================
+    @staticmethod
+    def _Combine( n_a, mean_a, sq_dev_a, n_b, mean_b, sq_dev_b, sign=1 ):
+        """Pooled count, mean and sum of squared deviations of two sets of statistics,
+        using Chan et al.'s parallel update. If sign is -1, set b is removed from set a
+        instead of added to it."""
+
+        oldsettings = np.seterr(all='ignore')
+        n = n_a + sign * n_b
+        if sign > 0:
+            delta = mean_b - mean_a
+            mean = mean_a + delta * n_b / n
+            sq_dev = sq_dev_a + sq_dev_b + delta * delta * n_a * n_b / n
+        else:
+            mean = ( n_a * mean_a - n_b * mean_b ) / n
+            delta = mean_b - mean
+            sq_dev = sq_dev_a - sq_dev_b - delta * delta * n * n_b / n_a
+        np.seterr(**oldsettings)
+        empty = n <= 0
+        mean[ empty ] = 0
+        # Round-off can leave tiny negative remainders after removal
+        sq_dev[ empty ] = 0
+        sq_dev[ sq_dev < 0 ] = 0
+        return n, mean, sq_dev
+
+    #==============================================================
+    def _Update( self, samples, class_labels, sign ):
+        """Add (sign = 1) or remove (sign = -1) the samples' statistics"""
+
+        samples, class_labels = self._CheckInput( samples, class_labels )
+        if not len( samples ):
+            return self
+
+        labels = np.array( class_labels, dtype=object )
+        for class_name in sorted( set( class_labels ) ):
+            if sign < 0 and class_name not in self.class_names:
+                raise ValueError( 'Cannot remove samples from class "{0}" which has none.'.format( class_name ) )
+            chunk = np.asarray( samples[ labels == class_name ], dtype='double' )
+            finite = np.isfinite( chunk )
+            n_chunk = finite.sum( axis=0 ).astype( 'double' )
+            n_high = ( chunk == np.inf ).sum( axis=0 )
+            n_low = len( chunk ) - n_chunk - n_high
+            finite_m = np.ma.masked_array( chunk, mask=~finite )
+            mean_chunk = finite_m.mean( axis=0 ).filled(0)
+            sq_dev_chunk = ( ( finite_m - mean_chunk ) ** 2 ).sum( axis=0 ).filled(0)
+
+            i = self._ClassIndex( class_name )
+            if sign < 0 and ( np.any( self.counts[i] < n_chunk ) or \
+                    np.any( self.low_counts[i] < n_low ) or np.any( self.high_counts[i] < n_high ) ):
+                raise ValueError( 'Cannot remove more samples from class "{0}" than were added.'.format( class_name ) )
+            self.counts[i], self.means[i], self.sq_devs[i] = self._Combine( self.counts[i],
+                    self.means[i], self.sq_devs[i], n_chunk, mean_chunk, sq_dev_chunk, sign )
+            self.low_counts[i] += sign * n_low
+            self.high_counts[i] += sign * n_high
+
+            if sign > 0 and finite.any():
+                chunk_min = finite_m.min( axis=0 ).filled( np.inf )
+                chunk_max = finite_m.max( axis=0 ).filled( -np.inf )
+                if self.feature_minima is None:
+                    self.feature_minima = chunk_min
+                    self.feature_maxima = chunk_max
+                else:
+                    np.minimum( self.feature_minima, chunk_min, out=self.feature_minima )
+                    np.maximum( self.feature_maxima, chunk_max, out=self.feature_maxima )
+
+        # forget classes that no longer have any samples
+        if sign < 0:
+            keep = [ i for i, size in enumerate( self.class_sizes ) if size > 0 ]
+            if len( keep ) != len( self.class_names ):
+                self.class_names = [ self.class_names[i] for i in keep ]
+                self.counts = self.counts[ keep ]
+                self.means = self.means[ keep ]
+                self.sq_devs = self.sq_devs[ keep ]
+                self.low_counts = self.low_counts[ keep ]
+                self.high_counts = self.high_counts[ keep ]
+        return self
+
+    #==============================================================
+    def AddSamples( self, samples, class_labels=None ):
+        """Accumulate samples into the running statistics.
+
+        samples - a FeatureSpace, or a 2D numpy array with one sample per row
+            (1D for a single sample), in raw feature units
+        class_labels - list of class names, one per sample. Taken from the
+            FeatureSpace if not given.
+
+        Returns self to allow chaining."""
+
+        return self._Update( samples, class_labels, 1 )
+
+    #==============================================================
+    def RemoveSamples( self, samples, class_labels=None ):
+        """Remove previously added samples from the running statistics. Arguments
+        as for AddSamples().
+
+        Returns self to allow chaining."""
+
+        return self._Update( samples, class_labels, -1 )
+
+    #==============================================================
+    def Merge( self, other ):
+        """Returns a new accumulator combining the statistics of this one with those
+        of other, e.g., accumulators computed on different shards of a data set."""
+
+        if other.num_features is not None and self.num_features is not None and \
+                ( other.num_features != self.num_features or \
+                  ( other.feature_names is not None and self.feature_names is not None and \
+                    other.feature_names != self.feature_names ) ):
+            raise ValueError( "Can't merge accumulators, features don't match." )
+
+        from copy import deepcopy
+        merged = deepcopy( self )
+        if merged.feature_names is None:
+            merged.feature_names = deepcopy( other.feature_names )
+        if merged.num_features is None:
+            merged.num_features = other.num_features
+
+        for j, class_name in enumerate( other.class_names ):
+            i = merged._ClassIndex( class_name )
+            merged.counts[i], merged.means[i], merged.sq_devs[i] = merged._Combine(
+                    merged.counts[i], merged.means[i], merged.sq_devs[i],
+                    other.counts[j], other.means[j], other.sq_devs[j] )
+            merged.low_counts[i] += other.low_counts[j]
+            merged.high_counts[i] += other.high_counts[j]
+
+        if other.feature_minima is not None:
+            if merged.feature_minima is None:
+                merged.feature_minima = other.feature_minima.copy()
+                merged.feature_maxima = other.feature_maxima.copy()
+            else:
+                np.minimum( merged.feature_minima, other.feature_minima, out=merged.feature_minima )
+                np.maximum( merged.feature_maxima, other.feature_maxima, out=merged.feature_maxima )
+        return merged
+
+    #==============================================================
+    def GetFisherFeatureWeights( self, name=None ):
+        """Returns a new instance of FisherFeatureWeights calculated from the
+        accumulated statistics, in the normalized space defined by the tracked
+        feature minima and maxima."""
+
+        if not self.class_names:
+            raise ValueError( "Can't calculate Fisher scores, no samples have been accumulated." )
+
+        # we deal with NANs/INFs separately, so turn off numpy warnings about invalid floats.
+        oldsettings = np.seterr(all='ignore')
+
+        # Map the finite-value statistics into the [0,100] normalized space.
+        # Features that are constant or never finite have zero range, and normalize to 0.
+        if self.feature_minima is None:
+            mins = np.zeros( self.num_features )
+            ranges = np.zeros( self.num_features )
+        else:
+            mins = np.where( np.isfinite( self.feature_minima ), self.feature_minima, 0 )
+            ranges = np.where( np.isfinite( self.feature_maxima ), self.feature_maxima, 0 ) - mins
+        scale = np.where( ranges > 0, 100.0 / ranges, 0 )
+        means = ( self.means - mins ) * scale
+        sq_devs = self.sq_devs * scale * scale
+
+        # NANs and -INFs become 0, +INFs become 100
+        zeros = np.zeros( means.shape )
+        counts, means, sq_devs = self._Combine( self.counts, means, sq_devs,
+                self.low_counts, zeros, zeros )
+        counts, means, sq_devs = self._Combine( counts, means, sq_devs,
+                self.high_counts, zeros + np.where( ranges > 0, 100.0, 0 ), zeros )
+
+        num_classes = len( self.class_names )
+        population_means = ( counts * means ).sum( axis=0 ) / counts.sum( axis=0 )
+        # Note ddof=1, as in FisherFeatureWeights.NewFromFeatureSpace()
+        intra_class_variances = sq_devs / ( counts - 1 )
+        intra_class_variances[ counts < 2 ] = np.nan
+
+        denom = np.mean( intra_class_variances, axis=0 )
+        denom[denom == 0] = np.nan
+        feature_weights_m = np.ma.masked_invalid(
+            ( np.square( population_means - means ).sum( axis = 0 ) /
+            ( num_classes - 1 ) ) / denom )
+        np.seterr(**oldsettings)
+
+        new_fw = FisherFeatureWeights( name=name )
+        if self.feature_names is not None:
+            new_fw.feature_names = self.feature_names[:]
+            new_fw.feature_indices = np.arange( self.num_features )
+        # the filled(0) method of the masked array sets all nan and infs to 0
+        new_fw.values = feature_weights_m.filled(0)
+        return new_fw
 
 #############################################################################
 # class definition of PearsonFeatureWeights
@@ -351,17 +719,21 @@ class PearsonFeatureWeights( FeatureWeights ):
     An example system where a continuous classifier could be used could be
     would be defining a spectrum of morphology across age or dose response."""
 
+    _per_feature_arrays = FeatureWeights._per_feature_arrays + ( 'slopes', 'intercepts',
+            'pearson_coeffs', 'pearson_stderrs', 'pearson_p_values', 'spearman_coeffs',
+            'spearman_p_values' )
+
     def __init__( self, name=None, size=None ):
         """Constructor"""
         super( PearsonFeatureWeights, self ).__init__( name=name, size=size )
         if size is not None:
-            self.slopes = [None] * size
-            self.intercepts = [None] * size
-            self.pearson_coeffs = [None] * size
-            self.pearson_stderrs = [None] * size
-            self.pearson_p_values = [None] * size
-            self.spearman_coeffs = [None] * size
-            self.spearman_p_values = [None] * size
+            self.slopes = np.zeros( size )
+            self.intercepts = np.zeros( size )
+            self.pearson_coeffs = np.zeros( size )
+            self.pearson_stderrs = np.zeros( size )
+            self.pearson_p_values = np.zeros( size )
+            self.spearman_coeffs = np.zeros( size )
+            self.spearman_p_values = np.zeros( size )
         else:
             self.slopes = None
             self.intercepts = None
@@ -383,66 +755,107 @@ class PearsonFeatureWeights( FeatureWeights ):
         if fs.normalized_against is None:
             raise ValueError( "Before generating feature weights, call Normalize() of the feature space." )
 
-        from scipy.stats import linregress, spearmanr
-
-        # Known issue: running stats.linregress() with np.seterr (all='raise') has caused
-        # arithmetic underflow (FloatingPointError: 'underflow encountered in stdtr' )
-        # I think this is something we can safely ignore in this function, and return settings
-        # back to normal at the end. -CEC
-        np.seterr (under='ignore')
+        from scipy.stats import t as t_dist
+        from .utils import rank_by_columns
 
         if fs.name:
             name = cls.__name__ + ' from training set "' + fs.name + '"'
         else:
             name = None
 
-        new_fw = cls( name=name, size=fs.num_features )
+        new_fw = cls( name=name )
         new_fw.associated_feature_space = fs
-
-        #r_val_sum = 0
-        r_val_squared_sum = 0
-        #r_val_cubed_sum = 0
-
-        ground_truths = np.array( [ float(val) for val in fs.ground_truth_values ] )
-
         new_fw.feature_names = fs.feature_names[:]
 
-        for feature_index in range( fs.num_features ):
-
-            feature_values = fs.data_matrix[ :, feature_index ]
-
-            slope, intercept, pearson_coeff, p_value, std_err = \
-                         linregress( ground_truths, feature_values )
-
-            new_fw.pearson_coeffs[ feature_index ] = pearson_coeff
-            new_fw.slopes[ feature_index ] = slope
-            new_fw.intercepts[ feature_index ] = intercept
-            new_fw.pearson_stderrs[ feature_index ] = std_err
-            new_fw.pearson_p_values[ feature_index ] = p_value
-
-            #from math import fabs
-            #r_val_sum += fabs(pearson_coeff)
-            r_val_squared_sum += pearson_coeff * pearson_coeff
-            #r_val_cubed_sum += pearson_coeff * pearson_coeff * pearson_coeff
-
-            try:
-                spearman_coeff, spearman_p_val = spearmanr( ground_truths, feature_values )
-            except FloatingPointError:
-                # to avoid: "FloatingPointError: invalid value encountered in true_divide"
-                spearman_coeff, spearman_p_val = ( 0, 1 )
+        ground_truths = np.array( [ float(val) for val in fs.ground_truth_values ] )
 
-            new_fw.spearman_coeffs[ feature_index ] = spearman_coeff
-            new_fw.spearman_p_values[ feature_index ] = spearman_p_val
+        # All columns are handled at once. The arithmetic follows scipy.stats.linregress()
+        # and scipy.stats.spearmanr(), with ground truths as the independent variable.
+        # Feature columns containing NaNs get NaN statistics, which is what the
+        # per-column scipy calls returned.
+        oldsettings = np.seterr(all='ignore')
 
-        #new_fw.values = [ fabs(val) / r_val_sum for val in new_fw.pearson_coeffs ]
-        new_fw.values = [val*val / r_val_squared_sum for val in new_fw.pearson_coeffs ]
-        #new_fw.values = [val*val*val / r_val_cubed_sum for val in new_fw.pearson_coeffs ]
+        n = fs.num_samples
+        dof = n - 2
+        feature_values = fs.data_matrix
+        nan_features = np.isnan( feature_values ).any( axis=0 )
+        if np.isnan( ground_truths ).any():
+            nan_features[:] = True
+        if nan_features.any():
+            feature_values = np.where( nan_features, 0, feature_values )
+
+        slopes, intercepts, pearson_coeffs = \
+                cls._ColumnwiseCorrelation( ground_truths, feature_values, with_line_fit=True )
+
+        if n == 2:
+            pearson_p_values = np.where( feature_values[0] == feature_values[1], 1.0, 0.0 )
+            pearson_stderrs = np.zeros( fs.num_features )
+        else:
+            TINY = 1.0e-20
+            t = pearson_coeffs * np.sqrt( dof / ( ( 1.0 - pearson_coeffs + TINY ) * \
+                    ( 1.0 + pearson_coeffs + TINY ) ) )
+            pearson_p_values = 2 * t_dist.sf( np.abs( t ), dof )
+            ssxm = np.var( ground_truths )
+            ssym = np.var( feature_values, axis=0, dtype='double' )
+            pearson_stderrs = np.sqrt( ( 1 - pearson_coeffs ** 2 ) * ssym / ssxm / dof )
+
+        # Spearman rho is the Pearson r of the ranks. Constant columns get rho = 0, p = 1,
+        # same as when spearmanr() used to raise a FloatingPointError for them.
+        spearman_coeffs = cls._ColumnwiseCorrelation(
+                rank_by_columns( ground_truths[:,None] )[:,0], rank_by_columns( feature_values ) )
+        t = spearman_coeffs * np.sqrt( ( dof / ( ( spearman_coeffs + 1.0 ) * \
+                ( 1.0 - spearman_coeffs ) ) ).clip(0) )
+        spearman_p_values = 2 * t_dist.sf( np.abs( t ), dof )
+
+        for stat in ( slopes, intercepts, pearson_coeffs, pearson_p_values, pearson_stderrs,
+                spearman_coeffs, spearman_p_values ):
+            stat[ nan_features ] = np.nan
+
+        new_fw.slopes = slopes
+        new_fw.intercepts = intercepts
+        new_fw.pearson_coeffs = pearson_coeffs
+        new_fw.pearson_stderrs = pearson_stderrs
+        new_fw.pearson_p_values = pearson_p_values
+        new_fw.spearman_coeffs = spearman_coeffs
+        new_fw.spearman_p_values = spearman_p_values
+        new_fw.feature_indices = np.arange( fs.num_features )
+
+        r_val_squared = pearson_coeffs * pearson_coeffs
+        #new_fw.values = np.abs( pearson_coeffs ) / np.abs( pearson_coeffs ).sum()
+        new_fw.values = r_val_squared / r_val_squared.sum()
+        #new_fw.values = pearson_coeffs ** 3 / ( pearson_coeffs ** 3 ).sum()
 
-        # Reset numpy
-        np.seterr (all='raise')
+        np.seterr(**oldsettings)
 
         return new_fw
 
+    #================================================================
+    @staticmethod
+    def _ColumnwiseCorrelation( x, Y, with_line_fit=False ):
+        """Pearson correlation coefficient of vector x with every column of matrix Y.
+        Constant columns get a coefficient of 0.
+
+        If with_line_fit, returns the tuple ( slopes, intercepts, coeffs ) of the
+        regression of each column of Y on x."""
+
+        x_mean = x.mean()
+        Y_mean = Y.mean( axis=0, dtype='double' )
+        x_dev = x - x_mean
+        Y_dev = Y - Y_mean
+        ssxm = np.dot( x_dev, x_dev ) / len( x )
+        ssym = np.mean( Y_dev ** 2, axis=0 )
+        ssxym = np.dot( x_dev, Y_dev ) / len( x )
+        r_den = np.sqrt( ssxm * ssym )
+        coeffs = np.zeros( Y.shape[1] )
+        nonzero = r_den != 0
+        coeffs[ nonzero ] = ssxym[ nonzero ] / r_den[ nonzero ]
+        np.clip( coeffs, -1.0, 1.0, out=coeffs )
+        if not with_line_fit:
+            return coeffs
+        slopes = ssxym / ssxm
+        intercepts = Y_mean - slopes * x_mean
+        return slopes, intercepts, coeffs
+
     #================================================================
     def Threshold( self, num_features_to_be_used=None, _all=False, use_spearman=False,
                  min_corr_coeff=None ):
@@ -468,24 +881,18 @@ class PearsonFeatureWeights( FeatureWeights ):
             raise ValueError('Cannot reduce a set of {0} feature weights to requested {1} features.'.\
                                   format( len( self.values ), num_features_to_be_used ) )
 
-        new_weights = self.__class__()
         if self.name:
             if num_features_to_be_used == len( self.feature_names ):
-                new_weights.name = self.name + " (rank-ordered)"
+                new_name = self.name + " (rank-ordered)"
             else:
-                new_weights.name = self.name + " (top {0} features)".format( num_features_to_be_used )
+                new_name = self.name + " (top {0} features)".format( num_features_to_be_used )
+        else:
+            new_name = None
 
         if use_spearman:
-            abs_corr_coeffs = [ abs( val ) for val in self.spearman_coeffs ]
+            abs_corr_coeffs = np.abs( self.spearman_coeffs )
         else:
-            abs_corr_coeffs = [ abs( val ) for val in self.pearson_coeffs ]
-
-        raw_featureweights = zip( abs_corr_coeffs, self.feature_names, self.pearson_coeffs, \
-            self.slopes, self.intercepts, self.pearson_stderrs, self.pearson_p_values, \
-            self.spearman_coeffs, self.spearman_p_values )
-
-        # sort from max to min
-        sorted_featureweights = sorted( raw_featureweights, key=lambda r: r[0], reverse = True )
+            abs_corr_coeffs = np.abs( self.pearson_coeffs )
 
         # take most correlated features, both positive and negative
         if min_corr_coeff is not None:
@@ -496,39 +903,30 @@ class PearsonFeatureWeights( FeatureWeights ):
             if val <= 0 or val > 1:
                 raise ValueError( 'Abs val of min correlation coefficient must be between 0 and 1.' )
 
-            from itertools import takewhile
-            use_these_feature_weights = list( takewhile( lambda x: x[0]>min_corr_coeff, sorted_featureweights ) )
+            oldsettings = np.seterr(all='ignore')
+            num_above = np.count_nonzero( abs_corr_coeffs > float( min_corr_coeff ) )
+            np.seterr(**oldsettings)
+            ranked = self._RankedIndices( abs_corr_coeffs, num_above )
         else:
-            from itertools import islice
-            use_these_feature_weights = list( islice( sorted_featureweights, num_features_to_be_used ) )
+            ranked = self._RankedIndices( abs_corr_coeffs, num_features_to_be_used )
             if _all is not True:
                 # You have a problem if any of the features have corellation coefficients of 0
-                for i, feat_fig_of_merit in enumerate( [ line[0] for line in use_these_feature_weights ] ):
-                    if feat_fig_of_merit == 0:
-                        if _all == 'nonzero':
-                            print "Features rank index {0} and below have a correllation coefficient of 0. ".format( i )
-                            print 'Using {0} features'.format( i )
-                            use_these_feature_weights = use_these_feature_weights[ : i ]
-                            break
-                        else:
-                            err_msg = "Can't reduce feature weights \"{0}\" to {1} features. ".format( self.name, num_features_to_be_used )
-                            err_msg += "Features ranked {0} and below have a correllation coefficient of 0. ".format( i )
-                            err_msg += "Request less features. "
-                            raise ValueError( err_msg )
-
-        # we want lists, not tuples!
-        abs_corr_coeffs, new_weights.feature_names, new_weights.pearson_coeffs, new_weights.slopes, \
-            new_weights.intercepts, new_weights.pearson_stderrs, new_weights.pearson_p_values,\
-            new_weights.spearman_coeffs, new_weights. spearman_p_values =\
-              [ list( unzipped_tuple ) for unzipped_tuple in zip( *use_these_feature_weights ) ]
-
-        r_val_sum = 0
-        for val in abs_corr_coeffs:
-            r_val_sum += val * val
-        new_weights.values = [ ( (val*val) / r_val_sum ) for val in abs_corr_coeffs ]
-
-        new_weights.associated_feature_space = self.associated_feature_space
+                zero_ranks = np.flatnonzero( abs_corr_coeffs[ ranked ] == 0 )
+                if len( zero_ranks ):
+                    i = zero_ranks[0]
+                    if _all == 'nonzero':
+                        print >> OutputStream(), "Features rank index {0} and below have a correllation coefficient of 0. ".format( i )
+                        print >> OutputStream(), 'Using {0} features'.format( i )
+                        ranked = ranked[ : i ]
+                    else:
+                        err_msg = "Can't reduce feature weights \"{0}\" to {1} features. ".format( self.name, num_features_to_be_used )
+                        err_msg += "Features ranked {0} and below have a correllation coefficient of 0. ".format( i )
+                        err_msg += "Request less features. "
+                        raise ValueError( err_msg )
 
+        new_weights = self._Subset( ranked, name=new_name )
+        r_vals_squared = abs_corr_coeffs[ ranked ] ** 2
+        new_weights.values = r_vals_squared / r_vals_squared.sum()
         return new_weights
 
     #================================================================
@@ -549,30 +947,14 @@ class PearsonFeatureWeights( FeatureWeights ):
         if (min_index < 0) or ( max_index > len( self.values ) ):
             raise ValueError( 'Cannot slice, check your start and stop indices.' )
 
-        new_weights = self.__class__()
         if self.name:
-            new_weights.name = self.name + " (sliced {0}-{1})".format( min_index, max_index )
-
-        abs_val_pearson_coeffs = [ abs( val ) for val in self.pearson_coeffs ]
-        raw_featureweights = zip( self.feature_names, abs_val_pearson_coeffs, self.pearson_coeffs, \
-            self.slopes, self.intercepts, self.pearson_stderrs, self.pearson_p_values, \
-            self.spearman_coeffs, self.spearman_p_values )
-
-        from itertools import islice
-        use_these_feature_weights = list( islice( raw_featureweights, min_index, max_index ) )
- 
-        new_weights.feature_names, abs_pearson_coeffs, new_weights.pearson_coeffs, new_weights.slopes, \
-            new_weights.intercepts, new_weights.pearson_stderrs, new_weights.pearson_p_values,\
-            new_weights.spearman_coeffs, new_weights. spearman_p_values =\
-              [ list( unzipped_tuple ) for unzipped_tuple in zip( *use_these_feature_weights ) ]
-
-        r_val_sum = 0
-        for val in abs_pearson_coeffs:
-            r_val_sum += val
-        new_weights.values = [ val / r_val_sum for val in abs_pearson_coeffs ]
-
-        new_weights.associated_feature_space = self.associated_feature_space
+            new_name = self.name + " (sliced {0}-{1})".format( min_index, max_index )
+        else:
+            new_name = None
 
+        new_weights = self._Subset( slice( min_index, max_index ), name=new_name )
+        abs_pearson_coeffs = np.abs( new_weights.pearson_coeffs )
+        new_weights.values = abs_pearson_coeffs / abs_pearson_coeffs.sum()
         return new_weights
 
     #================================================================
@@ -590,21 +972,21 @@ class PearsonFeatureWeights( FeatureWeights ):
         if self.name:
             s += ' "{0}:"'.format( self.name )
         s += " ({0} features)".format( len(self ) )
-        print s
+        print >> OutputStream(), s
 
-        print "-----------------------------------"
+        print >> OutputStream(), "-----------------------------------"
 
         if print_legend:
-            print "Legend:"
-            print "IFW - Feature weight applied to the individual feature"
-            print "IPC - Pearson correlation coefficient of feature values vs ground truth"
-            print "IPE - Standard Error of IPC"
-            print "IPP - P-value of IPC"
-            print "ISC - Spearman correlation coefficient of feature values vs ground truth"
-            print "IPP - P-value of ISC"
-            print ""
-        print "NUM\tIFW\tIPC\tIPE\tIPP\tISC\tIPP\tNAME"
-        print "===\t===\t===\t===\t===\t===\t===\t===="
+            print >> OutputStream(), "Legend:"
+            print >> OutputStream(), "IFW - Feature weight applied to the individual feature"
+            print >> OutputStream(), "IPC - Pearson correlation coefficient of feature values vs ground truth"
+            print >> OutputStream(), "IPE - Standard Error of IPC"
+            print >> OutputStream(), "IPP - P-value of IPC"
+            print >> OutputStream(), "ISC - Spearman correlation coefficient of feature values vs ground truth"
+            print >> OutputStream(), "IPP - P-value of ISC"
+            print >> OutputStream(), ""
+        print >> OutputStream(), "NUM\tIFW\tIPC\tIPE\tIPP\tISC\tIPP\tNAME"
+        print >> OutputStream(), "===\t===\t===\t===\t===\t===\t===\t===="
         for i in range( display ):
             line_item = "{0}\t".format( i + 1 )
             line_item += "{0:2.4f}\t".format( self.values[i] )
@@ -617,6 +999,254 @@ class PearsonFeatureWeights( FeatureWeights ):
                 line_item += self.feature_names[i]
             else:
                 line_item += self.feature_names[i][:50] + '... (truncated)'
-            print line_item
+            print >> OutputStream(), line_item
         if remainder:
-            print "<output truncated by user, {0} more feature weights>".format( remainder )
+            print >> OutputStream(), "<output truncated by user, {0} more feature weights>".format( remainder )
+
+#############################################################################
+# class definition of mRMRFeatureWeights
+#############################################################################
+class mRMRFeatureWeights( FeatureWeights ):
+    """Minimum Redundancy Maximum Relevance (mRMR) feature selection (Peng, Long & Ding,
+    IEEE TPAMI 2005), in-process, in place of the external "mrmr" program that
+    C++ wndchrm runs for "-fN:M".
+
+    Features are discretized into three states, below, within, or above their mean
+    +/- threshold * standard deviation, as the mrmr program does by default. Features
+    are then picked greedily: first the one with the highest mutual information with
+    the class (relevance), then each time the one that maximizes relevance minus
+    (scheme 'MID') or divided by (scheme 'MIQ') its mean mutual information with the
+    features already picked (redundancy).
+
+    The features are kept in the order they were picked, which is their rank. values
+    holds the mRMR scores, with negative scores set to 0, as the C++ code does."""
+
+    _per_feature_arrays = FeatureWeights._per_feature_arrays + ( 'relevances', 'redundancies' )
+
+    #: number of states features are discretized into
+    n_states = 3
+
+    def __init__( self, name=None, size=None ):
+        """Constructor"""
+        super( mRMRFeatureWeights, self ).__init__( name=name, size=size )
+        if size is not None:
+            self.relevances = np.zeros( size )
+            self.redundancies = np.zeros( size )
+        else:
+            self.relevances = None
+            self.redundancies = None
+        self.scheme = None
+
+    #================================================================
+    @classmethod
+    def NewFromFeatureSpace( cls, fs, num_features_to_be_used=None, scheme='MID',
+            threshold=1.0, n_jobs=None ):
+        """Selects num_features_to_be_used features of the discrete FeatureSpace fs by
+        mRMR, and returns them as a new instance of mRMRFeatureWeights.
+
+        num_features_to_be_used - int n where 0 < n <= fs.num_features, or float fraction
+            of the features on interval (0,1]. The default is 0.15, as in Threshold().
+        scheme - 'MID' (mutual information difference) or 'MIQ' (quotient)
+        threshold - features are discretized at their mean +/- threshold standard deviations
+        n_jobs - number of threads the mutual information is calculated in, or -1 for
+            one per processor. None or 1 calculates it in the calling thread.
+
+        The per-feature entropies are calculated once, and the summed redundancy of
+        every feature is updated with the one feature picked at each step, so each step
+        costs one pass over the discretized feature matrix."""
+
+        if fs.normalized_against is None:
+            raise ValueError( "Before generating feature weights, call Normalize() of the feature space." )
+        if not fs.discrete:
+            raise ValueError( "mRMR feature weights need a discrete FeatureSpace with classes." )
+        if scheme not in ( 'MID', 'MIQ' ):
+            raise ValueError( 'Arg "scheme" must be "MID" or "MIQ", got "{0}"'.format( scheme ) )
+        if n_jobs is not None and ( type( n_jobs ) is not int or n_jobs == 0 or n_jobs < -1 ):
+            raise ValueError( 'Arg "n_jobs" must be a positive int, -1 or None, got {0}'.format( n_jobs ) )
+
+        n_features = fs.num_features
+        if num_features_to_be_used is None:
+            num_features_to_be_used = int( n_features * 0.15 )
+        elif type( num_features_to_be_used ) is float:
+            if num_features_to_be_used <= 0 or num_features_to_be_used > 1:
+                raise ValueError('Choose feature reduction fraction on interval (0,1] (got "{0}"'.format( num_features_to_be_used  ) )
+            num_features_to_be_used = int( round( num_features_to_be_used * n_features ) )
+        if num_features_to_be_used > n_features or num_features_to_be_used <= 0:
+            raise ValueError('Cannot select {1} features out of a set of {0} features.'.\
+                                  format( n_features, num_features_to_be_used ) )
+
+        n_states = cls.n_states
+        classes = np.repeat( np.arange( fs.num_classes ), fs.class_sizes )
+        states = cls._Discretize( fs.data_matrix, threshold )
+        # Indicator matrix, column j * n_states + s is 1.0 where feature j is in state s.
+        # Joint counts of any discrete variable with all the features at once are then the
+        # product of the variable's indicator rows and this matrix. float32 counts are exact.
+        indicators = np.zeros( ( fs.num_samples, n_features * n_states ), dtype=np.float32 )
+        for state in range( n_states ):
+            indicators[ :, state::n_states ] = states == state
+
+        pool = None
+        chunks = [ ( 0, n_features ) ]
+        if n_jobs is not None and n_jobs != 1:
+            from multiprocessing import cpu_count
+            from multiprocessing.pool import ThreadPool
+            if n_jobs == -1:
+                n_jobs = cpu_count()
+            n_jobs = min( n_jobs, n_features )
+            bounds = np.linspace( 0, n_features, n_jobs + 1 ).astype( int )
+            chunks = zip( bounds[ :-1 ], bounds[ 1: ] )
+            pool = ThreadPool( n_jobs )
+
+        def JointEntropies( variable, n_values ):
+            """Entropy of the joint distribution of variable with each feature"""
+            rows = ( variable == np.arange( n_values )[ :, None ] ).astype( np.float32 )
+            def Chunk( bounds ):
+                start, stop = bounds
+                counts = np.dot( rows, indicators[ :, start * n_states : stop * n_states ] )
+                return cls._Entropies( counts.reshape( n_values, stop - start, n_states ).transpose( 0, 2, 1 ).\
+                        reshape( n_values * n_states, stop - start ) )
+            if pool is None:
+                return Chunk( chunks[0] )
+            return np.concatenate( pool.map( Chunk, chunks ) )
+
+        try:
+            feature_entropies = cls._Entropies( indicators.sum( axis=0 ).reshape( n_features, n_states ).T )
+            class_entropy = cls._Entropies( np.bincount( classes, minlength=fs.num_classes )[ :, None ] )[0]
+            relevances = feature_entropies + class_entropy - JointEntropies( classes, fs.num_classes )
+
+            selected = []
+            scores = []
+            selected_redundancies = []
+            redundancy_sums = np.zeros( n_features )
+            available = np.ones( n_features, dtype=bool )
+            oldsettings = np.seterr( all='ignore' )
+            for n_selected in range( num_features_to_be_used ):
+                if n_selected == 0:
+                    candidate_scores = relevances.copy()
+                    redundancies = np.zeros( n_features )
+                else:
+                    redundancies = redundancy_sums / n_selected
+                    if scheme == 'MID':
+                        candidate_scores = relevances - redundancies
+                    else:
+                        # guard against division by zero redundancy
+                        candidate_scores = relevances / ( redundancies + 0.0001 )
+                candidate_scores[ ~available ] = -np.inf
+                best = int( np.argmax( candidate_scores ) )
+                selected.append( best )
+                scores.append( candidate_scores[ best ] )
+                selected_redundancies.append( redundancies[ best ] )
+                available[ best ] = False
+                if n_selected + 1 < num_features_to_be_used:
+                    redundancy_sums += feature_entropies + feature_entropies[ best ] - \
+                            JointEntropies( states[ :, best ], n_states )
+            np.seterr( **oldsettings )
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        if fs.name:
+            name = cls.__name__ + ' from training set "' + fs.name + '"'
+        else:
+            name = None
+        new_fw = cls( name=name )
+        new_fw.scheme = scheme
+        new_fw.associated_feature_space = fs
+        new_fw.feature_names = [ fs.feature_names[i] for i in selected ]
+        new_fw.feature_indices = np.array( selected, dtype=int )
+        new_fw.values = np.clip( scores, 0, None )
+        new_fw.relevances = relevances[ selected ]
+        new_fw.redundancies = np.array( selected_redundancies )
+        return new_fw
+
+    #================================================================
+    @staticmethod
+    def _Discretize( data_matrix, threshold ):
+        """Returns uint8 matrix of the states of the features in the columns of
+        data_matrix: 0 below mean - threshold * stddev, 2 above mean + threshold * stddev,
+        1 in between."""
+
+        means = data_matrix.mean( axis=0, dtype='double' )
+        stddevs = data_matrix.std( axis=0, dtype='double' )
+        states = ( data_matrix >= means - threshold * stddevs ).astype( np.uint8 )
+        states += data_matrix > means + threshold * stddevs
+        return states
+
+    #================================================================
+    @staticmethod
+    def _Entropies( counts ):
+        """Entropy in bits of each column of the matrix of counts."""
+
+        totals = counts.sum( axis=0 ).astype( float )
+        probs = counts / totals
+        oldsettings = np.seterr( all='ignore' )
+        plogp = np.where( probs > 0, probs * np.log2( probs ), 0 )
+        np.seterr( **oldsettings )
+        return -plogp.sum( axis=0 )
+
+    #================================================================
+    def Threshold( self, num_features_to_be_used=None, _all=False ):
+        """Returns an instance of mRMRFeatureWeights with the first n features picked.
+        These are the features mRMR would have picked if asked for n.
+
+        num_features_to_be_used can be integer n where 0 < n <= len( self.feature_names )
+        or num_features_to_be_used can be float n where 0 < n <= 1. The default is 15%
+        of the features.
+
+        if _all == True, returns all the features."""
+
+        if _all:
+            num_features_to_be_used = len( self.values )
+        elif num_features_to_be_used is None:
+            num_features_to_be_used = int( len( self.values ) * 0.15 )
+        elif type( num_features_to_be_used ) is float:
+            if num_features_to_be_used <= 0 or num_features_to_be_used > 1:
+                raise ValueError('Choose feature reduction fraction on interval (0,1] (got "{0}"'.format( num_features_to_be_used  ) )
+            num_features_to_be_used = int( round( num_features_to_be_used * len( self ) ) )
+        elif num_features_to_be_used > len( self.values ) or num_features_to_be_used <= 0:
+            raise ValueError('Cannot reduce a set of {0} feature weights to requested {1} features.'.\
+                                  format( len( self.values ), num_features_to_be_used ) )
+
+        new_weights = self._Subset( slice( 0, num_features_to_be_used ), name=self.name )
+        new_weights.scheme = self.scheme
+        return new_weights
+
+    #================================================================
+    def Slice( self, start_index, stop_index ):
+        """Return a new instance of mRMRFeatureWeights containing a chunk
+        of middle-ranked features."""
+
+        min_index = min( start_index, stop_index )
+        max_index = max( start_index, stop_index )
+
+        if (min_index < 0) or ( max_index > len( self.values ) ):
+            raise ValueError( 'Cannot slice, check your start and stop indices.' )
+
+        new_weights = self._Subset( slice( min_index, max_index ), name=self.name )
+        new_weights.scheme = self.scheme
+        return new_weights
+
+    #================================================================
+    @output_railroad_switch
+    def Print( self, display=None ):
+        """Prints out feature weight values and statistics.
+        display (int) - number of features you want printed, from beginning"""
+
+        if display is None:
+            display = len( self )
+        remainder = len( self ) - display
+
+        s = self.__class__.__name__
+        if self.name:
+            s += ' "{0}:"'.format( self.name )
+        s += " ({0} features, {1})".format( len( self ), self.scheme )
+        print >> OutputStream(), s
+        print >> OutputStream(), "Rank\tValue\tRelev.\tRedund.\tName"
+        print >> OutputStream(), "====\t=====\t======\t=======\t===="
+        for i in range( min( display, len( self ) ) ):
+            print >> OutputStream(), "{0}\t{1:.6f}\t{2:.4f}\t{3:.4f}\t{4}".format( i + 1, self.values[i],
+                    self.relevances[i], self.redundancies[i], self.feature_names[i] )
+
+        if remainder > 0:
+            print >> OutputStream(), "<output truncated by user via \"display\" arg, {0} more feature weights>".format( remainder )
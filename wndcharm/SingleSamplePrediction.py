@@ -26,6 +26,8 @@
 import numpy as np
 import wndcharm # for ImageMatrix
 from .utils import output_railroad_switch
+from . import instrumentation
+from .instrumentation import OutputStream
 from .FeatureVector import FeatureVector
 from .FeatureWeights import FeatureWeights
 from .FeatureSpace import FeatureSpace
@@ -35,6 +37,9 @@ class SingleSamplePrediction( object ):
     """Base class to contain prediction results for a single image/ROI (a.k.a "sample"),
     which includes predicted class, marginal probabilities, etc."""
 
+    #: Attributes of the record events emitted by Record()
+    record_fields = ( 'source_filepath', 'ground_truth_value', 'predicted_value' )
+
     def __init__( self ):
         """Constructor"""
 
@@ -53,11 +58,23 @@ class SingleSamplePrediction( object ):
     def __repr__( self ):
         return str( self )
 
+    #==============================================================
+    def Record( self, name ):
+        """Emit a record event named name for this result, printed as its LineItem()."""
+
+        if instrumentation.Enabled():
+            instrumentation.Record( name, self.LineItem,
+                    **dict( ( field, getattr( self, field ) ) for field in self.record_fields ) )
+
 #=================================================================================
 class SingleSampleClassification( SingleSamplePrediction ):
     """Classification result for a single image/ROI (a.k.a "sample"),
     which includes predicted class, marginal probabilities, etc."""
 
+    record_fields = ( 'source_filepath', 'tile_index', 'normalization_factor',
+            'marginal_probabilities', 'ground_truth_class_name', 'predicted_class_name',
+            'predicted_value' )
+
     def __init__( self ):
         """Constructor"""
         super( SingleSampleClassification, self ).__init__()
@@ -65,6 +82,8 @@ class SingleSampleClassification( SingleSamplePrediction ):
         self.marginal_probabilities = []
         self.normalization_factor = None
         self.marginal_probabilities = None
+        #: Bound on the error of approximated marginal probabilities, if approximated
+        self.error_bound = None
 
         #: predicted_class_name will always be a string
         #: the interpolated value, if applicable, gets stored in self.predicted_vlaue
@@ -95,37 +114,43 @@ class SingleSampleClassification( SingleSamplePrediction ):
         probabilities"""
         
         if line_item:
-            # img name:
-            outstr = self.source_filepath if self.source_filepath else ""
-            if self.tile_index is not None:
-                if self.tile_index == 'AVG':
-                    outstr += " (AVG)"
-                else:
-                    outstr += " ({0}/{1})".format( self.tile_index + 1, self.num_samples_in_group )
-            # normalization factor:
-            if self.normalization_factor is None:
-                # no normalization factor means this is a non-call
-                print outstr + "\t--COLLISION--"
-                return
-            outstr += "\t{0:0.3g}\t".format( self.normalization_factor )
-
-            # marginal probabilities:
-            outstr += "\t".join(\
-                     [ "{0:0.3f}".format( prob ) for prob in self.marginal_probabilities ] )
-            outstr += "\t"
-            # actual class:
-            if self.ground_truth_class_name:
-                outstr += "{0}\t".format( self.ground_truth_class_name )
+            print >> OutputStream(), self.LineItem()
+        else:
+            print >> OutputStream(), str(self)
+
+    #==============================================================
+    def LineItem( self ):
+        """Returns the tab-separated line item of this result: image name, normalization
+        factor, marginal probabilities, actual and predicted class and predicted value."""
+
+        # img name:
+        outstr = self.source_filepath if self.source_filepath else ""
+        if self.tile_index is not None:
+            if self.tile_index == 'AVG':
+                outstr += " (AVG)"
             else:
-                outstr += "*\t"
-            # predicted class:
-            outstr += self.predicted_class_name + "\t"
-            # interpolated value, if applicable
-            if self.predicted_value is not None:
-                outstr += "{0:0.3f}".format( self.predicted_value )
-            print outstr
+                outstr += " ({0}/{1})".format( self.tile_index + 1, self.num_samples_in_group )
+        # normalization factor:
+        if self.normalization_factor is None:
+            # no normalization factor means this is a non-call
+            return outstr + "\t--COLLISION--"
+        outstr += "\t{0:0.3g}\t".format( self.normalization_factor )
+
+        # marginal probabilities:
+        outstr += "\t".join(\
+                 [ "{0:0.3f}".format( prob ) for prob in self.marginal_probabilities ] )
+        outstr += "\t"
+        # actual class:
+        if self.ground_truth_class_name:
+            outstr += "{0}\t".format( self.ground_truth_class_name )
         else:
-            print str(self)
+            outstr += "*\t"
+        # predicted class:
+        outstr += self.predicted_class_name + "\t"
+        # interpolated value, if applicable
+        if self.predicted_value is not None:
+            outstr += "{0:0.3f}".format( self.predicted_value )
+        return outstr
 
     #==============================================================
     def __str__( self ):
@@ -156,6 +181,8 @@ class SingleSampleClassification( SingleSamplePrediction ):
             for val in self.marginal_probabilities:
                 outstr += "{0:0.3f},".format( val )
             outstr += '}'
+        if self.error_bound is not None:
+            outstr += " err<={0:0.3g}".format( self.error_bound )
         if self.predicted_value is not None:
             outstr += " interp={0:0.2f}".format( self.predicted_value )
         return outstr + '>'
@@ -180,6 +207,8 @@ class SingleSampleClassification( SingleSamplePrediction ):
         #print "classifying..."
         epsilon = np.finfo( np.float ).eps
 
+        # Distances are summed in double also for float32 features
+        testimg = np.asarray( testimg, dtype='double' )
         num_features_in_testimg = len( testimg ) 
         weights_squared = np.square( feature_weights )
 
@@ -255,7 +284,7 @@ class SingleSampleClassification( SingleSamplePrediction ):
             raise ValueError("Can't classify, features in signature don't match features in training_set." )
 
         if not quiet:
-            print "Classifying image '{0}' ({1} features) against test set '{2}' ({3} features)".\
+            print >> OutputStream(), "Classifying image '{0}' ({1} features) against test set '{2}' ({3} features)".\
              format( test_samp.name, train_set_len, training_set.name, test_set_len )
 
         result = cls._WND5( training_set, test_samp.values, feature_weights.values )
@@ -285,8 +314,9 @@ class SingleSampleClassification( SingleSamplePrediction ):
             column_header +=\
              "".join( [ "p(" + class_name + ")\t" for class_name in training_set.class_names ] )
             column_header += "act. class\tpred. class\tpred. val."
-            print column_header
-            result.Print( line_item=True )
+            print >> OutputStream(), column_header
+        with instrumentation.Printing( quiet ):
+            result.Record( 'SingleSampleClassification.NewWND5.result' )
         return result
 
 #=================================================================================
@@ -304,20 +334,27 @@ class SingleSampleRegression( SingleSamplePrediction ):
         """Output results."""
 
         if line_item:
-            # img name:
-            output_str = str( self.source_filepath )
-            output_str += "\t"
-            # actual class:
-            if self.ground_truth_value is not None:
-                output_str += str( self.ground_truth_value ) + "\t"
-            else:
-                output_str += "*\t"
-            # predicted class:
-            output_str += str( self.predicted_value )
-            print output_str
+            print >> OutputStream(), self.LineItem()
         else:
             str( self )
 
+    #==============================================================
+    def LineItem( self ):
+        """Returns the tab-separated line item of this result: image name, ground truth
+        and predicted value."""
+
+        # img name:
+        output_str = str( self.source_filepath )
+        output_str += "\t"
+        # actual class:
+        if self.ground_truth_value is not None:
+            output_str += str( self.ground_truth_value ) + "\t"
+        else:
+            output_str += "*\t"
+        # predicted class:
+        output_str += str( self.predicted_value )
+        return output_str
+
     #==============================================================
     def __str__( self ):
         outstr = '<' + self.__class__.__name__
@@ -368,7 +405,7 @@ class SingleSampleRegression( SingleSamplePrediction ):
 
     #==============================================================
     @classmethod
-    def _LeastSquares( cls, one_image_features, training_set ):
+    def _LeastSquares( cls, one_image_features, training_matrix, ground_truth_values ):
         """Produce a predicted value for a single image based on numpy.linalg.lstsq().
         
         Don't call this function directly, but instead use the member function
@@ -378,7 +415,7 @@ class SingleSampleRegression( SingleSamplePrediction ):
         from numpy.linalg import lstsq
         from numpy import dot
 
-        A = lstsq( training_set.data_matrix, np.array( training_set.ground_truth_values ) )[0]
+        A = lstsq( training_matrix, np.array( ground_truth_values ) )[0]
         
         result = cls()
         result.predicted_value = dot( one_image_features, A )
@@ -0,0 +1,385 @@
+"""
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+ Copyright (C) 2015 National Institutes of Health
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+ Written by:  Christopher Coletta (github.com/colettace)
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Structured timing, counter and progress events from the heavy wndcharm methods,
+delivered to pluggable sinks, e.g.:
+
+    from wndcharm import instrumentation
+    sink = instrumentation.JSONLinesSink( 'events.jsonl' )
+    with instrumentation.Attached( sink ):
+        FeatureSpaceClassificationExperiment.NewShuffleSplit( fs, quiet=True )
+
+There are four kinds of events:
+    span - a named, timed section of code, emitted when it ends, with its duration
+    counter - a named increment
+    progress - how many of a total number of units of named work are done
+    record - one computed result, e.g., the prediction for one sample, with its
+        fields as attributes, and the line of text it's printed as
+
+Emitting functions return immediately when no sink is attached. Sinks are kept
+in a tuple that's replaced rather than modified, so events can be emitted from any
+thread without locking; each sink serializes its own output.
+
+The per-sample lines the methods print when quiet=False are record events, printed
+by a TextSink that the method attaches for the calling thread only (see Printing()).
+Text output goes to OutputStream(), which RedirectedOutput() sends elsewhere for the
+calling thread only, rather than by assigning to sys.stdout."""
+
+import sys
+import threading
+import functools
+from time import time
+from timeit import default_timer as timer
+
+# Attached sinks. Only ever replaced, never modified in place.
+_sinks = ()
+_sinks_lock = threading.Lock()
+
+# Per-thread stream the text output goes to, if not sys.stdout.
+_output = threading.local()
+
+#============================================================================
+def OutputStream():
+    """The stream text output from the calling thread goes to: the stream of the
+    innermost RedirectedOutput in effect in this thread, else sys.stdout."""
+
+    stream = getattr( _output, 'stream', None )
+    return stream if stream is not None else sys.stdout
+
+#============================================================================
+class RedirectedOutput( object ):
+    """Context manager that sends text output from the calling thread to stream for the
+    duration of the with block. Other threads keep writing wherever they were."""
+
+    def __init__( self, stream ):
+        self.stream = stream
+        self.previous = None
+
+    def __enter__( self ):
+        self.previous = getattr( _output, 'stream', None )
+        _output.stream = self.stream
+        return self.stream
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        _output.stream = self.previous
+        return False
+
+#============================================================================
+def AddSink( sink ):
+    """Start delivering events to sink. Returns sink."""
+
+    global _sinks
+    with _sinks_lock:
+        if sink not in _sinks:
+            _sinks = _sinks + ( sink, )
+    return sink
+
+#============================================================================
+def RemoveSink( sink ):
+    """Stop delivering events to sink. Doesn't close it."""
+
+    global _sinks
+    with _sinks_lock:
+        _sinks = tuple( s for s in _sinks if s is not sink )
+
+#============================================================================
+def Enabled():
+    """True if any sink is attached. Call sites that need to do work to compute
+    the attributes of an event should check this first."""
+
+    return bool( _sinks )
+
+#============================================================================
+class Attached( object ):
+    """Context manager that attaches sink for the duration of the with block,
+    and closes it afterwards if close is True."""
+
+    def __init__( self, sink, close=True ):
+        self.sink = sink
+        self.close = close
+
+    def __enter__( self ):
+        return AddSink( self.sink )
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        RemoveSink( self.sink )
+        if self.close:
+            self.sink.Close()
+        return False
+
+#============================================================================
+class Event( object ):
+    """A single instrumentation event.
+
+    kind - 'span', 'counter', 'progress' or 'record'
+    name - what the event is about, e.g., 'FeatureSpaceClassification.NewWND5'
+    timestamp - seconds since the epoch when the event was emitted
+    value - seconds taken by a span, increment of a counter, units done for progress,
+        1 for a record
+    total - total units of work for progress, else None
+    attributes - dict of any other JSON-serializable details
+    message - for a record, the line of text it's printed as, or a function returning it,
+        which is only called if the record is printed"""
+
+    __slots__ = ( 'kind', 'name', 'timestamp', 'value', 'total', 'attributes', 'thread',
+            'message' )
+
+    def __init__( self, kind, name, value, total=None, attributes=None, message=None ):
+        self.kind = kind
+        self.name = name
+        self.timestamp = time()
+        self.value = value
+        self.total = total
+        self.attributes = attributes if attributes is not None else {}
+        self.thread = threading.current_thread().name
+        self.message = message
+
+    def ToDict( self ):
+        retval = { 'kind': self.kind, 'name': self.name, 'timestamp': self.timestamp,
+                'value': self.value, 'thread': self.thread }
+        if self.total is not None:
+            retval[ 'total' ] = self.total
+        if self.attributes:
+            retval[ 'attributes' ] = self.attributes
+        return retval
+
+    def __str__( self ):
+        if self.kind == 'record' and self.message is not None:
+            return self.message() if callable( self.message ) else self.message
+        if self.kind == 'span':
+            outstr = '{0} took {1:.4f} s'.format( self.name, self.value )
+        elif self.kind == 'progress':
+            if self.total is not None:
+                outstr = '{0}: {1}/{2}'.format( self.name, self.value, self.total )
+            else:
+                outstr = '{0}: {1}'.format( self.name, self.value )
+        elif self.kind == 'record':
+            outstr = self.name
+        else:
+            outstr = '{0} += {1}'.format( self.name, self.value )
+        if self.attributes:
+            outstr += ' (' + ', '.join( '{0}={1}'.format( key, val ) for key, val in \
+                    sorted( self.attributes.items() ) ) + ')'
+        return outstr
+
+    def __repr__( self ):
+        return '<' + self.__class__.__name__ + ' ' + str( self ) + '>'
+
+#============================================================================
+def _Emit( event ):
+    for sink in _sinks:
+        sink.Handle( event )
+
+#============================================================================
+def Count( name, value=1, **attributes ):
+    """Emit a counter event."""
+
+    if _sinks:
+        _Emit( Event( 'counter', name, value, attributes=attributes ) )
+
+#============================================================================
+def Progress( name, done, total=None, **attributes ):
+    """Emit a progress event: done out of total units of work named name."""
+
+    if _sinks:
+        _Emit( Event( 'progress', name, done, total, attributes ) )
+
+#============================================================================
+def Record( name, message=None, **attributes ):
+    """Emit a record event: one computed result named name, with its fields as attributes.
+    message is the line of text it's printed as, or a function returning it. Call sites
+    that need to do work to compute the attributes should check Enabled() first."""
+
+    if _sinks:
+        _Emit( Event( 'record', name, 1, attributes=attributes, message=message ) )
+
+#============================================================================
+class _Span( object ):
+    """Times the with block it's used in, and emits a span event when it ends."""
+
+    __slots__ = ( 'name', 'attributes', 'start' )
+
+    def __init__( self, name, attributes ):
+        self.name = name
+        self.attributes = attributes
+        self.start = None
+
+    def Set( self, **attributes ):
+        """Add attributes to the event emitted when the span ends."""
+        self.attributes.update( attributes )
+
+    def __enter__( self ):
+        self.start = timer()
+        return self
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        duration = timer() - self.start
+        if exc_type is not None:
+            self.attributes[ 'error' ] = exc_type.__name__
+        _Emit( Event( 'span', self.name, duration, attributes=self.attributes ) )
+        return False
+
+#============================================================================
+class _NullSpan( object ):
+    """Stands in for _Span when no sink is attached."""
+
+    __slots__ = ()
+
+    def Set( self, **attributes ):
+        pass
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        return False
+
+_null_span = _NullSpan()
+
+#============================================================================
+def Span( name, **attributes ):
+    """Returns a context manager that emits a span event named name when the with block
+    it's used in ends. If no sink is attached, returns a shared do-nothing context manager."""
+
+    if not _sinks:
+        return _null_span
+    return _Span( name, attributes )
+
+#============================================================================
+def instrumented( name ):
+    """Decorator that wraps each call of the decorated function in a Span named name."""
+
+    def decorator( func ):
+        @functools.wraps( func )
+        def instrumented_wrapper( *args, **kwargs ):
+            if not _sinks:
+                return func( *args, **kwargs )
+            with _Span( name, {} ):
+                return func( *args, **kwargs )
+        return instrumented_wrapper
+    return decorator
+
+#============================================================================
+def Printing( quiet ):
+    """Returns a context manager that, unless quiet, prints the record events the calling
+    thread emits during the with block to its OutputStream(), one line each: the output
+    of the methods when quiet=False. If quiet, returns a do-nothing context manager."""
+
+    if quiet:
+        return _null_span
+    return Attached( TextSink( kinds=( 'record', ), thread=threading.current_thread() ) )
+
+#############################################################################
+# Sinks
+#############################################################################
+class Sink( object ):
+    """Base class of event sinks. Derived classes override Handle(), which may be
+    called from multiple threads at once."""
+
+    def Handle( self, event ):
+        pass
+
+    def Close( self ):
+        pass
+
+#============================================================================
+class NullSink( Sink ):
+    """Discards all events."""
+    pass
+
+#============================================================================
+class CallbackSink( Sink ):
+    """Calls callback( event ) for every event."""
+
+    def __init__( self, callback ):
+        self.callback = callback
+
+    def Handle( self, event ):
+        self.callback( event )
+
+#============================================================================
+class TextSink( Sink ):
+    """Writes one human readable line per event to stream, by default the OutputStream()
+    of the thread emitting the event, in the same register as the output of the methods
+    when quiet=False. Only events of the given kinds are written, and if thread is given,
+    only those emitted by that threading.Thread."""
+
+    def __init__( self, stream=None, kinds=( 'span', 'counter', 'progress', 'record' ),
+            thread=None ):
+        self.stream = stream
+        self.kinds = kinds
+        self.thread = thread.name if thread is not None else None
+        self._lock = threading.Lock()
+
+    def Handle( self, event ):
+        if event.kind not in self.kinds:
+            return
+        if self.thread is not None and event.thread != self.thread:
+            return
+        stream = self.stream if self.stream is not None else OutputStream()
+        line = str( event ) + '\n'
+        with self._lock:
+            stream.write( line )
+
+#============================================================================
+class LoggingSink( Sink ):
+    """Sends events to a logging.Logger, the "wndcharm" logger by default."""
+
+    def __init__( self, logger=None, level=None ):
+        import logging
+        if logger is None:
+            logger = logging.getLogger( 'wndcharm' )
+        self.logger = logger
+        self.level = level if level is not None else logging.INFO
+
+    def Handle( self, event ):
+        self.logger.log( self.level, '%s', event )
+
+#============================================================================
+class JSONLinesSink( Sink ):
+    """Writes each event as one line of JSON to the file at path (appended to), or to
+    an open file-like object. Each line is flushed as it's written, and the file is
+    opened in append mode, so events from forked worker processes, which inherit the
+    sink, end up as whole lines in the same file."""
+
+    def __init__( self, path_or_stream ):
+        if hasattr( path_or_stream, 'write' ):
+            self.stream = path_or_stream
+            self._owns_stream = False
+        else:
+            self.stream = open( path_or_stream, 'a' )
+            self._owns_stream = True
+        self._lock = threading.Lock()
+
+    def Handle( self, event ):
+        import json
+        line = json.dumps( event.ToDict(), sort_keys=True ) + '\n'
+        with self._lock:
+            self.stream.write( line )
+            self.stream.flush()
+
+    def Close( self ):
+        if self._owns_stream and not self.stream.closed:
+            self.stream.close()
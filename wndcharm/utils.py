@@ -25,8 +25,10 @@
 
 
 # wndcharm.py has the definitions of all the SWIG-wrapped primitive C++ WND_CHARM objects.
+import functools
 import wndcharm
 import numpy as np
+from .instrumentation import OutputStream, RedirectedOutput
 
 # ============================================================
 # BEGIN: Initialize module level globals
@@ -79,9 +81,12 @@ def initialize_module():
 # ============================================================
 def output_railroad_switch( method_that_prints_output ):
     """This is a decorator that optionally lets the user specify a file to which to redirect
-    STDOUT. To use, you must use the keyword argument "output_filepath" and optionally
-    the keyword argument "mode" """
+    the output. To use, you must use the keyword argument "output_filepath" and optionally
+    the keyword argument "mode", or the keyword argument "output_stream".
+    Only the output of the calling thread is redirected, see instrumentation.RedirectedOutput;
+    sys.stdout itself is left alone."""
 
+    @functools.wraps( method_that_prints_output )
     def print_method_wrapper( *args, **kwargs ):
         
         retval = None
@@ -93,26 +98,18 @@ def output_railroad_switch( method_that_prints_output ):
                 del kwargs[ "mode" ]
             else:
                 mode = 'w'
-            print 'Saving output of function "{0}()" to file "{1}", mode "{2}"'.format(\
+            print >> OutputStream(), 'Saving output of function "{0}()" to file "{1}", mode "{2}"'.format(\
                   method_that_prints_output.__name__, output_filepath, mode )
-            import sys
-            backup = sys.stdout
-            sys.stdout = open( output_filepath, mode )
-            retval = method_that_prints_output( *args, **kwargs )
-            sys.stdout.close()
-            sys.stdout = backup
+            with open( output_filepath, mode ) as output_file:
+                with RedirectedOutput( output_file ):
+                    retval = method_that_prints_output( *args, **kwargs )
         elif "output_stream" in kwargs:
             output_stream = kwargs[ "output_stream" ]
             del kwargs[ "output_stream" ]
-            print 'Saving output of function "{0}()" to stream'.format(\
+            print >> OutputStream(), 'Saving output of function "{0}()" to stream'.format(\
                   method_that_prints_output.__name__)
-            import sys
-            backup = sys.stdout
-            try:
-                sys.stdout = output_stream
+            with RedirectedOutput( output_stream ):
                 retval = method_that_prints_output( *args, **kwargs )
-            finally:
-                sys.stdout = backup
         else:
             retval = method_that_prints_output( *args, **kwargs )
         return retval
@@ -141,30 +138,42 @@ def normalize_by_columns( full_stack, mins=None, maxs=None ):
 #     3. feature ranges that are 0 result in nan feature values
 #     4. all nan feature values set to 0
 
-# Turn off numpy warnings, since we're taking care of invalid values explicitly
-    oldsettings = np.seterr(all='ignore')
-    if (mins is None or maxs is None):
-        # mask out NANs and +/-INFs to compute min/max
-        full_stack_m = np.ma.masked_invalid (full_stack, copy=False)
-        maxs = full_stack_m.max (axis=0)
-        mins = full_stack_m.min (axis=0)
-
-    # clip the values to the min-max range (NANs are left, but +/- INFs are taken care of)
-    full_stack.clip (mins, maxs, full_stack)
-    # remake a mask to account for NANs and divide-by-zero from max == min
-    full_stack_m = np.ma.masked_invalid (full_stack, copy=False)
+#   See class Normalizer, which does the work.
 
-    # Normalize
-    full_stack_m -= mins
-    full_stack_m /= (maxs - mins)
-    # Left over NANs and divide-by-zero from max == min become 0
-    # Note the deep copy to change the numpy parameter in-place.
-    full_stack[:] = full_stack_m.filled (0) * 100.0
-
-    # return settings to original
-    np.seterr(**oldsettings)
+    if (mins is None or maxs is None):
+        normalizer = Normalizer.NewFromMatrix( full_stack )
+    else:
+        normalizer = Normalizer( feature_minima=mins, feature_maxima=maxs )
+    normalizer.Apply( full_stack, out=full_stack )
+    return ( normalizer.feature_minima, normalizer.feature_maxima )
 
-    return (mins,maxs)
+# ============================================================
+def rank_by_columns( data ):
+    """Rank each column of a 2D array independently, 1-based, with tied values assigned
+    the average of the ranks they span, i.e., equivalent to applying
+    scipy.stats.rankdata( method='average' ) to every column.
+    Columns must not contain NANs."""
+
+    n_rows, n_cols = data.shape
+    col_indices = np.arange( n_cols )
+    sorter = np.argsort( data, axis=0, kind='mergesort' )
+    sorted_data = data[ sorter, col_indices ]
+
+    # Flag the first element of each run of tied values. The top of every column
+    # begins a new run, so all columns can be processed in a single flattened pass.
+    obs = np.ones( ( n_rows, n_cols ), dtype=bool )
+    obs[1:] = sorted_data[1:] != sorted_data[:-1]
+    obs = obs.T.ravel()
+    dense = np.cumsum( obs ) - 1
+    run_bounds = np.r_[ np.nonzero( obs )[0], obs.size ]
+    # mean 1-based position of each run, made relative to the top of its column
+    run_ranks = 0.5 * ( run_bounds[:-1] + run_bounds[1:] + 1 )
+    col_offsets = np.repeat( col_indices * n_rows, n_rows )
+    sorted_ranks = ( run_ranks[ dense ] - col_offsets ).reshape( n_cols, n_rows ).T
+
+    ranks = np.empty( ( n_rows, n_cols ) )
+    ranks[ sorter, col_indices ] = sorted_ranks
+    return ranks
 
 # END: Initialize module level globals
 #===============================================================
@@ -172,6 +181,150 @@ def normalize_by_columns( full_stack, mins=None, maxs=None ):
 
 # BEGIN: Class definitions for WND-CHARM intermediate objects
 
+#############################################################################
+# class definition of Normalizer
+#############################################################################
+class Normalizer( object ):
+    """Per-feature minima and maxima which transform features onto the interval [0,100],
+    the WND-CHARM convention. Values outside of the range are clipped to it (including
+    +/- INF), and NANs and features with a zero (or unknown) range become 0.
+
+    Fitting streams over row chunks with Fit(), and Apply() works chunk by chunk in place
+    or into a new matrix, so the only temporaries are chunk sized. Instances contain
+    only feature names and numpy arrays, so they pickle along with whatever holds them."""
+
+    #: Bytes of features processed at once by NewFromMatrix() and Apply()
+    chunk_bytes = 2**23
+
+    def __init__( self, feature_names=None, feature_minima=None, feature_maxima=None ):
+        """Constructor. feature_minima/feature_maxima can be masked arrays, as
+        produced by older versions of normalize_by_columns()."""
+
+        #: Feature names in column order, if known
+        self.feature_names = feature_names
+        #: Minima/maxima of the finite values of each feature, NAN if there were none
+        self.feature_minima = None
+        self.feature_maxima = None
+        if feature_minima is not None:
+            self.feature_minima = np.ma.filled( feature_minima, np.nan ).astype( 'double' )
+        if feature_maxima is not None:
+            self.feature_maxima = np.ma.filled( feature_maxima, np.nan ).astype( 'double' )
+
+    #==============================================================
+    def __repr__( self ):
+        outstr = '<' + self.__class__.__name__
+        if self.feature_minima is not None:
+            outstr += ' n_features=' + str( len( self.feature_minima ) )
+        return outstr + '>'
+
+    #==============================================================
+    @classmethod
+    def NewFromMatrix( cls, matrix, feature_names=None ):
+        """Returns a new Normalizer fit to the columns of the 2D array matrix, streaming
+        over it in chunks of rows."""
+
+        new_normalizer = cls( feature_names=feature_names )
+        for chunk in new_normalizer._Chunks( matrix ):
+            new_normalizer.Fit( chunk )
+        if new_normalizer.feature_minima is None:
+            new_normalizer.Fit( np.empty( ( 0, matrix.shape[-1] ) ) )
+        return new_normalizer
+
+    #==============================================================
+    def _Chunks( self, matrix ):
+        """Generates consecutive row chunks of matrix (1D is treated as a single row),
+        that are views into it."""
+
+        if matrix.ndim == 1:
+            matrix = matrix.reshape( 1, -1 )
+        chunk_rows = max( 1, self.chunk_bytes // ( 8 * max( 1, matrix.shape[1] ) ) )
+        for start in xrange( 0, len( matrix ), chunk_rows ):
+            yield matrix[ start : start + chunk_rows ]
+
+    #==============================================================
+    def Fit( self, chunk ):
+        """Take the finite values in chunk (2D array of samples, or 1D for a single sample)
+        into account in the feature minima/maxima. Returns self, so calls can be chained."""
+
+        chunk = np.array( chunk, dtype='double', ndmin=2 )
+        if self.feature_minima is None:
+            self.feature_minima = np.empty( chunk.shape[1] )
+            self.feature_minima.fill( np.nan )
+            self.feature_maxima = self.feature_minima.copy()
+        elif chunk.shape[1] != len( self.feature_minima ):
+            raise ValueError( "Can't fit normalizer, got {0} features, expected {1}.".format(
+                chunk.shape[1], len( self.feature_minima ) ) )
+
+        # NANs are ignored by fmin/fmax, so turn INFs into NANs too.
+        oldsettings = np.seterr(all='ignore')
+        np.copyto( chunk, np.nan, where=np.isinf( chunk ) )
+        if len( chunk ):
+            np.fmin( self.feature_minima, np.fmin.reduce( chunk, axis=0 ), out=self.feature_minima )
+            np.fmax( self.feature_maxima, np.fmax.reduce( chunk, axis=0 ), out=self.feature_maxima )
+        np.seterr(**oldsettings)
+        return self
+
+    #==============================================================
+    def Apply( self, data, out=None ):
+        """Normalize data (2D array of samples, or 1D for a single sample) chunk by chunk,
+        writing into out, which can be data itself to normalize in place. If out is None,
+        a new array of the same floating point type as data is allocated. Returns out.
+        The arithmetic is done in double, also for float32 data."""
+
+        if self.feature_minima is None:
+            raise ValueError( "Can't normalize, normalizer hasn't been fit." )
+        if data.shape[-1] != len( self.feature_minima ):
+            raise ValueError( "Can't normalize, got {0} features, expected {1}.".format(
+                data.shape[-1], len( self.feature_minima ) ) )
+
+        if out is None:
+            out = np.empty( data.shape, dtype=data.dtype if data.dtype.kind == 'f' else 'double' )
+        mins = self.feature_minima
+        maxs = self.feature_maxima
+
+        # Turn off numpy warnings, since we're taking care of invalid values explicitly
+        oldsettings = np.seterr(all='ignore')
+        ranges = maxs - mins
+        for source_chunk, out_chunk in zip( self._Chunks( data ), self._Chunks( out ) ):
+            if out.dtype != np.double:
+                chunk = source_chunk.astype( 'double' )
+            else:
+                chunk = out_chunk
+                if out is not data:
+                    np.copyto( chunk, source_chunk )
+            # clip the values to the min-max range (NANs are left, but +/- INFs are taken care of)
+            np.maximum( chunk, mins, out=chunk )
+            np.minimum( chunk, maxs, out=chunk )
+            chunk -= mins
+            chunk /= ranges
+            chunk *= 100.0
+            # Left over NANs and divide-by-zero from max == min become 0
+            np.copyto( chunk, 0, where=np.isnan( chunk ) )
+            if chunk is not out_chunk:
+                np.copyto( out_chunk, chunk, casting='same_kind' )
+        np.seterr(**oldsettings)
+        return out
+
+    #==============================================================
+    def FeatureReduce( self, requested_features ):
+        """Returns a new Normalizer for a subset/rearrangement of the features, given as
+        an object with a "feature_names" member, or an iterable of feature names."""
+
+        try:
+            requested_features = requested_features.feature_names
+        except AttributeError:
+            pass
+        if self.feature_names is None:
+            raise ValueError( "Can't feature reduce normalizer, its feature names are unknown." )
+        feature_index = dict( ( name, i ) for i, name in enumerate( self.feature_names ) )
+        missing = [ name for name in requested_features if name not in feature_index ]
+        if missing:
+            raise ValueError( "Can't feature reduce normalizer, missing {0}/{1} requested features.".format(
+                len( missing ), len( requested_features ) ) )
+        new_order = [ feature_index[ name ] for name in requested_features ]
+        return self.__class__( list( requested_features ), self.feature_minima[ new_order ],
+                self.feature_maxima[ new_order ] )
+
 #############################################################################
 # class definition of SampleImageTiles
 #############################################################################
@@ -275,7 +428,7 @@ def compare( a_list, b_list, atol=1e-7 ):
         e_in_b_str = 'e' in b_str
         if e_in_a_str != e_in_b_str:
             errmsg = "Index {0}: \"{1}\" and \"{2}\" exponents don't match."
-            print errmsg
+            print >> OutputStream(), errmsg
             result = False
             errcount += 1
             continue
@@ -334,7 +487,7 @@ def compare( a_list, b_list, atol=1e-7 ):
         #print "{0}->{1}=={2}<-{3} : {4} <= {5}".format( a_raw, a, b, b_raw, diff, 10 ** diff_digits )
         if diff > 10 ** diff_digits:      
             errstr = "Index {0}: {1} isn't enough like {2}".format( count, a_raw, b_raw )
-            print errstr
+            print >> OutputStream(), errstr
             result = False
             errcount += 1
             continue
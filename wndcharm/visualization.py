@@ -26,6 +26,7 @@
 
 import numpy as np
 from .utils import output_railroad_switch
+from .instrumentation import OutputStream
 
 #============================================================================
 class BaseGraph( object ):
@@ -48,7 +49,7 @@ class BaseGraph( object ):
         if self.figure == None:
             raise ValueError( 'No figure to save!' )
         self.figure.savefig( filepath )
-        print 'Wrote chart "{0}" to file "{1}"'.format( self.chart_title, filepath )
+        print >> OutputStream(), 'Wrote chart "{0}" to file "{1}"'.format( self.chart_title, filepath )
             
 #============================================================================
 class PredictedValuesGraph( BaseGraph ):
@@ -114,7 +115,7 @@ class PredictedValuesGraph( BaseGraph ):
         
         Required the package matplotlib to be installed."""
 
-        print "Rendering rank-ordered predicted values graph"
+        print >> OutputStream(), "Rendering rank-ordered predicted values graph"
         import matplotlib
         # Need following line to generate images on servers, see
         # http://matplotlib.org/faq/howto_faq.html#generate-images-without-having-a-window-appear
@@ -153,7 +154,7 @@ class PredictedValuesGraph( BaseGraph ):
         Requires the packages matplotlib and scipy. Uses scipy.stats.gaussian_kde to
         generate kernel-smoothed probability density functions."""
 
-        print "Rendering kernel-smoothed probability density estimate graph"
+        print >> OutputStream(), "Rendering kernel-smoothed probability density estimate graph"
         import matplotlib
         matplotlib.use('Agg')
         import matplotlib.pyplot as plt